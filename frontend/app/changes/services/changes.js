@@ -31,6 +31,7 @@ function Change($resource) {
 
                     return {
                         objects: objects,
+                        pagination: jsonData ? jsonData.pagination : null,
                     };
                 },
             },
@@ -176,14 +176,22 @@ function EmailListController($scope, $state, $stateParams, EmailAccount, EmailLa
     function _toggleReadMessages(read) {
         var i;
 
+        EmailMessage.bulkRead({ids: _checkedMessageIds(), read: read});
+
         for (i in vm.emailMessages) {
             if (vm.emailMessages[i].checked) {
-                EmailMessage.markAsRead(vm.emailMessages[i].id, read);
                 vm.emailMessages[i].read = read;
             }
         }
     }
 
+    /**
+     * Return the ids of the checked messages, to change them with a single bulk request.
+     */
+    function _checkedMessageIds() {
+        return vm.emailMessages.filter(message => message.checked).map(message => message.id);
+    }
+
     /**
      * Only show the reply and forward buttons if there is one message checked.
      */
@@ -275,70 +283,36 @@ function EmailListController($scope, $state, $stateParams, EmailAccount, EmailLa
 
     function archiveMessages() {
         var labelToRemove = '';
-        var i;
-        var data;
 
         if (vm.label && vm.label.label_id) {
             labelToRemove = vm.label.label_id;
         }
 
-        data = {
-            current_inbox: labelToRemove,
-        };
-
-        for (i in vm.emailMessages) {
-            if (vm.emailMessages[i].checked) {
-                EmailMessage.archive({id: vm.emailMessages[i].id, data: data});
-            }
-        }
+        EmailMessage.bulkArchive({ids: _checkedMessageIds(), current_inbox: labelToRemove});
         _removeCheckedMessagesFromList();
     }
 
     function trashMessages() {
-        var i;
-
-        for (i in vm.emailMessages) {
-            if (vm.emailMessages[i].checked) {
-                EmailMessage.trash({id: vm.emailMessages[i].id});
-            }
-        }
-
+        EmailMessage.bulkTrash({ids: _checkedMessageIds()});
         _removeCheckedMessagesFromList();
     }
 
     function deleteMessages() {
-        var i;
-
-        for (i in vm.emailMessages) {
-            if (vm.emailMessages[i].checked) {
-                EmailMessage.delete({id: vm.emailMessages[i].id});
-            }
-        }
+        // Trashing messages which are already in the trash deletes them.
+        EmailMessage.bulkTrash({ids: _checkedMessageIds()});
         _removeCheckedMessagesFromList();
     }
 
     function moveMessages(labelId) {
         var addedLabels = [labelId];
         var removedLabels = [];
-        var i;
-        var data;
 
         if (vm.label && vm.label.label_id) {
             removedLabels = [vm.label.label_id];
         }
 
         // Gmail API needs to know the new labels as well as the old ones, so send them too.
-        data = {
-            remove_labels: removedLabels,
-            add_labels: addedLabels,
-        };
-
-        for (i in vm.emailMessages) {
-            if (vm.emailMessages[i].checked) {
-                EmailMessage.move({id: vm.emailMessages[i].id, data: data});
-            }
-        }
-
+        EmailMessage.bulkMove({ids: _checkedMessageIds(), remove_labels: removedLabels, add_labels: addedLabels});
         _removeCheckedMessagesFromList();
     }
 
@@ -351,10 +325,11 @@ function EmailListController($scope, $state, $stateParams, EmailAccount, EmailLa
     function starMessages(starred) {
         var i;
 
+        EmailMessage.bulkStar({ids: _checkedMessageIds(), starred: starred});
+
         for (i in vm.emailMessages) {
             if (vm.emailMessages[i].checked) {
                 vm.emailMessages[i].is_starred = starred;
-                EmailMessage.star({id: vm.emailMessages[i].id, starred: starred});
             }
         }
     }
@@ -86,6 +86,31 @@ function EmailMessage($resource, $q) {
                     id: '@id',
                 },
             },
+            // The bulk actions change all messages with the given ids in one request.
+            bulkArchive: {
+                method: 'PUT',
+                url: '/api/messaging/email/email/bulk_archive/',
+            },
+            bulkTrash: {
+                method: 'PUT',
+                url: '/api/messaging/email/email/bulk_trash/',
+            },
+            bulkMove: {
+                method: 'PUT',
+                url: '/api/messaging/email/email/bulk_move/',
+            },
+            bulkStar: {
+                method: 'PUT',
+                url: '/api/messaging/email/email/bulk_star/',
+            },
+            bulkSpam: {
+                method: 'PUT',
+                url: '/api/messaging/email/email/bulk_spam/',
+            },
+            bulkRead: {
+                method: 'PUT',
+                url: '/api/messaging/email/email/bulk_read/',
+            },
         }
     );
 
@@ -20,10 +20,11 @@ function importConfig($stateProvider) {
 
 angular.module('app.preferences').controller('PreferencesImportController', PreferencesImportController);
 
-PreferencesImportController.$inject = ['HLForms', 'HLUtils', 'Upload'];
-function PreferencesImportController(HLForms, HLUtils, Upload) {
+PreferencesImportController.$inject = ['$http', '$timeout', 'HLForms', 'HLUtils', 'Upload'];
+function PreferencesImportController($http, $timeout, HLForms, HLUtils, Upload) {
     var vm = this;
     vm.csv = null;
+    vm.import_progress = null;
     vm.import_result_error = null;
     vm.import_result_duplicate = null;
     vm.import_result_created = null;
@@ -45,6 +46,7 @@ function PreferencesImportController(HLForms, HLUtils, Upload) {
         HLForms.clearErrors(form);
 
         // Reset message for a previous upload.
+        vm.import_progress = null;
         vm.import_result_error = null;
         vm.import_result_duplicate = null;
         vm.import_result_created = null;
@@ -54,18 +56,8 @@ function PreferencesImportController(HLForms, HLUtils, Upload) {
             method: 'POST',
             data: data,
         }).then(function(response) {
-            HLUtils.unblockUI(formName);
-            toastr.success('I\'ve imported your accounts!', 'Done');
-
-            if (response.data.error) {
-                vm.import_result_error = response.data.error;
-            }
-            if (response.data.duplicate) {
-                vm.import_result_duplicate = response.data.duplicate;
-            }
-            if (response.data.created) {
-                vm.import_result_created = response.data.created;
-            }
+            // The accounts are imported in the background, so follow the progress until it's done.
+            pollImport(formName, response.data.import_id);
         }, function(response) {
             HLUtils.unblockUI(formName);
             if (response) {
@@ -75,4 +67,36 @@ function PreferencesImportController(HLForms, HLUtils, Upload) {
             toastr.error('Uh oh, there seems to be a problem', 'Oops!');
         });
     }
+
+    function pollImport(formName, importId) {
+        $http.get('api/accounts/import/' + importId + '/').then(function(response) {
+            var data = response.data;
+
+            vm.import_progress = data.total ? Math.floor(data.processed / data.total * 100) : 0;
+
+            if (data.status === 'pending' || data.status === 'running') {
+                $timeout(function() {
+                    pollImport(formName, importId);
+                }, 2000);
+                return;
+            }
+
+            HLUtils.unblockUI(formName);
+
+            if (data.status === 'failed') {
+                toastr.error('Uh oh, there seems to be a problem', 'Oops!');
+                return;
+            }
+
+            toastr.success('I\'ve imported your accounts!', 'Done');
+
+            // Only the names of the first errors are reported, the rest is counted.
+            vm.import_result_error = data.error ? {count: data.error, names: data.errors} : null;
+            vm.import_result_duplicate = data.duplicate;
+            vm.import_result_created = data.created;
+        }, function() {
+            HLUtils.unblockUI(formName);
+            toastr.error('Uh oh, there seems to be a problem', 'Oops!');
+        });
+    }
 }
@@ -106,6 +106,37 @@ function ActivityStreamDirective($filter, $q, $state, Account, Case, Change, Con
                 loadMore();
             }
 
+            function _fetchChanges(obj, model) {
+                // The changes are paged, so ask for as many pages as the activity stream shows.
+                let firstPagePromise = Change.query({id: obj.id, model: model, page: 1, page_size: pageSize}).$promise;
+
+                return firstPagePromise.then(firstPage => {
+                    let lastPage = firstPage.pagination ? Math.min(page, firstPage.pagination.number_of_pages) : 1;
+                    let pagePromises = [];
+
+                    // Pages start with the most recent changes, so the older pages go first to keep the changes in
+                    // chronological order.
+                    for (let changePage = lastPage; changePage > 1; changePage--) {
+                        pagePromises.push(Change.query({
+                            id: obj.id,
+                            model: model,
+                            page: changePage,
+                            page_size: pageSize,
+                        }).$promise);
+                    }
+
+                    return $q.all(pagePromises).then(olderPages => {
+                        let objects = [];
+
+                        olderPages.concat([firstPage]).forEach(changePage => {
+                            objects = objects.concat(changePage.objects);
+                        });
+
+                        return {objects: objects};
+                    });
+                });
+            }
+
             function _fetchActivity(obj) {
                 var activity = [];
                 var promises = [];
@@ -170,7 +201,7 @@ function ActivityStreamDirective($filter, $q, $state, Account, Case, Change, Con
                     });
                 });
 
-                changePromise = Change.query({id: currentObject.id, model: targetPlural}).$promise;
+                changePromise = _fetchChanges(currentObject, targetPlural);
 
                 promises.push(changePromise);  // Add promise to list of all promises for later handling
 
@@ -1,4 +1,10 @@
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from lily.changes.models import Change
+from lily.changes.queue import change_queue
 from lily.tenant.factories import TenantFactory
+from lily.tenant.middleware import set_current_user
 from lily.tests.utils import GenericAPITestCase
 
 from ..factories import AccountFactory, AccountStatusFactory, WebsiteFactory
@@ -17,6 +23,7 @@ class AccountTests(GenericAPITestCase):
     factory_cls = AccountFactory
     model_cls = Account
     serializer_cls = AccountSerializer
+    constant_list_queries = True
 
     def _create_object(self, with_relations=False, size=1, **kwargs):
         data = super(AccountTests, self)._create_object(with_relations, size, **kwargs)
@@ -86,3 +93,68 @@ class AccountTests(GenericAPITestCase):
                 [item['id'] for item in request.data.get(field_name)],
                 '%s %s -was- deleted while it should have been.' % (field_name, object_list[1].pk)
             )
+
+    def test_changes(self):
+        """
+        Test that an update records only the changed fields and that the changes are listed.
+        """
+        set_current_user(self.user_obj)
+        account = self._create_object(with_relations=True)
+        websites = list(account.websites.all())
+
+        data = {
+            'name': 'Changed name',
+            'websites': [{'id': websites[0].pk, 'is_deleted': True}],
+        }
+        request = self.user.patch(self.get_url(self.detail_url, kwargs={'pk': account.pk}), data)
+        self.assertStatus(request, status.HTTP_200_OK)
+
+        request = self.user.get(reverse('account-changes', kwargs={'pk': account.pk}))
+        self.assertStatus(request, status.HTTP_200_OK)
+
+        changes = request.data.get('objects')
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['action'], 'patch')
+        self.assertEqual(changes[0]['data']['name'], {'old': account.name, 'new': 'Changed name'})
+        # Only the deleted website is stored, not the unchanged one.
+        self.assertEqual(changes[0]['data']['websites']['new'], [{'id': websites[0].pk, 'is_deleted': True}])
+        self.assertEqual([item['id'] for item in changes[0]['data']['websites']['old']], [websites[0].pk])
+
+    def test_changes_before_response(self):
+        """
+        Test that the changes of an update are stored before the response is returned.
+        """
+        set_current_user(self.user_obj)
+        account = self._create_object()
+
+        # Keep the queue open after the request, so changes are only stored if the view stores them itself.
+        change_queue.start()
+        try:
+            request = self.user.patch(self.get_url(self.detail_url, kwargs={'pk': account.pk}), {'name': 'Changed'})
+
+            self.assertStatus(request, status.HTTP_200_OK)
+            self.assertEqual(Change.objects.filter(object_id=account.pk).count(), 1)
+        finally:
+            change_queue.finish()
+
+    def test_changes_pages(self):
+        """
+        Test that the changes are paged, starting with the most recent changes.
+        """
+        set_current_user(self.user_obj)
+        account = self._create_object()
+
+        for name in ['First', 'Second', 'Third']:
+            self.user.patch(self.get_url(self.detail_url, kwargs={'pk': account.pk}), {'name': name})
+
+        url = reverse('account-changes', kwargs={'pk': account.pk})
+
+        data = self.user.get(url).data
+        self.assertEqual([change['data']['name']['new'] for change in data['objects']], ['First', 'Second', 'Third'])
+        self.assertEqual(data['pagination']['total'], 3)
+
+        data = self.user.get(url, {'page': 1, 'page_size': 2}).data
+        self.assertEqual([change['data']['name']['new'] for change in data['objects']], ['Second', 'Third'])
+
+        data = self.user.get(url, {'page': 2, 'page_size': 2}).data
+        self.assertEqual([change['data']['name']['new'] for change in data['objects']], ['First'])
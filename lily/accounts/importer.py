@@ -0,0 +1,286 @@
+"""
+Import of accounts from CSV files.
+
+The rows are read and imported in chunks, so the file is never held in memory as a whole: duplicates are detected
+with a query per chunk, every chunk is inserted with a few bulk inserts and the created accounts are indexed in bulk at
+the end. The progress is stored in the cache, so it can be polled while the import runs in the background. The total
+is only known once all rows are read. Only the number of created, duplicate and failed accounts is reported, together
+with the names of the first accounts that failed.
+"""
+import logging
+from itertools import islice
+
+from django.db import connection, transaction
+
+from lily.calls.resolver import invalidate_resolver
+from lily.calls.routing import update_call_routes
+from lily.search.indexing import index_ids
+from lily.search.scan_search import ModelMappings
+from lily.socialmedia.models import SocialMedia
+from lily.tenant.models import Tenant
+from lily.utils.functions import clean_website, flatten
+from lily.utils.jobs import DONE, RUNNING, get_job_status, set_job_status
+from lily.utils.models.models import Address, EmailAddress, NormalizedPhoneNumber, PhoneNumber
+
+from .models import Account, AccountStatus, Website
+
+
+logger = logging.getLogger(__name__)
+
+# The following set of fields should be present as headers in the uploaded file.
+REQUIRED_FIELDS = {u'name'}
+# The following set of fields are optional.
+OPTIONAL_FIELDS = {u'website', u'email address', u'phone number', u'twitter', u'address', u'postal code', u'city'}
+
+CHUNK_SIZE = 500
+# Max number of names of accounts that failed in the progress of an import.
+MAX_REPORTED_ERRORS = 100
+STATUS_KEY = 'accounts:import:%s'
+
+
+def get_import_status(import_id):
+    return get_job_status(STATUS_KEY % import_id)
+
+
+def set_import_status(import_id, **status):
+    set_job_status(STATUS_KEY % import_id, **status)
+
+
+def reserve_ids(model, count):
+    """
+    Take primary keys from the sequence of the table of the model.
+
+    bulk_create doesn't return the primary keys of the created objects, so they're assigned up front instead, allowing
+    related rows to be bulk created as well.
+    """
+    if not count:
+        return []
+
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s);',
+        [model._meta.db_table, model._meta.pk.column, count]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+class AccountImporter(object):
+    def __init__(self, tenant_id, import_id, headers):
+        self.tenant = Tenant.objects.get(pk=tenant_id)
+        self.import_id = import_id
+        self.headers = headers
+        # All the extra fields that are present in the upload are used in the description field.
+        self.extra_fields = [field for field in headers if field not in REQUIRED_FIELDS | OPTIONAL_FIELDS]
+
+        self.created = 0
+        self.duplicate = 0
+        self.error = 0
+        self.errors = []
+        self.created_ids = []
+        self.phone_numbers = set()
+
+    def report(self, state, total, processed):
+        set_import_status(
+            self.import_id,
+            tenant_id=self.tenant.pk,
+            status=state,
+            total=total,
+            processed=processed,
+            created=self.created,
+            duplicate=self.duplicate,
+            error=self.error,
+            errors=self.errors,
+        )
+
+    def add_error(self, name):
+        self.error += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(name)
+
+    def run(self, rows):
+        """
+        Import the accounts of the given rows.
+
+        Args:
+            rows (iterable): lists of values, in the order of the headers (e.g. a csv reader)
+        """
+        self.report(RUNNING, None, 0)
+
+        status = AccountStatus.objects.filter(name='Relation', tenant=self.tenant).first()
+
+        # Names of accounts that exist or are imported already, later rows with the same name are duplicates.
+        existing = set()
+        processed = 0
+        # Skip empty lines.
+        rows = (dict(zip(self.headers, row)) for row in rows if row)
+
+        while True:
+            rows_chunk = list(islice(rows, CHUNK_SIZE))
+
+            if not rows_chunk:
+                break
+
+            # Check if the accounts already exist, possibly when the user re-uploads the same file.
+            existing.update(Account.objects.filter(
+                tenant=self.tenant,
+                is_deleted=False,
+                name__in=set(row.get(u'name') for row in rows_chunk) - existing,
+            ).values_list('name', flat=True))
+
+            chunk = []
+            for row in rows_chunk:
+                name = row.get(u'name')
+
+                if not status:
+                    # Accounts can't be created without their default status.
+                    self.add_error(name)
+                elif name in existing:
+                    self.duplicate += 1
+                else:
+                    existing.add(name)
+                    chunk.append(row)
+
+            self.import_chunk(chunk, status)
+            processed += len(rows_chunk)
+            self.report(RUNNING, None, processed)
+
+        mapping = ModelMappings.model_to_mappings.get(Account)
+        if mapping:
+            index_ids(mapping, self.created_ids, self.tenant.pk)
+
+        # The calls of imported phone numbers should be routed to and shown as the new accounts.
+        update_call_routes(self.tenant.pk, self.phone_numbers)
+        invalidate_resolver(self.tenant.pk)
+
+        self.report(DONE, processed, processed)
+        logger.info('Imported %s accounts for tenant %s', self.created, self.tenant.pk)
+
+    def import_chunk(self, rows, status):
+        if not rows:
+            return
+
+        try:
+            # Use atomic to rollback all intermediate database actions if an error occurs in just one of them.
+            with transaction.atomic():
+                account_ids, phone_numbers = self.create_accounts(rows, status)
+        except Exception:
+            if len(rows) == 1:
+                self.add_error(rows[0].get(u'name'))
+            else:
+                # Import the rows one by one, so only the rows at fault fail.
+                for row in rows:
+                    self.import_chunk([row], status)
+        else:
+            self.created += len(rows)
+            self.created_ids += account_ids
+            self.phone_numbers.update(phone_numbers)
+
+    def create_accounts(self, rows, status):
+        """
+        Create the accounts of the rows, with their related objects, with bulk inserts.
+
+        Returns:
+            tuple: the ids of the accounts and the phone numbers that were created
+        """
+        tenant = self.tenant
+        account_ids = reserve_ids(Account, len(rows))
+        accounts = []
+        websites = []
+        # Lists of (account id, object) per many to many field of the account.
+        related = {
+            'email_addresses': [],
+            'phone_numbers': [],
+            'social_media': [],
+            'addresses': [],
+        }
+
+        for account_id, row in zip(account_ids, rows):
+            name = row.get(u'name')
+            description = ''.join('{0}: {1}\n'.format(field, row.get(field)) for field in self.extra_fields)
+
+            # Set the fields normally set on save, bulk_create doesn't call it.
+            accounts.append(Account(
+                id=account_id,
+                name=name,
+                flatname=flatten(name),
+                tenant=tenant,
+                status=status,
+                description=description
+            ))
+
+            if row.get(u'website'):
+                websites.append(Website(
+                    website=clean_website(row.get(u'website')),
+                    is_primary=True,
+                    account_id=account_id,
+                    tenant=tenant
+                ))
+
+            if row.get(u'email address'):
+                related['email_addresses'].append((account_id, EmailAddress(
+                    email_address=row.get(u'email address').lower(),
+                    status=EmailAddress.PRIMARY_STATUS,
+                    tenant=tenant
+                )))
+
+            if row.get(u'phone number'):
+                related['phone_numbers'].append((account_id, PhoneNumber(
+                    number=row.get(u'phone number'),
+                    tenant=tenant
+                )))
+
+            if row.get(u'twitter'):
+                related['social_media'].append((account_id, SocialMedia(
+                    name='twitter',
+                    username=row.get(u'twitter'),
+                    profile_url='https://twitter.com/{0}'.format(row.get(u'twitter')),
+                    tenant=tenant
+                )))
+
+            # An Address consists of multiple, optional fields.
+            if row.get(u'address') or row.get(u'postal code') or row.get(u'city'):
+                related['addresses'].append((account_id, Address(
+                    address=row.get(u'address') or '',
+                    postal_code=row.get(u'postal code') or '',
+                    city=row.get(u'city') or '',
+                    type='visiting',
+                    tenant=tenant
+                )))
+
+        Account.objects.bulk_create(accounts)
+        Website.objects.bulk_create(websites)
+
+        phone_numbers = [phone_number.number for account_id, phone_number in related['phone_numbers']]
+        normalized_numbers = NormalizedPhoneNumber.get_for_numbers(tenant, phone_numbers)
+        for account_id, phone_number in related['phone_numbers']:
+            phone_number.normalized = normalized_numbers.get(phone_number.number)
+
+        for field_name, objects in related.items():
+            self.create_related(field_name, objects)
+
+        return account_ids, phone_numbers
+
+    def create_related(self, field_name, objects):
+        """
+        Bulk create the objects of a many to many field of the accounts, together with the rows linking them.
+
+        Args:
+            field_name (str): name of the many to many field of Account
+            objects (list): tuples of (account id, unsaved object)
+        """
+        if not objects:
+            return
+
+        model = objects[0][1].__class__
+        for obj_id, (account_id, obj) in zip(reserve_ids(model, len(objects)), objects):
+            obj.id = obj_id
+
+        model.objects.bulk_create([obj for account_id, obj in objects])
+
+        field = Account._meta.get_field(field_name)
+        through = field.rel.through
+        through.objects.bulk_create([
+            through(**{field.m2m_column_name(): account_id, field.m2m_reverse_name(): obj.id})
+            for account_id, obj in objects
+        ])
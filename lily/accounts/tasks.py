@@ -0,0 +1,36 @@
+import logging
+
+import unicodecsv
+from celery.task import task
+from django.core.files.storage import default_storage
+
+from lily.utils.jobs import FAILED
+
+from .importer import AccountImporter, set_import_status
+
+
+logger = logging.getLogger(__name__)
+
+
+@task(name='import_accounts', logger=logger)
+def import_accounts(tenant_id, import_id, path):
+    """
+    Import accounts from an uploaded CSV file.
+
+    Args:
+        tenant_id (int): id of the tenant to import the accounts for
+        import_id (str): id of the import, to report the progress with
+        path (str): name of the uploaded file in the storage, which is removed afterwards
+    """
+    try:
+        with default_storage.open(path) as csv_file:
+            # Read the rows from the file as they're imported, instead of loading the whole file.
+            reader = unicodecsv.reader(csv_file, encoding='utf-8')
+
+            AccountImporter(tenant_id, import_id, next(reader)).run(reader)
+    except Exception:
+        logger.exception('Account import %s for tenant %s failed', import_id, tenant_id)
+        set_import_status(import_id, tenant_id=tenant_id, status=FAILED)
+        raise
+    finally:
+        default_storage.delete(path)
@@ -1,8 +1,16 @@
 import time
-from django.test import TestCase
+from io import BytesIO
 
-from lily.accounts.factories import AccountFactory
+from django.test import TestCase, override_settings
+from mock import patch
+
+from lily.accounts.factories import AccountFactory, AccountStatusFactory
 from lily.tenant.factories import TenantFactory
+from lily.utils.jobs import DONE
+
+from .importer import AccountImporter, get_import_status
+from .models import Account
+from .tasks import import_accounts
 
 
 class AccountTests(TestCase):
@@ -21,3 +29,93 @@ class AccountTests(TestCase):
 
         account.save(update_modified=True)
         self.assertNotEqual(modified, account.modified)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AccountImportTests(TestCase):
+    def test_import(self):
+        """
+        Test that an import creates the accounts with their related objects and skips duplicates.
+        """
+        tenant = TenantFactory.create(country='NL')
+        AccountStatusFactory.create(tenant=tenant, name='Relation')
+        AccountFactory.create(tenant=tenant, name='Existing')
+
+        headers = [u'name', u'website', u'email address', u'phone number', u'city', u'kvk']
+        rows = [
+            [u'Existing', u'', u'', u'', u'', u''],
+            [u'New', u'Example.com/', u'Info@Example.com', u'020 123 4567', u'Amsterdam', u'1234'],
+            [u'New', u'', u'', u'', u'', u''],
+            [u'Other', u'', u'', u'', u'', u''],
+        ]
+
+        AccountImporter(tenant.pk, 'test', headers).run(rows)
+
+        import_status = get_import_status('test')
+        self.assertEqual(import_status['status'], DONE)
+        self.assertEqual(import_status['processed'], 4)
+        self.assertEqual(import_status['created'], 2)
+        self.assertEqual(import_status['duplicate'], 2)
+        self.assertEqual(import_status['error'], 0)
+        self.assertEqual(import_status['errors'], [])
+
+        account = Account.objects.get(tenant=tenant, name='New')
+        self.assertEqual(account.flatname, 'new')
+        self.assertEqual(account.description, 'kvk: 1234\n')
+        self.assertEqual(account.websites.get().website, 'http://example.com')
+        self.assertEqual(account.email_addresses.get().email_address, 'info@example.com')
+        self.assertEqual(account.phone_numbers.get().normalized.number, '+31201234567')
+        self.assertEqual(account.addresses.get().city, 'Amsterdam')
+
+    def test_import_errors(self):
+        """
+        Test that failed accounts are counted and only the names of the first ones are reported.
+        """
+        tenant = TenantFactory.create()
+        rows = [[u'First'], [u'Second'], [u'Third']]
+
+        # Without the default status no accounts can be created.
+        with patch('lily.accounts.importer.MAX_REPORTED_ERRORS', 2):
+            AccountImporter(tenant.pk, 'test', [u'name']).run(rows)
+
+        import_status = get_import_status('test')
+        self.assertEqual(import_status['error'], 3)
+        self.assertEqual(import_status['errors'], [u'First', u'Second'])
+
+    def test_import_chunks(self):
+        """
+        Test that rows are read chunk by chunk and duplicates are found across chunks.
+        """
+        tenant = TenantFactory.create()
+        AccountStatusFactory.create(tenant=tenant, name='Relation')
+        AccountFactory.create(tenant=tenant, name='Existing')
+        rows = iter([[u'First'], [u'Second'], [], [u'First'], [u'Existing'], [u'Third']])
+
+        with patch('lily.accounts.importer.CHUNK_SIZE', 2):
+            AccountImporter(tenant.pk, 'test', [u'name']).run(rows)
+
+        import_status = get_import_status('test')
+        self.assertEqual(import_status['total'], 5)
+        self.assertEqual(import_status['created'], 3)
+        self.assertEqual(import_status['duplicate'], 2)
+        self.assertEqual(
+            sorted(Account.objects.filter(tenant=tenant).values_list('name', flat=True)),
+            [u'Existing', u'First', u'Second', u'Third']
+        )
+
+    def test_import_task(self):
+        """
+        Test that the import task reads the uploaded file from the storage and removes it afterwards.
+        """
+        tenant = TenantFactory.create(country='NL')
+        AccountStatusFactory.create(tenant=tenant, name='Relation')
+        path = 'accounts/import/%s/test.csv' % tenant.pk
+
+        with patch('lily.accounts.tasks.default_storage') as storage:
+            storage.open.return_value = BytesIO(b'name,city\r\nFirst,Amsterdam\r\nSecond,Utrecht\r\n')
+            import_accounts(tenant.pk, 'test', path)
+
+        self.assertEqual(get_import_status('test')['created'], 2)
+        self.assertEqual(Account.objects.get(tenant=tenant, name='Second').addresses.get().city, 'Utrecht')
+        storage.open.assert_called_once_with(path)
+        storage.delete.assert_called_once_with(path)
@@ -61,47 +61,40 @@ class ExportAccountView(ExportListViewMixin, View):
     }
 
     # ExportListViewMixin
-    def value_for_column(self, account, column):
-        try:
-            if column == 'url':
-                return '/#/accounts/%s' % account['id']
-            elif column == 'email_addresses':
-                # 'email_addresses' is a dict, so we need to process it differently.
-                value = []
-                for email in account.get('email_addresses', []):
-                    value.append(email['email_address'])
-            elif column == 'phone_numbers':
-                # 'phone_numbers' is a dict, so we need to process it differently.
-                value = []
-                for phone_number in account.get('phone_numbers', []):
-                    value.append(phone_number['number'])
-            else:
-                value = account[column]
-        except KeyError:
-            result = ''
-        else:
-            # Fetch address info from database
-            if column == 'addresses':
-                result = '\r\n'.join(['%s, %s, %s, %s' % (
-                    address['address'] or '',
-                    address['postal_code'] or '',
-                    address['city'] or '',
-                    address['country'] or '',
-                ) for address in value])
-            elif isinstance(value, list):
-                result = ', '.join(value)
-            else:
-                result = value
-        return result
+    def get_column_extractor(self, column):
+        if column == 'url':
+            return lambda account: '/#/accounts/%s' % account['id']
+        elif column == 'email_addresses':
+            return lambda account: ', '.join(
+                [email['email_address'] for email in account.get('email_addresses', [])]
+            )
+        elif column == 'phone_numbers':
+            return lambda account: ', '.join(
+                [phone_number['number'] for phone_number in account.get('phone_numbers', [])]
+            )
+        elif column == 'addresses':
+            return lambda account: '\r\n'.join(['%s, %s, %s, %s' % (
+                address['address'] or '',
+                address['postal_code'] or '',
+                address['city'] or '',
+                address['country'] or '',
+            ) for address in account.get('addresses', [])])
+
+        def extract(account):
+            value = account.get(column, '')
+            if isinstance(value, list):
+                value = ', '.join(value)
+            return value
+
+        return extract
 
     # ExportListViewMixin
     def get_items(self):
         search = LilySearch(
             tenant_id=self.request.user.tenant_id,
             model_type='accounts_account',
-            page=0,
-            size=1000000000,
         )
         if self.request.GET.get('export_filter'):
             search.query_common_fields(self.request.GET.get('export_filter'))
-        return search.do_search()[0]
+        # Scroll through the results, so the accounts are streamed instead of loaded all at once.
+        return search.iterate()
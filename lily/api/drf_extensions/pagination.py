@@ -4,11 +4,87 @@ from rest_framework import pagination
 from rest_framework.response import Response
 
 
+class SearchResults(object):
+    """
+    The results of a search as a sequence Django's paginator can page through.
+
+    Elasticsearch does the paging and provides the total, the rows of a page are fetched from the database in
+    one query and returned in the order of the search.
+    """
+    def __init__(self, search, queryset, page_size, page_number):
+        self.search = search
+        self.queryset = queryset
+        self.page_size = page_size
+
+        try:
+            self.page_number = int(page_number)
+        except (TypeError, ValueError):
+            # E.g. 'last', which needs the total first.
+            self.page_number = 1
+
+        self.total = None
+        self.pages = {}
+
+    def get_page_ids(self, page):
+        """
+        Return the ids of the results on the given page (starting at 0).
+        """
+        if page not in self.pages:
+            self.search.paginate(page, self.page_size)
+            hits, facets, total, took = self.search.do_search(['id'])
+
+            self.total = total or 0
+            self.pages[page] = [hit['id'] for hit in hits]
+
+        return self.pages[page]
+
+    def count(self):
+        if self.total is None:
+            # Search the page that's requested, the total comes with it.
+            self.get_page_ids(max(self.page_number - 1, 0))
+
+        return self.total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+
+        start = key.start or 0
+        stop = self.count() if key.stop is None else key.stop
+
+        # The paginator only asks for (the start of) whole pages.
+        ids = self.get_page_ids(start // self.page_size)[start % self.page_size:][:stop - start]
+
+        objects = self.queryset.in_bulk(ids)
+
+        # Results might not be in the database (anymore), e.g. when the index isn't updated yet.
+        return [objects[pk] for pk in ids if pk in objects]
+
+
 class CustomPagination(pagination.PageNumberPagination):
     page_size = 100  # The default page size.
     page_size_query_param = 'page_size'  # The query param used to custom define a page size per request.
     max_page_size = 200  # The hard limit for page size.
 
+    def paginate_queryset(self, queryset, request, view=None):
+        search = getattr(view, 'paginated_search', None)
+
+        if search is not None:
+            queryset = self.paginate_search(search, queryset, request)
+
+        return super(CustomPagination, self).paginate_queryset(queryset, request, view)
+
+    def paginate_search(self, search, queryset, request):
+        """
+        Let the paginator page through the results of the search (see ElasticSearchFilter).
+        """
+        page_number = request.query_params.get(self.page_query_param, 1)
+
+        return SearchResults(search, queryset, self.get_page_size(request), page_number)
+
     def get_paginated_response(self, data):
         return Response(OrderedDict([
             ('pagination', OrderedDict([
@@ -1,11 +1,22 @@
-from rest_framework.filters import BaseFilterBackend
+from django.conf import settings
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
 from rest_framework.settings import api_settings
 from lily.search.lily_search import LilySearch
 
 
 class ElasticSearchFilter(BaseFilterBackend):
+    """
+    Filter the list on a search in Elasticsearch.
+
+    When the ordering of the list can be done by Elasticsearch (see `search_ordering_fields` on the view) and the
+    request has no query parameters besides the search, ordering and paging, the search is paged by the paginator and
+    only the rows of the current page are fetched from the database. Otherwise the list is filtered on the ids of the
+    search results.
+    """
     # The URL query parameter used for the search.
     search_param = api_settings.SEARCH_PARAM
+    # Ordering fields which are indexed as sortable values (e.g. numbers and dates), if the view doesn't set them.
+    search_ordering_fields = ('id', )
 
     def get_search_terms(self, request):
         """
@@ -17,6 +28,42 @@ class ElasticSearchFilter(BaseFilterBackend):
             return params.split(',')
         return None
 
+    def get_search_sort(self, request, queryset, view):
+        """
+        Translate the ordering of the list to a sort of the search.
+
+        Returns:
+            list: sort fields, or None if Elasticsearch can't order the results like the list
+        """
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or ()
+        sortable_fields = getattr(view, 'search_ordering_fields', self.search_ordering_fields)
+
+        for field in ordering:
+            if field.lstrip('-') not in sortable_fields:
+                return None
+
+        sort = list(ordering)
+        if 'id' not in [field.lstrip('-') for field in sort]:
+            # Make sure the order, and with that the pages, are stable.
+            sort.append('id')
+
+        return sort
+
+    def is_filtered(self, request, view):
+        """
+        Return whether the list might be narrowed down by more than the search.
+
+        Elasticsearch can only count and page the results of the search itself. Any query parameter other than the
+        search, ordering and paging (e.g. for a filter backend or a filter on the queryset of the view) could filter
+        out rows, which would then be missing from its pages and total.
+        """
+        params = set([self.search_param, api_settings.ORDERING_PARAM])
+
+        if view.paginator is not None:
+            params.update([view.paginator.page_query_param, view.paginator.page_size_query_param])
+
+        return bool(set(request.query_params) - params)
+
     def filter_queryset(self, request, queryset, view):
         model_type = getattr(view, 'model_type', None)
 
@@ -36,13 +83,24 @@ class ElasticSearchFilter(BaseFilterBackend):
                 model_type=model_type,
                 size=int(limit),
             )
-        else:
-            search = LilySearch(
-                tenant_id=request.user.tenant_id,
-                model_type=model_type,
-            )
+            search.filter_query(' AND '.join(search_terms))
+            ids = [result['id'] for result in search.do_search(['id'])[0]]
+
+            return queryset.filter(id__in=ids)
+
+        sort = self.get_search_sort(request, queryset, view)
 
+        search = LilySearch(
+            tenant_id=request.user.tenant_id,
+            model_type=model_type,
+            sort=sort,
+        )
         search.filter_query(' AND '.join(search_terms))
-        ids = [result['id'] for result in search.do_search(['id'])[0]]
 
-        return queryset.filter(id__in=ids)
+        if (sort is not None and hasattr(view.paginator, 'paginate_search') and
+                not self.is_filtered(request, view)):
+            # The paginator pages through the search, the queryset is used to fetch the rows of a page.
+            view.paginated_search = search
+            return queryset
+
+        return queryset.filter(id__in=search.get_all_ids(limit=settings.SEARCH_MAX_FILTER_IDS))
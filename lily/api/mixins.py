@@ -5,11 +5,13 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework.decorators import detail_route
 from rest_framework.exceptions import ValidationError
-from rest_framework.fields import empty
+from rest_framework.fields import empty, SkipField
 from rest_framework.response import Response
 from rest_framework.serializers import as_serializer_error
 
+from lily.api.prefetch import prefetch_for_serializer
 from lily.changes.models import Change
+from lily.changes.queue import flush_change_queue, queue_change
 from lily.socialmedia.models import SocialMedia
 from lily.utils.functions import format_phone_number
 
@@ -48,144 +50,163 @@ class ValidateEverythingSimultaneouslyMixin(object):
 
 
 class ModelChangesMixin(object):
-    def create(self, request, *args, **kwargs):
-        response = super(ModelChangesMixin, self).create(request, *args, **kwargs)
+    """
+    Record the changes made through the API, for the activity stream of the object.
 
-        obj_id = response.data.get('id')
-        content_type_id = response.data.get('content_type').get('id')
-        content_type = ContentType.objects.get(pk=content_type_id)
+    Only the fields in the request are compared. Changes are queued and stored in bulk before the response is
+    returned, so a client that reloads the activity stream right away sees its own changes.
+    """
+    # Fields we don't want to track.
+    ignored_fields = ['modified', 'id', 'full_name']
 
-        Change.objects.create(
+    def finalize_response(self, request, response, *args, **kwargs):
+        flush_change_queue()
+
+        return super(ModelChangesMixin, self).finalize_response(request, response, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        super(ModelChangesMixin, self).perform_create(serializer)
+
+        queue_change(
             action='post',
-            data=json.dumps(request.data),
-            user=request.user,
-            content_type=content_type,
-            object_id=obj_id,
+            data=json.dumps(self.request.data, separators=(',', ':')),
+            user_id=self.request.user.pk,
+            content_type=ContentType.objects.get_for_model(serializer.instance),
+            object_id=serializer.instance.pk,
+            tenant_id=self.request.user.tenant_id,
         )
 
-        return response
-
-    def update(self, request, *args, **kwargs):
-        partial = kwargs.get('partial', False)
-        action = 'patch' if partial else 'put'
-        ignored_fields = ['modified', 'id', 'full_name']
+    def perform_update(self, serializer):
+        partial = self.request.method == 'PATCH'
+        keys = [
+            key for key in self.request.data
+            if key in serializer.fields and not serializer.fields[key].write_only and key not in self.ignored_fields
+        ]
 
         # Store the old data so we can compare changes.
-        serializer = self.get_serializer(instance=self.get_object())
-        old_data = serializer.data
+        old_data = self.get_change_data(serializer, keys)
 
-        response = super(ModelChangesMixin, self).update(request, *args, **kwargs)
+        super(ModelChangesMixin, self).perform_update(serializer)
 
-        obj = self.get_object()
-        serializer = self.get_serializer(instance=obj)
-        new_data = serializer.data
+        data = self.get_changes(old_data, self.get_change_data(serializer, keys))
 
-        # Social media fields are saved in a 'special' way.
-        # Since we want to show changes per social media type we split all the data.
-        if 'social_media' in request.data:
-            for item in old_data.get('social_media'):
-                social_type = item.get('name')
+        if data:
+            queue_change(
+                action='patch' if partial else 'put',
+                data=json.dumps(data, separators=(',', ':')),
+                user_id=self.request.user.pk,
+                content_type=ContentType.objects.get_for_model(serializer.instance),
+                object_id=serializer.instance.pk,
+                tenant_id=self.request.user.tenant_id,
+            )
+
+    def get_change_data(self, serializer, keys):
+        """
+        Serialize only the given fields of the instance, with their display values if available.
+        """
+        data = {}
 
-                if social_type not in old_data:
-                    old_data[social_type] = []
+        for key in keys + ['%s_display' % key for key in keys]:
+            field = serializer.fields.get(key)
 
-                old_data[social_type].append(item)
+            if field is None or field.write_only:
+                continue
 
-            del old_data['social_media']
+            try:
+                attribute = field.get_attribute(serializer.instance)
+            except SkipField:
+                continue
 
-            for item in new_data.get('social_media'):
-                social_type = item.get('name')
+            data[key] = None if attribute is None else field.to_representation(attribute)
 
-                if social_type not in new_data:
-                    new_data[social_type] = []
+        # Social media fields are saved in a 'special' way.
+        # Since we want to show changes per social media type we split all the data.
+        if 'social_media' in data:
+            for key in dict(SocialMedia.SOCIAL_NAME_CHOICES).keys():
+                data[key] = []
 
-                new_data[social_type].append(item)
+            for item in data.pop('social_media') or []:
+                data[item.get('name')].append(item)
 
-            del new_data['social_media']
+        return data
 
-            for key in dict(SocialMedia.SOCIAL_NAME_CHOICES).keys():
-                if key in old_data and key not in new_data:
-                    new_data[key] = []
-                elif key in new_data and key not in old_data:
-                    old_data[key] = []
+    def get_changes(self, old_data, new_data):
+        """
+        Compare old and new data.
 
+        Returns:
+            dict: the old and new value of every changed field, for lists only the changed items
+        """
         data = {}
-        # Compare old and new data and store those keys.
-        diffkeys = [k for k in old_data if old_data.get(k) != new_data.get(k)]
 
-        for key in diffkeys:
-            is_social_media = (key in dict(SocialMedia.SOCIAL_NAME_CHOICES).keys())
+        for key in old_data:
+            if key.endswith('_display') or old_data.get(key) == new_data.get(key):
+                continue
 
-            if key in request.data or is_social_media:
-                # We don't want to display an ID in the change log,
-                # so fetch the display name if possible.
-                choice_field_name = key + '_display'
+            # We don't want to display an ID in the change log, so fetch the display name if possible.
+            choice_field_name = key + '_display'
+            old = old_data.get(choice_field_name, old_data.get(key))
+            new = new_data.get(choice_field_name, new_data.get(key))
 
-                if choice_field_name in old_data:
-                    old = old_data.get(choice_field_name)
-                else:
-                    old = old_data.get(key)
+            if isinstance(old, list) or isinstance(new, list):
+                # Related fields (e.g. phone numbers) are lists.
+                old, new = self.get_changed_items(old or [], new or [])
 
+                if not new:
+                    continue
+            else:
                 if isinstance(old, dict):
-                    if 'name' in old:
-                        old = old.get('name')
-                    elif 'full_name' in old:
-                        old = old.get('full_name')
-
-                if choice_field_name in new_data:
-                    new = new_data.get(choice_field_name)
-                else:
-                    new = new_data.get(key)
+                    old = old.get('name', old.get('full_name', old))
 
                 if isinstance(new, dict):
-                    if 'name' in new:
-                        new = new.get('name')
-                    elif 'full_name' in new:
-                        new = new.get('full_name')
-
-                # Related fields (e.g. phone numbers) are always lists.
-                if is_social_media or isinstance(request.data[key], list):
-                    if len(old) > len(new):
-                        for item in old:
-                            # If the item has been deleted we still want to register the change.
-                            if not any(x.get('id') == item.get('id') for x in new):
-                                new.append({
-                                    'id': item.get('id'),
-                                    'is_deleted': True,
-                                })
-
-                change = {
-                    key: {
-                        'old': old,
-                        'new': new,
-                    }
-                }
-
-                data.update(change)
-
-        # Remove keys we don't want to track.
-        for key in data.keys():
-            if key in ignored_fields:
-                del data[key]
-
-        Change.objects.create(
-            action=action,
-            data=json.dumps(data),
-            user=request.user,
-            content_type=obj.content_type,
-            object_id=obj.id,
-        )
+                    new = new.get('name', new.get('full_name', new))
 
-        return response
+            data[key] = {
+                'old': old,
+                'new': new,
+            }
+
+        return data
+
+    def get_changed_items(self, old, new):
+        """
+        Compare two lists of related objects.
+
+        Returns:
+            tuple: the old versions of changed items and the new versions of added, changed and deleted items
+        """
+        old_items = OrderedDict((item.get('id'), item) for item in old)
+        new_ids = [item.get('id') for item in new]
+
+        changed = [item for item in new if item.get('id') not in old_items or old_items[item.get('id')] != item]
+        # We still want to register deleted items.
+        changed += [{'id': pk, 'is_deleted': True} for pk in old_items if pk not in new_ids]
+
+        return [old_items[item['id']] for item in changed if item.get('id') in old_items], changed
 
     @detail_route(methods=['get'])
     def changes(self, request, pk=None):
+        """
+        List the changes of an object, in chronological order.
+
+        Pages start with the most recent changes, the activity stream asks for more pages when more activity is
+        shown.
+        """
         obj = self.get_object()
 
-        change_objects = Change.objects.filter(object_id=obj.id, content_type=obj.content_type)
+        change_objects = Change.objects.filter(
+            object_id=obj.id,
+            content_type=ContentType.objects.get_for_model(obj),
+        ).select_related('user').order_by('-created', '-id')
+
+        page = self.paginate_queryset(change_objects)
+
+        if page is None:
+            page = list(change_objects)
+
         changes = []
 
-        for change in change_objects:
+        for change in reversed(page):
             user = {
                 'id': change.user.id,
                 'full_name': change.user.full_name,
@@ -200,7 +221,26 @@ class ModelChangesMixin(object):
                 'created': change.created,
             })
 
-        return Response({'objects': changes})
+        if self.paginator is None:
+            return Response({'objects': changes})
+
+        # The activity stream reads the changes from 'objects'.
+        data = self.get_paginated_response(changes).data
+
+        return Response({'objects': data['results'], 'pagination': data['pagination']})
+
+
+class PrefetchRelatedMixin(object):
+    """
+    Load the relations used by the serializer of a list in bulk, instead of querying them for every object.
+    """
+    def get_queryset(self):
+        queryset = super(PrefetchRelatedMixin, self).get_queryset()
+
+        if self.action == 'list':
+            queryset = prefetch_for_serializer(queryset, self.get_serializer())
+
+        return queryset
 
 
 class PhoneNumberFormatMixin(object):
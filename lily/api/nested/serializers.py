@@ -1,5 +1,4 @@
 import json
-import grequests
 
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
@@ -11,6 +10,7 @@ from rest_framework.fields import empty
 from rest_framework.serializers import SerializerMetaclass
 
 from lily.api.mixins import ValidateEverythingSimultaneouslyMixin
+from lily.utils.webhooks import queue_webhook_event
 
 
 def is_dirty(instance, data):
@@ -394,17 +394,8 @@ class WritableNestedSerializer(ValidateEverythingSimultaneouslyMixin, serializer
 
             data = json.dumps(data, sort_keys=True, default=lambda x: str(x))
 
-            headers = {
-                'Content-Type': 'application/json',
-            }
-
-            webhook_calls = (grequests.post(wh.url, data=data, headers=headers) for wh in [webhook])
-
-            try:
-                # User has a webhook set, so post the data to the given URL.
-                grequests.map(webhook_calls)
-            except:
-                pass
+            # User has a webhook set, so post the data to the given URL once the request is done.
+            queue_webhook_event(webhook.id, data)
 
 
 class WritableNestedListSerializer(serializers.ListSerializer):
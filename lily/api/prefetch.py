@@ -0,0 +1,93 @@
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.relations import ManyRelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+_plans = {}
+
+
+def get_prefetch_plan(serializer):
+    """
+    Determine which relations need to be loaded to serialize objects with the given serializer.
+
+    The fields of the serializer are walked recursively, including nested (related) serializers. Foreign keys are
+    joined with select_related, everything that returns multiple objects is prefetched.
+
+    Returns:
+        tuple: list of select_related lookups, list of prefetch_related lookups
+    """
+    key = serializer.__class__
+
+    if key not in _plans:
+        select_related = []
+        prefetch_related = []
+        _walk(serializer, '', False, select_related, prefetch_related)
+        _plans[key] = (select_related, prefetch_related)
+
+    return _plans[key]
+
+
+def _walk(serializer, prefix, prefetched, select_related, prefetch_related):
+    """
+    Add the lookups for the relations of a serializer to the given lists.
+
+    Args:
+        serializer (Serializer): the serializer to walk the fields of
+        prefix (str): lookup of the relation the serializer is used for
+        prefetched (boolean): whether the relation is prefetched, which means nothing can be joined anymore
+    """
+    model = serializer.Meta.model
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*' or '.' in field.source:
+            # Nothing to load or not a relation we can follow.
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            # Properties and methods, these take care of their own queries.
+            continue
+
+        if not model_field.is_relation:
+            continue
+
+        lookup = prefix + model_field.name
+
+        if isinstance(field, ListSerializer):
+            nested = field.child
+        elif isinstance(field, BaseSerializer):
+            nested = field
+        elif isinstance(field, ManyRelatedField):
+            # Only the primary keys are needed, but these still require a query per object.
+            nested = None
+        else:
+            # Related fields of a single object only use the foreign key value.
+            continue
+
+        many = model_field.many_to_many or model_field.one_to_many
+        if prefetched or many or isinstance(model_field, GenericForeignKey):
+            prefetch_related.append(lookup)
+            nested_prefetched = True
+        else:
+            select_related.append(lookup)
+            nested_prefetched = False
+
+        if nested is not None and hasattr(nested, 'Meta'):
+            _walk(nested, lookup + '__', nested_prefetched, select_related, prefetch_related)
+
+
+def prefetch_for_serializer(queryset, serializer):
+    """
+    Apply the prefetch plan of the serializer to the queryset.
+    """
+    select_related, prefetch_related = get_prefetch_plan(serializer)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+
+    return queryset
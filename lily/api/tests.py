@@ -0,0 +1,130 @@
+from django.test import TestCase
+from mock import Mock, patch
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from lily.accounts.api.views import AccountViewSet
+from lily.accounts.factories import AccountFactory
+from lily.accounts.models import Account
+from lily.cases.api.views import CaseViewSet
+from lily.cases.factories import CaseFactory
+from lily.tenant.middleware import set_current_user
+from lily.users.factories import LilyUserFactory
+
+from .drf_extensions.pagination import SearchResults
+from .filters import ElasticSearchFilter
+
+
+class SearchResultsTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.accounts = AccountFactory.create_batch(size=5)
+        # Search results in a different order than the database.
+        self.result_ids = [account.pk for account in reversed(self.accounts)]
+
+        self.search = Mock()
+        self.search.paginate.side_effect = self._paginate
+
+    def _paginate(self, page, size):
+        hits = [{'id': pk} for pk in self.result_ids[page * size:(page + 1) * size]]
+        self.search.do_search.return_value = (hits, None, len(self.result_ids), 1)
+
+    def test_pages(self):
+        """
+        Test that pages follow the order of the search and a page only takes one search.
+        """
+        results = SearchResults(self.search, Account.objects.all(), page_size=2, page_number=2)
+
+        self.assertEqual(results.count(), 5)
+        self.assertEqual([account.pk for account in results[2:4]], self.result_ids[2:4])
+        self.assertEqual(self.search.do_search.call_count, 1)
+
+        # The last page is smaller.
+        self.assertEqual([account.pk for account in results[4:5]], self.result_ids[4:5])
+        self.assertEqual(self.search.do_search.call_count, 2)
+
+    def test_missing_rows(self):
+        """
+        Test that search results which aren't in the database are skipped.
+        """
+        Account.objects.filter(pk=self.result_ids[0]).delete()
+
+        results = SearchResults(self.search, Account.objects.all(), page_size=2, page_number=1)
+
+        self.assertEqual([account.pk for account in results[0:2]], self.result_ids[1:2])
+
+
+@patch('lily.api.filters.LilySearch')
+class ElasticSearchFilterTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.user = LilyUserFactory.create(is_active=True)
+
+    def get_list(self, LilySearch, viewset, objects, **params):
+        # Every object matches the search.
+        search = LilySearch.return_value
+        search.get_all_ids.return_value = [obj.pk for obj in objects]
+        search.paginate.side_effect = lambda page, size: setattr(search.do_search, 'return_value', (
+            [{'id': obj.pk} for obj in objects[page * size:(page + 1) * size]], None, len(objects), 1
+        ))
+
+        request = APIRequestFactory().get('/', dict(params, search='name:test', page_size=2))
+        force_authenticate(request, user=self.user)
+
+        return viewset.as_view({'get': 'list'})(request).data
+
+    def test_paged_search(self, LilySearch):
+        """
+        Test that Elasticsearch pages through a search that isn't filtered otherwise.
+        """
+        accounts = AccountFactory.create_batch(size=5, tenant=self.user.tenant)
+
+        data = self.get_list(LilySearch, AccountViewSet, accounts)
+
+        self.assertEqual(data['pagination']['total'], 5)
+        self.assertEqual([account['id'] for account in data['results']], [account.pk for account in accounts[:2]])
+        self.assertFalse(LilySearch.return_value.get_all_ids.called)
+
+    def test_filtered_search(self, LilySearch):
+        """
+        Test that a search combined with a filter backend counts and pages the rows that match both.
+        """
+        accounts = AccountFactory.create_batch(size=5, tenant=self.user.tenant, assigned_to=None)
+        assigned_accounts = AccountFactory.create_batch(size=3, tenant=self.user.tenant, assigned_to=self.user)
+
+        data = self.get_list(LilySearch, AccountViewSet, accounts + assigned_accounts, assigned_to=self.user.pk)
+
+        self.assertEqual(data['pagination']['total'], 3)
+        self.assertEqual(data['pagination']['number_of_pages'], 2)
+        self.assertEqual(
+            [account['id'] for account in data['results']],
+            sorted(account.pk for account in assigned_accounts)[:2]
+        )
+
+    def test_filtered_queryset_search(self, LilySearch):
+        """
+        Test that a search combined with a query parameter the view filters its queryset on (see queryset_filter)
+        only counts the rows that match both.
+        """
+        cases = CaseFactory.create_batch(size=5, tenant=self.user.tenant)
+        unassigned_cases = CaseFactory.create_batch(size=3, tenant=self.user.tenant, assigned_to=None)
+
+        data = self.get_list(LilySearch, CaseViewSet, cases + unassigned_cases, is_assigned='False')
+
+        self.assertEqual(data['pagination']['total'], 3)
+        self.assertEqual(
+            [case['id'] for case in data['results']],
+            sorted(case.pk for case in unassigned_cases)[:2]
+        )
+
+    def test_paging_params(self, LilySearch):
+        """
+        Test that only the search, ordering and paging params let Elasticsearch page, any other param might filter.
+        """
+        view = AccountViewSet()
+
+        request = Request(APIRequestFactory().get('/', {'search': 'name:test', 'ordering': '-id', 'page': 2}))
+        self.assertFalse(ElasticSearchFilter().is_filtered(request, view))
+
+        request = Request(APIRequestFactory().get('/', {'search': 'name:test', 'status': 1}))
+        self.assertTrue(ElasticSearchFilter().is_filtered(request, view))
@@ -75,6 +75,7 @@ urlpatterns = [
     url(r'^deals/nextsteps/$', DealNextStepList.as_view()),
 
     url(r'^accounts/import/$', AccountImport.as_view()),
+    url(r'^accounts/import/(?P<import_id>[0-9a-f]+)/$', AccountImport.as_view()),
 
     url(r'integrations/auth/(?P<integration_type>[a-z]+)$', IntegrationAuth.as_view()),
     url(r'integrations/documents/events/catch/$', DocumentEventCatch.as_view()),
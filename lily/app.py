@@ -1,5 +1,6 @@
 import sys
 import inspect
+import pkgutil
 
 from django.apps import AppConfig
 from django.conf import settings
@@ -25,6 +26,7 @@ class LilyConfig(AppConfig):
 
         self.patch_forms(local_apps)
         self.scan_indexes(local_apps)
+        self.connect_signals(local_apps)
 
     def patch_forms(self, local_apps):
         """
@@ -62,3 +64,14 @@ class LilyConfig(AppConfig):
         Scan the installed apps for indexes.
         """
         ModelMappings.scan(local_apps)
+
+    def connect_signals(self, local_apps):
+        """
+        Import the signals modules of the installed apps, so their receivers get connected.
+        """
+        for app in local_apps:
+            module_name = '%s.signals' % app
+
+            # Only skip apps without a signals module, errors within one should surface.
+            if pkgutil.find_loader(module_name) is not None:
+                __import__(module_name)
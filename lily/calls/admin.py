@@ -1,8 +1,9 @@
 from django.contrib import admin
 
-from .models import Call, CallRecord, CallParticipant, CallTransfer
+from .models import Call, CallRecord, CallParticipant, CallTransfer, CallRoute
 
 admin.site.register(Call)
 admin.site.register(CallRecord)
 admin.site.register(CallParticipant)
 admin.site.register(CallTransfer)
+admin.site.register(CallRoute)
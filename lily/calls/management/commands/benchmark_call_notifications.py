@@ -0,0 +1,107 @@
+import random
+import time
+import uuid
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from mock import patch
+
+from lily.tenant.middleware import set_current_user
+from lily.users.models import LilyUser
+from lily.utils.models.models import PhoneNumber
+from lily.voipgrid.api.serializers import CallNotificationSerializer
+
+from ...resolver import lru_cache
+
+
+class NotificationRequest(object):
+    def __init__(self, user):
+        self.user = user
+
+
+class Command(BaseCommand):
+    help = """
+    Measure the throughput of call notifications with and without the number resolver cache.
+    Notifications are processed for the numbers of the given tenant, all changes are rolled back afterwards and no
+    notifications are sent to the users.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t', '--tenant',
+            action='store',
+            dest='tenant',
+            type=int,
+            required=True,
+            help='Use the phone numbers and users of this tenant.'
+        )
+        parser.add_argument(
+            '-n', '--calls',
+            action='store',
+            dest='calls',
+            type=int,
+            default=500,
+            help='Number of calls to notify, every call consists of a ringing and an ended notification.'
+        )
+
+    def handle(self, *args, **options):
+        user = LilyUser.objects.filter(tenant_id=options['tenant']).first()
+        if not user:
+            raise CommandError('Tenant %s has no users' % options['tenant'])
+
+        set_current_user(user)
+
+        numbers = list(PhoneNumber.objects.filter(tenant_id=user.tenant_id).values_list('number', flat=True)[:200])
+        # Unknown callers are common as well.
+        numbers += ['+3150%07d' % random.randint(0, 9999999) for i in range(len(numbers) / 4 + 1)]
+        internal_numbers = list(LilyUser.objects.filter(
+            tenant_id=user.tenant_id,
+            internal_number__isnull=False
+        ).values_list('internal_number', flat=True)) or [None]
+
+        # The same calls for both runs, so they're comparable.
+        calls = [(random.choice(numbers), random.choice(internal_numbers)) for i in range(options['calls'])]
+
+        for label, enabled in (('uncached', False), ('cached', True)):
+            lru_cache.clear()
+
+            with override_settings(CALL_RESOLVER_CACHE_ENABLED=enabled):
+                duration, queries = self.run_calls(user, calls)
+
+            self.stdout.write('%s: %s notifications in %.2fs (%.1f/s), %s queries' % (
+                label, len(calls) * 2, duration, len(calls) * 2 / duration, queries
+            ))
+
+        set_current_user(None)
+
+    def run_calls(self, user, calls):
+        context = {'request': NotificationRequest(user)}
+
+        # Channel messages can't be rolled back, so don't let the fake calls pop up in the browsers of the users.
+        with transaction.atomic(), patch('lily.voipgrid.api.serializers.Group'):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.time()
+
+                for number, internal_number in calls:
+                    call_id = uuid.uuid4().hex
+
+                    for notification_status in ('ringing', 'ended'):
+                        serializer = CallNotificationSerializer(data={
+                            'call_id': call_id,
+                            'timestamp': timezone.now().isoformat(),
+                            'status': notification_status,
+                            'direction': 'inbound',
+                            'caller': {'number': number, 'name': '', 'account_number': None},
+                            'destination': {'number': '+31508009000', 'name': '', 'account_number': internal_number},
+                        }, context=context)
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+
+                duration = time.time() - start
+
+            # Don't keep the records of the benchmark.
+            transaction.set_rollback(True)
+
+        return duration, len(captured.captured_queries)
@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+
+from lily.tenant.models import Tenant
+
+from ...routing import rebuild_call_routes
+
+
+class Command(BaseCommand):
+    help = """
+    Rebuild the call routes used for caller id and call routing. Run nightly to repair drift.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t', '--tenant',
+            action='store',
+            dest='tenant',
+            type=int,
+            help='Only rebuild the call routes of this tenant.'
+        )
+
+    def handle(self, *args, **options):
+        tenants = Tenant.objects.all()
+        if options['tenant']:
+            tenants = tenants.filter(pk=options['tenant'])
+
+        for tenant in tenants.order_by('pk'):
+            self.stdout.write('Rebuilding call routes for tenant %s' % tenant.pk)
+            rebuild_call_routes(tenant.pk)
+
+        self.stdout.write('Done.')
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0005_tenant_billing'),
+        ('contacts', '0013_auto_20170717_2005'),
+        ('accounts', '0019_auto_20170419_0926'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('calls', '0007_auto_20171019_0953'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallRoute',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('number', models.CharField(max_length=40, verbose_name='Number')),
+                ('caller_name', models.CharField(max_length=255, verbose_name='Caller name', blank=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='accounts.Account', null=True)),
+                ('contact', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='contacts.Contact', null=True)),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+                ('user', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='callroute',
+            unique_together=set([('tenant', 'number')]),
+        ),
+    ]
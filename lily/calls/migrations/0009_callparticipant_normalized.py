@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from lily.utils.functions import normalize_phone_number
+
+
+def link_normalized_numbers(apps, schema_editor):
+    Tenant = apps.get_model('tenant', 'Tenant')
+    NormalizedPhoneNumber = apps.get_model('utils', 'NormalizedPhoneNumber')
+    CallParticipant = apps.get_model('calls', 'CallParticipant')
+
+    for tenant in Tenant.objects.all():
+        numbers = defaultdict(list)
+        for number in CallParticipant.objects.filter(tenant=tenant).values_list('number', flat=True).distinct():
+            normalized_number = normalize_phone_number(number, tenant.country)
+            if normalized_number:
+                numbers[normalized_number].append(number)
+
+        existing = set(NormalizedPhoneNumber.objects.filter(tenant=tenant).values_list('number', flat=True))
+        NormalizedPhoneNumber.objects.bulk_create([
+            NormalizedPhoneNumber(tenant=tenant, number=number) for number in numbers if number not in existing
+        ])
+        normalized_ids = dict(NormalizedPhoneNumber.objects.filter(tenant=tenant).values_list('number', 'id'))
+
+        for normalized_number, raw_numbers in numbers.items():
+            CallParticipant.objects.filter(tenant=tenant, number__in=raw_numbers).update(
+                normalized_id=normalized_ids[normalized_number]
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0019_normalizedphonenumber'),
+        ('calls', '0008_callroute'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callparticipant',
+            name='normalized',
+            field=models.ForeignKey(related_name='call_participants', on_delete=django.db.models.deletion.SET_NULL,
+                                    blank=True, to='utils.NormalizedPhoneNumber', null=True),
+        ),
+        migrations.RunPython(link_normalized_numbers, migrations.RunPython.noop),
+    ]
@@ -156,9 +156,62 @@ class CallParticipant(TenantMixin):
         blank=True,
         verbose_name=_('Interal number')
     )
+    # Maintained on save, used to look up the calls of phone numbers.
+    normalized = models.ForeignKey(
+        'utils.NormalizedPhoneNumber',
+        related_name='call_participants',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
 
     def __unicode__(self):
         return self.name or self.number
 
     class Meta:
         unique_together = ('tenant', 'name', 'number', 'internal_number', )
+
+
+class CallRoute(TenantMixin):
+    """
+    Precomputed caller id and routing info for a phone number.
+
+    Maintained by lily.calls.routing, so the telephony platform's caller id requests can be answered with a single
+    indexed lookup.
+    """
+    number = models.CharField(
+        max_length=40,
+        verbose_name=_('Number')
+    )
+    # The name shown to the person picking up the phone.
+    caller_name = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name=_('Caller name')
+    )
+    contact = models.ForeignKey(
+        to='contacts.Contact',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+'
+    )
+    account = models.ForeignKey(
+        to='accounts.Account',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+'
+    )
+    # The user the call should be routed to.
+    user = models.ForeignKey(
+        to='users.LilyUser',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+'
+    )
+    modified = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return '%s: %s' % (self.number, self.caller_name)
+
+    class Meta:
+        unique_together = ('tenant', 'number', )
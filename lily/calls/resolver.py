@@ -0,0 +1,183 @@
+"""
+Cache of who is behind phone numbers and internal numbers, for the call notifications of the telephony platform.
+
+Every event of a call resolves its participants, so bursts of notifications would repeat the same lookups. Resolved
+numbers are kept in an in-process LRU cache, backed by the shared cache (Redis). The keys of both include a generation
+per tenant, which the signals bump when the numbers or names of users, contacts or accounts change. Within a request or
+task the generation of a tenant is only read from the shared cache once.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from lily.accounts.models import Account
+from lily.contacts.models import Contact
+from lily.search.cache import incr
+from lily.tenant.models import Tenant
+from lily.users.models import LilyUser
+from lily.utils.functions import normalize_phone_number
+from lily.utils.queues import RequestLocal, register
+
+
+GENERATION_KEY = 'calls:resolver:generation:%s'
+ENTRY_KEY = 'calls:resolver:%s:%s:%s:%s'
+
+
+class LRUCache(object):
+    """
+    Thread safe, size limited mapping which evicts the least recently used entries first.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return None
+
+            # Move the entry to the end, it's the most recently used now.
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class Generations(RequestLocal):
+    """
+    The generations of the tenants, as read from the shared cache during the current request or task.
+
+    Outside of requests and tasks (e.g. in management commands) the generations aren't kept, they're read every time.
+    """
+    def reset(self):
+        self.generations = {}
+
+
+lru_cache = LRUCache(settings.CALL_RESOLVER_LRU_SIZE)
+shared_generations = register(Generations())
+# Generations bumped by this process, which also works without a shared cache (e.g. the DummyCache).
+local_generations = {}
+local_generations_lock = threading.Lock()
+
+
+def get_generation(tenant_id):
+    """
+    Return the generation of the tenant in the shared cache.
+    """
+    if not shared_generations.active:
+        return cache.get(GENERATION_KEY % tenant_id, 0)
+
+    generations = shared_generations.generations
+
+    if tenant_id not in generations:
+        generations[tenant_id] = cache.get(GENERATION_KEY % tenant_id, 0)
+
+    return generations[tenant_id]
+
+
+def invalidate_resolver(tenant_id):
+    """
+    Forget all resolved numbers of a tenant.
+
+    Entries of the old generation aren't reachable anymore, they're evicted from the LRU cache over time.
+    """
+    generation = incr(GENERATION_KEY % tenant_id)
+
+    if shared_generations.active:
+        shared_generations.generations[tenant_id] = generation or 0
+
+    with local_generations_lock:
+        local_generations[tenant_id] = local_generations.get(tenant_id, 0) + 1
+
+
+def _get_or_resolve(tenant_id, kind, value, resolve):
+    if not settings.CALL_RESOLVER_CACHE_ENABLED:
+        return resolve()
+
+    generation = get_generation(tenant_id)
+    key = ENTRY_KEY % (tenant_id, generation, kind, value)
+    lru_key = (tenant_id, generation, local_generations.get(tenant_id, 0), kind, value)
+
+    result = lru_cache.get(lru_key)
+    if result is None:
+        result = cache.get(key)
+        if result is None:
+            result = resolve()
+            cache.set(key, result, settings.CALL_RESOLVER_CACHE_TIMEOUT)
+
+        lru_cache.set(lru_key, result)
+
+    return result
+
+
+def resolve_internal_number(tenant_id, internal_number):
+    """
+    Return the users with the internal number.
+
+    Returns:
+        dict: the name of the first user and the ids of all users, empty if no user has the internal number
+    """
+    def resolve():
+        users = list(LilyUser.objects.filter(tenant_id=tenant_id, internal_number=internal_number))
+
+        if not users:
+            return {}
+
+        return {
+            'name': users[0].full_name,
+            'user_ids': [user.id for user in users],
+        }
+
+    return _get_or_resolve(tenant_id, 'internal', internal_number, resolve)
+
+
+def resolve_number(tenant_id, number):
+    """
+    Return the contact or account with the phone number, contacts take precedence.
+
+    Returns:
+        dict: the type ('contact' or 'account'), id and name, empty if the number is unknown
+    """
+    country = _get_or_resolve(
+        tenant_id, 'country', '',
+        lambda: Tenant.objects.filter(pk=tenant_id).values_list('country', flat=True).first() or ''
+    )
+    normalized_number = normalize_phone_number(number, country)
+
+    def resolve():
+        contact = Contact.objects.filter(
+            tenant_id=tenant_id,
+            phone_numbers__normalized__number=normalized_number
+        ).first()
+
+        if contact and contact.full_name:
+            return {'type': 'contact', 'id': contact.id, 'name': contact.full_name}
+
+        account = Account.objects.filter(
+            tenant_id=tenant_id,
+            phone_numbers__normalized__number=normalized_number
+        ).first()
+
+        if account:
+            return {'type': 'account', 'id': account.id, 'name': account.name}
+        elif contact:
+            return {'type': 'contact', 'id': contact.id, 'name': contact.full_name}
+
+        return {}
+
+    return _get_or_resolve(tenant_id, 'number', normalized_number, resolve)
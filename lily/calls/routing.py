@@ -0,0 +1,247 @@
+import logging
+from datetime import date, timedelta
+
+from django.db.models import Q
+
+from lily.accounts.models import Account
+from lily.cases.models import Case
+from lily.contacts.models import Contact
+from lily.deals.models import Deal
+from lily.utils.queues import RequestQueue, register
+
+from .models import CallRoute
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_call_route(tenant_id, number):
+    """
+    Return the CallRoute for a (parsed) phone number, with the user to route to, in a single query.
+    """
+    return CallRoute.objects.select_related('user').filter(tenant_id=tenant_id, number=number).first()
+
+
+def get_responsible_user(contact, accounts):
+    """
+    Determine which user is responsible for the contact, based on open and recently closed cases and deals.
+    Falls back to the user assigned to the first of the given accounts.
+    """
+    user = None
+    week_ago = date.today() - timedelta(days=7)
+
+    cases = Case.objects.filter(contact=contact, is_deleted=False).order_by('-modified')
+    open_case = cases.filter(status__name='New').first()
+
+    deals = Deal.objects.filter(contact=contact, status__name='Open', is_deleted=False).order_by('-modified')
+    open_deal = deals.filter(status__name='Open').first()
+
+    if open_case and open_deal:
+        latest_case_note = open_case.notes.all().order_by('-modified').first()
+        latest_deal_note = open_deal.notes.all().order_by('-modified').first()
+
+        # If there is an open deal and an open case the one with the most recent note.
+        if latest_case_note and latest_deal_note:
+            # Check the latest modified note.
+            if latest_case_note.modified > latest_deal_note.modified:
+                user = open_case.assigned_to
+            else:
+                user = open_deal.assigned_to
+        else:
+            # No notes for both types, so check modified date.
+            if open_case.modified > open_deal.modified:
+                user = open_case.assigned_to
+            else:
+                user = open_deal.assigned_to
+    elif open_case:
+        # No open deal, so use open case.
+        user = open_case.assigned_to
+    elif open_deal:
+        # No open case, so use open deal.
+        user = open_deal.assigned_to
+    else:
+        # Get closed cases and deals.
+        latest_closed_case = cases.filter(Q(created__gte=week_ago) & Q(status__name='Closed')).first()
+        latest_closed_deal = deals.filter(Q(created__lte=week_ago) &
+                                          (Q(status__name='Won') | Q(status__name='Lost'))).first()
+
+        if latest_closed_case and latest_closed_deal:
+            if latest_closed_case.modified > latest_closed_deal.modified:
+                user = latest_closed_case.assigned_to
+            else:
+                user = latest_closed_deal.assigned_to
+        elif latest_closed_case:
+            # No closed deal, so use closed case.
+            user = latest_closed_case.assigned_to
+        elif latest_closed_deal:
+            # No closed case, so use closed deal.
+            user = latest_closed_deal.assigned_to
+        elif accounts:
+            # None of the above applies, so use account if possible.
+            user = accounts[0].assigned_to
+
+    return user
+
+
+def compute_call_route(tenant_id, number):
+    """
+    Determine who is calling from the given number and to which user the call should be routed.
+
+    A contact with the number is preferred. Otherwise the contact of the latest case or deal of an account with the
+    number is used, with the assignee of that case or deal as fallback for the user.
+
+    Returns:
+        dict with the caller name, contact, account and user or None if the number is unknown.
+    """
+    contact = Contact.objects.filter(
+        tenant_id=tenant_id,
+        phone_numbers__number=number,
+        is_deleted=False
+    ).order_by('-modified').first()
+    account = Account.objects.filter(
+        tenant_id=tenant_id,
+        phone_numbers__number=number,
+        is_deleted=False
+    ).order_by('-modified').first()
+
+    if not contact and not account:
+        return None
+
+    user = None
+    assignee = None
+    route_contact = contact
+
+    if not route_contact:
+        # Look for the last contacted contact of the account, through its cases or deals.
+        last_contacted = Case.objects.filter(
+            account=account,
+            contact__isnull=False,
+            is_deleted=False
+        ).select_related('contact', 'assigned_to').order_by('-modified').first()
+
+        if not last_contacted:
+            last_contacted = Deal.objects.filter(
+                account=account,
+                contact__isnull=False,
+                is_deleted=False
+            ).select_related('contact', 'assigned_to').order_by('-modified').first()
+
+        if last_contacted:
+            route_contact = last_contacted.contact
+            assignee = last_contacted.assigned_to
+
+    if route_contact:
+        user = get_responsible_user(route_contact, list(route_contact.accounts.filter(is_deleted=False)[:1]))
+    elif account:
+        user = account.assigned_to
+
+    if not user and assignee:
+        user = assignee
+
+    return {
+        # An account with the number takes precedence for the name shown.
+        'caller_name': account.name if account else contact.full_name,
+        'contact': route_contact,
+        'account': account,
+        'user': user,
+    }
+
+
+def update_call_routes(tenant_id, numbers):
+    """
+    Recompute the call routes for the given phone numbers, removing the routes of numbers which are no longer known.
+    """
+    for number in set(numbers):
+        if not number:
+            continue
+
+        route = compute_call_route(tenant_id, number)
+
+        if route:
+            CallRoute.objects.update_or_create(tenant_id=tenant_id, number=number, defaults=route)
+        else:
+            CallRoute.objects.filter(tenant_id=tenant_id, number=number).delete()
+
+
+def update_call_routes_for(tenant_id, contact_ids=None, account_ids=None):
+    """
+    Recompute the call routes of everything related to the given contacts and accounts: their own phone numbers and the
+    numbers of the routes currently pointing to them.
+    """
+    contact_ids = set(filter(None, contact_ids or []))
+    account_ids = set(filter(None, account_ids or []))
+
+    if not contact_ids and not account_ids:
+        return
+
+    routes = CallRoute.objects.filter(tenant_id=tenant_id).filter(
+        Q(contact_id__in=contact_ids) | Q(account_id__in=account_ids)
+    )
+    numbers = set(routes.values_list('number', flat=True))
+    numbers.update(Contact.objects.filter(pk__in=contact_ids).values_list('phone_numbers__number', flat=True))
+    numbers.update(Account.objects.filter(pk__in=account_ids).values_list('phone_numbers__number', flat=True))
+
+    update_call_routes(tenant_id, numbers)
+
+
+def rebuild_call_routes(tenant_id):
+    """
+    Rebuild all call routes of a tenant, to repair drift (e.g. caused by time based rules or missed signals).
+    """
+    numbers = set(Contact.objects.filter(
+        tenant_id=tenant_id,
+        is_deleted=False
+    ).values_list('phone_numbers__number', flat=True))
+    numbers.update(Account.objects.filter(
+        tenant_id=tenant_id,
+        is_deleted=False
+    ).values_list('phone_numbers__number', flat=True))
+    numbers.discard(None)
+
+    update_call_routes(tenant_id, numbers)
+
+    stale_routes = CallRoute.objects.filter(tenant_id=tenant_id).exclude(number__in=numbers)
+    logger.info('Rebuilt %s call routes for tenant %s, removing %s stale', len(numbers), tenant_id,
+                stale_routes.count())
+    stale_routes.delete()
+
+
+class CallRouteQueue(RequestQueue):
+    """
+    Thread local queue of call routes which have to be recomputed, per tenant.
+
+    Within requests and tasks the numbers, contacts and accounts are collected and their routes are recomputed by
+    a task at the end, so saving objects doesn't wait for it and every route is recomputed once. Outside of requests
+    and tasks (e.g. in management commands) the routes are recomputed right away.
+    """
+    def reset(self):
+        self.items = {}
+
+    def add(self, tenant_id, numbers=None, contact_ids=None, account_ids=None):
+        if not self.active:
+            update_call_routes(tenant_id, numbers or [])
+            update_call_routes_for(tenant_id, contact_ids, account_ids)
+            return
+
+        queued = self.items.setdefault(tenant_id, (set(), set(), set()))
+        queued[0].update(numbers or [])
+        queued[1].update(contact_ids or [])
+        queued[2].update(account_ids or [])
+
+    def process(self, items):
+        # Prevent circular imports.
+        from .tasks import update_call_routes_task
+
+        for tenant_id, (numbers, contact_ids, account_ids) in items.items():
+            update_call_routes_task.apply_async(args=(tenant_id, list(numbers), list(contact_ids), list(account_ids)))
+
+
+call_route_queue = register(CallRouteQueue())
+
+
+def queue_call_routes(tenant_id, numbers=None, contact_ids=None, account_ids=None):
+    """
+    Recompute the call routes of the numbers and of everything related to the contacts and accounts, at the end of the
+    current request or task.
+    """
+    call_route_queue.add(tenant_id, numbers, contact_ids, account_ids)
@@ -0,0 +1,160 @@
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, m2m_changed
+from django.dispatch.dispatcher import receiver
+
+from lily.accounts.models import Account
+from lily.cases.models import Case
+from lily.contacts.models import Contact, Function
+from lily.deals.models import Deal
+from lily.notes.models import Note
+from lily.search.signals import skip_signal
+from lily.users.models import LilyUser
+from lily.utils.models.models import NormalizedPhoneNumber, PhoneNumber
+
+from .models import CallParticipant
+from .resolver import invalidate_resolver
+from .routing import queue_call_routes
+
+
+@receiver(pre_save, sender=CallParticipant)
+def call_participant_pre_save(sender, instance, **kwargs):
+    # Not skippable, the call history of accounts and contacts depends on it.
+    instance.normalized = NormalizedPhoneNumber.get_for_number(instance.tenant, instance.number)
+
+
+@receiver(post_save, sender=PhoneNumber)
+@receiver(post_delete, sender=PhoneNumber)
+@skip_signal()
+def phone_number_changed(sender, instance, **kwargs):
+    contact_ids = []
+    account_ids = []
+
+    if kwargs.get('signal') == post_save:
+        # The number might have changed, so update the routes of the owners of the phone number as well.
+        contact_ids = instance.contact_set.values_list('pk', flat=True)
+        account_ids = instance.account_set.values_list('pk', flat=True)
+
+    queue_call_routes(instance.tenant_id, numbers=[instance.number], contact_ids=contact_ids, account_ids=account_ids)
+
+
+@receiver(m2m_changed, sender=Contact.phone_numbers.through)
+@receiver(m2m_changed, sender=Account.phone_numbers.through)
+@skip_signal()
+def phone_numbers_changed(sender, instance, action, pk_set=None, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if pk_set:
+        # Numbers added or removed.
+        queue_call_routes(instance.tenant_id, numbers=PhoneNumber.objects.filter(
+            pk__in=pk_set
+        ).values_list('number', flat=True))
+
+    if isinstance(instance, Contact):
+        queue_call_routes(instance.tenant_id, contact_ids=[instance.pk])
+    else:
+        queue_call_routes(instance.tenant_id, account_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Contact)
+@skip_signal()
+def contact_changed(sender, instance, **kwargs):
+    queue_call_routes(instance.tenant_id, contact_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Account)
+@skip_signal()
+def account_changed(sender, instance, **kwargs):
+    queue_call_routes(instance.tenant_id, account_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Function)
+@receiver(post_delete, sender=Function)
+@skip_signal()
+def function_changed(sender, instance, **kwargs):
+    queue_call_routes(instance.account.tenant_id, contact_ids=[instance.contact_id],
+                      account_ids=[instance.account_id])
+
+
+@receiver(post_save, sender=Case)
+@receiver(post_delete, sender=Case)
+@receiver(post_save, sender=Deal)
+@receiver(post_delete, sender=Deal)
+@skip_signal()
+def case_or_deal_changed(sender, instance, **kwargs):
+    # Assignment, status and contact changes influence to whom calls are routed.
+    queue_call_routes(instance.tenant_id, contact_ids=[instance.contact_id], account_ids=[instance.account_id])
+
+
+@receiver(post_save, sender=Note)
+@skip_signal()
+def note_changed(sender, instance, **kwargs):
+    # The latest note decides between an open case and an open deal.
+    if instance.content_type.model in ('case', 'deal'):
+        subject = instance.subject
+        if subject:
+            queue_call_routes(instance.tenant_id, contact_ids=[subject.contact_id])
+
+
+# The fields the resolver looks at, only changes to these invalidate the resolved numbers.
+RESOLVED_FIELDS = {
+    PhoneNumber: ('number',),
+    LilyUser: ('internal_number', 'first_name', 'last_name'),
+    Contact: ('first_name', 'last_name'),
+    Account: ('name',),
+}
+
+
+def get_resolved_values(sender, instance):
+    # Deferred fields aren't loaded, so they're compared as None.
+    return {field: instance.__dict__.get(field) for field in RESOLVED_FIELDS[sender]}
+
+
+@receiver(post_init, sender=PhoneNumber)
+@receiver(post_init, sender=LilyUser)
+@receiver(post_init, sender=Contact)
+@receiver(post_init, sender=Account)
+def resolved_number_post_init(sender, instance, **kwargs):
+    # Remember the values as loaded, so a save can tell whether they changed without querying them again.
+    instance._resolved_values = get_resolved_values(sender, instance)
+
+
+@receiver(pre_save, sender=PhoneNumber)
+@receiver(pre_save, sender=LilyUser)
+@receiver(pre_save, sender=Contact)
+@receiver(pre_save, sender=Account)
+def resolved_number_pre_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(RESOLVED_FIELDS[sender]):
+        # E.g. the last login of a user.
+        instance._resolved_fields_changed = False
+    elif instance.pk is None:
+        # New contacts and accounts are only resolved once a phone number is added to them.
+        instance._resolved_fields_changed = bool(getattr(instance, 'internal_number', None))
+    else:
+        instance._resolved_fields_changed = (
+            instance.__dict__.get('_resolved_values') != get_resolved_values(sender, instance)
+        )
+
+
+@receiver(post_save, sender=PhoneNumber)
+@receiver(post_delete, sender=PhoneNumber)
+@receiver(post_save, sender=LilyUser)
+@receiver(post_delete, sender=LilyUser)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def resolved_number_changed(sender, instance, **kwargs):
+    # Not skippable, notifications would show outdated names otherwise.
+    changed = instance.__dict__.pop('_resolved_fields_changed', True)
+    # Later saves of the instance compare against the saved values.
+    instance._resolved_values = get_resolved_values(sender, instance)
+
+    if changed or kwargs.get('signal') == post_delete:
+        invalidate_resolver(instance.tenant_id)
+
+
+@receiver(m2m_changed, sender=Contact.phone_numbers.through)
+@receiver(m2m_changed, sender=Account.phone_numbers.through)
+def resolved_numbers_changed(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_resolver(instance.tenant_id)
@@ -0,0 +1,21 @@
+from celery.task import task
+from django.core.management import call_command
+
+from .routing import update_call_routes, update_call_routes_for
+
+
+@task(name='rebuild_call_routes_scheduler')
+def rebuild_call_routes_scheduler():
+    """
+    Rebuild the call routes, because routing rules depend on time (e.g. recently closed cases).
+    """
+    call_command('rebuild_call_routes')
+
+
+@task(name='update_call_routes')
+def update_call_routes_task(tenant_id, numbers, contact_ids, account_ids):
+    """
+    Recompute the call routes queued during a request or task, see CallRouteQueue.
+    """
+    update_call_routes(tenant_id, numbers)
+    update_call_routes_for(tenant_id, contact_ids, account_ids)
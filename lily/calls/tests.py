@@ -0,0 +1,286 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import patch
+
+from lily.accounts.factories import AccountFactory
+from lily.cases.factories import CaseFactory, CaseStatusFactory
+from lily.contacts.factories import ContactFactory
+from lily.search.functions import search_number
+from lily.tenant.factories import TenantFactory
+from lily.users.factories import LilyUserFactory
+from lily.users.models import LilyUser
+from lily.utils.models.factories import PhoneNumberFactory
+
+from .factories import CallParticipantFactory, CallRecordFactory
+from .models import CallRecord, CallRoute
+from . import resolver
+from .resolver import get_generation, invalidate_resolver, lru_cache, resolve_number, shared_generations
+from .routing import call_route_queue, get_call_route, rebuild_call_routes
+
+
+class CallRouteTests(TestCase):
+    number = '+31612345678'
+
+    def setUp(self):
+        self.tenant = TenantFactory.create()
+
+    def test_route_for_contact(self):
+        """
+        Test that adding a phone number to a contact creates a route to the assignee of the contact's open case.
+        """
+        contact = ContactFactory.create(tenant=self.tenant)
+        user = LilyUserFactory.create(tenant=self.tenant, internal_number=201)
+        CaseFactory.create(
+            tenant=self.tenant,
+            contact=contact,
+            assigned_to=user,
+            status=CaseStatusFactory.create(tenant=self.tenant, name='New')
+        )
+
+        contact.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number=self.number))
+
+        route = get_call_route(self.tenant.pk, self.number)
+        self.assertEqual(route.contact, contact)
+        self.assertEqual(route.caller_name, contact.full_name)
+        self.assertEqual(route.user, user)
+
+    def test_route_for_account(self):
+        """
+        Test that an account's phone number routes to the user assigned to the account.
+        """
+        user = LilyUserFactory.create(tenant=self.tenant, internal_number=202)
+        account = AccountFactory.create(tenant=self.tenant, assigned_to=user)
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number=self.number))
+
+        route = get_call_route(self.tenant.pk, self.number)
+        self.assertEqual(route.account, account)
+        self.assertEqual(route.caller_name, account.name)
+        self.assertEqual(route.user, user)
+
+    def test_route_removed(self):
+        """
+        Test that the route is removed when the phone number is removed.
+        """
+        contact = ContactFactory.create(tenant=self.tenant)
+        phone_number = PhoneNumberFactory.create(tenant=self.tenant, number=self.number)
+        contact.phone_numbers.add(phone_number)
+        self.assertIsNotNone(get_call_route(self.tenant.pk, self.number))
+
+        contact.phone_numbers.remove(phone_number)
+        self.assertIsNone(get_call_route(self.tenant.pk, self.number))
+
+    def test_lookup_single_query(self):
+        """
+        Test that resolving a caller, including the user to route to, takes a single query.
+        """
+        user = LilyUserFactory.create(tenant=self.tenant, internal_number=203)
+        account = AccountFactory.create(tenant=self.tenant, assigned_to=user)
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number=self.number))
+
+        with self.assertNumQueries(1):
+            route = get_call_route(self.tenant.pk, self.number)
+            self.assertEqual(route.user.internal_number, 203)
+
+    def test_rebuild(self):
+        """
+        Test that a rebuild restores missing routes and removes stale ones.
+        """
+        account = AccountFactory.create(tenant=self.tenant)
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number=self.number))
+        CallRoute.objects.all().delete()
+        CallRoute.objects.create(tenant=self.tenant, number='+31600000000', caller_name='Stale')
+
+        rebuild_call_routes(self.tenant.pk)
+
+        self.assertIsNotNone(get_call_route(self.tenant.pk, self.number))
+        self.assertIsNone(get_call_route(self.tenant.pk, '+31600000000'))
+
+    @patch('lily.calls.tasks.update_call_routes_task.apply_async')
+    def test_routes_deferred(self, apply_async):
+        """
+        Test that within a request or task the routes are recomputed by a single task per tenant at the end.
+        """
+        account = AccountFactory.create(tenant=self.tenant)
+        phone_number = PhoneNumberFactory.create(tenant=self.tenant, number=self.number)
+
+        call_route_queue.start()
+        try:
+            account.phone_numbers.add(phone_number)
+            account.save()
+            self.assertIsNone(get_call_route(self.tenant.pk, self.number))
+            self.assertFalse(apply_async.called)
+        finally:
+            call_route_queue.finish()
+
+        self.assertEqual(apply_async.call_count, 1)
+        tenant_id, numbers, contact_ids, account_ids = apply_async.call_args[1]['args']
+        self.assertEqual(tenant_id, self.tenant.pk)
+        self.assertEqual(numbers, [self.number])
+        self.assertEqual(account_ids, [account.pk])
+
+    @patch('lily.calls.tasks.update_call_routes_task.apply_async')
+    def test_routes_nested(self, apply_async):
+        """
+        Test that the routes are only dispatched once the outermost request or task finishes.
+        """
+        account = AccountFactory.create(tenant=self.tenant)
+
+        call_route_queue.start()
+        call_route_queue.start()
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number=self.number))
+        call_route_queue.finish()
+        self.assertFalse(apply_async.called)
+
+        call_route_queue.finish()
+        self.assertEqual(apply_async.call_count, 1)
+
+
+class NormalizedPhoneNumberTests(TestCase):
+    def setUp(self):
+        self.tenant = TenantFactory.create(country='NL')
+
+    def test_numbers_linked_regardless_of_format(self):
+        """
+        Test that phone numbers and call participants with differently formatted numbers share a normalized number.
+        """
+        phone_number = PhoneNumberFactory.create(tenant=self.tenant, number='06-12345678')
+        participant = CallParticipantFactory.create(tenant=self.tenant, number='+31 6 1234 5678')
+
+        self.assertEqual(phone_number.normalized.number, '+31612345678')
+        self.assertEqual(phone_number.normalized_id, participant.normalized_id)
+
+        # Only a changed number is normalized again.
+        with patch('lily.utils.signals.NormalizedPhoneNumber.get_for_number') as get_for_number:
+            phone_number.save()
+        self.assertFalse(get_for_number.called)
+
+        phone_number.number = '06-87654321'
+        phone_number.save()
+        self.assertEqual(phone_number.normalized.number, '+31687654321')
+
+    def test_calls_of_account(self):
+        """
+        Test that the calls of an account and its contacts are found by their normalized numbers.
+        """
+        account = AccountFactory.create(tenant=self.tenant)
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number='020 123 4567'))
+        call = CallRecordFactory.create(
+            tenant=self.tenant,
+            caller=CallParticipantFactory.create(tenant=self.tenant, number='+31201234567'),
+        )
+        CallRecordFactory.create(tenant=self.tenant)
+
+        normalized_numbers = account.phone_numbers.values('normalized')
+        calls = CallRecord.objects.filter(caller__normalized__in=normalized_numbers)
+
+        self.assertEqual(list(calls), [call])
+
+    def test_search_number(self):
+        """
+        Test that searching a number finds the account, whatever format the number was stored in.
+        """
+        account = AccountFactory.create(tenant=self.tenant)
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number='(020) 123 45 67'))
+
+        result = search_number(self.tenant.pk, '+31201234567', return_related=False)
+
+        self.assertEqual(result['data']['accounts'], [account])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CALL_RESOLVER_CACHE_ENABLED=True
+)
+class ResolverTests(TestCase):
+    number = '+31612345678'
+
+    def setUp(self):
+        self.tenant = TenantFactory.create(country='NL')
+        lru_cache.clear()
+        resolver.cache.clear()
+
+    def test_resolve_cached(self):
+        """
+        Test that a resolved number is served from the cache until the contact changes.
+        """
+        contact = ContactFactory.create(tenant=self.tenant, first_name='John', last_name='Doe')
+        contact.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number='06 12345678'))
+
+        self.assertEqual(resolve_number(self.tenant.pk, self.number)['id'], contact.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_number(self.tenant.pk, self.number)['name'], 'John Doe')
+
+        contact.first_name = 'Jane'
+        contact.save()
+
+        self.assertEqual(resolve_number(self.tenant.pk, self.number)['name'], 'Jane Doe')
+
+    def test_resolve_unknown_number(self):
+        """
+        Test that unknown numbers are cached as well and are resolved once the number is added.
+        """
+        self.assertEqual(resolve_number(self.tenant.pk, self.number), {})
+
+        account = AccountFactory.create(tenant=self.tenant)
+        account.phone_numbers.add(PhoneNumberFactory.create(tenant=self.tenant, number=self.number))
+
+        self.assertEqual(resolve_number(self.tenant.pk, self.number)['id'], account.id)
+
+    def test_unrelated_changes(self):
+        """
+        Test that only changes to the fields the resolver uses invalidate the resolved numbers.
+        """
+        user = LilyUserFactory.create(tenant=self.tenant, internal_number=201)
+        generation = get_generation(self.tenant.pk)
+
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        user.save()
+        # Saves of loaded users compare against the values as they were loaded.
+        LilyUser.objects.get(pk=user.pk).save()
+        self.assertEqual(get_generation(self.tenant.pk), generation)
+
+        user.internal_number = 202
+        user.save()
+        self.assertNotEqual(get_generation(self.tenant.pk), generation)
+
+    def test_invalidate_tenant(self):
+        """
+        Test that invalidating the resolved numbers of a tenant keeps those of other tenants.
+        """
+        other_tenant = TenantFactory.create(country='NL')
+
+        resolve_number(self.tenant.pk, self.number)
+        resolve_number(other_tenant.pk, self.number)
+        invalidate_resolver(self.tenant.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_number(other_tenant.pk, self.number), {})
+        self.assertTrue([key for key in lru_cache.items if key[0] == other_tenant.pk])
+
+        with self.assertNumQueries(3):
+            # The country of the tenant and the contacts and accounts with the number.
+            self.assertEqual(resolve_number(self.tenant.pk, self.number), {})
+
+    def test_generation_per_request(self):
+        """
+        Test that the generation is only read once per request, unless it's bumped in the request itself.
+        """
+        resolve_number(self.tenant.pk, self.number)
+        generation = get_generation(self.tenant.pk)
+
+        shared_generations.start()
+        try:
+            with patch.object(resolver.cache, 'get', wraps=resolver.cache.get) as cache_get:
+                for i in range(3):
+                    resolve_number(self.tenant.pk, self.number)
+
+            generation_key = resolver.GENERATION_KEY % self.tenant.pk
+            self.assertEqual([args for args, kwargs in cache_get.call_args_list if args[0] == generation_key],
+                             [(generation_key, 0)])
+
+            invalidate_resolver(self.tenant.pk)
+            self.assertEqual(get_generation(self.tenant.pk), generation + 1)
+        finally:
+            shared_generations.finish()
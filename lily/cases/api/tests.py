@@ -19,6 +19,7 @@ class CaseTests(GenericAPITestCase):
     factory_cls = CaseFactory
     model_cls = Case
     serializer_cls = CaseSerializer
+    constant_list_queries = True
 
     def _create_object_stub(self, with_relations=False, size=1, **kwargs):
         """
@@ -5,7 +5,7 @@ from rest_framework.filters import OrderingFilter
 from rest_framework.views import APIView
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import ModelChangesMixin, PrefetchRelatedMixin
 
 from .serializers import CaseSerializer, CaseStatusSerializer, CaseTypeSerializer
 from ..models import Case, CaseStatus, CaseType
@@ -44,7 +44,7 @@ class CaseFilter(FilterSet):
         fields = ['type', 'status', 'not_type', 'not_status', ]
 
 
-class CaseViewSet(ModelChangesMixin, viewsets.ModelViewSet):
+class CaseViewSet(ModelChangesMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     """
     Returns a list of all **active** cases in the system.
 
@@ -81,6 +81,8 @@ class CaseViewSet(ModelChangesMixin, viewsets.ModelViewSet):
 
     # ElasticSearchFilter: set the model type.
     model_type = 'cases_case'
+    # ElasticSearchFilter: set the ordering fields Elasticsearch can sort on.
+    search_ordering_fields = ('id', 'created', 'modified', 'priority',)
     # OrderingFilter: set all possible fields to order by.
     ordering_fields = ('id', 'created', 'modified', 'priority', 'subject',)
     # OrderingFilter: set the default ordering fields.
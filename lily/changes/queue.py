@@ -0,0 +1,40 @@
+from django.conf import settings
+
+from lily.utils.queues import RequestQueue, register
+
+from .models import Change
+
+
+class ChangeQueue(RequestQueue):
+    """
+    Thread local queue of changes which still have to be stored.
+
+    Changes are stored in bulk at the end of the request or task, so recording a change doesn't cost a query on
+    the edit itself.
+    """
+    @property
+    def max_size(self):
+        return settings.CHANGE_QUEUE_MAX_SIZE
+
+    def process(self, changes):
+        Change.objects.bulk_create(changes)
+
+
+change_queue = register(ChangeQueue())
+
+
+def queue_change(**kwargs):
+    """
+    Queue a change to be stored at the end of the request or task.
+
+    Arguments:
+        kwargs: field values of the Change, including the tenant
+    """
+    change_queue.add(Change(**kwargs))
+
+
+def flush_change_queue(**kwargs):
+    """
+    Store all queued changes, without waiting for the request or task to finish.
+    """
+    change_queue.flush()
@@ -23,6 +23,7 @@ class ContactTests(GenericAPITestCase):
     factory_cls = ContactFactory
     model_cls = Contact
     serializer_cls = ContactSerializer
+    constant_list_queries = True
 
     def _create_object(self, with_relations=False, size=1, **kwargs):
         """
@@ -5,16 +5,15 @@ from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import ModelChangesMixin, PrefetchRelatedMixin
 
 from lily.calls.api.serializers import CallRecordSerializer
 from lily.calls.models import CallRecord
 from lily.contacts.api.serializers import ContactSerializer
 from lily.contacts.models import Contact, Function
-from lily.utils.functions import uniquify
 
 
-class ContactViewSet(ModelChangesMixin, viewsets.ModelViewSet):
+class ContactViewSet(ModelChangesMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     """
     Returns a list of all **active** contacts in the system.
 
@@ -85,11 +84,10 @@ class ContactViewSet(ModelChangesMixin, viewsets.ModelViewSet):
     def calls(self, request, pk=None):
         contact = self.get_object()
 
-        phone_numbers = contact.phone_numbers.all().values_list('number', flat=True)
-        phone_numbers = uniquify(phone_numbers)  # Filter out double numbers.
+        normalized_numbers = contact.phone_numbers.filter(normalized__isnull=False).values('normalized')
 
         calls = CallRecord.objects.filter(
-            Q(caller__number__in=phone_numbers) | Q(destination__number__in=phone_numbers)
+            Q(caller__normalized__in=normalized_numbers) | Q(destination__normalized__in=normalized_numbers)
         )
 
         page = self.paginate_queryset(calls)
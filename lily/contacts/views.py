@@ -52,43 +52,36 @@ class ExportContactView(LoginRequiredMixin, ExportListViewMixin, View):
     }
 
     # ExportListViewMixin
-    def value_for_column(self, contact, column):
-        try:
-            if column == 'url':
-                return '/#/contacts/%s' % contact['id']
-            elif column == 'accounts':
-                # 'accounts' is a dict, so we need to process it differently.
-                value = []
-                for account in contact.get('accounts', []):
-                    value.append(account['name'])
-            elif column == 'email_addresses':
-                # 'email_addresses' is a dict, so we need to process it differently.
-                value = []
-                for email in contact.get('email_addresses', []):
-                    value.append(email['email_address'])
-            elif column == 'phone_numbers':
-                # 'phone_numbers' is a dict, so we need to process it differently.
-                value = []
-                for phone_number in contact.get('phone_numbers', []):
-                    value.append(phone_number['number'])
-            else:
-                value = contact[column]
+    def get_column_extractor(self, column):
+        if column == 'url':
+            return lambda contact: '/#/contacts/%s' % contact['id']
+        elif column == 'accounts':
+            return lambda contact: ', '.join([account['name'] for account in contact.get('accounts', [])])
+        elif column == 'email_addresses':
+            return lambda contact: ', '.join(
+                [email['email_address'] for email in contact.get('email_addresses', [])]
+            )
+        elif column == 'phone_numbers':
+            return lambda contact: ', '.join(
+                [phone_number['number'] for phone_number in contact.get('phone_numbers', [])]
+            )
 
+        def extract(contact):
+            value = contact.get(column, '')
             if isinstance(value, list):
                 value = ', '.join(value)
-        except KeyError:
-            value = ''
-        return value
+            return value
+
+        return extract
 
     # ExportListViewMixin
     def get_items(self):
         search = LilySearch(
             tenant_id=self.request.user.tenant_id,
             model_type='contacts_contact',
-            page=0,
-            size=1000000000,
         )
 
         if self.request.GET.get('export_filter'):
             search.query_common_fields(self.request.GET.get('export_filter'))
-        return search.do_search()[0]
+        # Scroll through the results, so the contacts are streamed instead of loaded all at once.
+        return search.iterate()
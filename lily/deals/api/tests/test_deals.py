@@ -21,6 +21,7 @@ class DealTests(GenericAPITestCase):
     factory_cls = DealFactory
     model_cls = Deal
     serializer_cls = DealSerializer
+    constant_list_queries = True
 
     def _create_object_stub(self, with_relations=False, size=1, **kwargs):
         """
@@ -6,7 +6,7 @@ from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
 from lily.api.filters import ElasticSearchFilter
-from lily.api.mixins import ModelChangesMixin
+from lily.api.mixins import ModelChangesMixin, PrefetchRelatedMixin
 
 from .serializers import (DealSerializer, DealNextStepSerializer, DealWhyCustomerSerializer, DealWhyLostSerializer,
                           DealFoundThroughSerializer, DealContactedBySerializer, DealStatusSerializer)
@@ -133,7 +133,7 @@ class DealFilter(FilterSet):
         }
 
 
-class DealViewSet(ModelChangesMixin, ModelViewSet):
+class DealViewSet(ModelChangesMixin, PrefetchRelatedMixin, ModelViewSet):
     """
     Returns a list of all **active** deals in the system.
 
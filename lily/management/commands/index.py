@@ -1,10 +1,13 @@
+import json
+import multiprocessing
 import os
 import traceback
 import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import connection
+from django.db import connection, connections
+from django.db.models import Max, Min
 
 from slacker import Slacker
 
@@ -14,6 +17,62 @@ from lily.search.indexing import index_objects
 from lily.search.scan_search import ModelMappings
 
 
+# State of the worker processes of a parallel index run, set up by init_worker.
+worker_es = None
+worker_checkpoints = None
+
+
+def get_indexable_objects(mapping):
+    """
+    Return the queryset with all the objects of the mapping that should be indexed.
+    """
+    model = mapping.get_model()
+
+    if mapping.has_deleted():
+        return model.objects.filter(is_deleted=False)
+    return model.objects.all()
+
+
+def init_worker(checkpoints):
+    """
+    Set up a worker process of a parallel index run.
+
+    Every worker gets its own Elasticsearch client and database connection, the connections inherited from the
+    parent process are closed so they won't be shared.
+    """
+    global worker_es, worker_checkpoints
+
+    connections.close_all()
+    worker_es = get_es_client()
+    worker_checkpoints = checkpoints
+
+
+def index_shard(shard):
+    """
+    Index all objects of a mapping within a primary key range.
+
+    Args:
+        shard (dict): the shard as stored in the checkpoint file, with the mapping type name, the temp index base
+            and the pk range to index: (start_pk, end_pk], starting after last_pk
+    """
+    mapping = ModelMappings.get_mapping_by_type_name(shard['mapping'])
+    queryset = get_indexable_objects(mapping).filter(pk__lte=shard['end_pk'])
+
+    def checkpoint(last_pk):
+        worker_checkpoints.put((shard['mapping'], shard['number'], last_pk))
+
+    index_objects(
+        mapping,
+        queryset,
+        shard['temp_index_base'],
+        es_client=worker_es,
+        start_pk=shard['last_pk'],
+        checkpoint=checkpoint
+    )
+
+    return shard['mapping'], shard['number']
+
+
 class Command(BaseCommand):
     help = """Index current model instances into Elasticsearch. It does this by
 creating a new index, then changing the alias to point to the new index.
@@ -33,7 +92,17 @@ The second way is to target a specific model:
     index -t contacts_contact
     index -t lily.contacts
 
-It is possible to specify multiple models, using comma separation."""
+It is possible to specify multiple models, using comma separation.
+
+Large indexes can be built in parallel, by indexing multiple mappings at once
+and splitting the primary key range of every mapping over a pool of workers:
+
+    index -w 8
+
+The progress of a parallel run is saved to a checkpoint file, so an
+interrupted run can continue where it stopped:
+
+    index -w 8 --resume"""
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -61,6 +130,27 @@ It is possible to specify multiple models, using comma separation."""
             dest='force',
             help='Force the creation of the new index, removing the old one (leftovers).'
         )
+        parser.add_argument(
+            '-w', '--workers',
+            action='store',
+            dest='workers',
+            type=int,
+            default=1,
+            help='Index in parallel with this number of worker processes.'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            help='Resume an interrupted parallel run from the checkpoint file.'
+        )
+        parser.add_argument(
+            '--checkpoint-file',
+            action='store',
+            dest='checkpoint_file',
+            default='index_checkpoint.json',
+            help='The file to save the progress of a parallel run to.'
+        )
 
     def handle(self, *args, **kwargs):
         self.stdout.write('Please remember that Lily needs to be in maintenance mode. \n\n')
@@ -70,7 +160,10 @@ It is possible to specify multiple models, using comma separation."""
             self.handle_kwargs(**kwargs)
 
             self.es = get_es_client()
-            self.index()
+            if self.workers > 1 or self.resume:
+                self.index_parallel()
+            else:
+                self.index()
 
             if self.log_queries:
                 for query in connection.queries:
@@ -119,6 +212,13 @@ It is possible to specify multiple models, using comma separation."""
         # Validate the force kwarg.
         self.force = kwargs['force'] is True
 
+        # Validate the parallel indexing kwargs.
+        if kwargs['workers'] < 1:
+            raise Exception('The number of workers should be at least 1.')
+        self.workers = kwargs['workers']
+        self.resume = kwargs['resume'] is True
+        self.checkpoint_file = kwargs['checkpoint_file']
+
     def validate_targets(self, targets_to_check):
         """
         Validate every target that is passed to the command.
@@ -164,86 +264,253 @@ It is possible to specify multiple models, using comma separation."""
         Do the actual indexing for all specified targets.
         """
         for mapping in self.target_list:
-            model_name = mapping.get_mapping_type_name()
-            main_index_base = settings.ES_INDEXES['default']
-            main_index = get_index_name(main_index_base, mapping)
+            self.stdout.write('==> %s' % mapping.get_mapping_type_name())
+
+            old_index = self.check_indexes(mapping)
+            temp_index_base = self.create_index(mapping)
+
+            # Index documents.
+            self.index_documents(mapping, temp_index_base)
+
+            self.switch_aliases(mapping, old_index, temp_index_base)
+            self.stdout.write('')
+
+        self.stdout.write('Indexing finished.')
 
+    def index_parallel(self):
+        """
+        Index all specified targets at once, using a pool of worker processes.
+
+        Every mapping is split in pk ranges (shards), which are divided over the workers. The last indexed pk of every
+        shard is saved in the checkpoint file, so an interrupted run can be resumed with --resume.
+        """
+        checkpoint = self.load_checkpoint() if self.resume else {}
+
+        for mapping in self.target_list:
+            model_name = mapping.get_mapping_type_name()
             self.stdout.write('==> %s' % model_name)
 
-            # Check if we currently have an index for this mapping.
+            if model_name in checkpoint:
+                temp_index_base = checkpoint[model_name]['temp_index_base']
+                self.stdout.write('Resuming index "%s"' % get_index_name(temp_index_base, mapping))
+                self.check_indexes(mapping, keep_index_base=temp_index_base)
+            else:
+                self.check_indexes(mapping)
+                temp_index_base = self.create_index(mapping)
+                checkpoint[model_name] = {
+                    'temp_index_base': temp_index_base,
+                    'shards': self.get_shards(mapping, temp_index_base),
+                }
+                self.save_checkpoint(checkpoint)
+
+        shards = [
+            shard for mapping_checkpoint in checkpoint.values()
+            for shard in mapping_checkpoint['shards'] if not shard['done']
+        ]
+        self.stdout.write('Indexing %s shards with %s workers' % (len(shards), self.workers))
+
+        # Close the connection, so it won't be shared with the forked worker processes.
+        connection.close()
+
+        checkpoints = multiprocessing.Queue()
+        pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(checkpoints, ))
+        try:
+            result = pool.map_async(index_shard, shards, chunksize=1)
+            while not result.ready():
+                result.wait(5)
+                self.process_checkpoints(checkpoint, checkpoints)
+
+            for model_name, shard_number in result.get():
+                checkpoint[model_name]['shards'][shard_number]['done'] = True
+            self.process_checkpoints(checkpoint, checkpoints)
+        finally:
+            pool.close()
+            pool.join()
+
+        for mapping in self.target_list:
+            model_name = mapping.get_mapping_type_name()
+            main_index = get_index_name(settings.ES_INDEXES['default'], mapping)
+
             old_index = None
-            aliases = self.es.indices.get_aliases(name=main_index)
-            for key, value in aliases.iteritems():
+            for key, value in self.es.indices.get_aliases(name=main_index).iteritems():
                 if value['aliases']:
                     old_index = key
-                    self.stdout.write('Current index "%s"' % key)
-
-            # Check any indices with no alias (leftovers from failed indexing).
-            # Or it could be that it is still in progress,
-            aliases = self.es.indices.get_aliases()
-            for key, value in aliases.iteritems():
-                if not key.endswith(model_name):
-                    # Not the model we are looking after.
-                    continue
-                if key == main_index:
-                    # This is an auto created index. Will be removed at end of command.
-                    continue
-                if not value['aliases']:
-                    if self.force:
-                        self.stdout.write('Removing leftover "%s"' % key)
-                        self.es.indices.delete(key)
-                    else:
-                        raise Exception('Found leftover %s, proceed with -f to remove.'
-                                        ' Make sure indexing this model is not already running!' % key)
-
-            # Create new index.
-            index_settings = {
-                'mappings': {
-                    model_name: mapping.get_mapping()
-                },
-                'settings': {
-                    'analysis': get_analyzers()['analysis'],
-                    'number_of_shards': 1,
-                }
-            }
-            temp_index_base = 'index_%s' % (int(time.time()))
-            temp_index = get_index_name(temp_index_base, mapping)
 
-            self.stdout.write('Creating new index "%s"' % temp_index)
-            self.es.indices.create(temp_index, body=index_settings)
+            self.switch_aliases(mapping, old_index, checkpoint[model_name]['temp_index_base'])
 
-            # Index documents.
-            self.index_documents(mapping, temp_index_base)
+            del checkpoint[model_name]
+            self.save_checkpoint(checkpoint)
 
-            # Switch aliases.
-            if old_index:
-                self.es.indices.update_aliases({
-                    'actions': [
-                        {'remove': {'index': old_index, 'alias': main_index}},
-                        {'remove': {'index': old_index, 'alias': main_index_base}},
-                        {'add': {'index': temp_index, 'alias': main_index}},
-                        {'add': {'index': temp_index, 'alias': main_index_base}},
-                    ]
-                })
-                self.stdout.write('Removing previous index "%s"' % old_index)
-                self.es.indices.delete(old_index)
-            else:
-                if self.es.indices.exists(main_index):
-                    # This is a corner case. There was no alias named index_name, but
-                    # an index index_name nevertheless exists, this only happens when the index
-                    # was already created (because of ES auto creation features).
-                    self.stdout.write('Removing previous (presumably auto created) index "%s"' % main_index)
-                    self.es.indices.delete(main_index)
-                self.es.indices.update_aliases({
-                    'actions': [
-                        {'add': {'index': temp_index, 'alias': main_index}},
-                        {'add': {'index': temp_index, 'alias': main_index_base}},
-                    ]
-                })
-            self.stdout.write('')
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
 
         self.stdout.write('Indexing finished.')
 
+    def get_shards(self, mapping, temp_index_base):
+        """
+        Split the pk range of the objects to index into a shard per worker.
+        """
+        pk_range = get_indexable_objects(mapping).aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+        if pk_range['min_pk'] is None:
+            return []
+
+        start_pk = pk_range['min_pk'] - 1
+        shard_size = max((pk_range['max_pk'] - start_pk) // self.workers, 1)
+
+        shards = []
+        while start_pk < pk_range['max_pk']:
+            end_pk = min(start_pk + shard_size, pk_range['max_pk'])
+            if len(shards) == self.workers - 1:
+                # Make sure the last shard includes the rest of the range.
+                end_pk = pk_range['max_pk']
+
+            shards.append({
+                'mapping': mapping.get_mapping_type_name(),
+                'number': len(shards),
+                'temp_index_base': temp_index_base,
+                'start_pk': start_pk,
+                'end_pk': end_pk,
+                'last_pk': start_pk,
+                'done': False,
+            })
+            start_pk = end_pk
+
+        return shards
+
+    def process_checkpoints(self, checkpoint, checkpoints):
+        """
+        Save the progress reported by the workers to the checkpoint file.
+        """
+        updated = False
+        while not checkpoints.empty():
+            model_name, shard_number, last_pk = checkpoints.get()
+            shard = checkpoint[model_name]['shards'][shard_number]
+            shard['last_pk'] = max(shard['last_pk'], last_pk)
+            updated = True
+
+        if updated:
+            self.save_checkpoint(checkpoint)
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_file):
+            self.stdout.write('No checkpoint file "%s" found, starting a new run.' % self.checkpoint_file)
+            return {}
+
+        with open(self.checkpoint_file) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+        # Only resume the mappings which are targeted.
+        model_names = [mapping.get_mapping_type_name() for mapping in self.target_list]
+        return {key: value for key, value in checkpoint.items() if key in model_names}
+
+    def save_checkpoint(self, checkpoint):
+        # Write to a temp file first, so an interruption never leaves a corrupt checkpoint file.
+        temp_file = '%s.tmp' % self.checkpoint_file
+        with open(temp_file, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.rename(temp_file, self.checkpoint_file)
+
+    def check_indexes(self, mapping, keep_index_base=None):
+        """
+        Find the current index of the mapping and check for leftovers of failed runs.
+
+        Args:
+            keep_index_base (str): base name of a temp index of a resumed run, which isn't a leftover
+
+        Returns:
+            The name of the index which is currently aliased or None.
+        """
+        model_name = mapping.get_mapping_type_name()
+        main_index = get_index_name(settings.ES_INDEXES['default'], mapping)
+        keep_index = get_index_name(keep_index_base, mapping) if keep_index_base else None
+
+        # Check if we currently have an index for this mapping.
+        old_index = None
+        aliases = self.es.indices.get_aliases(name=main_index)
+        for key, value in aliases.iteritems():
+            if value['aliases']:
+                old_index = key
+                self.stdout.write('Current index "%s"' % key)
+
+        # Check any indices with no alias (leftovers from failed indexing).
+        # Or it could be that it is still in progress,
+        aliases = self.es.indices.get_aliases()
+        for key, value in aliases.iteritems():
+            if not key.endswith(model_name):
+                # Not the model we are looking after.
+                continue
+            if key in (main_index, keep_index):
+                # This is an auto created index. Will be removed at end of command.
+                # Or the index of a resumed run.
+                continue
+            if not value['aliases']:
+                if self.force:
+                    self.stdout.write('Removing leftover "%s"' % key)
+                    self.es.indices.delete(key)
+                else:
+                    raise Exception('Found leftover %s, proceed with -f to remove.'
+                                    ' Make sure indexing this model is not already running!' % key)
+
+        return old_index
+
+    def create_index(self, mapping):
+        """
+        Create a new (temp) index for the mapping.
+
+        Returns:
+            The base name of the new index.
+        """
+        model_name = mapping.get_mapping_type_name()
+        index_settings = {
+            'mappings': {
+                model_name: mapping.get_mapping()
+            },
+            'settings': {
+                'analysis': get_analyzers()['analysis'],
+                'number_of_shards': 1,
+            }
+        }
+        temp_index_base = 'index_%s' % (int(time.time()))
+        temp_index = get_index_name(temp_index_base, mapping)
+
+        self.stdout.write('Creating new index "%s"' % temp_index)
+        self.es.indices.create(temp_index, body=index_settings)
+
+        return temp_index_base
+
+    def switch_aliases(self, mapping, old_index, temp_index_base):
+        """
+        Point the aliases to the new index and remove the old index.
+        """
+        main_index_base = settings.ES_INDEXES['default']
+        main_index = get_index_name(main_index_base, mapping)
+        temp_index = get_index_name(temp_index_base, mapping)
+
+        if old_index:
+            self.es.indices.update_aliases({
+                'actions': [
+                    {'remove': {'index': old_index, 'alias': main_index}},
+                    {'remove': {'index': old_index, 'alias': main_index_base}},
+                    {'add': {'index': temp_index, 'alias': main_index}},
+                    {'add': {'index': temp_index, 'alias': main_index_base}},
+                ]
+            })
+            self.stdout.write('Removing previous index "%s"' % old_index)
+            self.es.indices.delete(old_index)
+        else:
+            if self.es.indices.exists(main_index):
+                # This is a corner case. There was no alias named index_name, but
+                # an index index_name nevertheless exists, this only happens when the index
+                # was already created (because of ES auto creation features).
+                self.stdout.write('Removing previous (presumably auto created) index "%s"' % main_index)
+                self.es.indices.delete(main_index)
+            self.es.indices.update_aliases({
+                'actions': [
+                    {'add': {'index': temp_index, 'alias': main_index}},
+                    {'add': {'index': temp_index, 'alias': main_index_base}},
+                ]
+            })
+
     def index_documents(self, mapping, temp_index_base):
         """
         Index all non deleted objects.
@@ -251,9 +518,4 @@ It is possible to specify multiple models, using comma separation."""
         model = mapping.get_model()
         self.stdout.write('Indexing {0}.{1}'.format(model.__module__, model.__name__).lower())
 
-        if mapping.has_deleted():
-            model_objs = model.objects.filter(is_deleted=False)
-        else:
-            model_objs = model.objects.all()
-
-        index_objects(mapping, model_objs, temp_index_base, print_progress=True)
+        index_objects(mapping, get_indexable_objects(mapping), temp_index_base, print_progress=True)
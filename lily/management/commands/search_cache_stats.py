@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from lily.search.cache import get_cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = """Show the hit and miss counters of the search result cache."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-r', '--reset',
+            action='store_true',
+            dest='reset',
+            help='Reset the counters after showing them.'
+        )
+
+    def handle(self, *args, **kwargs):
+        stats = get_cache_stats()
+        self.stdout.write('Hits: %(hits)s, misses: %(misses)s, hit ratio: %(hit_ratio).2f' % stats)
+
+        if kwargs['reset']:
+            reset_cache_stats()
+            self.stdout.write('Counters reset.')
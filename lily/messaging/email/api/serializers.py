@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.db.models import Q
@@ -83,6 +85,18 @@ class EmailMessageSerializer(serializers.ModelSerializer):
     labels = EmailLabelSerializer(many=True, read_only=True)
     sent_date = serializers.ReadOnlyField()
 
+    def to_representation(self, instance):
+        if getattr(instance, 'privacy', None) != EmailAccount.METADATA:
+            return super(EmailMessageSerializer, self).to_representation(instance)
+
+        # The content of the message isn't loaded, so don't touch the other fields.
+        ret = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name in EmailMessage.METADATA_FIELDS:
+                ret[field.field_name] = field.to_representation(field.get_attribute(instance))
+
+        return ret
+
     class Meta:
         model = EmailMessage
         fields = (
@@ -1,6 +1,8 @@
+from collections import defaultdict
 import logging
 
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
 import phonenumbers
@@ -11,7 +13,7 @@ from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
 from lily.accounts.models import Account
-from lily.messaging.email.utils import get_email_parameter_api_dict, reindex_email_message
+from lily.messaging.email.utils import get_email_parameter_api_dict, reindex_email_message, reindex_email_messages
 from lily.search.lily_search import LilySearch
 from lily.users.models import UserInfo
 from lily.users.api.serializers import LilyUserSerializer
@@ -21,9 +23,10 @@ from .serializers import (EmailLabelSerializer, EmailAccountSerializer, EmailMes
                           TemplateVariableSerializer)
 from ..models.models import (EmailLabel, EmailAccount, EmailMessage, EmailTemplateFolder, EmailTemplate,
                              SharedEmailConfig, TemplateVariable)
-from ..tasks import (trash_email_message, toggle_read_email_message,
-                     add_and_remove_labels_for_message, toggle_star_email_message, toggle_spam_email_message)
-from ..utils import get_filtered_message
+from ..tasks import (trash_email_message, toggle_read_email_message, add_and_remove_labels_for_message,
+                     batch_modify_email_messages, toggle_star_email_message, toggle_spam_email_message)
+from ..unread import bulk_add_and_remove_labels, set_email_message_read
+from ..utils import EmailPrivacyResolver
 
 
 logger = logging.getLogger(__name__)
@@ -160,17 +163,19 @@ class EmailMessageViewSet(mixins.RetrieveModelMixin,
     queryset = EmailMessage.objects.all()
     serializer_class = EmailMessageSerializer
 
+    def get_privacy_resolver(self):
+        """
+        Return the privacy resolver of the current request, so email accounts and shared configs are loaded only once.
+        """
+        if not hasattr(self, '_privacy_resolver'):
+            self._privacy_resolver = EmailPrivacyResolver(self.request.user)
+        return self._privacy_resolver
+
     def get_object(self):
         pk = int(self.kwargs['pk'])
         email_message = EmailMessage.objects.get(pk=pk)
-        user = self.request.user
 
-        try:
-            email_account = EmailAccount.objects.get(pk=email_message.account.id)
-        except EmailAccount.DoesNotExist:
-            email_message = None
-        else:
-            email_message = get_filtered_message(email_message, email_account, user)
+        email_message = self.get_privacy_resolver().filter_message(email_message)
 
         if not email_message:
             raise NotFound()
@@ -182,22 +187,40 @@ class EmailMessageViewSet(mixins.RetrieveModelMixin,
 
     def get_queryset(self):
         user = self.request.user
-        email_messages = EmailMessage.objects.filter(account__tenant=user.tenant)
-
-        # Get all email accounts.
-        email_accounts = EmailAccount.objects.filter(tenant=user.tenant, is_deleted=False).distinct('id')
-
-        filtered_queryset = []
-
-        for email_message in email_messages:
-            email_account = email_accounts.get(pk=email_message.account.id)
-
-            filtered_message = get_filtered_message(email_message, email_account, user)
-
-            if filtered_message:
-                filtered_queryset.append(filtered_message)
-
-        return filtered_queryset
+        email_messages = EmailMessage.objects.filter(account__tenant=user.tenant).select_related(
+            'sender',
+        ).prefetch_related(
+            'labels',
+            'received_by',
+            'received_by_cc',
+            'attachments',
+        ).defer(
+            # The content is loaded for the messages on the page the user may read, see paginate_queryset.
+            *EmailMessage.CONTENT_FIELDS
+        ).order_by('-sent_date', '-id')
+
+        # Filter on privacy in the database, so the list is paginated there and only the page is loaded.
+        return self.get_privacy_resolver().filter_queryset(email_messages)
+
+    def paginate_queryset(self, queryset):
+        page = super(EmailMessageViewSet, self).paginate_queryset(queryset)
+
+        if page is not None:
+            # Load the content of the messages that aren't metadata only, with one query for the whole page.
+            message_ids = [message.id for message in page if message.privacy != EmailAccount.METADATA]
+            serialized_fields = self.get_serializer_class().Meta.fields
+            field_names = [name for name in EmailMessage.CONTENT_FIELDS if name in serialized_fields]
+            contents = {
+                content['id']: content for content in EmailMessage.objects.filter(
+                    id__in=message_ids
+                ).values('id', *field_names)
+            }
+
+            for email_message in page:
+                for field_name, value in contents.get(email_message.id, {}).items():
+                    setattr(email_message, field_name, value)
+
+        return page
 
     def perform_update(self, serializer):
         """
@@ -206,8 +229,7 @@ class EmailMessageViewSet(mixins.RetrieveModelMixin,
         update database directly. Save will trigger an update of the search index.
         """
         email = self.get_object()
-        email.read = self.request.data['read']
-        email.save()
+        set_email_message_read(email, self.request.data['read'])
         toggle_read_email_message.apply_async(args=(email.id, self.request.data['read']))
 
     def perform_destroy(self, instance):
@@ -298,6 +320,159 @@ class EmailMessageViewSet(mixins.RetrieveModelMixin,
         toggle_spam_email_message.delay(email.id, spam=request.data['markAsSpam'])
         return Response(serializer.data)
 
+    def get_bulk_queryset(self):
+        """
+        Return the email messages with the ids in the request, which the user is allowed to change.
+        """
+        email_messages = EmailMessage.objects.filter(
+            account__tenant=self.request.user.tenant,
+            id__in=self.request.data.get('ids', []),
+        )
+
+        return self.get_privacy_resolver().filter_queryset(email_messages).exclude(privacy=EmailAccount.METADATA)
+
+    def bulk_modify(self, email_messages, add_labels=None, remove_labels=None, read=None):
+        """
+        Add and/or remove labels of multiple email messages.
+
+        The labels are changed in the database in one transaction and the messages are reindexed with one bulk
+        request, so changes are immediately visible. Gmail is updated asynchronously with a batch modify task per
+        email account.
+
+        Args:
+            email_messages (queryset): the EmailMessages to change
+            add_labels (list, optional): list of label_ids to add
+            remove_labels (list, optional): list of label_ids to remove
+            read (boolean, optional): mark the messages as (un)read as well
+
+        Returns:
+            Response with the ids of the changed email messages
+        """
+        add_labels = [label for label in add_labels or [] if label != settings.GMAIL_LABEL_SENT]
+        remove_labels = [label for label in remove_labels or [] if label != settings.GMAIL_LABEL_SENT]
+
+        if read is not None:
+            # The read status is an UNREAD label in Gmail.
+            (remove_labels if read else add_labels).append(settings.GMAIL_LABEL_UNREAD)
+
+        message_ids_per_account = defaultdict(dict)
+        for email_id, account_id, message_id in email_messages.values_list('id', 'account_id', 'message_id'):
+            message_ids_per_account[account_id][email_id] = message_id
+
+        labels_per_account = defaultdict(list)
+        for label in EmailLabel.objects.filter(
+            account_id__in=message_ids_per_account.keys(),
+            label_id__in=add_labels + remove_labels,
+        ):
+            labels_per_account[label.account_id].append(label)
+
+        changed_ids = []
+        with transaction.atomic():
+            for account_id, message_ids in message_ids_per_account.items():
+                changed_ids += bulk_add_and_remove_labels(
+                    message_ids.keys(),
+                    add_labels=[label for label in labels_per_account[account_id] if label.label_id in add_labels],
+                    remove_labels=[
+                        label for label in labels_per_account[account_id] if label.label_id in remove_labels
+                    ],
+                    read=read,
+                )
+
+        for account_id, message_ids in message_ids_per_account.items():
+            batch_modify_email_messages.delay(
+                account_id,
+                message_ids.values(),
+                # Only add labels which exist for the email account, except for the UNREAD label which always exists.
+                add_labels=[
+                    label for label in add_labels if label == settings.GMAIL_LABEL_UNREAD or
+                    label in [account_label.label_id for account_label in labels_per_account[account_id]]
+                ],
+                remove_labels=remove_labels,
+            )
+
+        reindex_email_messages(changed_ids, self.request.user.tenant_id)
+
+        return Response({'ids': changed_ids})
+
+    @list_route(methods=['put'])
+    def bulk_archive(self, request):
+        """
+        Archive multiple email messages by removing the inbox label and the provided label of the current inbox.
+        """
+        remove_labels = [settings.GMAIL_LABEL_INBOX]
+
+        # Filter out labels an user should not manipulate.
+        current_inbox = request.data.get('current_inbox', '')
+        if current_inbox and current_inbox not in settings.GMAIL_LABELS_DONT_MANIPULATE + remove_labels:
+            remove_labels.append(current_inbox)
+
+        return self.bulk_modify(self.get_bulk_queryset(), remove_labels=remove_labels)
+
+    @list_route(methods=['put'])
+    def bulk_trash(self, request):
+        """
+        Trash multiple email messages by adding the trash label.
+
+        Drafts are deleted and already trashed messages are deleted permanently, which can't be done in batch, so these
+        are still trashed per message.
+        """
+        email_messages = self.get_bulk_queryset()
+
+        excluded_ids = list(email_messages.filter(
+            labels__label_id__in=[settings.GMAIL_LABEL_DRAFT, settings.GMAIL_LABEL_TRASH],
+        ).values_list('id', flat=True).distinct())
+
+        for email_id in excluded_ids:
+            trash_email_message.apply_async(args=(email_id,))
+
+        response = self.bulk_modify(
+            email_messages.exclude(id__in=excluded_ids),
+            add_labels=[settings.GMAIL_LABEL_TRASH],
+            remove_labels=[settings.GMAIL_LABEL_INBOX],
+        )
+        response.data['ids'] += excluded_ids
+        return response
+
+    @list_route(methods=['put'])
+    def bulk_move(self, request):
+        """
+        Add and/or remove labels of multiple email messages.
+        """
+        return self.bulk_modify(
+            self.get_bulk_queryset(),
+            add_labels=request.data.get('add_labels', []),
+            remove_labels=request.data.get('remove_labels', []),
+        )
+
+    @list_route(methods=['put'])
+    def bulk_star(self, request):
+        """
+        (Un)star multiple email messages.
+        """
+        if request.data['starred']:
+            return self.bulk_modify(self.get_bulk_queryset(), add_labels=[settings.GMAIL_LABEL_STAR])
+        return self.bulk_modify(self.get_bulk_queryset(), remove_labels=[settings.GMAIL_LABEL_STAR])
+
+    @list_route(methods=['put'])
+    def bulk_spam(self, request):
+        """
+        (Un)mark multiple email messages as spam. Messages marked as spam are moved out of the inbox, like Gmail does.
+        """
+        if request.data['markAsSpam']:
+            return self.bulk_modify(
+                self.get_bulk_queryset(),
+                add_labels=[settings.GMAIL_LABEL_SPAM],
+                remove_labels=[settings.GMAIL_LABEL_INBOX],
+            )
+        return self.bulk_modify(self.get_bulk_queryset(), remove_labels=[settings.GMAIL_LABEL_SPAM])
+
+    @list_route(methods=['put'])
+    def bulk_read(self, request):
+        """
+        Mark multiple email messages as (un)read.
+        """
+        return self.bulk_modify(self.get_bulk_queryset(), read=request.data['read'])
+
     @detail_route(methods=['get'])
     def history(self, request, pk):
         """
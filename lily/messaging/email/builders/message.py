@@ -3,19 +3,22 @@ import datetime
 import email
 import gc
 import logging
+import os
 import re
-import StringIO
+from collections import Counter, defaultdict
 
 from bs4 import BeautifulSoup, UnicodeDammit
 from dateutil.parser import parse
 from django.conf import settings
 from django.core.files import File
-from django.db import transaction
+from django.db import IntegrityError, transaction
 import pytz
 
-from lily.messaging.email.utils import get_extensions_for_type
+from lily.messaging.email.utils import (get_extensions_for_type, prerender_email_message, reindex_email_message,
+                                        urlsafe_b64decode_to_file)
 
 from ..models.models import EmailMessage, EmailHeader, Recipient, EmailAttachment, NoEmailMessageId
+from ..unread import count_unread, update_unread_counts
 
 logger = logging.getLogger(__name__)
 
@@ -37,10 +40,12 @@ class MessageBuilder(object):
         self.message = None
         self.labels = []
         self.headers = []
+        self.sender = None
         self.received_by = None
         self.received_by_cc = None
         self.attachments = []
         self.inline_attachments = {}
+        self.batch = []
 
     def get_or_create_message(self, message_dict):
         """
@@ -57,6 +62,7 @@ class MessageBuilder(object):
         self.message = None
         self.labels = []
         self.headers = []
+        self.sender = None
         self.received_by = set()
         self.received_by_cc = set()
         self.attachments = []
@@ -150,6 +156,8 @@ class MessageBuilder(object):
 
         self.message.body_html = ''
         self.message.body_text = ''
+        # The body is rendered again when the message is saved.
+        self.message.body_version = 0
 
         # Check Message is split up in parts
         if 'parts' in payload:
@@ -285,38 +293,40 @@ class MessageBuilder(object):
             logger.warning('No attachment, not storing anything')
             return
 
-        file_data = base64.urlsafe_b64decode(file_data.encode('UTF-8'))
-
-        # Create as string file.
-        file = StringIO.StringIO(file_data)
+        # Decode into a (spooled) temporary file, so large attachments aren't kept in memory.
+        file = urlsafe_b64decode_to_file(file_data)
         if headers and 'content-type' in headers:
             file.content_type = headers['content-type'].split(';')[0]
         else:
             file.content_type = 'application/octet-stream'
 
-        file.size = len(file_data)
-        file.name = part.get('filename', '').rsplit('\\')[-1]
-        if len(file.name) > 200:
-            file.name = None
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+
+        name = part.get('filename', '').rsplit('\\')[-1]
+        if len(name) > 200:
+            name = None
 
         # No filename in part, create a name.
-        if not file.name:
+        if not name:
             extensions = get_extensions_for_type(file.content_type)
             if part.get('partId'):
-                file.name = 'attachment-%s%s' % (part.get('partId'), extensions.next())
+                name = 'attachment-%s%s' % (part.get('partId'), extensions.next())
             else:
                 logger.warning('No part id, no filename')
-                file.name = 'attachment-%s-%s' % (
+                name = 'attachment-%s-%s' % (
                     len(self.attachments) + len(self.inline_attachments),
                     extensions.next()
                 )
 
-        final_file = File(file, file.name)
+        final_file = File(file, name)
+        final_file.size = size
 
         # Create a EmailAttachment object.
         attachment = EmailAttachment()
         attachment.attachment = final_file
-        attachment.size = file.size
+        attachment.size = size
         attachment.inline = inline
         attachment.tenant_id = self.manager.email_account.tenant_id
 
@@ -419,69 +429,227 @@ class MessageBuilder(object):
         recipients = re.sub(r'(\.[A-Z]{2,16}|>)(,)', r'\1;', header_value, flags=re.IGNORECASE).split('; ')
 
         for recipient in recipients:
-            # Get or create recipient
             email_address = email.utils.parseaddr(recipient)
 
             if email_address[1] != '':
-                recipient = Recipient.objects.get_or_create(
-                    name=email_address[0],
-                    email_address=email_address[1],
-                )[0]
+                # Recipients are looked up or created in bulk when saving.
+                recipient = (email_address[0], email_address[1])
 
                 # Set recipient to correct field
                 if header_name == 'from':
-                    self.message.sender = recipient
+                    self.sender = recipient
                 elif header_name in ['to', 'delivered-to']:
                     self.received_by.add(recipient)
                 elif header_name == 'cc':
                     self.received_by_cc.add(recipient)
 
+    def get_or_create_recipients(self, addresses):
+        """
+        Get or create the Recipients for the given addresses, with one lookup and one bulk insert.
+
+        Args:
+            addresses (set): of (name, email_address) tuples
+
+        Returns:
+            dict with the Recipient for every address
+        """
+        recipients = self._get_recipients(addresses)
+
+        missing = addresses - set(recipients)
+        if missing:
+            try:
+                with transaction.atomic():
+                    Recipient.objects.bulk_create([
+                        Recipient(name=name, email_address=email_address) for name, email_address in missing
+                    ])
+            except IntegrityError:
+                # Another sync created some of the recipients in the meantime.
+                pass
+
+            recipients.update(self._get_recipients(missing))
+
+            for name, email_address in missing - set(recipients):
+                recipients[(name, email_address)] = Recipient.objects.get_or_create(
+                    name=name,
+                    email_address=email_address,
+                )[0]
+
+        return recipients
+
+    def _get_recipients(self, addresses):
+        if not addresses:
+            return {}
+
+        recipients = Recipient.objects.filter(
+            email_address__in=set(email_address for name, email_address in addresses)
+        )
+
+        return {
+            (recipient.name, recipient.email_address): recipient
+            for recipient in recipients if (recipient.name, recipient.email_address) in addresses
+        }
+
+    def add_to_batch(self):
+        """
+        Add the current message to the batch of messages that is stored with the next save_batch call.
+        """
+        self.batch.append({
+            'message': self.message,
+            'labels': self.labels,
+            'headers': self.headers,
+            'sender': self.sender,
+            'received_by': self.received_by or set(),
+            'received_by_cc': self.received_by_cc or set(),
+            'attachments': self.attachments,
+            'inline_attachments': self.inline_attachments,
+        })
+
     def save(self):
-        # Only save if there is a sent date, otherwise it's a chat message.
-        if self.message.sent_date and self.message.sender_id:
+        """
+        Save the current message.
+        """
+        self.add_to_batch()
+        self.save_batch()
 
-            self.message.skip_signal = True  # Disable intermediate reindexing of the message.
+    def save_batch(self):
+        """
+        Save all messages in the batch.
 
-            # Check for attachments.
-            if self.attachments or self.inline_attachments:
-                self.message.has_attachment = True
+        Recipients of all messages are resolved at once and the relations of the messages are written in bulk, so
+        apart from saving the messages themselves the number of queries doesn't depend on the size of the batch.
+        """
+        batch, self.batch = self.batch, []
 
-            if not self.message.pk:
-                # Save before we can add many-to-many and foreign keys.
-                self.message.save()
+        addresses = set()
+        for item in batch:
+            addresses.update(item['received_by'], item['received_by_cc'])
+            if item['sender']:
+                addresses.add(item['sender'])
 
-            # Save recipients.
-            self.message.received_by.add(*self.received_by)
-            self.message.received_by_cc.add(*self.received_by_cc)
+        recipients = self.get_or_create_recipients(addresses)
 
-            # Save labels.
-            if len(self.labels):
-                with transaction.atomic():
-                    if self.message.pk:
-                        self.message.labels.clear()
-                    self.message.labels.add(*self.labels)
-            elif self.message.labels:
-                self.message.labels.clear()
-
-            # Save headers.
-            if len(self.headers):
-                self.message.headers.all().delete()
-                self.message.headers.add(*self.headers)
-
-            # Save attachments.
-            if len(self.attachments):
-                self.message.attachments.all().delete()
-                self.message.attachments.add(*self.attachments)
-
-            self.message.skip_signal = False  # Re-enable indexing of the email on the last save.
-            self.message.save()
-        else:
-            logger.warning('Downloaded a message other than an email.')
+        items = []
+        for item in batch:
+            message = item['message']
+            if item['sender']:
+                message.sender = recipients[item['sender']]
+
+            # Only save if there is a sent date, otherwise it's a chat message.
+            if message.sent_date and message.sender_id:
+                items.append(item)
+            else:
+                logger.warning('Downloaded a message other than an email.')
+
+                NoEmailMessageId.objects.get_or_create(
+                    message_id=message.message_id,
+                    account=self.manager.email_account
+                )
+
+        if not items:
+            return
+
+        with transaction.atomic():
+            # The read status and labels before this save, to update the unread counts of the labels with. The messages
+            # are locked, so concurrent saves of the same message are counted once.
+            existing_ids = [item['message'].pk for item in items if item['message'].pk]
+            old_reads = dict(EmailMessage.objects.select_for_update().filter(
+                pk__in=existing_ids
+            ).values_list('id', 'read')) if existing_ids else {}
+            old_label_ids = defaultdict(list)
+            for message_id, label_id in EmailMessage.labels.through.objects.filter(
+                emailmessage_id__in=[message_id for message_id, read in old_reads.items() if not read]
+            ).values_list('emailmessage_id', 'emaillabel_id'):
+                old_label_ids[message_id].append(label_id)
+
+            unread_deltas = Counter()
+
+            for item in items:
+                message = item['message']
+                item['created'] = not message.pk
+
+                count_unread(unread_deltas, old_reads.get(message.pk, True), old_label_ids[message.pk], -1)
+                count_unread(unread_deltas, message.read, set(label.pk for label in item['labels']))
 
-            NoEmailMessageId.objects.get_or_create(
-                message_id=self.message.message_id,
-                account=self.manager.email_account
+                # Check for attachments.
+                if item['attachments'] or item['inline_attachments']:
+                    message.has_attachment = True
+
+                # Sanitize and render the body once, instead of every time the message is read.
+                if not message.is_prerendered:
+                    prerender_email_message(message)
+
+                message.skip_signal = True  # The message is indexed once its relations are stored as well.
+                message.save()
+                message.skip_signal = False
+
+            self._save_relations(items, recipients)
+            update_unread_counts(unread_deltas)
+
+        for item in items:
+            reindex_email_message(item['message'])
+
+    def _save_relations(self, items, recipients):
+        """
+        Replace the labels, recipients, headers and attachments of the given messages in bulk.
+        """
+        existing_ids = [item['message'].pk for item in items if not item['created']]
+
+        labels = []
+        received_by = []
+        received_by_cc = []
+        headers = []
+        attachments = []
+
+        for item in items:
+            message = item['message']
+
+            labels.extend(
+                EmailMessage.labels.through(emailmessage_id=message.pk, emaillabel_id=label.pk)
+                for label in set(item['labels'])
             )
+            received_by.extend(
+                EmailMessage.received_by.through(emailmessage_id=message.pk, recipient_id=recipients[address].pk)
+                for address in item['received_by']
+            )
+            received_by_cc.extend(
+                EmailMessage.received_by_cc.through(emailmessage_id=message.pk, recipient_id=recipients[address].pk)
+                for address in item['received_by_cc']
+            )
+
+            for header in item['headers']:
+                header.message = message
+                headers.append(header)
+
+            for attachment in item['attachments']:
+                attachment.message = message
+                attachments.append(attachment)
+
+        # Labels are always replaced, the other relations only when the message info contained them.
+        self._replace_rows(EmailMessage.labels.through, 'emailmessage_id', existing_ids, labels)
+        self._replace_rows(
+            EmailMessage.received_by.through,
+            'emailmessage_id',
+            self._get_replaced_ids(items, 'received_by'),
+            received_by
+        )
+        self._replace_rows(
+            EmailMessage.received_by_cc.through,
+            'emailmessage_id',
+            self._get_replaced_ids(items, 'received_by_cc'),
+            received_by_cc
+        )
+        self._replace_rows(EmailHeader, 'message_id', self._get_replaced_ids(items, 'headers'), headers)
+        self._replace_rows(EmailAttachment, 'message_id', self._get_replaced_ids(items, 'attachments'), attachments)
+
+    def _get_replaced_ids(self, items, relation):
+        return [item['message'].pk for item in items if not item['created'] and item[relation]]
+
+    def _replace_rows(self, model, message_field, message_ids, rows):
+        if message_ids:
+            model.objects.filter(**{'%s__in' % message_field: message_ids}).delete()
+
+        if rows:
+            model.objects.bulk_create(rows)
 
     def _get_encoding_from_headers(self, headers):
         """
@@ -523,7 +691,9 @@ class MessageBuilder(object):
         self.message = None
         self.labels = []
         self.headers = []
+        self.sender = None
         self.received_by = None
         self.received_by_cc = None
         self.attachments = []
         self.inline_attachments = {}
+        self.batch = []
@@ -1,4 +1,5 @@
 import logging
+import os
 import random
 import time
 import anyjson
@@ -70,66 +71,142 @@ class GmailConnector(object):
             try:
                 return self.gmail_service.execute_service(service)
             except HttpError as error:
-                try:
-                    error = anyjson.loads(error.content)
-                    # Error could be nested, so unwrap if necessary.
-                    error = error.get('error', error)
-
-                    if error.get('code') == 403 and error.get('errors')[0].get('reason') in ['rateLimitExceeded',
-                                                                                             'userRateLimitExceeded']:
-                        # Apply exponential backoff.
-                        sleep_time = (2 ** n) + random.randint(0, 1000) / 1000
-                        logger.warning('Limit overrated, sleeping for %s seconds' % sleep_time)
-                        time.sleep(sleep_time)
-                    elif error.get('code') == 429:
-                        # Apply exponential backoff.
-                        sleep_time = (2 ** n) + random.randint(0, 1000) / 1000
-                        logger.warning('Too many concurrent requests for user, sleeping for %d seconds' % sleep_time)
-                        time.sleep(sleep_time)
-                    elif error.get('code') == 503 or error.get('code') == 500:
-                        # Apply exponential backoff.
-                        sleep_time = (2 ** n) + random.randint(0, 1000) / 1000
-                        logger.warning('Backend error, sleeping for %d seconds' % sleep_time)
-                        time.sleep(sleep_time)
-                    elif error.get('code') == 400 and error.get('message') == 'labelId not found':
-                        raise LabelNotFoundError
-                    elif error.get('code') == 400 and error.get('message') == 'Invalid label: SENT':
-                        raise IllegalLabelError('Not allowed to set label SENT.')
-                    elif error.get('code') == 404:
-                        raise NotFoundError
-                    else:
-                        logger.exception('Unkown error code for error %s' % error)
-                        if service.body_size < 25000:
-                            # Log the actual API call to Google in case of an error. But restrict on the (arbitrary
-                            # chosen) body_size. Size can be very large due to inline images / html tags.
-                            logger.exception(service.to_json())
-                        else:
-                            logger.exception('Did not log api call, body size to large: %d' % service.body_size)
-                        raise
-
-                except ValueError:
-                    # The error couldn't be loaded as json.
-                    if error.resp.status == 404:
-                        raise NotFoundError
-                    else:
-                        logger.exception('Unkown error code for error %s' % error)
-                        if service.body_size < 25000:
-                            logger.exception(service.to_json())
-                        else:
-                            logger.exception('Did not log api call, body size to large: %d' % service.body_size)
-                        raise
+                time.sleep(self.handle_http_error(error, n, service))
             except HttpAccessTokenRefreshError:
-                # Thrown when a user removes Lily from the connected apps or
-                # changes the credentials of the Google account.
-                self.email_account.is_authorized = False
-                self.email_account.is_syncing = False
-                self.email_account.save()
-                logger.error('Invalid access token for account %s' % self.email_account)
+                self.handle_refresh_error()
                 raise
 
         logger.exception('Service call failed after all retries')
         raise FailedServiceCallException('Service call failed after all retries')
 
+    def handle_http_error(self, error, n, service):
+        """
+        Determine what to do with a failed service call.
+
+        Args:
+            error (instance): HttpError of the service call
+            n (int): number of the attempt, used for the exponential backoff
+            service (instance): service instance
+        Returns:
+            number of seconds to sleep before retrying the service call
+        Raises:
+            the appropriate ConnectorError or the HttpError itself if the call shouldn't be retried
+        """
+        http_error = error
+        try:
+            error = anyjson.loads(error.content)
+            # Error could be nested, so unwrap if necessary.
+            error = error.get('error', error)
+
+            if error.get('code') == 403 and error.get('errors')[0].get('reason') in ['rateLimitExceeded',
+                                                                                     'userRateLimitExceeded']:
+                # Apply exponential backoff.
+                sleep_time = (2 ** n) + random.randint(0, 1000) / 1000
+                logger.warning('Limit overrated, sleeping for %s seconds' % sleep_time)
+                return sleep_time
+            elif error.get('code') == 429:
+                # Apply exponential backoff.
+                sleep_time = (2 ** n) + random.randint(0, 1000) / 1000
+                logger.warning('Too many concurrent requests for user, sleeping for %d seconds' % sleep_time)
+                return sleep_time
+            elif error.get('code') == 503 or error.get('code') == 500:
+                # Apply exponential backoff.
+                sleep_time = (2 ** n) + random.randint(0, 1000) / 1000
+                logger.warning('Backend error, sleeping for %d seconds' % sleep_time)
+                return sleep_time
+            elif error.get('code') == 400 and error.get('message') == 'labelId not found':
+                raise LabelNotFoundError
+            elif error.get('code') == 400 and error.get('message') == 'Invalid label: SENT':
+                raise IllegalLabelError('Not allowed to set label SENT.')
+            elif error.get('code') == 404:
+                raise NotFoundError
+            else:
+                logger.exception('Unkown error code for error %s' % error)
+                if service.body_size < 25000:
+                    # Log the actual API call to Google in case of an error. But restrict on the (arbitrary
+                    # chosen) body_size. Size can be very large due to inline images / html tags.
+                    logger.exception(service.to_json())
+                else:
+                    logger.exception('Did not log api call, body size to large: %d' % service.body_size)
+                raise http_error
+
+        except ValueError:
+            # The error couldn't be loaded as json.
+            if error.resp.status == 404:
+                raise NotFoundError
+            else:
+                logger.exception('Unkown error code for error %s' % error)
+                if service.body_size < 25000:
+                    logger.exception(service.to_json())
+                else:
+                    logger.exception('Did not log api call, body size to large: %d' % service.body_size)
+                raise
+
+    def handle_refresh_error(self):
+        """
+        Thrown when a user removes Lily from the connected apps or changes the credentials of the Google account.
+        """
+        self.email_account.is_authorized = False
+        self.email_account.is_syncing = False
+        self.email_account.save()
+        logger.error('Invalid access token for account %s' % self.email_account)
+
+    def execute_batch_service_calls(self, services):
+        """
+        Execute multiple service calls in a single HTTP batch request.
+
+        Calls that fail because the rate limit is exceeded are retried in a new batch after sleeping, just like
+        execute_service_call does. Calls for which the resource no longer exists are left out of the result.
+
+        Args:
+            services (dict): request id with its service instance
+        Returns:
+            dict with the responses by request id
+        """
+        responses = {}
+        pending = dict(services)
+
+        for n in range(0, 6):
+            errors = {}
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                else:
+                    errors[request_id] = exception
+
+            batch = self.gmail_service.service.new_batch_http_request(callback=callback)
+            for request_id, service in pending.items():
+                batch.add(service, request_id=request_id)
+
+            try:
+                self.gmail_service.execute_service(batch)
+            except HttpAccessTokenRefreshError:
+                self.handle_refresh_error()
+                raise
+
+            sleep_time = 0
+            retry = {}
+            for request_id, error in errors.items():
+                if not isinstance(error, HttpError):
+                    raise error
+
+                try:
+                    sleep_time = max(sleep_time, self.handle_http_error(error, n, pending[request_id]))
+                except NotFoundError:
+                    logger.debug('Resource for request %s not found' % request_id)
+                else:
+                    retry[request_id] = pending[request_id]
+
+            if not retry:
+                return responses
+
+            pending = retry
+            time.sleep(sleep_time)
+
+        logger.exception('Batch service call failed after all retries')
+        raise FailedServiceCallException('Batch service call failed after all retries')
+
     def get_history(self):
         """
         Fetch the history list from the gmail api. This includes email and chat messages.
@@ -219,6 +296,24 @@ class GmailConnector(object):
 
         return response
 
+    def get_message_info_batch(self, message_ids):
+        """
+        Fetch message information for multiple messages with a single batch request.
+
+        Args:
+            message_ids (list): ids of the messages
+
+        Returns:
+            dict with message info by message id, messages that no longer exist are left out
+        """
+        return self.execute_batch_service_calls({
+            message_id: self.gmail_service.service.users().messages().get(
+                userId='me',
+                id=message_id,
+                quotaUser=self.email_account.id,
+            ) for message_id in message_ids
+        })
+
     def get_label_list(self):
         """
         Fetch all labels from the email account.
@@ -304,6 +399,24 @@ class GmailConnector(object):
             ))
         return response
 
+    def batch_modify(self, message_ids, labels):
+        """
+        Add and remove the same labels of multiple messages with a single call.
+
+        Args:
+            message_ids (list): message_ids of the messages, at most 1000
+            labels (dict): the label_ids to add and remove, by addLabelIds and removeLabelIds
+        """
+        body = {'ids': message_ids}
+        body.update(labels)
+
+        return self.execute_service_call(
+            self.gmail_service.service.users().messages().batchModify(
+                userId='me',
+                body=body,
+                quotaUser=self.email_account.id,
+            ))
+
     def trash_email_message(self, message_id):
         response = self.execute_service_call(
             self.gmail_service.service.users().messages().trash(
@@ -323,17 +436,31 @@ class GmailConnector(object):
             ))
         return response
 
-    def send_email_message(self, message_string, thread_id=None):
-        # Possible TODO: only use MediaIOBaseUpload on large email bodys instead of always:
-        # http://stackoverflow.com/questions/27875858/#33155212
-        fd = StringIO(message_string)
-        media = MediaIoBaseUpload(
-            fd,
+    def get_message_upload(self, message):
+        """
+        Return the upload of a message. Large messages are uploaded resumable, which streams them from the file
+        instead of reading them in memory to build a multipart request.
+
+        Args:
+            message (string or file): the message, as a string or a file positioned at the start
+        """
+        if isinstance(message, basestring):
+            message = StringIO(message)
+
+        message.seek(0, os.SEEK_END)
+        size = message.tell()
+        message.seek(0)
+
+        return MediaIoBaseUpload(
+            message,
             mimetype='message/rfc822',
             chunksize=settings.GMAIL_CHUNK_SIZE,
-            resumable=settings.GMAIL_UPLOAD_RESUMABLE
+            resumable=settings.GMAIL_UPLOAD_RESUMABLE or size > settings.GMAIL_RESUMABLE_UPLOAD_SIZE
         )
 
+    def send_email_message(self, message, thread_id=None):
+        media = self.get_message_upload(message)
+
         message_dict = {}
         if thread_id:
             message_dict.update({'threadId': thread_id})
@@ -348,16 +475,8 @@ class GmailConnector(object):
 
         return response
 
-    def create_draft_email_message(self, message_string):
-        # Possible TODO: only use MediaIOBaseUpload on large email bodys instead of always:
-        # http://stackoverflow.com/questions/27875858/#33155212
-        fd = StringIO(message_string)
-        media = MediaIoBaseUpload(
-            fd,
-            mimetype='message/rfc822',
-            chunksize=settings.GMAIL_CHUNK_SIZE,
-            resumable=settings.GMAIL_UPLOAD_RESUMABLE
-        )
+    def create_draft_email_message(self, message):
+        media = self.get_message_upload(message)
 
         response = self.execute_service_call(
             self.gmail_service.service.users().drafts().create(
@@ -367,16 +486,8 @@ class GmailConnector(object):
             ))
         return response
 
-    def update_draft_email_message(self, message_string, draft_id):
-        # Possible TODO: only use MediaIOBaseUpload on large email bodys instead of always:
-        # http://stackoverflow.com/questions/27875858/#33155212
-        fd = StringIO(message_string)
-        media = MediaIoBaseUpload(
-            fd,
-            mimetype='message/rfc822',
-            chunksize=settings.GMAIL_CHUNK_SIZE,
-            resumable=settings.GMAIL_UPLOAD_RESUMABLE
-        )
+    def update_draft_email_message(self, message, draft_id):
+        media = self.get_message_upload(message)
 
         response = self.execute_service_call(
             self.gmail_service.service.users().drafts().update(
@@ -0,0 +1,92 @@
+import base64
+import glob
+import json
+import os
+import time
+
+from django.core.management import BaseCommand
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from ...models.models import EmailMessage
+from ...utils import (DATA_DIR, extract_script_tags, render_email_body, render_email_message_body,
+                      replace_anchors_in_html, replace_cid_in_html)
+
+
+def get_html_parts(payload):
+    """
+    Return the decoded html parts of a (multipart) Gmail message payload.
+    """
+    if payload.get('mimeType') == 'text/html' and payload.get('body', {}).get('data'):
+        yield base64.urlsafe_b64decode(payload['body']['data'].encode()).decode('utf-8')
+
+    for part in payload.get('parts', []):
+        for html in get_html_parts(part):
+            yield html
+
+
+class Command(BaseCommand):
+    help = """
+    Measure rendering the html bodies of the test messages, with a parse per step, in a single pass and cached.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n', '--iterations',
+            action='store',
+            dest='iterations',
+            type=int,
+            default=20,
+            help='Number of times every body is rendered.'
+        )
+        parser.add_argument(
+            '-r', '--repeat',
+            action='store',
+            dest='repeat',
+            type=int,
+            default=50,
+            help='Repeat the content of every body, the test messages are a lot smaller than a typical newsletter.'
+        )
+
+    def handle(self, *args, **options):
+        bodies = []
+        for path in sorted(glob.glob(os.path.join(DATA_DIR, 'get_message_info_*.json'))):
+            with open(path) as message_file:
+                payload = json.load(message_file)['payload']
+
+            for html in get_html_parts(payload):
+                bodies.append('<html><body>%s</body></html>' % (html * options['repeat']))
+
+        messages = [EmailMessage(pk=index, body_html=html) for index, html in enumerate(bodies)]
+        request = RequestFactory().get('/', HTTP_HOST='localhost:8000')
+
+        def multi_pass(message):
+            html = extract_script_tags(message.body_html)
+            html = replace_anchors_in_html(html)
+            return replace_cid_in_html(html, [], request)
+
+        def single_pass(message):
+            return render_email_body(message.body_html, [], request)
+
+        def cached(message):
+            return render_email_message_body(message, [], request)
+
+        self.stdout.write('%s bodies, %s KB on average' % (
+            len(bodies), sum(len(html) for html in bodies) / len(bodies) / 1024
+        ))
+
+        with override_settings(
+            EMAIL_BODY_CACHE_ENABLED=True,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        ):
+            for label, render in (('parse per step', multi_pass), ('single pass', single_pass), ('cached', cached)):
+                start = time.time()
+
+                for i in range(options['iterations']):
+                    for message in messages:
+                        render(message)
+
+                duration = time.time() - start
+                self.stdout.write('%s: %.1f ms per body' % (
+                    label, duration * 1000 / (options['iterations'] * len(messages))
+                ))
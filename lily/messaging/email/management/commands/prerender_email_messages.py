@@ -0,0 +1,73 @@
+import logging
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from ...models.models import EmailMessage
+from ...utils import prerender_email_message
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = """
+    Render the bodies of email messages that were stored before their bodies were rendered at ingest, or with an older
+    version of the rendering. Messages are processed in batches and can be rendered while the sync is running.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t', '--tenant',
+            action='store',
+            dest='tenant',
+            type=int,
+            default=None,
+            help='Only render the messages of this tenant.'
+        )
+        parser.add_argument(
+            '-b', '--batch-size',
+            action='store',
+            dest='batch_size',
+            type=int,
+            default=500,
+            help='Number of messages to render per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        # Messages stored before the bodies were rendered have no body version.
+        outdated = Q(body_version__isnull=True) | Q(body_version__lt=EmailMessage.BODY_VERSION)
+        messages = EmailMessage.objects.filter(outdated).only(
+            'id', 'body_html', 'body_text', 'body_version'
+        ).order_by('id')
+
+        if options['tenant']:
+            messages = messages.filter(account__tenant_id=options['tenant'])
+
+        last_id = 0
+        rendered = 0
+
+        while True:
+            # Page by primary key, rendered messages drop out of the filter so offsets would skip messages.
+            batch = list(messages.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                for message in batch:
+                    prerender_email_message(message)
+
+                    # Update the rendered fields only, the sync might be changing the message meanwhile.
+                    EmailMessage.objects.filter(outdated, id=message.id).update(
+                        rendered_body_html=message.rendered_body_html,
+                        reply_body_html=message.reply_body_html,
+                        search_body=message.search_body,
+                        body_version=message.body_version,
+                    )
+
+            last_id = batch[-1].id
+            rendered += len(batch)
+            logger.info('Rendered %s email messages' % rendered)
+
+        self.stdout.write('Rendered %s email messages' % rendered)
@@ -10,6 +10,7 @@ from .builders.message import MessageBuilder
 from .connector import GmailConnector, NotFoundError, LabelNotFoundError
 from .credentials import InvalidCredentialsError
 from .models.models import EmailLabel, EmailMessage, NoEmailMessageId
+from .unread import add_and_remove_labels, delete_email_messages
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +57,8 @@ class GmailManager(object):
             ).values_list('message_id', flat='true')
         )
 
+        new_message_ids = []
+
         # What do we need to do with every email message?
         for i, message_dict in enumerate(message_ids):
             logger.debug('Check for existing messages, %s/%s' % (i, len(message_ids)))
@@ -64,11 +67,7 @@ class GmailManager(object):
                 pass
             elif message_dict['id'] not in message_ids_in_db:
                 # Message is new.
-                app.send_task(
-                    'download_email_message',
-                    args=[self.email_account.id, message_dict['id']],
-                    queue='email_first_sync'
-                )
+                new_message_ids.append(message_dict['id'])
             else:
                 # We only need to update the labels for this message.
                 app.send_task(
@@ -77,6 +76,9 @@ class GmailManager(object):
                     queue='email_first_sync'
                 )
 
+        # New messages are downloaded in batches.
+        self.send_download_tasks(new_message_ids, queue='email_first_sync')
+
         # Finally, add a task to keep track when the sync queue is finished.
         app.send_task(
             'full_sync_finished',
@@ -87,6 +89,59 @@ class GmailManager(object):
         self.connector.save_history_id()
         logger.debug('Finished queuing up tasks for email sync, storing history id for %s' % self.email_account)
 
+    def send_download_tasks(self, message_ids, queue=None):
+        """
+        Create tasks to download the given messages, each task downloads a batch of messages.
+
+        Args:
+            message_ids (list): message_ids of the messages
+            queue (str): optional queue to route the tasks to
+        """
+        batch_size = settings.GMAIL_MESSAGE_DOWNLOAD_BATCH_SIZE
+        kwargs = {'queue': queue} if queue else {}
+
+        for i in range(0, len(message_ids), batch_size):
+            app.send_task(
+                'download_email_messages',
+                args=[self.email_account.id, message_ids[i:i + batch_size]],
+                **kwargs
+            )
+
+    def download_messages(self, message_ids):
+        """
+        Download multiple messages from Google with a single batch request and parse them into EmailMessages.
+
+        Arguments:
+            message_ids (list): message_ids of the messages
+        """
+        # If messages are already downloaded, only update them.
+        existing_message_ids = set(EmailMessage.objects.filter(
+            account=self.email_account,
+            message_id__in=message_ids
+        ).order_by().values_list('message_id', flat=True))
+
+        for message_id in existing_message_ids:
+            self.update_labels_for_message(message_id)
+
+        message_ids = [message_id for message_id in message_ids if message_id not in existing_message_ids]
+        if not message_ids:
+            return
+
+        # Fetch the info from the connector and only store the messages that are still out there.
+        message_infos = self.connector.get_message_info_batch(message_ids)
+
+        for message_id in message_ids:
+            message_info = message_infos.get(message_id)
+            if message_info is None:
+                logger.debug('Message %s already deleted from remote' % message_id)
+                continue
+
+            self.message_builder.store_message_info(message_info, message_id)
+            self.message_builder.add_to_batch()
+
+        # Store all downloaded messages at once.
+        self.message_builder.save_batch()
+
     def download_message(self, message_id):
         """
         Download message from Google and parse into an EmailMessage.
@@ -114,9 +169,11 @@ class GmailManager(object):
         Synchronize EmailAccount by history.
 
         Fetches the changes from the GMail api and creates tasks for the mutations.
+
+        Returns:
+            True if the mailbox has changed since the last synchronization
         """
         logger.info('updating history for %s with history_id %s' % (self.email_account, self.email_account.history_id))
-        old_history_id = self.email_account.history_id
 
         try:
             history = self.connector.get_history()
@@ -134,11 +191,11 @@ class GmailManager(object):
                 self.email_account.save()
                 logger.error('Repeated 404 error on incremental syncing. Authorization revoked for account %s' %
                              self.email_account)
-            return
+            return False
 
         self.connector.save_history_id()
         if not len(history):
-            return
+            return False
 
         new_messages = set()
         edit_labels = set()
@@ -181,25 +238,20 @@ class GmailManager(object):
                 new_messages.discard(message['message']['id'])
                 edit_labels.discard(message['message']['id'])
 
-                EmailMessage.objects.filter(
+                delete_email_messages(EmailMessage.objects.filter(
                     message_id=message['message']['id'], account=self.email_account
-                ).order_by().delete()
+                ))
 
         # Create tasks to download email messages.
-        for message_id in new_messages:
-            logger.info('creating download_email_message for %s', message_id)
-            app.send_task('download_email_message', args=[self.email_account.id, message_id])
+        logger.info('creating download_email_messages for %s messages', len(new_messages))
+        self.send_download_tasks(list(new_messages))
 
         # Creates tasks to update labeling for email messages.
         for message_id in edit_labels:
             logger.info('creating update_labels_for_message for %s', message_id)
             app.send_task('update_labels_for_message', args=[self.email_account.id, message_id])
 
-        # Only update the unread count if the history id was updated.
-        if old_history_id != self.email_account.history_id:
-            # TODO: Find out if there is a better place to update unread count. download_email_message tasks aren't
-            # finished yet.
-            self.update_unread_count()
+        return True
 
     def sync_labels(self):
         """
@@ -258,17 +310,6 @@ class GmailManager(object):
                 label_id__in=delete_label_ids
             ).delete()
 
-    def update_unread_count(self):
-        """
-        Update unread count on every label.
-        """
-        pass
-        # logger.debug('Updating unread count for every label, account %s' % self.email_account)
-        # for label in self.email_account.labels.all():
-        #     unread_count = label.messages.filter(read=False).count()
-        #     label.unread = unread_count
-        #     label.save()
-
     def administer_sync_status(self, is_syncing):
         """
         Keep track if the email account is synchronizing and reset synchronization failure count.
@@ -378,7 +419,7 @@ class GmailManager(object):
                 message_info = self.connector.get_short_message_info(email_message.message_id)
             except NotFoundError:
                 logger.debug('Message not available on remote.')
-                EmailMessage.objects.get(pk=email_message.id).delete()
+                delete_email_messages(EmailMessage.objects.filter(pk=email_message.id))
                 return
 
             # Initialize a label update object.
@@ -406,18 +447,42 @@ class GmailManager(object):
                     raise
                 else:
                     # API call to update labelling successfull, so also update the labelling in the database.
-                    email_message.labels.remove(
-                        *list(EmailLabel.objects.filter(label_id__in=labels['removeLabelIds'],
-                                                        account=self.email_account))
-                    )
-                    email_message.labels.add(
-                        *list(EmailLabel.objects.filter(label_id__in=labels['addLabelIds'],
-                                                        account=self.email_account))
+                    add_and_remove_labels(
+                        email_message,
+                        add_labels=EmailLabel.objects.filter(label_id__in=labels['addLabelIds'],
+                                                             account=self.email_account),
+                        remove_labels=EmailLabel.objects.filter(label_id__in=labels['removeLabelIds'],
+                                                                account=self.email_account),
                     )
                     # Labels updated in the database, so no need to retry / continue the for-loop.
                     break
 
-        self.update_unread_count()
+    def batch_modify_email_messages(self, message_ids, add_labels=[], remove_labels=[]):
+        """
+        Add and/or remove labels of multiple messages, with a batchModify call per chunk of messages.
+
+        The labels are already changed in the database, see bulk_add_and_remove_labels.
+
+        Args:
+            message_ids (list): message_ids of the messages
+            add_labels (list, optional): list of label_ids to add
+            remove_labels (list, optional): list of label_ids to remove
+        """
+        labels = {
+            'addLabelIds': [label for label in add_labels if label != settings.GMAIL_LABEL_SENT],
+            'removeLabelIds': [label for label in remove_labels if label != settings.GMAIL_LABEL_SENT],
+        }
+
+        if not labels['addLabelIds'] and not labels['removeLabelIds']:
+            return
+
+        for i in range(0, len(message_ids), settings.GMAIL_BATCH_MODIFY_SIZE):
+            try:
+                self.connector.batch_modify(message_ids[i:i + settings.GMAIL_BATCH_MODIFY_SIZE], labels)
+            except LabelNotFoundError:
+                # Retrying won't help, the label no longer exists in Gmail.
+                logger.error('label not found, batch modify failed! %s: %s' % (self.email_account, labels))
+                return
 
     def toggle_star_email_message(self, email_message, star=True):
         """
@@ -492,7 +557,6 @@ class GmailManager(object):
             # Store updated message.
             self.message_builder.store_message_info(full_message_dict, message_dict['id'])
             self.message_builder.save()
-            self.update_unread_count()
 
     def delete_email_message(self, email_message):
         """
@@ -505,8 +569,6 @@ class GmailManager(object):
             self.connector.delete_email_message(email_message.message_id)
         except NotFoundError:
             logger.debug('Message already deleted from remote')
-        else:
-            self.update_unread_count()
 
     def send_email_message(self, email_message, thread_id=None):
         """
@@ -517,7 +579,7 @@ class GmailManager(object):
             thread_id (string): Thread ID of original message that is replied or forwarded on
         """
         # Send message.
-        message_dict = self.connector.send_email_message(email_message.as_string(), thread_id)
+        message_dict = self.connector.send_email_message(email_message.as_file(), thread_id)
         try:
             full_message_dict = self.connector.get_message_info(message_dict['id'])
         except NotFoundError:
@@ -526,7 +588,6 @@ class GmailManager(object):
             # Store updated message.
             self.message_builder.store_message_info(full_message_dict, message_dict['id'])
             self.message_builder.save()
-            self.update_unread_count()
 
     def create_draft_email_message(self, email_message):
         """
@@ -536,7 +597,7 @@ class GmailManager(object):
             email_message (instance): Email instance
         """
         # Create draft message.
-        draft_dict = self.connector.create_draft_email_message(email_message.as_string())
+        draft_dict = self.connector.create_draft_email_message(email_message.as_file())
 
         try:
             message_dict = self.connector.get_message_info(draft_dict['message']['id'])
@@ -547,7 +608,6 @@ class GmailManager(object):
             self.message_builder.store_message_info(message_dict, draft_dict['message']['id'])
             self.message_builder.message.draft_id = draft_dict.get('id', '')
             self.message_builder.save()
-            self.update_unread_count()
 
     def update_draft_email_message(self, email_message, draft_id):
         """
@@ -558,7 +618,7 @@ class GmailManager(object):
             draft_id (string): id of current draft
         """
         # Update draft message.
-        draft_dict = self.connector.update_draft_email_message(email_message.as_string(), draft_id)
+        draft_dict = self.connector.update_draft_email_message(email_message.as_file(), draft_id)
 
         try:
             message_dict = self.connector.get_message_info(draft_dict['message']['id'])
@@ -569,7 +629,6 @@ class GmailManager(object):
             self.message_builder.store_message_info(message_dict, draft_dict['message']['id'])
             self.message_builder.message.draft_id = draft_dict.get('id', '')
             self.message_builder.save()
-            self.update_unread_count()
 
     def delete_draft_email_message(self, email_message):
         """
@@ -583,9 +642,9 @@ class GmailManager(object):
         except NotFoundError:
             # Draft exists in Lily but not anymore on remote, so remove it from the database.
             logger.debug('Draft already deleted from remote.')
-            EmailMessage.objects.filter(message_id=email_message.message_id, account=self.email_account).delete()
-        else:
-            self.update_unread_count()
+            delete_email_messages(
+                EmailMessage.objects.filter(message_id=email_message.message_id, account=self.email_account)
+            )
 
     def cleanup(self):
         """
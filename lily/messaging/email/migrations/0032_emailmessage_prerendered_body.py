@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email', '0031_auto_20170801_0900'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='body_version',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='rendered_body_html',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='reply_body_html',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='search_body',
+            field=models.TextField(null=True),
+        ),
+    ]
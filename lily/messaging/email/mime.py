@@ -0,0 +1,146 @@
+"""
+Streaming assembly of outgoing email messages.
+
+The body parts of a message are small and built with the email package as usual. Attachments are only referenced by
+the name of their file in the storage. When the message is written, every attachment is read in chunks and base64
+encoded line by line into a spooled temporary file, so memory use doesn't depend on the size of the attachments.
+"""
+import base64
+import logging
+import tempfile
+import uuid
+from StringIO import StringIO
+from email.generator import Generator
+from email.message import Message
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+
+from .utils import iter_storage_file
+
+
+logger = logging.getLogger(__name__)
+
+# Base64 encodes 57 bytes into 76 characters, the max line length of a MIME body.
+BASE64_LINE_SIZE = 57
+
+
+def iter_base64_lines(chunks):
+    """
+    Base64 encode a stream of chunks into lines of 76 characters, without joining the chunks.
+
+    Args:
+        chunks (iterable): strings with the data to encode
+
+    Returns:
+        generator with the encoded lines, a chunk at a time
+    """
+    remainder = ''
+
+    for chunk in chunks:
+        data = remainder + chunk
+        size = len(data) - len(data) % BASE64_LINE_SIZE
+
+        if size:
+            # encodestring splits its output in lines of 76 characters itself.
+            yield base64.encodestring(data[:size])
+
+        remainder = data[size:]
+
+    if remainder:
+        yield base64.encodestring(remainder)
+
+
+class StreamingMIMEMessage(object):
+    """
+    A multipart email message of which the attachments are streamed from the storage when the message is written.
+
+    Attributes:
+        message: the multipart message with the headers and the body parts
+        attachments: list of (headers, storage file name) of the attachments
+    """
+    def __init__(self, message):
+        """
+        Args:
+            message (instance): MIMEMultipart with the headers and body parts of the message
+        """
+        self.message = message
+        self.attachments = []
+
+        if self.message.get_boundary() is None:
+            # The boundary has to be known up front, the message isn't generated by the email package as a whole.
+            self.message.set_boundary('===============%s==' % uuid.uuid4().hex)
+
+    def attach_stored_file(self, name, content_type, filename, disposition='attachment', content_id=None):
+        """
+        Add a file from the storage as a base64 encoded part of the message.
+
+        Args:
+            name (string): name of the file in the storage
+            content_type (string): MIME type of the part
+            filename (string): filename shown to the recipient
+            disposition (string): attachment or inline
+            content_id (string, optional): Content-ID to refer to the part from the html body
+        """
+        main_type, sub_type = content_type.split('/', 1)
+
+        part = MIMEBase(main_type, sub_type, **({'name': filename} if content_id else {}))
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', disposition, filename=filename)
+        if content_id:
+            part.add_header('Content-ID', content_id)
+
+        self.attachments.append((part, name))
+
+    def write(self, fp):
+        """
+        Write the message to a file, the same way the email package generates a multipart message.
+        """
+        boundary = self.message.get_boundary()
+        generator = Generator(fp, mangle_from_=False)
+
+        # Generate the headers without the body parts, so the parts can be written one by one. A string payload of a
+        # multipart is written as is, instead of the boundaries of its subparts.
+        headers = Message()
+        for key, value in self.message.items():
+            headers[key] = value
+        headers.set_payload('')
+        generator.flatten(headers)
+
+        fp.write('--%s\n' % boundary)
+        for index, part in enumerate(self.message.get_payload()):
+            if index:
+                fp.write('\n--%s\n' % boundary)
+            generator.flatten(part)
+
+        for part, name in self.attachments:
+            fp.write('\n--%s\n' % boundary)
+            generator.flatten(part)
+
+            try:
+                for lines in iter_base64_lines(iter_storage_file(name)):
+                    fp.write(lines)
+            except IOError:
+                logger.exception('Couldn\'t read attachment %s' % name)
+                raise
+
+        fp.write('\n--%s--' % boundary)
+
+    def as_file(self):
+        """
+        Return the message as a file positioned at the start. Only small messages are kept in memory.
+        """
+        message_file = tempfile.SpooledTemporaryFile(max_size=settings.EMAIL_ATTACHMENT_MAX_MEMORY_SIZE)
+        self.write(message_file)
+        message_file.seek(0)
+
+        return message_file
+
+    def as_string(self):
+        message_string = StringIO()
+        self.write(message_string)
+
+        return message_string.getvalue()
+
+    def __getitem__(self, name):
+        return self.message[name]
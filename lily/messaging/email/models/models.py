@@ -1,10 +1,5 @@
 import anyjson
-from email import Encoders
 from email.header import Header
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
-from email.mime.text import MIMEText
 from email.utils import parseaddr
 import logging
 import mimetypes
@@ -13,7 +8,6 @@ import textwrap
 
 from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
-from django.core.files.storage import default_storage
 from django.core.mail import SafeMIMEText, SafeMIMEMultipart
 from django.core.urlresolvers import reverse
 from django.db import models
@@ -195,16 +189,44 @@ class EmailMessage(models.Model):
     snippet = models.TextField(default='')
     subject = models.TextField(default='')
     thread_id = models.CharField(max_length=50, db_index=True)
+    # Versions of the body that are shown, quoted and searched. They're computed when the message is stored (see
+    # prerender_email_message), so reading a message doesn't have to parse and sanitize the html. They're null for
+    # messages stored before, adding the columns with a default would rewrite the whole table.
+    rendered_body_html = models.TextField(null=True)
+    reply_body_html = models.TextField(null=True)
+    search_body = models.TextField(null=True)
+    body_version = models.PositiveSmallIntegerField(null=True)
+
+    # Increase to render the bodies of all messages again, with the prerender_email_messages command.
+    BODY_VERSION = 1
+    # Fields that are shown of messages the user may only see the metadata of.
+    METADATA_FIELDS = ('id', 'account', 'sent_date', 'received_by', 'received_by_cc', 'sender')
+    # Fields with the content of the message, as opposed to its metadata.
+    CONTENT_FIELDS = ('body_html', 'body_text', 'rendered_body_html', 'reply_body_html', 'search_body', 'snippet',
+                      'subject')
 
     @property
     def tenant_id(self):
         return self.account.tenant_id
 
+    @property
+    def is_prerendered(self):
+        return self.body_version is not None and self.body_version >= self.BODY_VERSION
+
     @property
     def reply_body(self):
-        from ..utils import create_a_beautiful_soup_object
         """
         Return a version of the body which is used for replies or forwards.
+        """
+        if self.is_prerendered:
+            return self.reply_body_html
+
+        return self.get_reply_body()
+
+    def get_reply_body(self):
+        from ..utils import create_a_beautiful_soup_object
+        """
+        Create a version of the body which is used for replies or forwards.
         This is preferably the html part, but in case that doesn't exist we use the plain text part.
         """
         if self.body_html:
@@ -219,6 +241,10 @@ class EmailMessage(models.Model):
             if not soup or soup.get_text == "":
                 html = self.body_html
             else:
+                # Strip malicious/unwanted content when replying.
+                for script in soup.find_all('script'):
+                    script.extract()
+
                 soup.html.unwrap()
                 html = soup.decode()
 
@@ -492,6 +518,13 @@ class EmailOutboxMessage(TenantMixin, models.Model):
     original_message_id = models.CharField(null=True, blank=True, max_length=50, db_index=True)
 
     def message(self):
+        """
+        Return the message to send. The attachments are only read from the storage when the message is written.
+
+        Returns:
+            StreamingMIMEMessage instance
+        """
+        from ..mime import StreamingMIMEMessage
         from ..utils import get_attachment_filename_from_url, replace_cid_and_change_headers
 
         to = anyjson.loads(self.to)
@@ -530,59 +563,34 @@ class EmailOutboxMessage(TenantMixin, models.Model):
         email_message_html = SafeMIMEText(html, 'html', 'utf-8')
         email_message_alternative.attach(email_message_html)
 
+        email_message = StreamingMIMEMessage(email_message)
+
         for attachment in self.attachments.all():
             if attachment.inline:
                 continue
 
-            try:
-                storage_file = default_storage._open(attachment.attachment.name)
-            except IOError:
-                logger.exception('Couldn\'t get attachment, not sending %s' % self.id)
-                return False
-
             filename = get_attachment_filename_from_url(attachment.attachment.name)
 
-            storage_file.open()
-            content = storage_file.read()
-            storage_file.close()
-
             content_type, encoding = mimetypes.guess_type(filename)
             if content_type is None or encoding is not None:
                 content_type = 'application/octet-stream'
-            main_type, sub_type = content_type.split('/', 1)
-
-            if main_type == 'text':
-                msg = MIMEText(content, _subtype=sub_type)
-            elif main_type == 'image':
-                msg = MIMEImage(content, _subtype=sub_type)
-            elif main_type == 'audio':
-                msg = MIMEAudio(content, _subtype=sub_type)
-            else:
-                msg = MIMEBase(main_type, sub_type)
-                msg.set_payload(content)
-                Encoders.encode_base64(msg)
-
-            msg.add_header('Content-Disposition', 'attachment', filename=os.path.basename(filename))
 
-            email_message.attach(msg)
+            email_message.attach_stored_file(
+                attachment.attachment.name,
+                content_type,
+                os.path.basename(filename)
+            )
 
         # Add the inline attachments to email message header
         for inline_header in inline_headers:
-            main_type, sub_type = inline_header['content-type'].split('/', 1)
-            if main_type == 'image':
-                msg = MIMEImage(
-                    inline_header['content'],
-                    _subtype=sub_type,
-                    name=os.path.basename(inline_header['content-filename'])
+            if inline_header['content-type'].split('/', 1)[0] == 'image':
+                email_message.attach_stored_file(
+                    inline_header['content-name'],
+                    inline_header['content-type'],
+                    os.path.basename(inline_header['content-filename']),
+                    disposition=inline_header['content-disposition'],
+                    content_id=inline_header['content-id']
                 )
-                msg.add_header(
-                    'Content-Disposition',
-                    inline_header['content-disposition'],
-                    filename=os.path.basename(inline_header['content-filename'])
-                )
-                msg.add_header('Content-ID', inline_header['content-id'])
-
-                email_message.attach(msg)
 
         return email_message
 
@@ -41,6 +41,9 @@ _ALLOWED_STYLES = [
     'unicode-bidi', 'url', 'vertical-align', 'visibility', 'white-space', 'widows', 'width', 'word-spacing', 'z-index'
 ]
 
+# Inline images refer to their attachment with a cid url, which is replaced by a link to the attachment when shown.
+_ALLOWED_PROTOCOLS = bleach.ALLOWED_PROTOCOLS + ['cid']
+
 
 def sanitize_html_email(html):
     if html is None:
@@ -51,6 +54,7 @@ def sanitize_html_email(html):
         tags=_ALLOWED_TAGS,
         attributes=_ALLOWED_ATTRIBUTES,
         styles=_ALLOWED_STYLES,
+        protocols=_ALLOWED_PROTOCOLS,
         strip=True,
         strip_comments=True
     )
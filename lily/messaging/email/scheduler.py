@@ -0,0 +1,98 @@
+import logging
+import time
+import uuid
+
+from django.conf import settings
+
+from lily.utils.functions import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_KEY = 'email:sync:schedule'
+INTERVALS_KEY = 'email:sync:intervals'
+LOCK_KEY = 'email:sync:lock:%s'
+
+# Only delete the lock if it's still ours, it might have expired and been taken by another sync in the meantime.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
+
+
+def acquire_sync_lock(account_id):
+    """
+    Try to lock the email account for synchronization, so only one sync of the account runs at a time.
+
+    Returns:
+        token to release the lock with or None if the account is already locked
+    """
+    token = uuid.uuid4().hex
+
+    if get_redis().set(LOCK_KEY % account_id, token, nx=True, ex=settings.GMAIL_SYNC_LOCK_LIFETIME):
+        return token
+
+    return None
+
+
+def release_sync_lock(account_id, token):
+    client = get_redis()
+    client.register_script(RELEASE_LOCK_SCRIPT)(keys=[LOCK_KEY % account_id], args=[token], client=client)
+
+
+def get_schedule():
+    """
+    Return the time the next sync is due for every scheduled email account.
+    """
+    return {int(account_id): due for account_id, due in get_redis().zrange(SCHEDULE_KEY, 0, -1, withscores=True)}
+
+
+def schedule_sync(account_id, changed):
+    """
+    Schedule the next sync of an email account.
+
+    Accounts that changed are synced again soon, for quiet accounts the interval doubles up to the maximum interval.
+
+    Args:
+        account_id (int): id of the EmailAccount
+        changed (boolean): whether the last sync found any changes
+
+    Returns:
+        the number of seconds until the next sync
+    """
+    client = get_redis()
+
+    if changed:
+        interval = settings.GMAIL_SYNC_MIN_INTERVAL
+    else:
+        interval = float(client.hget(INTERVALS_KEY, account_id) or settings.GMAIL_SYNC_MIN_INTERVAL)
+        interval = min(interval * 2, settings.GMAIL_SYNC_MAX_INTERVAL)
+
+    pipeline = client.pipeline()
+    pipeline.hset(INTERVALS_KEY, account_id, interval)
+    pipeline.zadd(SCHEDULE_KEY, time.time() + interval, account_id)
+    pipeline.execute()
+
+    logger.debug('Next sync for email account %s in %s seconds', account_id, interval)
+
+    return interval
+
+
+def postpone_sync(account_id, delay):
+    """
+    Push back the next sync of an email account, e.g. while a sync is queued, so it isn't dispatched again.
+    """
+    get_redis().zadd(SCHEDULE_KEY, time.time() + delay, account_id)
+
+
+def unschedule_sync(*account_ids):
+    if not account_ids:
+        return
+
+    pipeline = get_redis().pipeline()
+    pipeline.zrem(SCHEDULE_KEY, *account_ids)
+    pipeline.hdel(INTERVALS_KEY, *account_ids)
+    pipeline.execute()
@@ -1,8 +1,7 @@
-from bs4 import BeautifulSoup
 from lily.search.base_mapping import BaseMapping
 
 from .models.models import EmailMessage
-from lily.messaging.email.utils import convert_br_to_newline
+from lily.messaging.email.utils import get_text_from_html
 
 
 class EmailMessageMapping(BaseMapping):
@@ -163,7 +162,7 @@ class EmailMessageMapping(BaseMapping):
             'received_by_cc_name': [receiver.name for receiver in received_by_cc if receiver.name],
             'message_id': obj.message_id,
             'thread_id': obj.thread_id,
-            'body': obj.body_text or cls.body_html_parsed(obj),
+            'body': obj.search_body if obj.is_prerendered else obj.body_text or cls.body_html_parsed(obj),
             'is_trashed': obj.is_trashed,
             'is_starred': obj.is_starred,
             'is_spam': obj.is_spam,
@@ -177,6 +176,4 @@ class EmailMessageMapping(BaseMapping):
 
     @classmethod
     def body_html_parsed(cls, obj):
-        soup = BeautifulSoup(obj.body_html, 'lxml')
-        soup = convert_br_to_newline(soup)
-        return soup.get_text()
+        return get_text_from_html(obj.body_html)
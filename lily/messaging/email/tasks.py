@@ -1,15 +1,18 @@
 import logging
+import time
 import traceback
 
 from celery.task import task
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
+from django.conf import settings
 from oauth2client.client import HttpAccessTokenRefreshError
 
 from lily.utils.functions import post_intercom_event
 from .manager import GmailManager
 from .models.models import (EmailAccount, EmailMessage, EmailOutboxMessage, EmailTemplateAttachment,
                             EmailOutboxAttachment, EmailAttachment)
+from .scheduler import (acquire_sync_lock, get_schedule, postpone_sync, release_sync_lock, schedule_sync,
+                        unschedule_sync)
+from .unread import reconcile_unread_counts
 
 logger = logging.getLogger(__name__)
 
@@ -17,9 +20,14 @@ logger = logging.getLogger(__name__)
 @task(name='synchronize_email_account_scheduler')
 def synchronize_email_account_scheduler():
     """
-    Start new tasks for every active mailbox to synchronize.
+    Start new tasks for every active mailbox that is due for synchronization.
     """
+    now = time.time()
+    schedule = get_schedule()
+    active_account_ids = set()
+
     for email_account in EmailAccount.objects.filter(is_authorized=True, is_deleted=False):
+        active_account_ids.add(email_account.pk)
         logger.debug('Scheduling sync for %s', email_account)
 
         if email_account.full_sync_needed:
@@ -30,14 +38,20 @@ def synchronize_email_account_scheduler():
                 max_retries=1,
                 default_retry_delay=100,
             )
-        elif not email_account.is_syncing:
-            # The email account is done with a full synchroniazation, so initiate an incremental synchronization.
+        elif not email_account.is_syncing and schedule.get(email_account.pk, now) <= now:
+            # The email account is done with a full synchroniazation and is due (or not scheduled yet), so initiate
+            # an incremental synchronization.
             logger.info('Adding task for incremental sync for: %s', email_account)
             incremental_synchronize_email_account.apply_async(
                 args=(email_account.pk,),
                 max_retries=1,
                 default_retry_delay=100,
             )
+            # Don't queue another sync while this one is waiting, the sync itself schedules the next one.
+            postpone_sync(email_account.pk, settings.GMAIL_SYNC_LOCK_LIFETIME)
+
+    # Clean up the schedule of accounts that are deleted or no longer authorized.
+    unschedule_sync(*(set(schedule) - active_account_ids))
 
 
 @task(name='synchronize_labels_scheduler')
@@ -51,6 +65,31 @@ def synchronize_labels_scheduler():
         logger.info('Adding task for label sync for: %s', email_account)
 
 
+@task(name='reconcile_unread_counts_scheduler')
+def reconcile_unread_counts_scheduler():
+    """
+    Correct the unread counts of the labels of all email accounts, in case they drifted.
+    """
+    for email_account_id in EmailAccount.objects.filter(is_deleted=False).values_list('pk', flat=True):
+        reconcile_unread_counts_for_account.apply_async(args=(email_account_id,))
+
+
+@task(name='reconcile_unread_counts', logger=logger)
+def reconcile_unread_counts_for_account(account_id):
+    """
+    Count the unread messages of every label of the email account and correct the counts that drifted.
+
+    Args:
+        account_id (int): id of the EmailAccount
+    """
+    email_account = EmailAccount.objects.filter(pk=account_id, is_deleted=False).first()
+
+    if email_account:
+        corrected = reconcile_unread_counts(email_account)
+        if corrected:
+            logger.info('Corrected the unread count of %s labels for %s', corrected, email_account)
+
+
 @task(name='incremental_synchronize_email_account', logger=logger)
 def incremental_synchronize_email_account(account_id):
     """
@@ -66,10 +105,16 @@ def incremental_synchronize_email_account(account_id):
         return False
     else:
         if email_account.is_authorized:
+            lock = acquire_sync_lock(account_id)
+            if not lock:
+                logger.info('Sync for %s already in progress', email_account)
+                return False
+
             manager = None
+            changed = False
             try:
                 manager = GmailManager(email_account)
-                manager.sync_by_history()
+                changed = manager.sync_by_history()
                 logger.info('History page sync done for: %s', email_account)
             except HttpAccessTokenRefreshError:
                 logger.warning('Not syncing, no authorization for: %s', email_account)
@@ -79,6 +124,8 @@ def incremental_synchronize_email_account(account_id):
             finally:
                 if manager:
                     manager.cleanup()
+                schedule_sync(account_id, changed)
+                release_sync_lock(account_id, lock)
         else:
             logger.warning('Not syncing, no authorization for: %s', email_account)
 
@@ -97,6 +144,11 @@ def full_synchronize_email_account(account_id):
         logger.warning('EmailAccount no longer exists: %s', account_id)
     else:
         if email_account.is_authorized:
+            lock = acquire_sync_lock(account_id)
+            if not lock:
+                logger.info('Sync for %s already in progress', email_account)
+                return
+
             manager = None
             try:
                 manager = GmailManager(email_account)
@@ -111,6 +163,7 @@ def full_synchronize_email_account(account_id):
             finally:
                 if manager:
                     manager.cleanup()
+                release_sync_lock(account_id, lock)
         else:
             logger.warning('Not syncing, no authorization for: %s', email_account)
 
@@ -210,6 +263,39 @@ def download_email_message(self, account_id, message_id):
             logger.warning('Not syncing, no authorization for: %s', email_account)
 
 
+@task(name='download_email_messages', logger=logger, acks_late=True, bind=True)
+def download_email_messages(self, account_id, message_ids):
+    """
+    Download a batch of messages.
+
+    Args:
+        account_id (int): id of the EmailAccount
+        message_ids (list): google ids of EmailMessages
+    """
+    try:
+        email_account = EmailAccount.objects.get(pk=account_id, is_deleted=False)
+    except EmailAccount.DoesNotExist:
+        logger.warning('EmailAccount no longer exists: %s', account_id)
+    else:
+        if email_account.is_authorized:
+            manager = None
+            try:
+                manager = GmailManager(email_account)
+                logger.debug('Fetch %s messages for: %s' % (len(message_ids), email_account))
+                manager.download_messages(message_ids)
+            except HttpAccessTokenRefreshError:
+                logger.warning('Not syncing, no authorization for: %s', email_account)
+                pass
+            except Exception as exc:
+                logger.exception('Fetch %s messages for: %s failed' % (len(message_ids), email_account))
+                raise self.retry(exc=exc)
+            finally:
+                if manager:
+                    manager.cleanup()
+        else:
+            logger.warning('Not syncing, no authorization for: %s', email_account)
+
+
 @task(name='update_labels_for_message', logger=logger, bind=True)
 def update_labels_for_message(self, account_id, email_id):
     """
@@ -349,6 +435,41 @@ def add_and_remove_labels_for_message(self, email_id, add_labels=[], remove_labe
             logger.warning('Not syncing, no authorization for: %s', email_message.account)
 
 
+@task(name='batch_modify_email_messages', logger=logger, bind=True)
+def batch_modify_email_messages(self, account_id, message_ids, add_labels=[], remove_labels=[]):
+    """
+    Add and/or remove the same labels of multiple messages of an account in Gmail.
+
+    Args:
+        account_id (int): id of the EmailAccount
+        message_ids (list): message_ids of the messages
+        add_labels (list, optional): list of label_ids to add
+        remove_labels (list, optional): list of label_ids to remove
+    """
+    try:
+        email_account = EmailAccount.objects.get(pk=account_id, is_deleted=False)
+    except EmailAccount.DoesNotExist:
+        logger.warning('EmailAccount no longer exists: %s', account_id)
+    else:
+        if email_account.is_authorized:
+            manager = None
+            try:
+                manager = GmailManager(email_account)
+                logger.debug('Changing labels of %s messages for: %s', len(message_ids), email_account)
+                manager.batch_modify_email_messages(message_ids, add_labels, remove_labels)
+            except HttpAccessTokenRefreshError:
+                logger.warning('Not syncing, no authorization for: %s', email_account)
+                pass
+            except Exception as exc:
+                logger.exception('Failed changing labels of messages for %s' % email_account)
+                raise self.retry(exc=exc)
+            finally:
+                if manager:
+                    manager.cleanup()
+        else:
+            logger.warning('Not syncing, no authorization for: %s', email_account)
+
+
 @task(name='send_message', logger=logger)
 def send_message(email_outbox_message_id, original_message_id=None):
     """
@@ -411,18 +532,10 @@ def send_message(email_outbox_message_id, original_message_id=None):
                 outbox_attachment = EmailOutboxAttachment()
                 outbox_attachment.email_outbox_message = email_outbox_message
                 outbox_attachment.tenant_id = original_attachment.message.tenant_id
-
-                file = default_storage._open(original_attachment.attachment.name)
-                file.open()
-                content = file.read()
-                file.close()
-
-                file = ContentFile(content)
-                file.name = original_attachment.attachment.name
-
-                outbox_attachment.attachment = file
+                # Refer to the file of the original attachment instead of copying it, like template attachments.
+                outbox_attachment.attachment = original_attachment.attachment.name
                 outbox_attachment.inline = original_attachment.inline
-                outbox_attachment.size = file.size
+                outbox_attachment.size = original_attachment.size
                 outbox_attachment.save()
 
     manager = None
@@ -0,0 +1,76 @@
+from django.test import TestCase
+from django.test.client import RequestFactory
+from mock import Mock, patch
+
+from lily.messaging.email.views import EmailAttachmentProxy
+
+
+@patch('lily.messaging.email.views.get_storage_file_content_type', Mock(return_value='application/pdf'))
+@patch('lily.messaging.email.views.iter_storage_file')
+@patch('lily.messaging.email.views.EmailAttachment')
+class EmailAttachmentProxyTests(TestCase):
+    size = 100
+
+    def get_response(self, byte_range=None):
+        headers = {'HTTP_RANGE': byte_range} if byte_range else {}
+        request = RequestFactory().get('/', **headers)
+        request.user = Mock()
+
+        return EmailAttachmentProxy.as_view()(request, pk=1)
+
+    def setUp(self):
+        self.attachment = Mock(size=self.size, inline=False)
+        self.attachment.attachment.name = 'email/attachments/1/invoice.pdf'
+
+    def test_whole_file(self, email_attachment, iter_storage_file):
+        email_attachment.objects.get.return_value = self.attachment
+
+        response = self.get_response()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(self.size))
+        iter_storage_file.assert_called_once_with(self.attachment.attachment.name)
+
+    def test_single_range(self, email_attachment, iter_storage_file):
+        email_attachment.objects.get.return_value = self.attachment
+
+        response = self.get_response('bytes=10-19')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        iter_storage_file.assert_called_once_with(self.attachment.attachment.name, 10, 19)
+
+    def test_open_ended_range(self, email_attachment, iter_storage_file):
+        email_attachment.objects.get.return_value = self.attachment
+
+        response = self.get_response('bytes=90-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 90-99/100')
+
+        response = self.get_response('bytes=-30')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 70-99/100')
+
+    def test_unsatisfiable_range(self, email_attachment, iter_storage_file):
+        email_attachment.objects.get.return_value = self.attachment
+
+        for byte_range in ('bytes=100-', 'bytes=150-200', 'bytes=-0'):
+            response = self.get_response(byte_range)
+
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        self.assertFalse(iter_storage_file.called)
+
+    def test_invalid_range(self, email_attachment, iter_storage_file):
+        """
+        Test that ranges which can't be parsed or aren't supported are ignored.
+        """
+        email_attachment.objects.get.return_value = self.attachment
+
+        for byte_range in ('bytes=20-10', 'bytes=0-1,5-6', 'items=0-10', 'bytes=-'):
+            response = self.get_response(byte_range)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Length'], str(self.size))
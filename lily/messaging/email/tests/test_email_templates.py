@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.test import TestCase
+
+from lily.contacts.factories import ContactFactory
+from lily.messaging.email.models.models import EmailTemplate, TemplateVariable
+from lily.messaging.email.utils import get_compiled_email_template, get_email_template_lookups
+from lily.tenant.middleware import set_current_user
+from lily.users.factories import LilyUserFactory
+
+
+class EmailTemplateRenderingTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.user = LilyUserFactory.create()
+        self.contacts = ContactFactory.create_batch(size=2, tenant=self.user.tenant)
+
+        self.email_template = EmailTemplate.objects.create(
+            tenant=self.user.tenant,
+            name='Welcome',
+            subject='Welcome [[ contact.first_name ]]',
+            body_html='<p>[[ custom.greeting ]] [[ contact.first_name ]],</p><p>[[ custom.signature.public ]]</p>',
+        )
+
+        TemplateVariable.objects.create(tenant=self.user.tenant, owner=self.user, name='greeting', text='Dear')
+        TemplateVariable.objects.create(
+            tenant=self.user.tenant,
+            owner=LilyUserFactory.create(tenant=self.user.tenant),
+            name='signature',
+            text='Kind regards',
+            is_public=True
+        )
+
+    def test_cache(self):
+        """
+        Test that a compiled template is reused until the template is modified.
+        """
+        compiled = get_compiled_email_template(self.email_template)
+        self.assertIs(get_compiled_email_template(EmailTemplate.objects.only('id', 'modified').get()), compiled)
+
+        EmailTemplate.objects.filter(pk=self.email_template.pk).update(
+            subject='Hello [[ contact.first_name ]]',
+            modified=self.email_template.modified + timedelta(seconds=1)
+        )
+        email_template = EmailTemplate.objects.only('id', 'modified').get()
+        recompiled = get_compiled_email_template(email_template)
+
+        self.assertIsNot(recompiled, compiled)
+        self.assertEqual(
+            recompiled.render(get_email_template_lookups(self.user, [self.contacts[0].pk]), self.user)[0][1],
+            'Hello %s' % self.contacts[0].first_name
+        )
+
+    def test_render(self):
+        """
+        Test that the template is rendered for every recipient with the custom variables of the user.
+        """
+        lookups = get_email_template_lookups(self.user, [contact.pk for contact in self.contacts])
+        rendered = get_compiled_email_template(self.email_template).render(lookups, self.user)
+
+        self.assertEqual(rendered, [
+            (
+                '<p>Dear %s,</p><p>Kind regards</p>' % contact.first_name,
+                'Welcome %s' % contact.first_name,
+            ) for contact in self.contacts
+        ])
@@ -68,12 +68,16 @@ class GmailManagerTests(UserBasedTest, APITestCase):
 
         # Count the number of times the send_task mock was called to download a new message or to administer the
         # synchronization finished.
-        call_download_email_message_count = sum(
-            call[0][0] == 'download_email_message' for call in send_task_mock.call_args_list)
+        downloaded_message_ids = []
+        for call in send_task_mock.call_args_list:
+            if call[0][0] == 'download_email_messages':
+                message_ids = call[1]['args'][1]
+                self.assertLessEqual(len(message_ids), settings.GMAIL_MESSAGE_DOWNLOAD_BATCH_SIZE)
+                downloaded_message_ids.extend(message_ids)
         call_full_sync_finished_count = sum(
             call[0][0] == 'full_sync_finished' for call in send_task_mock.call_args_list)
 
-        self.assertEqual(call_download_email_message_count, len(messages))
+        self.assertEqual(downloaded_message_ids, [message['id'] for message in messages])
         self.assertEqual(call_full_sync_finished_count, 1)
 
     @patch.object(GmailConnector, 'get_message_info')
@@ -108,6 +112,37 @@ class GmailManagerTests(UserBasedTest, APITestCase):
             [settings.GMAIL_LABEL_UNREAD, settings.GMAIL_LABEL_IMPORTANT, settings.GMAIL_LABEL_PERSONAL,
              settings.GMAIL_LABEL_INBOX]))
 
+    @patch.object(GmailConnector, 'get_message_info_batch')
+    def test_download_messages(self, get_message_info_batch_mock):
+        """
+        Test the GmailManager on downloading a batch of messages, skipping the ones deleted from remote.
+        """
+        message_id = '15a6008a4baa65f3'
+
+        with open('lily/messaging/email/tests/data/get_message_info_{0}.json'.format(message_id)) as infile:
+            json_obj = json.load(infile)
+            # The second message has been deleted in the meantime, so isn't part of the batch response.
+            get_message_info_batch_mock.return_value = {message_id: json_obj}
+
+        email_account = EmailAccount.objects.first()
+
+        labels = [settings.GMAIL_LABEL_UNREAD, settings.GMAIL_LABEL_IMPORTANT, settings.GMAIL_LABEL_PERSONAL,
+                  settings.GMAIL_LABEL_INBOX]
+        for label in labels:
+            EmailLabelFactory.create(account=email_account, label_id=label)
+
+        manager = GmailManager(email_account)
+        manager.download_messages([message_id, '15a6008a4baa65f4'])
+
+        # All messages are fetched with a single batch request.
+        get_message_info_batch_mock.assert_called_once_with([message_id, '15a6008a4baa65f4'])
+
+        # Verify that only the message that still exists is stored in the db.
+        self.assertEqual(
+            list(EmailMessage.objects.filter(account=email_account).values_list('message_id', flat=True)),
+            [message_id]
+        )
+
     @patch.object(GmailConnector, 'get_short_message_info')
     @patch.object(GmailConnector, 'get_message_info')
     def test_download_message_exists(self, get_message_info_mock, get_short_message_info_mock):
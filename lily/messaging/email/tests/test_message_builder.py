@@ -0,0 +1,138 @@
+import base64
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from googleapiclient.discovery import build
+from rest_framework.test import APITestCase
+
+from lily.messaging.email.factories import EmailAccountFactory, EmailLabelFactory
+from lily.messaging.email.manager import GmailManager
+from lily.messaging.email.models.models import EmailAccount, EmailMessage
+from lily.messaging.email.services import GmailService
+from lily.messaging.email.utils import urlsafe_b64decode_to_file
+from lily.tests.utils import UserBasedTest, get_dummy_credentials
+
+from mock import patch
+
+
+class MessageBuilderTests(UserBasedTest, APITestCase):
+    """
+    Class for unit testing the MessageBuilder.
+    """
+    message_ids = [
+        '15a6001f325c4e9d',
+        '15a60025b255c626',
+        '15a60044bb3e2a7a',
+        '15a60053dea565fa',
+        '15a60053f67f5de4',
+        '15a600543e10c8e4',
+        '15a60067ef5e0bf9',
+        '15a600682d97904e',
+        '15a600737124149d',
+        '15a6008a4baa65f3',
+    ]
+
+    def setUp(self):
+        # Patch the creation of a Gmail API service without the need for authorized credentials.
+        credentials = get_dummy_credentials()
+        self.get_credentials_mock_patcher = patch('lily.messaging.email.connector.get_credentials')
+        get_credentials_mock = self.get_credentials_mock_patcher.start()
+        get_credentials_mock.return_value = credentials
+
+        self.authorize_mock_patcher = patch.object(GmailService, 'authorize')
+        authorize_mock = self.authorize_mock_patcher.start()
+        authorize_mock.return_value = None
+
+        self.build_service_mock_patcher = patch.object(GmailService, 'build_service')
+        build_service_mock = self.build_service_mock_patcher.start()
+        build_service_mock.return_value = build('gmail', 'v1', credentials=credentials)
+
+        self.message_infos = {}
+        for message_id in self.message_ids:
+            with open('lily/messaging/email/tests/data/get_message_info_{0}.json'.format(message_id)) as infile:
+                self.message_infos[message_id] = json.load(infile)
+
+        # Make sure all labels are present, so storing the messages doesn't do any API calls.
+        email_account = EmailAccount.objects.first()
+        label_ids = set()
+        for message_info in self.message_infos.values():
+            label_ids.update(message_info.get('labelIds', []))
+        for label_id in label_ids:
+            EmailLabelFactory.create(account=email_account, label_id=label_id)
+
+    @classmethod
+    def setUpTestData(cls):
+        # Create a user, handled by UserBasedTest.
+        super(MessageBuilderTests, cls).setUpTestData()
+
+        # Create an email account for the user.
+        EmailAccountFactory.create(owner=cls.user_obj, tenant=cls.user_obj.tenant)
+
+    def tearDown(self):
+        self.get_credentials_mock_patcher.stop()
+        self.authorize_mock_patcher.stop()
+        self.build_service_mock_patcher.stop()
+
+    def _save_messages(self, message_ids):
+        """
+        Build the given messages and store them as one batch.
+
+        Returns:
+            the number of queries needed to store the batch
+        """
+        manager = GmailManager(EmailAccount.objects.first())
+        for message_id in message_ids:
+            manager.message_builder.store_message_info(self.message_infos[message_id], message_id)
+            manager.message_builder.add_to_batch()
+
+        with CaptureQueriesContext(connection) as context:
+            manager.message_builder.save_batch()
+
+        return len(context.captured_queries)
+
+    def test_save_batch(self):
+        """
+        Test that a batch of messages is stored with its labels and recipients.
+        """
+        self._save_messages(self.message_ids)
+
+        email_account = EmailAccount.objects.first()
+        for message_id in self.message_ids:
+            email_message = EmailMessage.objects.get(account=email_account, message_id=message_id)
+            message_info = self.message_infos[message_id]
+
+            self.assertEqual(
+                set(email_message.labels.values_list('label_id', flat=True)),
+                set(message_info.get('labelIds', []))
+            )
+            self.assertIsNotNone(email_message.sender_id)
+            self.assertTrue(email_message.received_by.exists() or email_message.received_by_cc.exists())
+            # The body is rendered when the message is stored.
+            self.assertTrue(email_message.is_prerendered)
+            self.assertTrue(email_message.search_body)
+
+    @override_settings(ES_DISABLED=True)
+    def test_save_batch_query_count(self):
+        """
+        Benchmark the number of queries per message: apart from saving each message itself, storing a batch uses the
+        same number of queries as storing a single message.
+        """
+        single_query_count = self._save_messages(self.message_ids[:1])
+        batch_query_count = self._save_messages(self.message_ids[1:])
+
+        # Per message the message itself is inserted, the relations are inserted in bulk for the whole batch. Allow for
+        # a few relations (e.g. cc recipients) which the single message doesn't have.
+        # Saving messages one by one used to take a query or more per recipient, label, header and attachment.
+        self.assertLessEqual(batch_query_count, single_query_count + len(self.message_ids[1:]) - 1 + 3)
+
+    def test_urlsafe_b64decode_to_file(self):
+        """
+        Test that attachment data decoded in chunks equals the data decoded at once, also without padding.
+        """
+        data = ''.join(chr(i % 256) for i in range(1000))
+        encoded = base64.urlsafe_b64encode(data)
+
+        for encoded_data in (encoded, encoded.rstrip('=')):
+            decoded_file = urlsafe_b64decode_to_file(unicode(encoded_data), chunk_size=30)
+            self.assertEqual(decoded_file.read(), data)
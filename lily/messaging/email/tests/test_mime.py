@@ -0,0 +1,68 @@
+import email
+import os
+
+from django.core.mail import SafeMIMEMultipart, SafeMIMEText
+from django.test import TestCase
+from mock import patch
+
+from lily.messaging.email.mime import StreamingMIMEMessage, iter_base64_lines
+
+
+class StreamingMIMEMessageTests(TestCase):
+    def setUp(self):
+        self.files = {
+            'attachments/report.pdf': os.urandom(200 * 1024 + 7),
+            'attachments/logo.png': os.urandom(1000),
+        }
+
+        message = SafeMIMEMultipart('related')
+        message['Subject'] = 'Report'
+        message['To'] = 'user2@example.com'
+
+        alternative = SafeMIMEMultipart('alternative')
+        alternative.attach(SafeMIMEText('Report', 'plain', 'utf-8'))
+        alternative.attach(SafeMIMEText('<b>Report</b>', 'html', 'utf-8'))
+        message.attach(alternative)
+
+        self.message = StreamingMIMEMessage(message)
+        self.message.attach_stored_file('attachments/report.pdf', 'application/pdf', 'report.pdf')
+        self.message.attach_stored_file(
+            'attachments/logo.png',
+            'image/png',
+            'logo.png',
+            disposition='inline',
+            content_id='<logo@example.com>'
+        )
+
+    def iter_storage_file(self, name):
+        content = self.files[name]
+        for start in range(0, len(content), 64 * 1024):
+            yield content[start:start + 64 * 1024]
+
+    def test_base64_lines(self):
+        """
+        Test that encoding chunks gives the same lines as encoding the data at once.
+        """
+        data = self.files['attachments/report.pdf']
+        self.assertEqual(''.join(iter_base64_lines(self.iter_storage_file('attachments/report.pdf'))),
+                         data.encode('base64'))
+
+    def test_write(self):
+        """
+        Test that the written message is parsed into the body and the attachments read from the storage.
+        """
+        with patch('lily.messaging.email.mime.iter_storage_file', side_effect=self.iter_storage_file):
+            message = email.message_from_file(self.message.as_file())
+
+        body, report, logo = message.get_payload()
+
+        self.assertEqual(message['Subject'], 'Report')
+        self.assertEqual([part.get_payload(decode=True) for part in body.get_payload()], ['Report', '<b>Report</b>'])
+
+        self.assertEqual(report.get_content_type(), 'application/pdf')
+        self.assertEqual(report.get_filename(), 'report.pdf')
+        self.assertEqual(report.get_payload(decode=True), self.files['attachments/report.pdf'])
+
+        self.assertEqual(logo['Content-ID'], '<logo@example.com>')
+        self.assertTrue(logo['Content-Disposition'].startswith('inline'))
+        self.assertEqual(logo.get_payload(decode=True), self.files['attachments/logo.png'])
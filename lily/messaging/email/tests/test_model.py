@@ -3,7 +3,7 @@ from rest_framework.test import APITestCase
 
 from lily.messaging.email.factories import EmailAccountFactory, EmailMessageFactory
 from lily.messaging.email.models.models import EmailMessage, Recipient, EmailLabel, EmailHeader, EmailAccount
-from lily.messaging.email.utils import get_filtered_message
+from lily.messaging.email.utils import get_filtered_message, EmailPrivacyResolver
 from lily.settings import settings
 from lily.tenant.factories import TenantFactory
 from lily.tests.utils import UserBasedTest
@@ -414,6 +414,52 @@ class EmailAccountTests(UserBasedTest, APITestCase):
             else:
                 self.assertEqual(filtered_messages, [])
 
+    def test_privacy_resolver(self):
+        """
+        Test if the privacy resolver filters messages the same as get_filtered_message, with a fixed number of queries.
+        """
+        users = LilyUserFactory.create_batch(size=3, tenant=self.tenant)
+        email_messages = []
+
+        for privacy, shared_privacy in [(EmailAccount.PUBLIC, EmailAccount.PRIVATE),
+                                        (EmailAccount.METADATA, EmailAccount.PUBLIC),
+                                        (EmailAccount.PRIVATE, None)]:
+            email_account = EmailAccountFactory.create(tenant=self.tenant, privacy=privacy, owner=users[0])
+
+            if shared_privacy is not None:
+                email_account.sharedemailconfig_set.create(
+                    user=users[1],
+                    email_account=email_account,
+                    privacy=shared_privacy,
+                    tenant=self.tenant
+                )
+
+            email_messages += EmailMessageFactory.create_batch(account=email_account, size=2)
+
+        for user in users:
+            resolver = EmailPrivacyResolver(user)
+
+            # One query for the email accounts and one for the shared configs, regardless of the number of messages.
+            with self.assertNumQueries(2):
+                filtered_messages = [resolver.filter_message(email_message) for email_message in email_messages]
+
+            for email_message, filtered_message in zip(email_messages, filtered_messages):
+                expected = get_filtered_message(email_message, email_message.account, user)
+
+                self.assertEqual(type(filtered_message), type(expected))
+                if isinstance(expected, dict):
+                    self.assertEqual(filtered_message['id'], expected['id'])
+
+            # Filtering in the database gives the same messages, annotated with the privacy.
+            queryset = resolver.filter_queryset(EmailMessage.objects.filter(
+                id__in=[email_message.id for email_message in email_messages]
+            ))
+            expected_privacy = {
+                email_message.id: resolver.get_privacy(email_message.account_id)
+                for email_message, filtered_message in zip(email_messages, filtered_messages) if filtered_message
+            }
+            self.assertEqual({email_message.id: email_message.privacy for email_message in queryset}, expected_privacy)
+
     def _can_view_full_message(self, email_account, user):
         shared_config = email_account.sharedemailconfig_set.filter(user=user).first()
 
@@ -0,0 +1,87 @@
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from mock import Mock
+
+from lily.messaging.email.models.models import EmailMessage
+from lily.messaging.email.utils import prerender_email_message, render_email_body, render_email_message_body
+
+
+class RenderEmailBodyTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/', HTTP_HOST='app.hellolily.com', secure=True)
+        self.attachment = Mock(pk=1, cid='<image001@example.com>')
+
+    def test_render(self):
+        """
+        Test that scripts are removed, links open outside the iframe and inline images use the proxy view.
+        """
+        html = (
+            '<html><body><script>alert(1);</script><a href="https://example.com">Link</a>'
+            '<img src="cid:image001@example.com"></body></html>'
+        )
+
+        body = render_email_body(html, [self.attachment], self.request)
+
+        self.assertNotIn('<script>', body)
+        self.assertNotIn('alert', body)
+        self.assertIn('target="_blank"', body)
+        self.assertIn('rel="noopener noreferrer"', body)
+        self.assertIn('https://app.hellolily.com%s' % reverse('email_attachment_proxy_view', kwargs={'pk': 1}), body)
+
+    def test_render_without_html(self):
+        self.assertIsNone(render_email_body(None, [], self.request))
+
+    @override_settings(
+        EMAIL_BODY_CACHE_ENABLED=True,
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    )
+    def test_cached_body(self):
+        """
+        Test that a rendered body is reused until the body, the attachments or the host change.
+        """
+        message = EmailMessage(pk=1, body_html='<p>Hello</p><img src="cid:image001@example.com">')
+
+        body = render_email_message_body(message, [self.attachment], self.request)
+        message.body_html = '<p>Changed</p>'
+        self.assertNotEqual(render_email_message_body(message, [self.attachment], self.request), body)
+
+        message.body_html = '<p>Hello</p><img src="cid:image001@example.com">'
+        self.assertEqual(render_email_message_body(message, [self.attachment], self.request), body)
+        self.assertNotEqual(render_email_message_body(message, [], self.request), body)
+
+    def test_prerendered_body(self):
+        """
+        Test that a body rendered at ingest shows the same as a body rendered when it's read.
+        """
+        html = (
+            '<html><body><script>alert(1);</script><a href="mailto:info@example.com">Mail</a>'
+            '<img src="cid:image001@example.com"></body></html>'
+        )
+        message = EmailMessage(pk=1, body_html=html)
+
+        prerender_email_message(message)
+        body = render_email_message_body(message, [self.attachment], self.request)
+
+        self.assertTrue(message.is_prerendered)
+        self.assertNotIn('alert', body)
+        self.assertNotIn('alert', message.reply_body)
+        self.assertIn('href="/#/email/compose/info@example.com"', body)
+        self.assertIn('https://app.hellolily.com%s' % reverse('email_attachment_proxy_view', kwargs={'pk': 1}), body)
+        self.assertEqual(message.search_body, 'Mail')
+
+    def test_prerendered_escaped_cid(self):
+        """
+        Test that inline images are linked when the sanitizer escapes their cid, and messages without rendered
+        bodies are rendered when they're read.
+        """
+        attachment = Mock(pk=2, cid='<image&001@example.com>')
+        message = EmailMessage(pk=1, body_html='<p>Hello</p><img src="cid:image&001@example.com">')
+        self.assertFalse(message.is_prerendered)
+
+        prerender_email_message(message)
+        body = render_email_message_body(message, [attachment], self.request)
+
+        self.assertIn('https://app.hellolily.com%s' % reverse('email_attachment_proxy_view', kwargs={'pk': 2}), body)
+        self.assertNotIn('src="cid:', body)
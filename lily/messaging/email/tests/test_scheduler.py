@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from lily.messaging.email.scheduler import acquire_sync_lock, get_schedule, release_sync_lock, schedule_sync
+from lily.tests.utils import RedisTestMixin
+
+
+class SyncSchedulerTests(RedisTestMixin, SimpleTestCase):
+    """
+    Class for unit testing the adaptive email sync scheduler.
+    """
+    account_id = 1
+
+    def test_backoff(self):
+        """
+        Test that quiet accounts back off exponentially and accounts with changes are synced soon again.
+        """
+        self.assertEqual(schedule_sync(self.account_id, False), settings.GMAIL_SYNC_MIN_INTERVAL * 2)
+        self.assertEqual(schedule_sync(self.account_id, False), settings.GMAIL_SYNC_MIN_INTERVAL * 4)
+
+        for i in range(20):
+            interval = schedule_sync(self.account_id, False)
+        self.assertEqual(interval, settings.GMAIL_SYNC_MAX_INTERVAL)
+
+        self.assertEqual(schedule_sync(self.account_id, True), settings.GMAIL_SYNC_MIN_INTERVAL)
+
+        # The next sync is due after the interval.
+        due = get_schedule()[self.account_id]
+        self.assertAlmostEqual(due, time.time() + settings.GMAIL_SYNC_MIN_INTERVAL, delta=5)
+
+    def test_lock(self):
+        """
+        Test that only one sync of an email account can hold the lock.
+        """
+        lock = acquire_sync_lock(self.account_id)
+        self.assertIsNotNone(lock)
+        self.assertIsNone(acquire_sync_lock(self.account_id))
+
+        # Releasing with another token leaves the lock alone.
+        release_sync_lock(self.account_id, 'other')
+        self.assertIsNone(acquire_sync_lock(self.account_id))
+
+        release_sync_lock(self.account_id, lock)
+        lock = acquire_sync_lock(self.account_id)
+        self.assertIsNotNone(lock)
+        release_sync_lock(self.account_id, lock)
@@ -0,0 +1,88 @@
+from django.test import TestCase
+
+from lily.messaging.email.factories import EmailAccountFactory, EmailLabelFactory, EmailMessageFactory
+from lily.messaging.email.models.models import EmailLabel, EmailMessage
+from lily.messaging.email.unread import (add_and_remove_labels, bulk_add_and_remove_labels, delete_email_messages,
+                                         reconcile_unread_counts, set_email_message_read)
+from lily.tenant.middleware import set_current_user
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.email_account = EmailAccountFactory.create()
+        self.inbox, self.label = EmailLabelFactory.create_batch(size=2, account=self.email_account, unread=0)
+
+        self.messages = EmailMessageFactory.create_batch(size=3, account=self.email_account, read=False)
+        for message in self.messages:
+            message.labels.add(self.inbox)
+
+        reconcile_unread_counts(self.email_account)
+
+    def assertUnread(self, label, count):
+        self.assertEqual(EmailLabel.objects.get(pk=label.pk).unread, count)
+
+    def test_reconcile(self):
+        """
+        Test that reconciling counts the unread messages per label.
+        """
+        self.assertUnread(self.inbox, 3)
+        self.assertUnread(self.label, 0)
+
+        EmailLabel.objects.filter(pk=self.inbox.pk).update(unread=10)
+        self.assertEqual(reconcile_unread_counts(self.email_account), 1)
+        self.assertUnread(self.inbox, 3)
+
+    def test_read(self):
+        """
+        Test that (un)reading a message updates the counts of its labels, once.
+        """
+        set_email_message_read(self.messages[0], True)
+        set_email_message_read(self.messages[0], True)
+        self.assertUnread(self.inbox, 2)
+
+        set_email_message_read(self.messages[0], False)
+        self.assertUnread(self.inbox, 3)
+
+    def test_labels(self):
+        """
+        Test that adding and removing labels updates the counts of the labels that actually changed.
+        """
+        add_and_remove_labels(self.messages[0], add_labels=[self.label, self.inbox], remove_labels=[])
+        self.assertUnread(self.inbox, 3)
+        self.assertUnread(self.label, 1)
+
+        add_and_remove_labels(self.messages[0], add_labels=[], remove_labels=[self.inbox])
+        self.assertUnread(self.inbox, 2)
+
+    def test_bulk(self):
+        """
+        Test that changing the labels of multiple messages at once updates the counts like changing them one by one.
+        """
+        message_ids = [message.id for message in self.messages]
+
+        changed_ids = bulk_add_and_remove_labels(message_ids, add_labels=[self.label], remove_labels=[self.inbox])
+        self.assertEqual(sorted(changed_ids), sorted(message_ids))
+        self.assertUnread(self.inbox, 0)
+        self.assertUnread(self.label, 3)
+
+        bulk_add_and_remove_labels(message_ids[:2], read=True)
+        self.assertUnread(self.label, 1)
+        self.assertEqual(EmailMessage.objects.filter(pk__in=message_ids, read=True).count(), 2)
+
+        bulk_add_and_remove_labels(message_ids, add_labels=[self.inbox], read=False)
+        self.assertUnread(self.inbox, 3)
+        self.assertUnread(self.label, 3)
+
+        # The incremental counts match a recount.
+        self.assertEqual(reconcile_unread_counts(self.email_account), 0)
+
+    def test_delete(self):
+        """
+        Test that deleting messages subtracts them from the counts.
+        """
+        delete_email_messages(EmailMessage.objects.filter(pk__in=[message.pk for message in self.messages[:2]]))
+        self.assertUnread(self.inbox, 1)
+
+        # The incremental counts match a recount.
+        self.assertEqual(reconcile_unread_counts(self.email_account), 0)
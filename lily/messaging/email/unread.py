@@ -0,0 +1,196 @@
+"""
+Unread counts of email labels.
+
+EmailLabel.unread is a counter which is updated in the same transaction as the messages and labels it counts: every
+change adds or subtracts the messages that became (un)read or were added to or removed from the label. Counting the
+unread messages of every label after each change doesn't scale to large mailboxes. Drift, e.g. by concurrent changes,
+is corrected by reconcile_unread_counts, which runs periodically.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+
+from .models.models import EmailLabel, EmailMessage
+
+
+def update_unread_counts(deltas):
+    """
+    Apply changes to the unread counts of labels, with a single query.
+
+    Args:
+        deltas (dict): the change of the unread count per label id
+    """
+    deltas = {label_id: delta for label_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    whens = []
+    for label_id, delta in deltas.items():
+        # Counts can't go below zero, even if they drifted.
+        whens.append(When(id=label_id, unread__gte=-delta, then=F('unread') + delta))
+        whens.append(When(id=label_id, then=Value(0)))
+
+    EmailLabel.objects.filter(id__in=deltas.keys()).update(unread=Case(*whens, output_field=IntegerField()))
+
+
+def count_unread(deltas, read, label_ids, sign=1):
+    """
+    Add (or with sign -1 subtract) a message to the unread counts of its labels, if it is unread.
+    """
+    if not read:
+        for label_id in label_ids:
+            deltas[label_id] += sign
+
+
+def get_unread_label_counts(email_messages):
+    """
+    Return the number of unread messages per label of the given messages.
+    """
+    return Counter(dict(EmailMessage.labels.through.objects.filter(
+        emailmessage__in=email_messages.filter(read=False).values('id')
+    ).values_list('emaillabel_id').annotate(count=Count('id')).order_by()))
+
+
+def delete_email_messages(email_messages):
+    """
+    Delete the email messages and subtract them from the unread counts of their labels.
+    """
+    with transaction.atomic():
+        deltas = get_unread_label_counts(email_messages)
+        email_messages.order_by().delete()
+        update_unread_counts({label_id: -count for label_id, count in deltas.items()})
+
+
+def set_email_message_read(email_message, read):
+    """
+    Mark the email message as (un)read and update the unread counts of its labels.
+    """
+    with transaction.atomic():
+        # Lock the message, so concurrent changes of the read status are counted once.
+        was_read = EmailMessage.objects.select_for_update().filter(
+            pk=email_message.pk
+        ).values_list('read', flat=True).first()
+
+        email_message.read = read
+        email_message.save()
+
+        if was_read is not None and was_read != read:
+            deltas = Counter()
+            count_unread(deltas, False, email_message.labels.values_list('id', flat=True), -1 if read else 1)
+            update_unread_counts(deltas)
+
+
+def add_and_remove_labels(email_message, add_labels, remove_labels):
+    """
+    Add and remove labels of the email message and update their unread counts.
+
+    Args:
+        email_message (instance): EmailMessage instance
+        add_labels (list): EmailLabel instances to add
+        remove_labels (list): EmailLabel instances to remove
+    """
+    with transaction.atomic():
+        was_read = EmailMessage.objects.select_for_update().filter(
+            pk=email_message.pk
+        ).values_list('read', flat=True).first()
+
+        if was_read is None:
+            # The message was deleted meanwhile.
+            return
+
+        current_label_ids = set(email_message.labels.values_list('id', flat=True))
+        removed_label_ids = current_label_ids & set(label.id for label in remove_labels)
+        added_label_ids = set(label.id for label in add_labels) - current_label_ids
+
+        email_message.labels.remove(*removed_label_ids)
+        email_message.labels.add(*added_label_ids)
+
+        deltas = Counter()
+        count_unread(deltas, was_read, removed_label_ids, -1)
+        count_unread(deltas, was_read, added_label_ids)
+        update_unread_counts(deltas)
+
+
+def bulk_add_and_remove_labels(message_ids, add_labels=None, remove_labels=None, read=None):
+    """
+    Add and remove the same labels of multiple email messages and update the unread counts, with a fixed number of
+    queries. The labels are changed directly on the through table, so no signals are sent and the messages have to be
+    reindexed by the caller.
+
+    Args:
+        message_ids (list): ids of the EmailMessages
+        add_labels (list, optional): EmailLabel instances to add
+        remove_labels (list, optional): EmailLabel instances to remove
+        read (boolean, optional): mark the messages as (un)read as well
+
+    Returns:
+        list: ids of the messages that still exist
+    """
+    through = EmailMessage.labels.through
+    add_label_ids = set(label.id for label in add_labels or [])
+    remove_label_ids = set(label.id for label in remove_labels or [])
+
+    with transaction.atomic():
+        # Lock the messages, so concurrent changes are counted once.
+        was_read = dict(EmailMessage.objects.select_for_update().filter(
+            id__in=message_ids
+        ).order_by().values_list('id', 'read'))
+
+        current_label_ids = defaultdict(set)
+        for message_id, label_id in through.objects.filter(
+            emailmessage_id__in=was_read.keys()
+        ).values_list('emailmessage_id', 'emaillabel_id'):
+            current_label_ids[message_id].add(label_id)
+
+        deltas = Counter()
+
+        if read is not None:
+            changed_ids = [message_id for message_id, message_read in was_read.items() if message_read != read]
+            if changed_ids:
+                EmailMessage.objects.filter(id__in=changed_ids).update(read=read)
+
+            for message_id in changed_ids:
+                count_unread(deltas, False, current_label_ids[message_id], -1 if read else 1)
+                was_read[message_id] = read
+
+        if remove_label_ids:
+            through.objects.filter(emailmessage_id__in=was_read.keys(), emaillabel_id__in=remove_label_ids).delete()
+
+        new_rows = []
+        for message_id, message_read in was_read.items():
+            removed_label_ids = current_label_ids[message_id] & remove_label_ids
+            added_label_ids = add_label_ids - current_label_ids[message_id]
+
+            count_unread(deltas, message_read, removed_label_ids, -1)
+            count_unread(deltas, message_read, added_label_ids)
+
+            new_rows += [through(emailmessage_id=message_id, emaillabel_id=label_id) for label_id in added_label_ids]
+
+        through.objects.bulk_create(new_rows)
+        update_unread_counts(deltas)
+
+    return was_read.keys()
+
+
+def reconcile_unread_counts(email_account):
+    """
+    Count the unread messages of all labels of the email account and correct the counters that drifted.
+
+    Returns:
+        int: the number of labels that were corrected
+    """
+    counts = dict(EmailLabel.objects.filter(account=email_account).annotate(
+        count=Sum(Case(When(messages__read=False, then=Value(1)), default=Value(0), output_field=IntegerField()))
+    ).values_list('id', 'count'))
+
+    corrected = 0
+    for label in EmailLabel.objects.filter(account=email_account):
+        count = counts.get(label.id) or 0
+
+        if label.unread != count:
+            # Only update the count itself, concurrent updates of the other fields are kept.
+            EmailLabel.objects.filter(id=label.id).update(unread=count)
+            corrected += 1
+
+    return corrected
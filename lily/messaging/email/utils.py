@@ -1,9 +1,15 @@
+import base64
+import hashlib
+import HTMLParser
 import logging
 import re
 import mimetypes
 import json
 import os
+import tempfile
+import threading
 
+from collections import defaultdict
 from datetime import datetime
 from bs4 import BeautifulSoup
 import html2text
@@ -11,9 +17,11 @@ from urllib import unquote
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.core.urlresolvers import reverse
-from django.template import engines, Context, TemplateSyntaxError
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.template import engines, Context, Template, TemplateSyntaxError
 from django.template.base import VARIABLE_TAG_START, VARIABLE_TAG_END
 from django.template.loader_tags import BlockNode, ExtendsNode
 from django.utils.translation import ugettext_lazy as _
@@ -21,20 +29,35 @@ from django.utils.translation import ugettext_lazy as _
 from lily.accounts.models import Account
 from lily.contacts.models import Contact
 from lily.search.scan_search import ModelMappings
-from lily.search.indexing import update_in_index
+from lily.search.indexing import index_ids, update_in_index
 
 from .decorators import get_safe_template
-from .models.models import EmailAttachment, EmailMessage, EmailAccount
+from .models.models import EmailAttachment, EmailMessage, EmailAccount, SharedEmailConfig, TemplateVariable
 from .sanitize import sanitize_html_email
 
 _EMAIL_PARAMETER_DICT = {}
 _EMAIL_PARAMETER_API_DICT = {}
 _EMAIL_PARAMETER_CHOICES = {}
 
+# Parameters in templates, with the following syntax: model.field
+PARAMETER_REGEX = re.compile('(%s[\s]*[a-zA-Z]+\.[a-zA-Z_]+[\s]*%s)' % (
+    re.escape(VARIABLE_TAG_START),
+    re.escape(VARIABLE_TAG_END)
+))
+CUSTOM_VARIABLE_REGEX = re.compile('\[\[ custom\.(.*?) \]\]')
+
+# Compiled email templates by id, see get_compiled_email_template.
+_COMPILED_EMAIL_TEMPLATES = {}
+_COMPILED_EMAIL_TEMPLATES_LOCK = threading.Lock()
+
 logger = logging.getLogger(__name__)
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'tests/data')
 
+RENDERED_BODY_KEY = 'email:rendered_body:%s:%s'
+# Images with a cid source in sanitized html, the source is quoted with double quotes unless it contains them.
+CID_SOURCE_RE = re.compile(r'''src=(["'])cid:(.*?)\1''')
+
 DRAFTS = '\\Drafts'
 INBOX = '\\Inbox'
 SENT = '\\Sent'
@@ -166,9 +189,11 @@ class TemplateParser(object):
         """
         parts = parts or ['name', 'subject', 'body_html']
         response = {}
+        # Walk the template once for all parts.
+        blocks = self._get_blocks(self.template, Context())
 
         for part in parts:
-            value = self._get_node(self.template, name=part).strip()
+            value = blocks[part].render(Context()).strip() if part in blocks else ''
 
             if value:
                 response[part] = value
@@ -182,62 +207,400 @@ class TemplateParser(object):
         """
         Escape variables and delete Django syntax around variables that are not allowed.
         """
-        # Filter on parameters with the following syntax: model.field
-        param_regex = (re.compile('(%s[\s]*[a-zA-Z]+\.[a-zA-Z_]+[\s]*%s)' % (
-            re.escape(VARIABLE_TAG_START),
-            re.escape(VARIABLE_TAG_END)
-        )))
-        parameter_list = [x for x in re.findall(param_regex, text)]
-
-        for parameter in parameter_list:
+        def escape_parameter(match):
+            parameter = match.group(0)
             stripped_parameter = parameter.strip(' {}')
             split_parameter = stripped_parameter.split('|')[0]
+
             if split_parameter in get_email_parameter_dict():
                 # variable is accepted, now just escape so it can be rendered later
-                text = text.replace(
-                    '%s' % parameter,
-                    '{%% templatetag openvariable %%} %s {%% templatetag closevariable %%}' % stripped_parameter
-                )
                 self.valid_parameters.append(stripped_parameter)
-            else:
-                # variable is not accepted, remove surrounding braces
-                text = text.replace('%s' % parameter, '%s' % stripped_parameter)
+                return '{%% templatetag openvariable %%} %s {%% templatetag closevariable %%}' % stripped_parameter
+
+            # variable is not accepted, remove surrounding braces
+            return stripped_parameter
 
-        return text
+        # Replace all parameters in a single pass over the text.
+        return PARAMETER_REGEX.sub(escape_parameter, text)
 
-    def _get_node(self, template, context=Context(), name='subject', block_lookups=None):
+    def _get_blocks(self, template, context, block_lookups=None):
         """
-        Get contents of specified node out of the template.
+        Get the top level blocks of the template by name, with the blocks of extended templates filled in.
         """
         block_lookups = block_lookups or {}
-        for node in template:
-            if isinstance(node, BlockNode) and node.name == name:
+        blocks = {}
+
+        # Templates of the template engine wrap the template with the nodes.
+        for node in getattr(template, 'template', template):
+            if isinstance(node, BlockNode):
+                if node.name in blocks:
+                    continue
+
                 # Rudimentary handling of extended templates, for issue #3
                 for i in xrange(len(node.nodelist)):
                     n = node.nodelist[i]
                     if isinstance(n, BlockNode) and n.name in block_lookups:
                         node.nodelist[i] = block_lookups[n.name]
-                return node.render(context)
+                blocks[node.name] = node
             elif isinstance(node, ExtendsNode):
                 lookups = dict([(n.name, n) for n in node.nodelist if isinstance(n, BlockNode)])
                 lookups.update(block_lookups)
-                return self._get_node(node.get_parent(context), context, name, lookups)
-        return ''
+
+                for name, block in self._get_blocks(node.get_parent(context), context, lookups).items():
+                    blocks.setdefault(name, block)
+                break
+
+        return blocks
+
+
+class CompiledEmailTemplate(object):
+    """
+    An email template compiled for rendering in the compose screen, see get_compiled_email_template.
+
+    The subject and the body are compiled once. The texts of custom variables are part of the source of the body, so a
+    body with custom variables is compiled once per combination of their texts.
+
+    Attributes:
+        subject: the compiled subject
+        custom_variables: the custom variables in the body, in order of occurrence
+    """
+    # Every user has their own texts for custom variables.
+    MAX_COMPILED_BODIES = 50
+
+    def __init__(self, email_template):
+        self.subject = Template(self.to_django_syntax(email_template.subject))
+        self.body_html = email_template.body_html
+        self.custom_variables = CUSTOM_VARIABLE_REGEX.findall(self.body_html)
+        self.bodies = {}
+
+    @staticmethod
+    def to_django_syntax(source):
+        # Ugly hack to make parsing of new template brackets style work
+        return source.replace('[[', '{{').replace(']]', '}}')
+
+    def get_custom_variable_texts(self, user):
+        """
+        Return the texts of the custom variables in the body, with a single query.
+
+        Variables like custom.name are the user's own variables, custom.name.public are the public ones.
+        """
+        if not self.custom_variables:
+            return ()
+
+        lookups = []
+        for custom_variable in self.custom_variables:
+            try:
+                # Try to split to see if it's a public variable
+                variable, public = custom_variable.split('.')
+            except ValueError:
+                # Not a public variable, so .split raises an error
+                variable, public = custom_variable, None
+
+            lookups.append((variable.lower(), bool(public)))
+
+        name_filter = Q()
+        for name in set(name for name, public in lookups):
+            name_filter |= Q(name__iexact=name)
+
+        texts = {}
+        for template_variable in TemplateVariable.objects.filter(name_filter).filter(
+            Q(is_public=True) | Q(owner=user)
+        ).order_by('pk'):
+            name = template_variable.name.lower()
+
+            if template_variable.is_public:
+                texts.setdefault((name, True), template_variable.text)
+            if template_variable.owner_id == user.pk:
+                texts.setdefault((name, False), template_variable.text)
+
+        return tuple(texts.get(lookup) for lookup in lookups)
+
+    def get_body(self, custom_variable_texts):
+        """
+        Return the compiled body with the texts of the custom variables filled in.
+        """
+        body = self.bodies.get(custom_variable_texts)
+
+        if body is None:
+            body_html = self.body_html
+
+            for custom_variable, text in zip(self.custom_variables, custom_variable_texts):
+                if text is not None:
+                    body_html = body_html.replace('[[ custom.%s ]]' % custom_variable, text, 1)
+
+            if len(self.bodies) >= self.MAX_COMPILED_BODIES:
+                self.bodies.clear()
+
+            body = self.bodies[custom_variable_texts] = Template(self.to_django_syntax(body_html))
+
+        return body
+
+    def render(self, lookups, user):
+        """
+        Render the template for one or more recipients.
+
+        Args:
+            lookups (list): dicts with the context of every recipient
+            user (instance): LilyUser of which the custom variables are used
+
+        Returns:
+            list of (body, subject) per recipient
+        """
+        body = self.get_body(self.get_custom_variable_texts(user))
+        html_parser = HTMLParser.HTMLParser()
+        rendered = []
+
+        for lookup in lookups:
+            context = Context(lookup)
+            # Make sure HTML entities are displayed correctly
+            rendered.append((body.render(context), html_parser.unescape(self.subject.render(context))))
+
+        return rendered
+
+
+def get_compiled_email_template(email_template):
+    """
+    Return the compiled email template, which is compiled again when the template has been modified.
+
+    Compiled templates can't be pickled, so they are cached per process.
+
+    Args:
+        email_template (instance): EmailTemplate instance, only its id and modified date are needed on a cache hit
+    """
+    with _COMPILED_EMAIL_TEMPLATES_LOCK:
+        modified, compiled = _COMPILED_EMAIL_TEMPLATES.get(email_template.pk, (None, None))
+
+    if compiled is None or modified != email_template.modified:
+        deferred_fields = email_template.get_deferred_fields() & {'subject', 'body_html'}
+        if deferred_fields:
+            email_template.refresh_from_db(fields=list(deferred_fields))
+
+        compiled = CompiledEmailTemplate(email_template)
+
+        with _COMPILED_EMAIL_TEMPLATES_LOCK:
+            if len(_COMPILED_EMAIL_TEMPLATES) >= settings.EMAIL_TEMPLATE_CACHE_SIZE:
+                _COMPILED_EMAIL_TEMPLATES.clear()
+            _COMPILED_EMAIL_TEMPLATES[email_template.pk] = (email_template.modified, compiled)
+
+    return compiled
+
+
+def get_email_template_lookups(user, contact_ids=None, account_id=None):
+    """
+    Return the context for rendering email templates for every contact, with the contacts, their accounts and the
+    relations used by the template parameters loaded in bulk.
+
+    Args:
+        user (instance): the LilyUser sending the email
+        contact_ids (list, optional): ids of the recipients
+        account_id (int, optional): id of the account to use for recipients without exactly one account
+
+    Returns:
+        list of dicts with the user, account and contact, a single one without a contact if there are no contact_ids
+    """
+    account = Account.objects.filter(pk=account_id).prefetch_related('phone_numbers').first() if account_id else None
+
+    if not contact_ids:
+        return [{'user': user, 'account': account} if account else {'user': user}]
+
+    contacts = {
+        contact.pk: contact for contact in Contact.objects.filter(pk__in=contact_ids).prefetch_related(
+            'phone_numbers',
+            'functions__account__phone_numbers',
+        )
+    }
+
+    lookups = []
+    for contact_id in contact_ids:
+        lookup = {'user': user}
+        contact = contacts.get(int(contact_id))
+
+        if contact:
+            lookup['contact'] = contact
+            functions = contact.functions.all()
+            if len(functions) == 1:
+                lookup['account'] = functions[0].account
+            elif account:
+                lookup['account'] = account
+        elif account:
+            lookup['account'] = account
+
+        lookups.append(lookup)
+
+    return lookups
 
 
 def get_attachment_filename_from_url(url):
     return unquote(url).split('/')[-1]
 
 
-def render_email_body(html, mapped_attachments, request):
+def urlsafe_b64decode_to_file(data, chunk_size=None):
     """
-    Update all the target attributes in the <a> tag.
-    After that replace the cid information in the html.
+    Decode url safe base64 data in chunks into a spooled temporary file.
+
+    Only small files are kept in memory, larger ones are written to disk while decoding. So there is no need for a
+    second, decoded, copy of the data in memory.
+
+    Args:
+        data (string): url safe base64 encoded data
+        chunk_size (int): number of encoded characters to decode at once
+
+    Returns:
+        file object positioned at the start of the decoded data
+    """
+    chunk_size = chunk_size or settings.EMAIL_ATTACHMENT_CHUNK_SIZE
+    # Only whole groups of 4 characters can be decoded separately.
+    chunk_size -= chunk_size % 4
+
+    decoded_file = tempfile.SpooledTemporaryFile(max_size=settings.EMAIL_ATTACHMENT_MAX_MEMORY_SIZE)
+
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size].encode('UTF-8')
+        # Padding might be left out at the end of the data.
+        chunk += '=' * (-len(chunk) % 4)
+        decoded_file.write(base64.urlsafe_b64decode(chunk))
+
+    decoded_file.seek(0)
+
+    return decoded_file
+
+
+def iter_storage_file(name, start=0, end=None, chunk_size=None):
+    """
+    Read a file from the storage in chunks, without loading the whole file in memory.
+
+    Args:
+        name (string): name of the file in the storage
+        start (int): first byte to read
+        end (int): last byte to read (inclusive), None to read until the end of the file
+        chunk_size (int): maximum number of bytes per chunk
+
+    Returns:
+        generator with the chunks of the file
+    """
+    chunk_size = chunk_size or settings.EMAIL_ATTACHMENT_CHUNK_SIZE
+    storage_file = default_storage._open(name)
+
+    if hasattr(storage_file, 'key'):
+        # Read directly from the S3 response instead of letting the storage file download the whole file first.
+        key = storage_file.key
+        headers = {}
+        if start or end is not None:
+            headers['Range'] = 'bytes=%s-%s' % (start, '' if end is None else end)
+
+        key.open_read(headers=headers)
+        try:
+            while True:
+                chunk = key.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            key.close()
+    else:
+        try:
+            storage_file.seek(start)
+            remaining = None if end is None else end - start + 1
+
+            while remaining is None or remaining > 0:
+                chunk = storage_file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            storage_file.close()
+
+
+def get_storage_file_content_type(name):
+    """
+    Return the content type of a file in the storage.
+    """
+    storage_file = default_storage._open(name)
+
+    if hasattr(storage_file, 'key'):
+        return storage_file.key.content_type
+    else:
+        storage_file.close()
+        return mimetypes.guess_type(storage_file.file.name)[0]
+
+
+def get_base_url(request):
+    """
+    Return the scheme and host of the request, e.g. https://app.hellolily.com.
+    """
+    protocol = 'http'
+    if request.is_secure():
+        protocol = 'https'
+
+    return '%s://%s' % (protocol, request.META['HTTP_HOST'])
+
+
+def remove_tag(tag):
+    tag.extract()
+
+
+def open_anchor_outside(tag):
+    """
+    Make the anchor open outside the iframe.
+    """
+    tag.attrs.update({
+        'target': '_blank',
+        'rel': 'noopener noreferrer',
+    })
+
+
+def rewrite_mailto(tag):
+    """
+    Replace mailto links with an url to compose new mail within Lily.
+    """
+    href = tag.get('href')
+    if href and href.startswith('mailto'):
+        tag['href'] = href.replace('mailto:', '/#/email/compose/')
+        tag['target'] = '_top'  # Break out of iframe.
+
+
+def inline_image_rewriter(mapped_attachments, base_url):
+    """
+    Return a rewriter which points the images with a cid source to the proxy view of their attachment.
 
     Args:
-        html (string): HTML string of the email body to be sent.
         mapped_attachments (list): List of linked attachments to the email.
-        request (instance): The Django request.
+        base_url (string): The scheme and host the proxy view is served on.
+    """
+    attachments = {}
+    for attachment in mapped_attachments or []:
+        # The cid is either stored with or without the surrounding angle brackets.
+        attachments.setdefault(attachment.cid, attachment)
+        attachments.setdefault(attachment.cid[1:-1], attachment)
+
+    cid_done = set()
+
+    def rewrite(tag):
+        src = tag.get('src')
+        if not src or not src.startswith('cid:'):
+            return
+
+        image_cid = src[4:]
+        attachment = attachments.get(image_cid)
+
+        if attachment and attachment.cid not in cid_done:
+            proxy_url = reverse('email_attachment_proxy_view', kwargs={'pk': attachment.pk})
+            tag['src'] = '%s%s' % (base_url, proxy_url)
+            tag['cid'] = image_cid
+            cid_done.add(attachment.cid)
+
+    return rewrite
+
+
+def transform_email_html(html, rewriters):
+    """
+    Parse the html once and apply all rewriters in a single walk over the tree.
+
+    Args:
+        html (string): HTML string of the email body.
+        rewriters (dict): Functions to apply to the tags, per tag name.
 
     Returns:
         html body (string)
@@ -245,21 +608,29 @@ def render_email_body(html, mapped_attachments, request):
     if html is None:
         return None
 
-    email_body = extract_script_tags(html)
-    email_body = replace_anchors_in_html(email_body)
-    email_body = replace_cid_in_html(email_body, mapped_attachments, request)
+    soup = create_a_beautiful_soup_object(html)
 
-    return email_body
+    if not soup:
+        return html
 
+    # find_all returns a list, so rewriters are free to remove tags.
+    for tag in soup.find_all(rewriters.keys()):
+        for rewriter in rewriters[tag.name]:
+            rewriter(tag)
 
-def replace_cid_in_html(html, mapped_attachments, request):
+    return soup.encode_contents()
+
+
+def render_email_body(html, mapped_attachments, request, open_links_outside=True):
     """
-    Replace all the cid image information with a link to the image
+    Remove the script tags, update all the target attributes in the <a> tag and replace the cid information in the
+    html, then sanitize the result.
 
     Args:
         html (string): HTML string of the email body to be sent.
         mapped_attachments (list): List of linked attachments to the email.
         request (instance): The Django request.
+        open_links_outside (boolean): Whether the anchors should open outside the iframe.
 
     Returns:
         html body (string)
@@ -267,43 +638,139 @@ def replace_cid_in_html(html, mapped_attachments, request):
     if html is None:
         return None
 
-    soup = create_a_beautiful_soup_object(html)
-    cid_done = []
-    inline_images = []
+    rewriters = {
+        'script': [remove_tag],
+        'img': [inline_image_rewriter(mapped_attachments, get_base_url(request))],
+    }
+    if open_links_outside:
+        rewriters['a'] = [open_anchor_outside, rewrite_mailto]
 
-    if soup and mapped_attachments:
-        inline_images = soup.findAll('img', {'src': lambda src: src and src.startswith('cid:')})
+    return sanitize_html_email(transform_email_html(html, rewriters))
 
-    if (not soup or soup.get_text() == '') and not inline_images:
-        html = sanitize_html_email(html)
+
+def render_email_message_body(email_message, mapped_attachments, request):
+    """
+    Return the rendered body of the email message, see render_email_body.
+
+    Rendered bodies are cached per message, body, attachment set and host, so large bodies are only parsed and
+    sanitized once.
+    """
+    if email_message.body_html is None:
+        return None
+
+    mapped_attachments = list(mapped_attachments)
+
+    if email_message.is_prerendered:
+        # The body is rendered when the message is stored, only the links to the inline images depend on the request.
+        return link_inline_images(email_message.rendered_body_html, mapped_attachments, request)
+
+    if not settings.EMAIL_BODY_CACHE_ENABLED:
+        return render_email_body(email_message.body_html, mapped_attachments, request)
+
+    digest = hashlib.md5(get_base_url(request))
+    digest.update(email_message.body_html.encode('utf-8'))
+    for attachment in mapped_attachments:
+        digest.update('%s:%s' % (attachment.pk, attachment.cid))
+
+    key = RENDERED_BODY_KEY % (email_message.pk, digest.hexdigest())
+    body_html = cache.get(key)
+
+    if body_html is None:
+        body_html = render_email_body(email_message.body_html, mapped_attachments, request)
+        cache.set(key, body_html, settings.EMAIL_BODY_CACHE_TIMEOUT)
+
+    return body_html
+
+
+def link_inline_images(html, mapped_attachments, request):
+    """
+    Point the images with a cid source to the proxy view of their attachment, in html rendered by
+    prerender_email_message. The html is sanitized already, so the sources are replaced without parsing it again.
+    """
+    base_url = get_base_url(request)
+    proxy_urls = {}
+
+    for attachment in mapped_attachments:
+        if attachment.cid:
+            proxy_url = reverse('email_attachment_proxy_view', kwargs={'pk': attachment.pk})
+
+            # The cid is either stored with or without the surrounding angle brackets.
+            proxy_urls.setdefault(attachment.cid, proxy_url)
+            proxy_urls.setdefault(attachment.cid[1:-1], proxy_url)
+
+    def link(match):
+        quote, escaped_cid = match.groups()
+        # The sanitizer escapes the attribute values (e.g. & as &amp;).
+        proxy_url = proxy_urls.get(HTMLParser.HTMLParser().unescape(escaped_cid))
+
+        if not proxy_url:
+            return match.group(0)
+
+        return 'cid=%s%s%s src="%s%s"' % (quote, escaped_cid, quote, base_url, proxy_url)
+
+    if not proxy_urls:
         return html
 
-    protocol = 'http'
-    if request.is_secure():
-        protocol = 'https'
-    host = request.META['HTTP_HOST']
+    return CID_SOURCE_RE.sub(link, html)
 
-    for image in inline_images:
-        image_cid = image.get('src')[4:]
 
-        for attachment in mapped_attachments:
-            if (attachment.cid[1:-1] == image_cid or attachment.cid == image_cid) and attachment.cid not in cid_done:
-                proxy_url = reverse('email_attachment_proxy_view', kwargs={'pk': attachment.pk})
-                image['src'] = '%s://%s%s' % (protocol, host, proxy_url)
-                image['cid'] = image_cid
-                cid_done.append(attachment.cid)
+def get_text_from_html(html):
+    """
+    Return the text of the html, with line breaks as new lines.
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    soup = convert_br_to_newline(soup)
+    return soup.get_text()
+
+
+def prerender_email_message(email_message):
+    """
+    Compute the versions of the body that are shown, quoted in replies and indexed for search.
 
-    html = soup.encode_contents()
-    html = sanitize_html_email(html)
+    The html is sanitized with links to the inline images left as cid urls, which link_inline_images replaces when the
+    message is shown. The message isn't saved.
+    """
+    if email_message.body_html:
+        email_message.rendered_body_html = sanitize_html_email(transform_email_html(email_message.body_html, {
+            'script': [remove_tag],
+            'a': [open_anchor_outside, rewrite_mailto],
+        }))
+    else:
+        email_message.rendered_body_html = ''
 
-    return html
+    email_message.reply_body_html = email_message.get_reply_body()
+    if email_message.body_text or not email_message.body_html:
+        email_message.search_body = email_message.body_text
+    else:
+        email_message.search_body = get_text_from_html(email_message.body_html)
+    email_message.body_version = EmailMessage.BODY_VERSION
+
+
+def replace_cid_in_html(html, mapped_attachments, request):
+    """
+    Replace all the cid image information with a link to the image
+
+    Args:
+        html (string): HTML string of the email body to be sent.
+        mapped_attachments (list): List of linked attachments to the email.
+        request (instance): The Django request.
+
+    Returns:
+        html body (string)
+    """
+    if html is None:
+        return None
+
+    html = transform_email_html(html, {'img': [inline_image_rewriter(mapped_attachments, get_base_url(request))]})
+
+    return sanitize_html_email(html)
 
 
 def replace_cid_and_change_headers(html, pk):
     """
     Check in the html source if there is an image tag with the attribute cid. Loop through the attachemnts that are
     linked with the email. If there is a match replace the source of the image with the cid information.
-    After read the image information form the disk and put the data in a dummy header.
+    Then put the image information and the name of its file in the storage in a dummy header.
     At least create a plain text version of the html email.
 
     Args:
@@ -339,17 +806,8 @@ def replace_cid_and_change_headers(html, pk):
                 if (file.cid[1:-1] == image_cid or file.cid == image_cid) and file.cid not in cid_done:
                     image['src'] = "cid:%s" % image_cid
 
-                    storage_file = default_storage._open(file.attachment.name)
                     filename = get_attachment_filename_from_url(file.attachment.name)
-
-                    if hasattr(storage_file, 'key'):
-                        content_type = storage_file.key.content_type
-                    else:
-                        content_type = mimetypes.guess_type(storage_file.file.name)[0]
-
-                    storage_file.open()
-                    content = storage_file.read()
-                    storage_file.close()
+                    content_type = get_storage_file_content_type(file.attachment.name)
 
                     response = {
                         'content-type': content_type,
@@ -358,7 +816,8 @@ def replace_cid_and_change_headers(html, pk):
                         'content-id': file.cid,
                         'x-attachment-id': image_cid,
                         'content-transfer-encoding': 'base64',
-                        'content': content
+                        # The image is streamed from the storage when the message is written, see StreamingMIMEMessage.
+                        'content-name': file.attachment.name,
                     }
 
                     dummy_headers.append(response)
@@ -410,36 +869,11 @@ def replace_anchors_in_html(html):
     """
     Make all anchors open outside the iframe.
     """
-    if html is None:
-        return None
-
-    soup = create_a_beautiful_soup_object(html)
-
-    if not soup or soup.get_text == '':
-        return html
-
-    for anchor in soup.findAll('a'):
-        anchor.attrs.update({
-            'target': '_blank',
-            'rel': 'noopener noreferrer',
-        })
-
-    return soup.encode_contents()
+    return transform_email_html(html, {'a': [open_anchor_outside]})
 
 
 def extract_script_tags(html):
-    if html is None:
-        return None
-
-    soup = create_a_beautiful_soup_object(html)
-
-    if not soup or soup.get_text == '':
-        return html
-
-    for item in soup.findAll('script'):
-        item.extract()
-
-    return soup.encode_contents()
+    return transform_email_html(html, {'script': [remove_tag]})
 
 
 def create_reply_body_header(email_message):
@@ -539,6 +973,17 @@ def reindex_email_message(instance):
         update_in_index(instance, mapping)
 
 
+def reindex_email_messages(email_message_ids, tenant_id):
+    """
+    Re-index the email messages with the given ids in bulk, e.g. after their labels were changed without signals.
+    """
+    if settings.ES_DISABLED:
+        return
+    mapping = ModelMappings.model_to_mappings.get(EmailMessage)
+    if mapping:
+        index_ids(mapping, email_message_ids, tenant_id)
+
+
 def fullpath(filename):
     return os.path.join(DATA_DIR, "{:%H%M%S%f}".format(datetime.now()) + '-' + filename)
 
@@ -552,33 +997,185 @@ def write_json_to_disk(path, data):
 def get_filtered_message(email_message, email_account, user):
     shared_config = email_account.sharedemailconfig_set.filter(user=user).first()
 
-    # If the email account or sharing is set to metadata only, just return these fields.
-    metadata_only_message = {
-        'id': email_message.id,
-        'sender': email_message.sender,
-        'received_by': email_message.received_by.all(),
-        'received_by_cc': email_message.received_by_cc.all(),
-        'sent_date': email_message.sent_date,
-        'account': email_message.account,
-    }
-
     if email_account.owner != user:
         if shared_config:
             privacy = shared_config.privacy
         else:
             privacy = email_account.privacy
 
-        if privacy == EmailAccount.METADATA:
-            return metadata_only_message
-        elif privacy == EmailAccount.PRIVATE:
-            # Sharing for this user is set to private, so don't return a message.
-            return None
-        else:
-            return email_message
+        return filter_message_by_privacy(email_message, privacy, email_account)
+
+    return email_message
+
+
+def filter_message_by_privacy(email_message, privacy, email_account):
+    """
+    Return the email message, only its metadata or None, depending on the given privacy.
+    """
+    if privacy == EmailAccount.METADATA:
+        # If the email account or sharing is set to metadata only, just return these fields.
+        metadata = {'account': email_account}
+
+        for field_name in EmailMessage.METADATA_FIELDS:
+            if field_name not in metadata:
+                value = getattr(email_message, field_name)
+
+                if EmailMessage._meta.get_field(field_name).many_to_many:
+                    value = value.all()
+
+                metadata[field_name] = value
+
+        return metadata
+    elif privacy == EmailAccount.PRIVATE:
+        # Sharing for this user is set to private, so don't return a message.
+        return None
 
     return email_message
 
 
+class EmailPrivacyResolver(object):
+    """
+    Resolve what a user is allowed to see of the email accounts of the tenant.
+
+    The email accounts and the user's shared email configs are loaded once, with one query each, after which every
+    privacy check is a dict lookup. Use one resolver per request.
+    """
+    def __init__(self, user):
+        self.user = user
+        self._email_accounts = None
+        self._shared_configs = None
+
+    @property
+    def email_accounts(self):
+        if self._email_accounts is None:
+            self._email_accounts = {
+                email_account.id: email_account for email_account in EmailAccount.objects.filter(
+                    tenant_id=self.user.tenant_id,
+                    is_deleted=False
+                )
+            }
+        return self._email_accounts
+
+    @property
+    def shared_configs(self):
+        if self._shared_configs is None:
+            self._shared_configs = {
+                shared_config.email_account_id: shared_config for shared_config in SharedEmailConfig.objects.filter(
+                    tenant_id=self.user.tenant_id,
+                    user=self.user
+                )
+            }
+        return self._shared_configs
+
+    def get_email_account(self, email_account_id):
+        return self.email_accounts.get(email_account_id)
+
+    def get_privacy(self, email_account_id):
+        """
+        Return the privacy the user has for the email account.
+
+        The owner of an email account can always see everything. For other users the privacy set on the
+        shared email config overrides the privacy of the email account.
+
+        Returns:
+            The privacy (one of EmailAccount.PRIVACY_CHOICES) or None if the email account doesn't exist (anymore).
+        """
+        email_account = self.get_email_account(email_account_id)
+
+        if not email_account:
+            return None
+
+        if email_account.owner_id == self.user.id:
+            return EmailAccount.PUBLIC
+
+        shared_config = self.shared_configs.get(email_account_id)
+        if shared_config:
+            return shared_config.privacy
+
+        return email_account.privacy
+
+    def filter_message(self, email_message):
+        """
+        Return the email message, only its metadata or None, like get_filtered_message.
+        """
+        privacy = self.get_privacy(email_message.account_id)
+
+        if privacy is None:
+            return None
+
+        return filter_message_by_privacy(email_message, privacy, self.get_email_account(email_message.account_id))
+
+    def filter_queryset(self, queryset):
+        """
+        Filter the email messages the user is allowed to see in the database, like filter_message.
+
+        The privacy per email account is resolved up front and compiled into the query, every message is annotated with
+        the privacy the user has for it.
+        """
+        account_ids = defaultdict(list)
+        for email_account_id in self.email_accounts:
+            privacy = self.get_privacy(email_account_id)
+
+            if privacy != EmailAccount.PRIVATE:
+                account_ids[privacy].append(email_account_id)
+
+        if not account_ids:
+            return queryset.none()
+
+        return queryset.filter(
+            account_id__in=[email_account_id for ids in account_ids.values() for email_account_id in ids]
+        ).annotate(
+            privacy=Case(
+                *[When(account_id__in=ids, then=Value(level)) for level, ids in account_ids.items()],
+                output_field=IntegerField()
+            )
+        )
+
+    def filter_hit(self, hit):
+        """
+        Return the search hit of an email message, only its metadata or None, depending on the privacy.
+        """
+        privacy = self.get_privacy(hit.get('account').get('id'))
+
+        if privacy is None or privacy == EmailAccount.PRIVATE:
+            return None
+
+        if privacy == EmailAccount.METADATA:
+            # If the email account or sharing is set to metadata only, just return these fields.
+            return {
+                'id': hit.get('id'),
+                'sender_name': hit.get('sender_name'),
+                'sender_email': hit.get('sender_email'),
+                'received_by_email': hit.get('received_by_email'),
+                'received_by_name': hit.get('received_by_name'),
+                'received_by_cc_email': hit.get('received_by_cc_email'),
+                'received_by_cc_name': hit.get('received_by_cc_name'),
+                'sent_date': hit.get('sent_date'),
+                'privacy': privacy,
+            }
+
+        return hit
+
+    def get_followed_email_accounts(self):
+        """
+        Return the email accounts the user follows: the user's own email accounts and the ones publicly shared
+        (with the user), except those the user has hidden.
+        """
+        followed_email_accounts = []
+
+        for email_account in self.email_accounts.values():
+            shared_config = self.shared_configs.get(email_account.id)
+
+            if shared_config and shared_config.is_hidden:
+                continue
+
+            if (email_account.owner_id == self.user.id or email_account.privacy == EmailAccount.PUBLIC or
+                    (shared_config and shared_config.privacy == EmailAccount.PUBLIC)):
+                followed_email_accounts.append(email_account)
+
+        return followed_email_accounts
+
+
 def convert_br_to_newline(soup, newline='\n'):
     """
     Replace html line breaks with spaces to prevent lines appended after one another.
@@ -1,8 +1,6 @@
 from itertools import chain
 import anyjson
-import HTMLParser
 import logging
-import mimetypes
 import re
 import urllib
 
@@ -13,11 +11,8 @@ from celery.states import FAILURE
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.files.storage import default_storage
-from django.core.servers.basehttp import FileWrapper
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404, HttpResponse
-from django.template import Context, Template
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404, HttpResponse, StreamingHttpResponse
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import UpdateView, DeleteView, CreateView, FormView
@@ -44,8 +39,9 @@ from .services import GmailService
 from .tasks import (send_message, create_draft_email_message, update_draft_email_message,
                     add_and_remove_labels_for_message, trash_email_message)
 from .utils import (get_attachment_filename_from_url, get_email_parameter_choices, create_recipients,
-                    render_email_body, replace_cid_in_html, create_reply_body_header, reindex_email_message,
-                    extract_script_tags)
+                    render_email_body, render_email_message_body, create_reply_body_header, reindex_email_message,
+                    get_storage_file_content_type, iter_storage_file, link_inline_images, get_compiled_email_template,
+                    get_email_template_lookups)
 
 
 logger = logging.getLogger(__name__)
@@ -173,10 +169,14 @@ class EmailMessageHTMLView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(EmailMessageHTMLView, self).get_context_data(**kwargs)
-        context['body_html'] = render_email_body(self.object.body_html, self.object.attachments.all(), self.request)
+        context['body_html'] = render_email_message_body(self.object, self.object.attachments.all(), self.request)
         return context
 
 
+class RangeNotSatisfiable(Exception):
+    pass
+
+
 class EmailAttachmentProxy(View):
     def get(self, request, *args, **kwargs):
         try:
@@ -187,24 +187,73 @@ class EmailAttachmentProxy(View):
         except:
             raise Http404()
 
-        s3_file = default_storage._open(attachment.attachment.name)
+        name = attachment.attachment.name
+        size = attachment.size
+        content_type = get_storage_file_content_type(name)
 
-        wrapper = FileWrapper(s3_file)
-        if hasattr(s3_file, 'key'):
-            content_type = s3_file.key.content_type
+        try:
+            byte_range = self.get_byte_range(size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                iter_storage_file(name, start, end),
+                content_type=content_type,
+                status=206
+            )
+            response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+            response['Content-Length'] = end - start + 1
         else:
-            content_type = mimetypes.guess_type(s3_file.file.name)[0]
-
-        response = HttpResponse(wrapper, content_type=content_type)
+            response = StreamingHttpResponse(iter_storage_file(name), content_type=content_type)
+            response['Content-Length'] = size
 
         inline = 'attachment'
         if attachment.inline:
             inline = 'inline'
 
-        response['Content-Disposition'] = '%s; filename=%s' % (inline, get_attachment_filename_from_url(s3_file.name))
-        response['Content-Length'] = attachment.size
+        response['Content-Disposition'] = '%s; filename=%s' % (inline, get_attachment_filename_from_url(name))
+        response['Accept-Ranges'] = 'bytes'
         return response
 
+    def get_byte_range(self, size):
+        """
+        Parse the Range header of the request, only a single byte range is supported.
+
+        Returns:
+            tuple with the first and last byte to serve or None to serve the whole file
+
+        Raises:
+            RangeNotSatisfiable: the range lies outside the file
+        """
+        match = re.match(r'^bytes=(\d*)-(\d*)$', self.request.META.get('HTTP_RANGE', '').strip())
+        if not match or not size or match.groups() == ('', ''):
+            # Invalid or unsupported ranges are ignored.
+            return None
+
+        start, end = match.groups()
+        if start:
+            start = int(start)
+            if end and int(end) < start:
+                return None
+
+            if start >= size:
+                raise RangeNotSatisfiable()
+
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            # Suffix range, serve the last bytes of the file.
+            if not int(end):
+                raise RangeNotSatisfiable()
+
+            start = max(size - int(end), 0)
+            end = size - 1
+
+        return start, end
+
 
 #
 # EmailMessage compose views (create/edit draft, reply, forward) incl. preview & send message.
@@ -234,9 +283,17 @@ class EmailMessageComposeView(LoginRequiredMixin, FormView):
 
                 attachments = EmailAttachment.objects.filter(message_id=self.object.pk)
 
-                # Strip malicious/unwanted content when replying.
-                self.object.body_html = extract_script_tags(self.object.body_html)
-                self.object.body_html = replace_cid_in_html(self.object.body_html, attachments, request)
+                if self.object.is_prerendered:
+                    # Sanitized when the message was stored, only the links to the inline images depend on the request.
+                    self.object.reply_body_html = link_inline_images(self.object.reply_body_html, attachments, request)
+
+                    if self.object.body_html:
+                        self.object.body_html = self.object.reply_body_html
+                else:
+                    # Strip malicious/unwanted content when replying.
+                    self.object.body_html = render_email_body(
+                        self.object.body_html, attachments, request, open_links_outside=False
+                    )
             except EmailMessage.DoesNotExist:
                 pass
 
@@ -942,33 +999,17 @@ class EmailTemplateGetDefaultView(LoginRequiredMixin, View):
 
 class DetailEmailTemplateView(LoginRequiredMixin, DetailView):
     def get(self, request, *args, **kwargs):
-        template = EmailTemplate.objects.get(pk=kwargs.get('template_id'))
-        lookup = {'user': self.request.user}
+        # The content is only loaded when the template has to be compiled.
+        template = EmailTemplate.objects.only('id', 'modified').get(pk=kwargs.get('template_id'))
         errors = {}
 
-        if 'account_id' in self.request.GET:
-            try:
-                account = Account.objects.get(pk=self.request.GET.get('account_id'))
-            except Account.DoesNotExist:
-                pass
-            else:
-                lookup.update({'account': account})
+        # Render for multiple recipients at once with contact_ids, a comma separated list.
+        contact_ids = [contact_id for contact_id in self.request.GET.get('contact_ids', '').split(',') if contact_id]
+        if not contact_ids and self.request.GET.get('contact_id'):
+            contact_ids = [self.request.GET.get('contact_id')]
 
-        if 'contact_id' in self.request.GET:
-            try:
-                contact = Contact.objects.get(pk=self.request.GET.get('contact_id'))
-            except Contact.DoesNotExist:
-                pass
-            else:
-                lookup.update({'contact': contact})
-                functions = contact.functions.all()
-                if len(functions) == 1:
-                    try:
-                        account = Account.objects.get(pk=functions[0].account_id)
-                    except Account.DoesNotExist:
-                        pass
-                    else:
-                        lookup.update({'account': account})
+        lookups = get_email_template_lookups(self.request.user, contact_ids, self.request.GET.get('account_id'))
+        lookup = lookups[0]
 
         if 'document_id' in self.request.GET:
             credentials = get_credentials('pandadoc')
@@ -1034,47 +1075,8 @@ class DetailEmailTemplateView(LoginRequiredMixin, DetailView):
             else:
                 lookup.get('user').current_email_address = emailaccount.email_address
 
-        # Setup regex to find custom variables
-        search_regex = '\[\[ custom\.(.*?) \]\]'
-        # Find all occurrences.
-        search_result = re.findall(search_regex, template.body_html)
-
-        if search_result:
-            for custom_variable in search_result:
-                public = None
-
-                try:
-                    # Try to split to see if it's a public variable
-                    variable, public = custom_variable.split('.')
-                except ValueError:
-                    # Not a public variable, so .split raises an error
-                    variable = custom_variable
-
-                if public:
-                    template_variable = TemplateVariable.objects.filter(
-                        name__iexact=variable,
-                        is_public=True
-                    )
-                else:
-                    template_variable = TemplateVariable.objects.filter(
-                        name__iexact=variable,
-                        owner=get_current_user()
-                    )
-
-                if template_variable:
-                    # find = '\[\[ custom.' + custom_variable + '(\s)?\]\]'
-                    find = re.compile('\[\[ custom\.' + custom_variable + ' \]\]')
-                    replace = template_variable.first().text
-
-                    template.body_html = re.sub(find, replace, template.body_html, 1)
-
-        # Ugly hack to make parsing of new template brackets style work
-        parsed_template = Template(template.body_html.replace('[[', '{{').replace(']]', '}}')).render(Context(lookup))
-        parsed_subject = Template(template.subject.replace('[[', '{{').replace(']]', '}}')).render(Context(lookup))
-
-        # Make sure HTML entities are displayed correctly
-        html_parser = HTMLParser.HTMLParser()
-        parsed_subject = html_parser.unescape(parsed_subject)
+        rendered = get_compiled_email_template(template).render(lookups, self.request.user)
+        parsed_template, parsed_subject = rendered[0]
 
         attachments = []
 
@@ -1087,12 +1089,21 @@ class DetailEmailTemplateView(LoginRequiredMixin, DetailView):
                 'name': name,
             })
 
-        return HttpResponse(anyjson.serialize({
+        response = {
             'template': parsed_template,
             'template_subject': parsed_subject,
             'attachments': attachments,
             'errors': errors,
-        }), content_type='application/json')
+        }
+
+        if len(contact_ids) > 1:
+            response['recipients'] = [{
+                'contact_id': contact_id,
+                'template': body,
+                'template_subject': subject,
+            } for contact_id, (body, subject) in zip(contact_ids, rendered)]
+
+        return HttpResponse(anyjson.serialize(response), content_type='application/json')
 
 
 class CreateUpdateTemplateVariableMixin(LoginRequiredMixin):
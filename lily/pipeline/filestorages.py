@@ -26,6 +26,38 @@ class MediaFilesStorage(S3BotoStorage):
         kwargs['querystring_expire'] = 300
         super(MediaFilesStorage, self).__init__(*args, **kwargs)
 
+    def _save_content(self, key, content, headers):
+        """
+        Upload large files in parts, streaming every part from the file instead of sending it in one request.
+        """
+        size = content.size
+        if size < settings.AWS_S3_MULTIPART_THRESHOLD:
+            return super(MediaFilesStorage, self)._save_content(key, content, headers)
+
+        upload = self.bucket.initiate_multipart_upload(
+            key.name,
+            headers=headers,
+            reduced_redundancy=self.reduced_redundancy,
+            encrypt_key=self.encryption,
+            policy=self.default_acl,
+        )
+
+        try:
+            part_number = 1
+            for offset in range(0, size, settings.AWS_S3_MULTIPART_CHUNK_SIZE):
+                content.seek(offset)
+                upload.upload_part_from_file(
+                    content,
+                    part_number,
+                    size=min(settings.AWS_S3_MULTIPART_CHUNK_SIZE, size - offset)
+                )
+                part_number += 1
+        except Exception:
+            upload.cancel_upload()
+            raise
+
+        upload.complete_upload()
+
 
 class StaticFilesStorage(CachedFilesMixin, S3BotoStorage):
     """
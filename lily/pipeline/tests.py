@@ -0,0 +1,65 @@
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import Mock, PropertyMock, patch
+from storages.backends.s3boto import S3BotoStorage
+
+from .filestorages import MediaFilesStorage
+
+
+@override_settings(AWS_S3_MULTIPART_THRESHOLD=10, AWS_S3_MULTIPART_CHUNK_SIZE=4)
+class MediaFilesStorageTests(TestCase):
+    def setUp(self):
+        self.bucket = Mock()
+        self.upload = self.bucket.initiate_multipart_upload.return_value
+        self.key = Mock()
+        self.key.name = 'email/attachments/1/large.pdf'
+
+        patcher = patch.object(MediaFilesStorage, 'bucket', new_callable=PropertyMock, return_value=self.bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.storage = MediaFilesStorage()
+
+    def test_small_file(self):
+        """
+        Test that files below the threshold are uploaded in one request.
+        """
+        content = ContentFile('123456789')
+
+        with patch.object(S3BotoStorage, '_save_content') as save_content:
+            self.storage._save_content(self.key, content, {})
+
+        save_content.assert_called_once_with(self.key, content, {})
+        self.assertFalse(self.bucket.initiate_multipart_upload.called)
+
+    def test_multipart_upload(self):
+        """
+        Test that large files are uploaded in parts of the chunk size.
+        """
+        content = ContentFile('0123456789')
+        parts = []
+
+        def upload_part_from_file(fp, part_number, size):
+            parts.append((part_number, fp.read(size)))
+
+        self.upload.upload_part_from_file.side_effect = upload_part_from_file
+
+        self.storage._save_content(self.key, content, {})
+
+        self.assertEqual(self.bucket.initiate_multipart_upload.call_args[0][0], self.key.name)
+        self.assertEqual(parts, [(1, '0123'), (2, '4567'), (3, '89')])
+        self.upload.complete_upload.assert_called_once_with()
+        self.assertFalse(self.upload.cancel_upload.called)
+
+    def test_multipart_upload_failed(self):
+        """
+        Test that a failed part cancels the upload.
+        """
+        self.upload.upload_part_from_file.side_effect = IOError()
+
+        with self.assertRaises(IOError):
+            self.storage._save_content(self.key, ContentFile('0123456789'), {})
+
+        self.upload.cancel_upload.assert_called_once_with()
+        self.assertFalse(self.upload.complete_upload.called)
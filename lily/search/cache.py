@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'search:generation:%s:%s'
+RESULT_KEY = 'search:result:%s:%s:%s:%s'
+STATS_HITS_KEY = 'search:stats:hits'
+STATS_MISSES_KEY = 'search:stats:misses'
+
+
+def incr(key):
+    """
+    Increment a counter in the cache, creating it if needed.
+
+    Returns:
+        The new value of the counter, or None if the cache backend doesn't support counters (e.g. the DummyCache).
+    """
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return None
+
+
+def get_generation(tenant_id, model_type):
+    """
+    Return the current generation of the search results of a (tenant, model type).
+    """
+    return cache.get(GENERATION_KEY % (tenant_id, model_type), 0)
+
+
+def bump_generation(tenant_id, model_type):
+    """
+    Invalidate all cached search results of a (tenant, model type).
+
+    Cache keys include the generation, so after a bump the old entries are never served again.
+    They just expire.
+    """
+    if not settings.SEARCH_CACHE_ENABLED:
+        return
+
+    incr(GENERATION_KEY % (tenant_id, model_type))
+
+
+def get_result_key(tenant_id, model_type, params):
+    """
+    Build the cache key for a search.
+
+    Args:
+        params (dict): everything that influences the result (query, filters, sort, pagination, return fields)
+    """
+    normalized = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.md5(normalized.encode('utf-8')).hexdigest()
+
+    return RESULT_KEY % (tenant_id, model_type, get_generation(tenant_id, model_type), digest)
+
+
+def get_cached_result(key):
+    result = cache.get(key)
+
+    if result is None:
+        incr(STATS_MISSES_KEY)
+    else:
+        incr(STATS_HITS_KEY)
+
+    return result
+
+
+def set_cached_result(key, result):
+    cache.set(key, result, settings.SEARCH_CACHE_TIMEOUT)
+
+
+def get_cache_stats():
+    """
+    Return the hit and miss counters of the search result cache.
+    """
+    hits = cache.get(STATS_HITS_KEY, 0)
+    misses = cache.get(STATS_MISSES_KEY, 0)
+    total = hits + misses
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': float(hits) / total if total else 0.0,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([STATS_HITS_KEY, STATS_MISSES_KEY])
@@ -1,6 +1,7 @@
 from lily.accounts.models import Account
 from lily.contacts.models import Contact
-from lily.utils.functions import parse_phone_number
+from lily.tenant.models import Tenant
+from lily.utils.functions import normalize_phone_number
 
 
 def search_number(tenant_id, number, return_related=True):
@@ -8,9 +9,14 @@ def search_number(tenant_id, number, return_related=True):
     If the phone number belongs to an account, this returns the first account and all its contacts
     Else if the number belongs to a contact, this returns the first contact and all its accounts
     """
-    phone_number = parse_phone_number(number)
-    accounts = Account.objects.filter(phone_numbers__number=phone_number, is_deleted=False)
-    contacts = Contact.objects.filter(phone_numbers__number=phone_number, is_deleted=False)
+    country = Tenant.objects.filter(pk=tenant_id).values_list('country', flat=True).first()
+    phone_number = normalize_phone_number(number, country)
+    accounts = Account.objects.filter(
+        tenant_id=tenant_id, phone_numbers__normalized__number=phone_number, is_deleted=False
+    )
+    contacts = Contact.objects.filter(
+        tenant_id=tenant_id, phone_numbers__normalized__number=phone_number, is_deleted=False
+    )
 
     accounts_result = []
     contacts_result = []
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from datetime import date
 import logging
 import traceback
@@ -6,8 +7,10 @@ from django.conf import settings
 from elasticsearch.exceptions import NotFoundError
 from elasticutils.contrib.django import tasks
 
+from lily.search.cache import bump_generation
 from lily.search.connections_utils import get_es_client, get_index_name
 from lily.utils import logutil
+from lily.utils.queues import RequestQueue, register
 
 
 logger = logging.getLogger('search')
@@ -15,16 +18,107 @@ main_index = settings.ES_INDEXES['default']
 es = get_es_client(maxsize=1)
 
 
+OP_INDEX = 'index'
+OP_DELETE = 'delete'
+
+
+class IndexQueue(RequestQueue):
+    """
+    Thread local, deduplicating queue of pending index operations.
+
+    Every entry is keyed on (mapping type name, id), so saving the same object multiple times during a request
+    results in just one operation. The last queued operation wins. Outside of requests and tasks operations are
+    processed right away, in process.
+    """
+    @property
+    def max_size(self):
+        # Prevent long running requests and tasks (imports, syncs) from building up an unbounded queue.
+        return settings.ES_INDEXING_QUEUE_MAX_SIZE
+
+    def reset(self):
+        self.items = OrderedDict()
+
+    def add(self, mapping, obj_id, op, tenant_id=None):
+        key = (mapping.get_mapping_type_name(), obj_id)
+        # Pop first, so the key moves to the end and the queue keeps the order of the latest operations.
+        self.items.pop(key, None)
+        self.items[key] = (op, tenant_id)
+
+        if not self.active:
+            self.process(self.drain(), mode='sync')
+        else:
+            self.flush_if_needed()
+
+    def drain(self):
+        """
+        Empty the queue and return the pending operations as a list of [mapping type name, id, op, tenant id].
+        """
+        items = [
+            [mapping_name, obj_id, op, tenant_id] for (mapping_name, obj_id), (op, tenant_id) in self.items.items()
+        ]
+        self.reset()
+        return items
+
+    def process(self, items, mode=None):
+        """
+        Process the operations, either in process or by handing them off to a Celery worker.
+
+        All exceptions are caught, so failures will not interfere with the regular model updates.
+        """
+        try:
+            process_index_items(items, mode)
+        except Exception, e:
+            logger.error(traceback.format_exc(e))
+
+
+index_queue = register(IndexQueue())
+
+
+def process_index_items(items, mode=None):
+    """
+    Process a list of index operations, either in process or by handing them off to Celery workers in batches.
+
+    Args:
+        items (list): lists of [mapping type name, id, op, tenant id]
+        mode (str): 'sync' to process the operations in process, defaults to ES_INDEXING_MODE
+    """
+    if not items or settings.ES_DISABLED:
+        return
+
+    if (mode or settings.ES_INDEXING_MODE) == 'celery':
+        # Import here to prevent circular imports.
+        from lily.search.tasks import process_index_queue
+
+        for i in range(0, len(items), settings.ES_INDEXING_BATCH_SIZE):
+            process_index_queue.apply_async(args=(items[i:i + settings.ES_INDEXING_BATCH_SIZE],))
+    else:
+        for i in range(0, len(items), settings.ES_INDEXING_BATCH_SIZE):
+            bulk_update_in_index(items[i:i + settings.ES_INDEXING_BATCH_SIZE])
+
+
+def index_ids(mapping, ids, tenant_id=None):
+    """
+    Index objects by id in bulk, e.g. objects created with bulk_create, which doesn't send any signals.
+    """
+    process_index_items([[mapping.get_mapping_type_name(), obj_id, OP_INDEX, tenant_id] for obj_id in ids])
+
+
 def update_in_index(instance, mapping):
     """
     Utility function for signal listeners index to Elasticsearch.
-    Currently uses synchronous tasks. And because of that all exceptions are
-    caught, so failures will not interfere with the regular model updates.
+
+    With the default 'sync' indexing mode the document is indexed directly and the index is refreshed. This is used in
+    tests, where results need to be searchable right away. Other modes only queue the operation, which is processed in
+    bulk when the queue is flushed (see IndexQueue).
+
+    All exceptions are caught, so failures will not interfere with the regular model updates.
     """
     if settings.ES_DISABLED:
         return
     if hasattr(instance, 'is_deleted') and instance.is_deleted:
         remove_from_index(instance, mapping)
+    elif settings.ES_INDEXING_MODE != 'sync':
+        index_queue.add(mapping, instance.pk, OP_INDEX, instance.tenant_id)
     else:
         logger.info(u'Updating instance %s: %s' % (instance.__class__.__name__, instance.pk))
 
@@ -39,6 +133,7 @@ def update_in_index(instance, mapping):
                 # Index object direct instead of bulk_index, to prevent multiple reads from db
                 mapping.index(document, id_=instance.id, es=es, index=main_index_with_type)
                 es.indices.refresh(main_index_with_type)
+                bump_generation(instance.tenant_id, mapping.get_mapping_type_name())
         except Exception, e:
             logger.error(traceback.format_exc(e))
 
@@ -46,37 +141,152 @@ def update_in_index(instance, mapping):
 def remove_from_index(instance, mapping):
     """
     Utility function for signal listeners to remove from Elasticsearch.
-    Currently uses synchronous tasks. And because of that all exceptions are
-    caught, so failures will not interfere with the regular model updates.
+
+    Like update_in_index, this is done synchronously with the 'sync' indexing mode and queued otherwise.
+    All exceptions are caught, so failures will not interfere with the regular model updates.
     """
     if settings.ES_DISABLED:
         return
+    if settings.ES_INDEXING_MODE != 'sync':
+        index_queue.add(mapping, instance.pk, OP_DELETE, instance.tenant_id)
+        return
+
     logger.info(u'Removing instance %s: %s' % (instance.__class__.__name__, instance.pk))
 
     try:
         main_index_with_type = get_index_name(main_index, mapping)
         tasks.unindex_objects(mapping, [instance.id], es=es, index=main_index_with_type)
         es.indices.refresh(main_index_with_type)
+        bump_generation(instance.tenant_id, mapping.get_mapping_type_name())
     except NotFoundError, e:
         logger.warn('Not found in index instance %s: %s' % (instance.__class__.__name__, instance.pk))
     except Exception, e:
         logger.error(traceback.format_exc(e))
 
 
-def index_objects(mapping, queryset, index, print_progress=False):
+def flush_index_queue(**kwargs):
+    """
+    Process the index operations queued in the current thread, without waiting for the request or task to finish.
+
+    Accepts **kwargs so it can be connected directly to signals.
+    """
+    index_queue.flush()
+
+
+def bulk_update_in_index(items):
+    """
+    Process a list of queued index operations with one bulk request per mapping.
+
+    The objects to index are fetched with one (batch optimized) query per mapping. Objects which no longer exist or
+    are marked as deleted are removed from the index instead. The index is only refreshed when search results are
+    cached, so the cached results can be invalidated once the changes are searchable. Otherwise Elasticsearch takes
+    care of that by itself within its refresh interval.
+
+    Args:
+        items (list): lists/tuples of (mapping type name, id, op, tenant id)
+    """
+    # Import here to prevent circular imports.
+    from lily.search.scan_search import ModelMappings
+
+    operations = OrderedDict()
+    tenants = set()
+    index_names = set()
+    for mapping_name, obj_id, op, tenant_id in items:
+        operations.setdefault(mapping_name, OrderedDict())[obj_id] = op
+        tenants.add((tenant_id, mapping_name))
+
+    for mapping_name, id_ops in operations.items():
+        mapping = ModelMappings.get_mapping_by_type_name(mapping_name)
+        if not mapping:
+            logger.warning('Unknown mapping type %s, skipping %s operations' % (mapping_name, len(id_ops)))
+            continue
+
+        index_name = get_index_name(main_index, mapping)
+        index_names.add(index_name)
+        index_ids = [obj_id for obj_id, op in id_ops.items() if op == OP_INDEX]
+        delete_ids = set(obj_id for obj_id, op in id_ops.items() if op == OP_DELETE)
+
+        try:
+            documents = []
+            if index_ids:
+                queryset = mapping.prepare_batch(mapping.get_model().objects.filter(pk__in=index_ids))
+                found_ids = set()
+                for instance in queryset:
+                    found_ids.add(instance.pk)
+                    if getattr(instance, 'is_deleted', False):
+                        delete_ids.add(instance.pk)
+                        continue
+                    try:
+                        documents.append(mapping.extract_document(instance.pk, instance))
+                    except Exception as exc:
+                        logger.exception('Unable to extract document {0}: {1}'.format(instance, repr(exc)))
+
+                # Objects deleted in the meantime should not linger in the index.
+                delete_ids.update(set(index_ids) - found_ids)
+
+            if documents:
+                logger.info(u'Bulk updating %s %s documents' % (len(documents), mapping_name))
+                mapping.bulk_index(documents, id_field='id', es=es, index=index_name)
+
+            if delete_ids:
+                logger.info(u'Bulk removing %s %s documents' % (len(delete_ids), mapping_name))
+                bulk_unindex(mapping, delete_ids, index_name)
+        except Exception, e:
+            logger.error(traceback.format_exc(e))
+
+    if not settings.SEARCH_CACHE_ENABLED or not index_names:
+        return
+
+    try:
+        # Results cached before the changes are searchable would be cached again under the new generation.
+        es.indices.refresh(','.join(sorted(index_names)))
+    except Exception, e:
+        logger.error(traceback.format_exc(e))
+
+    # Invalidate the cached search results of the changed types.
+    for tenant_id, mapping_name in tenants:
+        bump_generation(tenant_id, mapping_name)
+
+
+def bulk_unindex(mapping, ids, index):
+    """
+    Remove documents from the index with a single bulk request.
+
+    Documents which aren't in the index are ignored.
+    """
+    body = []
+    for obj_id in ids:
+        body.append({'delete': {'_index': index, '_type': mapping.get_mapping_type_name(), '_id': obj_id}})
+
+    es.bulk(body=body)
+
+
+def index_objects(mapping, queryset, index, print_progress=False, es_client=None, start_pk=0, checkpoint=None):
     """
     Index synchronously model specified mapping type with an optimized query.
+
+    Args:
+        es_client: the Elasticsearch client to use, defaults to the shared module client
+        start_pk (int): only index objects with a pk larger than this
+        checkpoint (callable): called with the pk of the last indexed object after every bulk request
     """
+    es_client = es_client or es
     documents = []
-    for instance in queryset_iterator(mapping, queryset, print_progress=print_progress):
+    last_pk = start_pk
+    for instance in queryset_iterator(mapping, queryset, print_progress=print_progress, start_pk=start_pk):
         documents.append(mapping.extract_document(instance.id, instance))
+        last_pk = instance.pk
 
         if len(documents) >= 100:
-            mapping.bulk_index(documents, id_field='id', index=get_index_name(index, mapping), es=es)
+            mapping.bulk_index(documents, id_field='id', index=get_index_name(index, mapping), es=es_client)
             documents = []
+            if checkpoint:
+                checkpoint(last_pk)
 
-    mapping.bulk_index(documents, id_field='id', index=get_index_name(index, mapping), es=es)
+    mapping.bulk_index(documents, id_field='id', index=get_index_name(index, mapping), es=es_client)
     documents = []
+    if checkpoint:
+        checkpoint(last_pk)
 
 
 def unindex_objects(mapping, queryset, index, print_progress=False):
@@ -93,7 +303,7 @@ def unindex_objects(mapping, queryset, index, print_progress=False):
             pass
 
 
-def queryset_iterator(mapping, queryset, chunksize=100, print_progress=False):
+def queryset_iterator(mapping, queryset, chunksize=100, print_progress=False, start_pk=0):
     """
     Returns an iterator that chops the queryset into chunks.
 
@@ -105,9 +315,9 @@ def queryset_iterator(mapping, queryset, chunksize=100, print_progress=False):
 
     queryset = mapping.prepare_batch(queryset)
 
-    pk = 0
+    pk = start_pk
     progress = 0
-    end = queryset.count()
+    end = queryset.filter(pk__gt=pk).count()
     queryset = queryset.order_by('pk')
     while True:
         subset = queryset.filter(pk__gt=pk)[:chunksize]
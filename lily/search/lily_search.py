@@ -1,13 +1,15 @@
 import logging
+from itertools import islice
 
 from django.conf import settings
-from django.db.models.query_utils import Q
 from elasticsearch.exceptions import RequestError
+from elasticsearch.helpers import scan
 from elasticutils import S
 
 from lily.accounts.models import Account
 from lily.contacts.models import Contact
-from lily.messaging.email.models.models import EmailAccount, SharedEmailConfig
+from lily.messaging.email.utils import EmailPrivacyResolver
+from lily.search.cache import get_cached_result, get_result_key, set_cached_result
 from lily.search.connections_utils import get_es_client_kwargs, get_index_name
 
 
@@ -21,16 +23,17 @@ class LilySearch(object):
     Search API for Elastic search backend.
     """
 
-    def __init__(self, tenant_id, model_type=None, sort=None, page=0, size=10, facet=None):
+    def __init__(self, tenant_id, model_type=None, sort=None, page=0, size=10, facet=None, use_cache=True):
         """
         Setup of search.
 
         Arguments:
             tenant_id (int): ID of the tenant
             model_type (string): limit the search to a model
-            sort (string): sort option for results
+            sort (string/list): sort option(s) for results
             page (int): page number of pagination
             size (int): max number of returned results
+            use_cache (boolean): use the search result cache (if enabled in the settings)
         """
         search_request = S().es(**get_es_client_kwargs()).indexes(settings.ES_INDEXES['default'])
         self.search = search_request.all()
@@ -46,17 +49,33 @@ class LilySearch(object):
         # Set the facet.
         self.facet = facet
 
+        # Keep track of everything that determines the results, to be able to cache them.
+        self.use_cache = use_cache
+        self.raw_query = None
+        self.sort = sort
+
         # Filter on model type.
         self.model_type = model_type
 
         # Add sorting.
         if sort:
-            self.search = self.search.order_by(sort)
+            if isinstance(sort, (list, tuple)):
+                self.search = self.search.order_by(*sort)
+            else:
+                self.search = self.search.order_by(sort)
+
+        self.paginate(page, size)
 
-        # Pagination.
-        from_hits = page * size
-        to_hits = (page + 1) * size
-        self.search = self.search[from_hits:to_hits]
+    def paginate(self, page, size):
+        """
+        Set the page of results to return.
+
+        Arguments:
+            page (int): page number of pagination, starting at 0
+            size (int): max number of returned results
+        """
+        self.page = page
+        self.size = size
 
     def do_search(self, return_fields=None):
         """
@@ -67,20 +86,127 @@ class LilySearch(object):
 
         Returns:
             hits (list): dicts with search results per item
+            facets (list): facet terms, if a facet was set
             count (int): total number of results
             took (int): milliseconds Elastic search took to get the results
         """
         if settings.ES_DISABLED:
-            return [], 0, 0
-        self.search = self.search.filter_raw({'and': self.raw_filters})
+            return [], None, 0, 0
+
+        cache_key = None
+        if settings.SEARCH_CACHE_ENABLED and self.use_cache and self.model_type:
+            # Results are only cached per model type, because that's the level on which they are invalidated.
+            cache_key = get_result_key(self.tenant_id, self.model_type, {
+                'query': self.raw_query,
+                'filters': self.raw_filters,
+                'facet': self.facet,
+                'sort': self.sort,
+                'page': self.page,
+                'size': self.size,
+                'return_fields': sorted(return_fields) if return_fields else None,
+            })
+            result = get_cached_result(cache_key)
+            if result is not None:
+                return result
+
+        try:
+            result = self._execute(return_fields)
+        except RequestError as e:
+            # This can happen when the query is malformed. For example:
+            # A user entering special characters. This should normally be taken
+            # care of where the request is built (usually in Javascript),
+            # by escaping or omitting special characters.
+            # This may be hard to get fool proof, therefore we also
+            # catch the exception here to prevent server errors.
+            logger.error('request error %s' % e)
+            return [], None, 0, 0
+
+        if cache_key:
+            set_cached_result(cache_key, result)
+
+        return result
+
+    def get_all_ids(self, limit=None):
+        """
+        Return the ids of all results, regardless of the page.
+
+        The results are retrieved with a scroll cursor, so this is not limited by pagination.
+        Results aren't sorted or cached.
+
+        Arguments:
+            limit (int): max number of ids to return, more results are left out (and logged)
+        """
+        ids = [int(hit['_id']) for hit in islice(self._scan(fields=[]), limit + 1 if limit else None)]
+
+        if limit and len(ids) > limit:
+            logger.warning('search for %s has more than %s results, the rest is left out' % (self.model_type, limit))
+            ids = ids[:limit]
+
+        return ids
+
+    def iterate(self):
+        """
+        Yield all results as documents, regardless of the page.
+
+        Like get_all_ids this uses a scroll cursor, so only one batch of results is held in memory at a time.
+        Results aren't sorted or cached.
+        """
+        for hit in self._scan():
+            document = hit.get('_source', {})
+            document.setdefault('id', int(hit['_id']))
+            yield document
+
+    def _scan(self, **kwargs):
+        """
+        Yield the raw hits of all results with a scroll cursor.
+        """
+        if settings.ES_DISABLED:
+            return
+
+        search = self._prepare(paginate=False)
+        body = search.build_search()
+        for key in ('from', 'size', 'sort'):
+            body.pop(key, None)
+
+        try:
+            for hit in scan(
+                search.get_es(),
+                query=body,
+                index=search.get_indexes(),
+                doc_type=search.get_doctypes(),
+                **kwargs
+            ):
+                yield hit
+        except RequestError as e:
+            # Malformed queries, see do_search.
+            logger.error('request error %s' % e)
+
+    def _prepare(self, paginate=True):
+        """
+        Return the search with the filters, types, indexes and pagination applied.
+        """
+        search = self.search.filter_raw({'and': self.raw_filters})
+
+        if paginate:
+            from_hits = self.page * self.size
+            to_hits = (self.page + 1) * self.size
+            search = search[from_hits:to_hits]
 
         if self.model_type:
-            self.search = self.search.doctypes(self.model_type)
+            search = search.doctypes(self.model_type)
             # Also limit the search to just the index with the right type.
             # This is faster than asking every index, also prevents some
             # annoying "cannot find field" errors in the elasticsearch logs.
             index_name = get_index_name(main_index, self.model_type)
-            self.search = self.search.indexes(index_name)
+            search = search.indexes(index_name)
+
+        return search
+
+    def _execute(self, return_fields):
+        """
+        Execute the search on Elasticsearch.
+        """
+        search = self._prepare()
 
         if self.facet:
             facet_raw = {
@@ -114,54 +240,44 @@ class LilySearch(object):
 
             facet_raw['facet_filter'] = facet_filter_dict
 
-            self.search = self.search.facet_raw(items=facet_raw)
+            search = search.facet_raw(items=facet_raw)
 
         # Fire off search.
-        try:
-            hits = []
-            execute = self.search.execute()
-            for result in execute:
-                hit = {
-                    'id': result.id,
-                }
-                if not self.model_type:
-                    # We will add type if not specifically searched on it.
-                    hit['type'] = result.es_meta.type
-                for field in result:
-                    # Add specified fields, or all fields when not specified.
-                    if return_fields:
-                        if field in return_fields:
-                            hit[field] = result[field]
-                    else:
+        hits = []
+        execute = search.execute()
+        for result in execute:
+            hit = {
+                'id': result.id,
+            }
+            if not self.model_type:
+                # We will add type if not specifically searched on it.
+                hit['type'] = result.es_meta.type
+            for field in result:
+                # Add specified fields, or all fields when not specified.
+                if return_fields:
+                    if field in return_fields:
                         hit[field] = result[field]
-                hits.append(hit)
+                else:
+                    hit[field] = result[field]
+            hits.append(hit)
 
-            if execute.facets:
-                facets = execute.facets['items']['terms']
+        if execute.facets:
+            facets = execute.facets['items']['terms']
 
-                if self.model_type == 'tags_tag':
-                    for hit in hits:
-                        # Get the object with the given name.
-                        facet = next((x for x in facets if x.get('term') == hit.get('name_flat')), None)
+            if self.model_type == 'tags_tag':
+                for hit in hits:
+                    # Get the object with the given name.
+                    facet = next((x for x in facets if x.get('term') == hit.get('name_flat')), None)
 
-                        if facet and (not facet.get('last_used') or hit.get('last_used') > facet.get('last_used')):
-                            # Set the latest usage date.
-                            facet.update({
-                                'last_used': hit.get('last_used')
-                            })
+                    if facet and (not facet.get('last_used') or hit.get('last_used') > facet.get('last_used')):
+                        # Set the latest usage date.
+                        facet.update({
+                            'last_used': hit.get('last_used')
+                        })
 
-                return hits, facets, execute.count, execute.took
+            return hits, facets, execute.count, execute.took
 
-            return hits, None, execute.count, execute.took
-        except RequestError as e:
-            # This can happen when the query is malformed. For example:
-            # A user entering special characters. This should normally be taken
-            # care of where the request is built (usually in Javascript),
-            # by escaping or omitting special characters.
-            # This may be hard to get fool proof, therefore we also
-            # catch the exception here to prevent server errors.
-            logger.error('request error %s' % e)
-            return [], None, 0, 0
+        return hits, None, execute.count, execute.took
 
     def query_common_fields(self, query):
         """
@@ -220,6 +336,7 @@ class LilySearch(object):
                     ],
                 },
             }
+            self.raw_query = raw_query
             self.search = self.search.query_raw(raw_query)
 
     def filter_query(self, filterquery):
@@ -286,31 +403,20 @@ class LilySearch(object):
         filterquery = 'sender_email:(%s) OR received_by_email:(%s) OR received_by_cc_email:(%s)' % (join, join, join)
         self.filter_query(filterquery)
 
-    def user_email_related(self, user):
+    def user_email_related(self, user, privacy_resolver=None):
         """
         Search emails that the user is allowed to see.
 
         Args:
             user (User): The user to use with the search
+            privacy_resolver (EmailPrivacyResolver): optional resolver to reuse within a request
         """
-        # Get a list of email accounts which are publicly shared or shared specifically with me.
-        shared_email_account_list = EmailAccount.objects.filter(
-            Q(owner=user) |
-            Q(privacy=EmailAccount.PUBLIC) |
-            (Q(sharedemailconfig__user__id=user.pk) & Q(sharedemailconfig__privacy=EmailAccount.PUBLIC))
-        ).filter(is_deleted=False).distinct('id')
-
-        # Get a list of email accounts we don't want to follow.
-        email_account_exclude_list = SharedEmailConfig.objects.filter(
-            user=user,
-            is_hidden=True
-        ).values_list('email_account_id', flat=True)
-
-        # Exclude those email accounts from the accounts that are shared with me.
-        # So it's a list of email accounts I want to follow.
-        follow_email_account_list = shared_email_account_list.exclude(
-            id__in=email_account_exclude_list
-        )
+        if not privacy_resolver:
+            privacy_resolver = EmailPrivacyResolver(user)
+
+        # Get a list of email accounts which are publicly shared or shared specifically with me,
+        # without the ones I don't want to follow.
+        follow_email_account_list = privacy_resolver.get_followed_email_accounts()
 
         if not follow_email_account_list:
             # Disable results if no email at all for account.
@@ -321,7 +427,8 @@ class LilySearch(object):
             })
             return
 
-        email_accounts = set(['%s' % email.email_address for email in follow_email_account_list])
+        # Sort, so the filter (and with that the cache key) is the same for every request.
+        email_accounts = sorted(set(['%s' % email.email_address for email in follow_email_account_list]))
         join = ' OR '.join(email_accounts)
         filterquery = 'account.email:(%s)' % join
         self.filter_query(filterquery)
@@ -33,3 +33,13 @@ class ModelMappings(object):
                         cls.app_to_mappings[app] = member
             except Exception:
                 pass
+
+    @classmethod
+    def get_mapping_by_type_name(cls, mapping_type_name):
+        """
+        Return the mapping for the given mapping type name (e.g. 'contacts_contact'), or None if it's unknown.
+        """
+        for mapping in cls.mappings:
+            if mapping.get_mapping_type_name() == mapping_type_name:
+                return mapping
+        return None
@@ -0,0 +1,20 @@
+import logging
+
+from celery.task import task
+
+from lily.search.indexing import bulk_update_in_index
+
+
+logger = logging.getLogger(__name__)
+
+
+@task(name='process_index_queue', logger=logger, acks_late=True)
+def process_index_queue(items):
+    """
+    Process a batch of queued index operations.
+
+    Args:
+        items (list): lists of [mapping type name, id, op, tenant id]
+    """
+    logger.debug('Processing %s queued index operations', len(items))
+    bulk_update_in_index(items)
@@ -0,0 +1,93 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import Mock, call, patch
+
+from lily.search import indexing
+from lily.search.cache import bump_generation, get_cache_stats, get_result_key
+from lily.search.lily_search import LilySearch
+
+
+@override_settings(
+    SEARCH_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_result_key(self):
+        """
+        Test that searches with the same parameters share a key, regardless of their order.
+        """
+        key = get_result_key(1, 'accounts_account', {'query': 'name:test', 'page': 0, 'size': 10})
+
+        self.assertEqual(key, get_result_key(1, 'accounts_account', {'size': 10, 'page': 0, 'query': 'name:test'}))
+        self.assertNotEqual(key, get_result_key(1, 'accounts_account', {'query': 'name:test', 'page': 1, 'size': 10}))
+        self.assertNotEqual(key, get_result_key(2, 'accounts_account', {'query': 'name:test', 'page': 0, 'size': 10}))
+        self.assertNotEqual(key, get_result_key(1, 'contacts_contact', {'query': 'name:test', 'page': 0, 'size': 10}))
+
+    def test_bump_generation(self):
+        """
+        Test that bumping the generation only invalidates the results of the (tenant, model type).
+        """
+        params = {'query': 'name:test'}
+        key = get_result_key(1, 'accounts_account', params)
+        other_keys = [get_result_key(2, 'accounts_account', params), get_result_key(1, 'contacts_contact', params)]
+
+        bump_generation(1, 'accounts_account')
+
+        self.assertNotEqual(get_result_key(1, 'accounts_account', params), key)
+        self.assertEqual(
+            [get_result_key(2, 'accounts_account', params), get_result_key(1, 'contacts_contact', params)],
+            other_keys
+        )
+
+    @override_settings(ES_DISABLED=False)
+    def test_bump_after_refresh(self):
+        """
+        Test that bulk index updates invalidate the cached results once the changes are searchable.
+        """
+        calls = Mock()
+
+        with patch.object(indexing, 'es', calls.es), patch.object(indexing, 'bulk_unindex', calls.bulk_unindex), \
+                patch.object(indexing, 'bump_generation', calls.bump_generation):
+            indexing.bulk_update_in_index([['accounts_account', 0, indexing.OP_DELETE, 1]])
+
+        self.assertEqual([name for name, args, kwargs in calls.mock_calls],
+                         ['bulk_unindex', 'es.indices.refresh', 'bump_generation'])
+        self.assertEqual(calls.bump_generation.call_args, call(1, 'accounts_account'))
+
+    @override_settings(ES_DISABLED=False)
+    @patch.object(LilySearch, '_execute', return_value=([{'id': 1}], None, 1, 1))
+    def test_cached_search(self, execute):
+        """
+        Test that a search is only executed again after an update of the index.
+        """
+        for i in range(2):
+            search = LilySearch(tenant_id=1, model_type='accounts_account')
+            self.assertEqual(search.do_search(['id']), ([{'id': 1}], None, 1, 1))
+
+        self.assertEqual(execute.call_count, 1)
+        self.assertEqual(get_cache_stats()['hits'], 1)
+
+        bump_generation(1, 'accounts_account')
+        LilySearch(tenant_id=1, model_type='accounts_account').do_search(['id'])
+
+        self.assertEqual(execute.call_count, 2)
+
+    @override_settings(ES_DISABLED=False, SEARCH_CACHE_ENABLED=False)
+    @patch.object(LilySearch, '_execute', return_value=([{'id': 1}], None, 1, 1))
+    def test_disabled(self, execute):
+        """
+        Test that nothing is cached or invalidated when the cache is disabled.
+        """
+        for i in range(2):
+            LilySearch(tenant_id=1, model_type='accounts_account').do_search(['id'])
+
+        self.assertEqual(execute.call_count, 2)
+        self.assertEqual(get_cache_stats()['hits'] + get_cache_stats()['misses'], 0)
+
+        key = get_result_key(1, 'accounts_account', {})
+        bump_generation(1, 'accounts_account')
+        self.assertEqual(get_result_key(1, 'accounts_account', {}), key)
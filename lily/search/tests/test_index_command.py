@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import tempfile
+from Queue import Queue
+from StringIO import StringIO
+
+from django.test import SimpleTestCase
+from mock import Mock, patch
+
+from lily.management.commands import index
+from lily.management.commands.index import Command
+
+
+class FakePool(object):
+    """
+    Stand in for multiprocessing.Pool, which records the shards instead of indexing them in worker processes.
+    """
+    shards = None
+
+    def __init__(self, processes, initializer=None, initargs=()):
+        pass
+
+    def map_async(self, func, shards, chunksize=None):
+        FakePool.shards = shards
+        return Mock(ready=Mock(return_value=True), get=Mock(return_value=[
+            (shard['mapping'], shard['number']) for shard in shards
+        ]))
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class IndexCommandTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+        self.mapping = Mock()
+        self.mapping.get_mapping_type_name.return_value = 'accounts_account'
+
+        self.command = Command(stdout=StringIO())
+        self.command.workers = 3
+        self.command.target_list = [self.mapping]
+        self.command.checkpoint_file = os.path.join(self.temp_dir, 'index_checkpoint.json')
+
+    def get_shards(self, min_pk, max_pk):
+        queryset = Mock()
+        queryset.aggregate.return_value = {'min_pk': min_pk, 'max_pk': max_pk}
+
+        with patch.object(index, 'get_indexable_objects', return_value=queryset):
+            return self.command.get_shards(self.mapping, 'index_1')
+
+    def test_get_shards(self):
+        """
+        Test that the shards cover the whole pk range without overlap, with a shard per worker.
+        """
+        shards = self.get_shards(1, 10)
+
+        self.assertEqual([(shard['start_pk'], shard['end_pk']) for shard in shards], [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual([shard['number'] for shard in shards], [0, 1, 2])
+        for shard in shards:
+            self.assertEqual(shard['last_pk'], shard['start_pk'])
+            self.assertFalse(shard['done'])
+
+    def test_get_shards_small_range(self):
+        """
+        Test that there are no empty shards when there are less objects than workers.
+        """
+        self.assertEqual([(shard['start_pk'], shard['end_pk']) for shard in self.get_shards(5, 6)], [(4, 5), (5, 6)])
+        self.assertEqual(self.get_shards(None, None), [])
+
+    def test_checkpoint(self):
+        """
+        Test that the progress of the workers is saved and only the targeted mappings are loaded again.
+        """
+        checkpoint = {
+            'accounts_account': {'temp_index_base': 'index_1', 'shards': self.get_shards(1, 10)},
+            'contacts_contact': {'temp_index_base': 'index_1', 'shards': []},
+        }
+        checkpoints = Queue()
+        checkpoints.put(('accounts_account', 1, 5))
+        checkpoints.put(('accounts_account', 1, 4))
+
+        self.command.process_checkpoints(checkpoint, checkpoints)
+
+        self.assertFalse(os.path.exists('%s.tmp' % self.command.checkpoint_file))
+        loaded = self.command.load_checkpoint()
+        self.assertEqual(loaded.keys(), ['accounts_account'])
+        # Progress never moves back.
+        self.assertEqual([shard['last_pk'] for shard in loaded['accounts_account']['shards']], [0, 5, 6])
+
+    @patch.object(index, 'index_objects')
+    @patch.object(index.ModelMappings, 'get_mapping_by_type_name')
+    @patch.object(index, 'get_indexable_objects')
+    def test_index_shard(self, get_indexable_objects, get_mapping_by_type_name, index_objects):
+        """
+        Test that a shard continues after the last checkpoint and reports its progress.
+        """
+        shard = self.get_shards(1, 10)[1]
+        shard['last_pk'] = 5
+        checkpoints = Queue()
+
+        with patch.object(index, 'worker_checkpoints', checkpoints):
+            self.assertEqual(index.index_shard(shard), ('accounts_account', 1))
+            index_objects.call_args[1]['checkpoint'](6)
+
+        self.assertEqual(index_objects.call_args[1]['start_pk'], 5)
+        get_indexable_objects.return_value.filter.assert_called_once_with(pk__lte=6)
+        self.assertEqual(checkpoints.get(), ('accounts_account', 1, 6))
+
+    @patch.object(index, 'connection', Mock())
+    @patch.object(index.multiprocessing, 'Pool', FakePool)
+    def test_resume(self):
+        """
+        Test that a resumed run only indexes the unfinished shards, into the index of the interrupted run.
+        """
+        shards = self.get_shards(1, 10)
+        shards[0]['done'] = True
+        shards[1]['last_pk'] = 5
+        self.command.save_checkpoint({'accounts_account': {'temp_index_base': 'index_1', 'shards': shards}})
+
+        self.command.resume = True
+        self.command.es = Mock()
+        self.command.es.indices.get_aliases.return_value = {}
+        self.command.create_index = Mock()
+        self.command.switch_aliases = Mock()
+
+        self.command.index_parallel()
+
+        self.assertEqual([(shard['number'], shard['last_pk']) for shard in FakePool.shards], [(1, 5), (2, 6)])
+        self.assertFalse(self.command.create_index.called)
+        self.command.switch_aliases.assert_called_once_with(self.mapping, None, 'index_1')
+        # The checkpoint file is removed once the run is finished.
+        self.assertFalse(os.path.exists(self.command.checkpoint_file))
+
+    def test_interrupted_checkpoint(self):
+        """
+        Test that an interrupted save leaves the previous checkpoint intact.
+        """
+        self.command.save_checkpoint({'accounts_account': {'temp_index_base': 'index_1', 'shards': []}})
+
+        with patch.object(index.json, 'dump', side_effect=KeyboardInterrupt()):
+            with self.assertRaises(KeyboardInterrupt):
+                self.command.save_checkpoint({})
+
+        with open(self.command.checkpoint_file) as checkpoint_file:
+            self.assertIn('accounts_account', json.load(checkpoint_file))
@@ -0,0 +1,98 @@
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from mock import Mock, patch
+
+from lily.search import indexing
+
+
+@override_settings(
+    ES_DISABLED=False,
+    ES_INDEXING_MODE='queue',
+    ES_INDEXING_QUEUE_MAX_SIZE=10,
+    ES_INDEXING_BATCH_SIZE=2
+)
+@patch('lily.search.tasks.process_index_queue.apply_async')
+@patch.object(indexing, 'bulk_update_in_index')
+class IndexQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.mapping = Mock()
+        self.mapping.get_mapping_type_name.return_value = 'accounts_account'
+        self.queue = indexing.IndexQueue()
+
+    def test_queue(self, bulk_update_in_index, apply_async):
+        """
+        Test that operations are deduplicated and processed in process at the end of the request or task.
+        """
+        self.queue.start()
+        self.queue.add(self.mapping, 1, indexing.OP_INDEX, 1)
+        self.queue.add(self.mapping, 2, indexing.OP_INDEX, 1)
+        self.queue.add(self.mapping, 1, indexing.OP_DELETE, 1)
+        self.assertFalse(bulk_update_in_index.called)
+
+        self.queue.finish()
+
+        bulk_update_in_index.assert_called_once_with([
+            ['accounts_account', 2, indexing.OP_INDEX, 1],
+            ['accounts_account', 1, indexing.OP_DELETE, 1],
+        ])
+        self.assertFalse(apply_async.called)
+
+    @override_settings(ES_INDEXING_MODE='celery')
+    def test_celery(self, bulk_update_in_index, apply_async):
+        """
+        Test that operations are handed off to tasks in batches.
+        """
+        self.queue.start()
+        for obj_id in range(3):
+            self.queue.add(self.mapping, obj_id, indexing.OP_INDEX, 1)
+        self.queue.finish()
+
+        self.assertEqual([call[1]['args'][0] for call in apply_async.call_args_list], [
+            [['accounts_account', 0, indexing.OP_INDEX, 1], ['accounts_account', 1, indexing.OP_INDEX, 1]],
+            [['accounts_account', 2, indexing.OP_INDEX, 1]],
+        ])
+        self.assertFalse(bulk_update_in_index.called)
+
+    def test_nested(self, bulk_update_in_index, apply_async):
+        """
+        Test that the queue is only flushed at the end of the outermost request or task, or when it's full.
+        """
+        self.queue.start()
+        self.queue.start()
+        self.queue.add(self.mapping, 1, indexing.OP_INDEX, 1)
+        self.queue.finish()
+        self.assertFalse(bulk_update_in_index.called)
+
+        for obj_id in range(2, 11):
+            self.queue.add(self.mapping, obj_id, indexing.OP_INDEX, 1)
+        self.assertEqual(bulk_update_in_index.call_count, 5)
+        self.assertFalse(self.queue.items)
+
+        self.queue.finish()
+        self.assertEqual(bulk_update_in_index.call_count, 5)
+
+    @override_settings(ES_INDEXING_MODE='celery')
+    def test_outside_request(self, bulk_update_in_index, apply_async):
+        """
+        Test that operations outside of requests and tasks (e.g. management commands) are processed right away.
+        """
+        self.queue.add(self.mapping, 1, indexing.OP_INDEX, 1)
+
+        bulk_update_in_index.assert_called_once_with([['accounts_account', 1, indexing.OP_INDEX, 1]])
+        self.assertFalse(self.queue.items)
+        self.assertFalse(apply_async.called)
+
+    def test_flush_index_queue(self, bulk_update_in_index, apply_async):
+        """
+        Test that flushing processes the queue of the current thread and doesn't raise errors.
+        """
+        bulk_update_in_index.side_effect = ValueError()
+
+        with patch.object(indexing, 'index_queue', self.queue):
+            self.queue.start()
+            self.queue.add(self.mapping, 1, indexing.OP_INDEX, 1)
+
+            indexing.flush_index_queue()
+
+        self.assertEqual(bulk_update_in_index.call_count, 1)
+        self.assertFalse(self.queue.items)
@@ -45,6 +45,8 @@ CELERY_QUEUES = (
     Queue('email_first_sync', routing_key='email_first_sync'),
     # Miscellaneous tasks.
     Queue('other_tasks', routing_key='other_tasks'),
+    # Delivery of webhook events, so slow webhooks don't hold up other tasks.
+    Queue('webhooks', routing_key='webhooks'),
 )
 CELERY_ROUTES = (
     {'synchronize_email_account_scheduler': {
@@ -61,15 +63,44 @@ CELERY_ROUTES = (
         # When task is created in first sync, this task will be routed to email_first_sync.
         'queue': 'email_scheduled_tasks'
     }},
+    {'download_email_messages': {
+        # When task is created in first sync, this task will be routed to email_first_sync.
+        'queue': 'email_scheduled_tasks'
+    }},
     {'update_labels_for_message': {
         # When task is created in first sync, this task will be routed to email_first_sync.
         'queue': 'email_scheduled_tasks'
     }},
+    {'process_index_queue': {
+        'queue': 'other_tasks'
+    }},
+    {'rebuild_stats_scheduler': {
+        'queue': 'other_tasks'
+    }},
+    {'update_stats': {
+        'queue': 'other_tasks'
+    }},
+    {'update_call_routes': {
+        'queue': 'other_tasks'
+    }},
+    {'import_accounts': {
+        'queue': 'other_tasks'
+    }},
+    {'export_list': {
+        'queue': 'other_tasks'
+    }},
+    {'deliver_webhook_events': {
+        'queue': 'webhooks'
+    }},
+    {'reconcile_unread_counts': {
+        'queue': 'other_tasks'
+    }},
 )
 CELERYBEAT_SCHEDULE = {
     'synchronize_email_account_scheduler': {
         'task': 'synchronize_email_account_scheduler',
-        'schedule': timedelta(seconds=int(os.environ.get('EMAIL_SYNC_INTERVAL', 60))),
+        # Only email accounts that are due are synced, so the scheduler can run often.
+        'schedule': timedelta(seconds=int(os.environ.get('EMAIL_SYNC_INTERVAL', 15))),
     },
     'check_subscriptions_scheduler': {
         'task': 'check_subscriptions',
@@ -83,6 +114,18 @@ CELERYBEAT_SCHEDULE = {
         'task': 'clear_sessions_scheduler',
         'schedule': crontab(hour=1, minute=0),  # Every night at one o'clock.
     },
+    'rebuild_call_routes_scheduler': {
+        'task': 'rebuild_call_routes_scheduler',
+        'schedule': crontab(hour=2, minute=0),  # Every night at two o'clock.
+    },
+    'rebuild_stats_scheduler': {
+        'task': 'rebuild_stats_scheduler',
+        'schedule': crontab(hour=3, minute=0),  # Every night at three o'clock.
+    },
+    'reconcile_unread_counts_scheduler': {
+        'task': 'reconcile_unread_counts_scheduler',
+        'schedule': crontab(hour=4, minute=0),  # Every night at four o'clock.
+    },
     'cleanup_deleted_email_accounts_scheduler': {
         'task': 'cleanup_deleted_email_accounts',
         'schedule': crontab(hour=1, minute=0),  # Every night at one o'clock.
@@ -75,6 +75,8 @@ uses_netloc.append('redis')
 REDIS_ENV = os.environ.get('REDIS_PROVIDER_ENV', 'REDIS_DEV_URL')
 REDIS_URL = os.environ.get(REDIS_ENV, 'redis://redis:6379')
 REDIS = urlparse(REDIS_URL)
+# Database of the Redis server that tests which use Redis directly run against, it's emptied by every test.
+REDIS_TEST_DB = int(os.environ.get('REDIS_TEST_DB', 15))
 
 #######################################################################################################################
 # DJANGO CHANNELS                                                                                                     #
@@ -171,6 +173,9 @@ FILE_UPLOAD_HANDLERS = (
 
 ACCOUNT_LOGO_UPLOAD_TO = 'accounts/account/%(tenant_id)d/%(account_id)d/%(filename)s'
 
+# Uploaded account imports are kept until they're imported by a task.
+ACCOUNT_IMPORT_UPLOAD_TO = 'accounts/import/%(tenant_id)d/%(import_id)s.csv'
+
 CONTACT_PICTURE_UPLOAD_TO = 'contacts/contact/%(tenant_id)d/%(contact_id)d/%(filename)s'
 
 LILYUSER_PICTURE_UPLOAD_TO = 'users/lilyuser/%(tenant_id)d/%(user_id)d/%(filename)s'
@@ -178,6 +183,11 @@ LILYUSER_PICTURE_MAX_SIZE = os.environ.get('MAX_AVATAR_SIZE', 300 * 1024)
 
 EMAIL_ATTACHMENT_UPLOAD_TO = 'messaging/email/attachments/%(tenant_id)d/%(message_id)d/%(filename)s'
 
+# Attachments are decoded, read and uploaded in chunks. Files up to the max memory size are kept in memory, larger
+# ones are spooled to disk.
+EMAIL_ATTACHMENT_CHUNK_SIZE = 64 * 1024
+EMAIL_ATTACHMENT_MAX_MEMORY_SIZE = 1024 * 1024
+
 EMAIL_TEMPLATE_ATTACHMENT_UPLOAD_TO = ('messaging/email/templates/attachments'
                                        '/%(tenant_id)d/%(template_id)d/%(filename)s')
 
@@ -195,6 +205,11 @@ AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 AWS_S3_SECURE_URLS = True
 AWS_PRELOAD_METADATA = True
+# Spool files read from S3 to disk instead of keeping them in memory completely.
+AWS_S3_MAX_MEMORY_SIZE = EMAIL_ATTACHMENT_MAX_MEMORY_SIZE
+# Files larger than the threshold are uploaded in parts (S3 requires parts of at least 5 MB).
+AWS_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+AWS_S3_MULTIPART_CHUNK_SIZE = 5 * 1024 * 1024
 
 # custom headers for files uploaded to amazon
 expires = datetime.utcnow() + timedelta(days=(25 * 365))
@@ -576,6 +591,43 @@ ES_MAXSIZE = os.environ.get('ES_MAXSIZE', 2)  # Default is 10
 
 ES_BLOCK = os.environ.get('ES_BLOCK', True)  # Default is False
 
+# How signal based index updates are processed:
+# 'sync': index every object directly and refresh the index (so tests can search right away).
+# 'queue': queue the updates and process them in bulk at the end of the request/task, in process.
+# 'celery': queue the updates and hand them off in bulk to the process_index_queue task.
+# Outside of requests and tasks (e.g. management commands) updates are always processed right away, in process.
+ES_INDEXING_MODE = os.environ.get('ES_INDEXING_MODE', 'sync')
+# The queue is flushed early when it grows larger than this (e.g. during imports).
+ES_INDEXING_QUEUE_MAX_SIZE = int(os.environ.get('ES_INDEXING_QUEUE_MAX_SIZE', 1000))
+# Max number of index operations per process_index_queue task.
+ES_INDEXING_BATCH_SIZE = int(os.environ.get('ES_INDEXING_BATCH_SIZE', 500))
+
+# Cache search results in the default cache. Cached results are invalidated per (tenant, model type) on every index
+# update. The timeout limits how long results can be stale when an update isn't searchable yet (refresh interval).
+SEARCH_CACHE_ENABLED = boolean(os.environ.get('SEARCH_CACHE_ENABLED', 0))
+SEARCH_CACHE_TIMEOUT = int(os.environ.get('SEARCH_CACHE_TIMEOUT', 60))
+# Max number of search results a list is filtered on, when the list can't be paged by Elasticsearch (e.g. because
+# it's filtered on more than the search).
+SEARCH_MAX_FILTER_IDS = int(os.environ.get('SEARCH_MAX_FILTER_IDS', 10000))
+
+# Cache the stats dashboards in the default cache. Cached responses are invalidated per tenant on every rollup update,
+# the timeout makes sure relative periods (e.g. last week) move on.
+STATS_CACHE_ENABLED = boolean(os.environ.get('STATS_CACHE_ENABLED', 1))
+STATS_CACHE_TIMEOUT = int(os.environ.get('STATS_CACHE_TIMEOUT', 300))
+
+# Cache who is behind the numbers of call notifications, in process (LRU) and in the default cache. Cached numbers are
+# invalidated per tenant when the phone numbers or names of users, contacts or accounts change.
+CALL_RESOLVER_CACHE_ENABLED = boolean(os.environ.get('CALL_RESOLVER_CACHE_ENABLED', 1))
+CALL_RESOLVER_CACHE_TIMEOUT = int(os.environ.get('CALL_RESOLVER_CACHE_TIMEOUT', 60 * 60))
+CALL_RESOLVER_LRU_SIZE = int(os.environ.get('CALL_RESOLVER_LRU_SIZE', 10000))
+
+# Cache the rendered (sanitized) html of email messages. The cache key contains a hash of the body, the attachments
+# and the host, so changes to any of them render the body again.
+EMAIL_BODY_CACHE_ENABLED = boolean(os.environ.get('EMAIL_BODY_CACHE_ENABLED', 1))
+EMAIL_BODY_CACHE_TIMEOUT = int(os.environ.get('EMAIL_BODY_CACHE_TIMEOUT', 60 * 60 * 24))
+# Max number of email templates kept compiled per process, templates are compiled again when they're modified.
+EMAIL_TEMPLATE_CACHE_SIZE = int(os.environ.get('EMAIL_TEMPLATE_CACHE_SIZE', 500))
+
 #######################################################################################################################
 # Gmail settings                                                                                                  #
 #######################################################################################################################
@@ -583,10 +635,19 @@ GOOGLE_OAUTH2_CLIENT_ID = os.environ.get('GOOGLE_OAUTH2_CLIENT_ID', '')
 GOOGLE_OAUTH2_CLIENT_SECRET = os.environ.get('GOOGLE_OAUTH2_CLIENT_SECRET', '')
 GMAIL_FULL_MESSAGE_BATCH_SIZE = os.environ.get('GMAIL_FULL_MESSAGE_BATCH_SIZE', 300)
 GMAIL_LABEL_UPDATE_BATCH_SIZE = os.environ.get('GMAIL_LABEL_UPDATE_BATCH_SIZE', 500)
+# Number of messages of which the labels are changed with a single batchModify call, Gmail allows up to 1000.
+GMAIL_BATCH_MODIFY_SIZE = int(os.environ.get('GMAIL_BATCH_MODIFY_SIZE', 1000))
+# Number of messages downloaded with a single batch request. Gmail allows up to 100 calls per batch, but larger batches
+# are more likely to hit the rate limits.
+GMAIL_MESSAGE_DOWNLOAD_BATCH_SIZE = int(os.environ.get('GMAIL_MESSAGE_DOWNLOAD_BATCH_SIZE', 50))
 GMAIL_PARTIAL_SYNC_LIMIT = os.environ.get('GMAIL_PARTIAL_SYNC_LIMIT', 899)
 GMAIL_CALLBACK_URL = os.environ.get('GMAIL_CALLBACK_URL', 'http://localhost:8000/messaging/email/callback/')
 GMAIL_SYNC_DELAY_INTERVAL = 1
 GMAIL_SYNC_LOCK_LIFETIME = 300
+# Incremental syncs of accounts with changes are scheduled after the min interval. For quiet accounts the interval is
+# doubled after every sync without changes, up to the max interval (in seconds).
+GMAIL_SYNC_MIN_INTERVAL = int(os.environ.get('GMAIL_SYNC_MIN_INTERVAL', 30))
+GMAIL_SYNC_MAX_INTERVAL = int(os.environ.get('GMAIL_SYNC_MAX_INTERVAL', 600))
 # A chuck size of -1 indicates that the entire file should be uploaded in a single request. If the underlying platform
 # supports streams, such as Python 2.6 or later, then this can be very efficient as it avoids multiple connections, and
 # also avoids loading the entire file into memory before sending it.
@@ -596,6 +657,9 @@ GMAIL_CHUNK_SIZE = -1
 # With resumable uploads enabled, tests on sending email behave different when mocking. In the old situation resumable
 # was enabled but code handling failing uploads was missing.
 GMAIL_UPLOAD_RESUMABLE = False
+# Messages larger than this (in bytes) are uploaded resumable anyway, so they're streamed from the file instead of read
+# in memory.
+GMAIL_RESUMABLE_UPLOAD_SIZE = int(os.environ.get('GMAIL_RESUMABLE_UPLOAD_SIZE', 5 * 1024 * 1024))
 GMAIL_LABEL_INBOX = os.environ.get('GMAIL_LABEL_INBOX', 'INBOX')
 GMAIL_LABEL_SPAM = os.environ.get('GMAIL_LABEL_SPAM', 'SPAM')
 GMAIL_LABEL_TRASH = os.environ.get('GMAIL_LABEL_TRASH', 'TRASH')
@@ -668,6 +732,18 @@ SLACK_LILY_CLIENT_SECRET = os.environ.get('SLACK_LILY_CLIENT_SECRET', '')
 # Token used to verify requests are actually coming from Slack.
 SLACK_LILY_TOKEN = os.environ.get('SLACK_LILY_TOKEN', '')
 
+# Webhook events are queued and delivered by the deliver_webhook_events task. Events of a webhook that arrive within
+# the batch delay are delivered together, over one connection.
+WEBHOOK_BATCH_DELAY = int(os.environ.get('WEBHOOK_BATCH_DELAY', 1))
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 50))
+# Max number of deliveries to the same webhook at a time, 1 keeps the events in order.
+WEBHOOK_MAX_CONCURRENCY = int(os.environ.get('WEBHOOK_MAX_CONCURRENCY', 1))
+WEBHOOK_TIMEOUT = int(os.environ.get('WEBHOOK_TIMEOUT', 10))
+# Failed deliveries are retried after the retry delay, which doubles every attempt up to the max retry delay.
+WEBHOOK_RETRY_DELAY = int(os.environ.get('WEBHOOK_RETRY_DELAY', 10))
+WEBHOOK_MAX_RETRY_DELAY = int(os.environ.get('WEBHOOK_MAX_RETRY_DELAY', 60 * 60))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+
 #######################################################################################################################
 # TESTING                                                                                                             #
 #######################################################################################################################
@@ -688,6 +764,10 @@ MULTI_TENANT = boolean(os.environ.get('MULTI_TENANT', 0))
 
 BILLING_ENABLED = boolean(os.environ.get('BILLING_ENABLED', 0))
 
+# Changes for the activity stream are stored in bulk at the end of the request/task. The queue is flushed early when
+# it grows larger than this (e.g. during imports).
+CHANGE_QUEUE_MAX_SIZE = int(os.environ.get('CHANGE_QUEUE_MAX_SIZE', 500))
+
 # Django Bootstrap
 # TODO: These settings can be removed once all forms are converted to Angular
 BOOTSTRAP3 = {
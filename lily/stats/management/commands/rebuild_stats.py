@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+
+from lily.tenant.models import Tenant
+
+from ...rollups import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = """
+    Rebuild the daily rollups the stats dashboards are served from. Run nightly to repair drift.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t', '--tenant',
+            action='store',
+            dest='tenant',
+            type=int,
+            help='Only rebuild the stats of this tenant.'
+        )
+
+    def handle(self, *args, **options):
+        tenants = Tenant.objects.all()
+        if options['tenant']:
+            tenants = tenants.filter(pk=options['tenant'])
+
+        for tenant in tenants.order_by('pk'):
+            self.stdout.write('Rebuilding stats for tenant %s' % tenant.pk)
+            rebuild_stats(tenant.pk)
+
+        self.stdout.write('Done.')
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0005_tenant_billing'),
+        ('cases', '0020_auto_20170419_0926'),
+        ('deals', '0036_auto_20170419_0926'),
+        ('users', '0023_userinvite'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaseStats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('day', models.DateField()),
+                ('is_archived', models.BooleanField(default=False)),
+                ('case_count', models.IntegerField(default=0)),
+                ('tagged_case_count', models.IntegerField(default=0)),
+                ('status', models.ForeignKey(related_name='+', to='cases.CaseStatus')),
+                ('team', models.ForeignKey(related_name='+', to='users.Team')),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+                ('type', models.ForeignKey(related_name='+', to='cases.CaseType')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CaseTagStats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('day', models.DateField()),
+                ('tag_name', models.CharField(max_length=50)),
+                ('tag_count', models.IntegerField(default=0)),
+                ('team', models.ForeignKey(related_name='+', to='users.Team')),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+                ('type', models.ForeignKey(related_name='+', to='cases.CaseType')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DealClosedStats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('day', models.DateField()),
+                ('new_business', models.BooleanField(default=False)),
+                ('deal_count', models.IntegerField(default=0)),
+                ('amount_recurring', models.DecimalField(default=0, max_digits=19, decimal_places=2)),
+                ('assigned_to', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('status', models.ForeignKey(related_name='+', to='deals.DealStatus')),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DealFollowUpStats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('day', models.DateField()),
+                ('deal_count', models.IntegerField(default=0)),
+                ('assigned_to', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('status', models.ForeignKey(related_name='+', to='deals.DealStatus')),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='dealfollowupstats',
+            index_together=set([('tenant', 'day')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='dealclosedstats',
+            index_together=set([('tenant', 'day')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='casetagstats',
+            index_together=set([('tenant', 'team', 'day')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='casestats',
+            index_together=set([('tenant', 'team', 'day')]),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import models
+
+from lily.tenant.models import TenantMixin
+
+
+class CaseStats(TenantMixin):
+    """
+    Daily rollup of the cases assigned to a team, by creation date, type, status and archived state.
+
+    Maintained by lily.stats.rollups, the stats views read these instead of aggregating all cases.
+    """
+    team = models.ForeignKey(to='users.Team', on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    type = models.ForeignKey(to='cases.CaseType', on_delete=models.CASCADE, related_name='+')
+    status = models.ForeignKey(to='cases.CaseStatus', on_delete=models.CASCADE, related_name='+')
+    is_archived = models.BooleanField(default=False)
+    case_count = models.IntegerField(default=0)
+    # Number of these cases with one or more (non empty) tags.
+    tagged_case_count = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = ('tenant', 'team', 'day')
+
+
+class CaseTagStats(TenantMixin):
+    """
+    Daily rollup of the tags of the cases assigned to a team, by creation date of the case and case type.
+    """
+    team = models.ForeignKey(to='users.Team', on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    type = models.ForeignKey(to='cases.CaseType', on_delete=models.CASCADE, related_name='+')
+    tag_name = models.CharField(max_length=50)
+    tag_count = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = ('tenant', 'team', 'day')
+
+
+class DealClosedStats(TenantMixin):
+    """
+    Daily rollup of the deals assigned to a user, by closed date, status and new business.
+    """
+    assigned_to = models.ForeignKey(to='users.LilyUser', on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    status = models.ForeignKey(to='deals.DealStatus', on_delete=models.CASCADE, related_name='+')
+    new_business = models.BooleanField(default=False)
+    deal_count = models.IntegerField(default=0)
+    amount_recurring = models.DecimalField(default=0, max_digits=19, decimal_places=2)
+
+    class Meta:
+        index_together = ('tenant', 'day')
+
+
+class DealFollowUpStats(TenantMixin):
+    """
+    Daily rollup of the deals assigned to a user, by next step date and status.
+    """
+    assigned_to = models.ForeignKey(to='users.LilyUser', on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    status = models.ForeignKey(to='deals.DealStatus', on_delete=models.CASCADE, related_name='+')
+    deal_count = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = ('tenant', 'day')
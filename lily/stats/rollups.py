@@ -0,0 +1,295 @@
+"""
+Maintenance of the daily stats rollups.
+
+Rollups are recomputed per tenant and day with the same joins and filters as the stats queries used to run on the
+cases and deals tables directly. Signals queue the days touched by a change, which are recomputed once at the end of
+the request or task. The nightly rebuild repairs any drift.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from lily.search.cache import incr
+from lily.utils.queues import RequestQueue, register
+
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'stats:generation:%s'
+# Namespace of the advisory locks of the tenants, rebuilds lock a tenant exclusively, updates of days share the lock.
+LOCK_NAMESPACE = 7300
+# Key of the advisory locks that serialize updates of a single day of a rollup.
+DAY_LOCK_KEY = 'stats:%s:%s:%s'
+
+CASE_STATS_QUERY = '''
+    INSERT INTO stats_casestats
+        (tenant_id, team_id, day, type_id, status_id, is_archived, case_count, tagged_case_count)
+    SELECT
+        cases_case.tenant_id,
+        cases_case_assigned_to_teams.team_id,
+        cases_case.created::date,
+        cases_case.type_id,
+        cases_case.status_id,
+        cases_case.is_archived,
+        count(cases_case.id),
+        sum(CASE WHEN EXISTS (
+            SELECT 1 FROM tags_tag
+            WHERE
+                tags_tag.object_id = cases_case.id AND
+                tags_tag.name != '' AND
+                tags_tag.tenant_id = cases_case.tenant_id
+        ) THEN 1 ELSE 0 END)
+    FROM
+        cases_case,
+        cases_case_assigned_to_teams
+    WHERE
+        cases_case.id = cases_case_assigned_to_teams.case_id AND
+        cases_case.tenant_id = %s AND
+        cases_case.is_deleted = false
+        {day_filter}
+    GROUP BY
+        cases_case.tenant_id,
+        cases_case_assigned_to_teams.team_id,
+        cases_case.created::date,
+        cases_case.type_id,
+        cases_case.status_id,
+        cases_case.is_archived;
+'''
+
+# Like the stats query it replaces, tags are matched on object id only and the tenant is the tenant of the tag.
+CASE_TAG_STATS_QUERY = '''
+    INSERT INTO stats_casetagstats
+        (tenant_id, team_id, day, type_id, tag_name, tag_count)
+    SELECT
+        tags_tag.tenant_id,
+        cases_case_assigned_to_teams.team_id,
+        cases_case.created::date,
+        cases_case.type_id,
+        tags_tag.name,
+        count(tags_tag.name)
+    FROM
+        cases_case,
+        cases_case_assigned_to_teams,
+        tags_tag
+    WHERE
+        cases_case.id = cases_case_assigned_to_teams.case_id AND
+        cases_case.id = tags_tag.object_id AND
+        tags_tag.name <> '' AND
+        tags_tag.tenant_id = %s AND
+        cases_case.is_deleted = false
+        {day_filter}
+    GROUP BY
+        tags_tag.tenant_id,
+        cases_case_assigned_to_teams.team_id,
+        cases_case.created::date,
+        cases_case.type_id,
+        tags_tag.name;
+'''
+
+DEAL_CLOSED_STATS_QUERY = '''
+    INSERT INTO stats_dealclosedstats
+        (tenant_id, assigned_to_id, day, status_id, new_business, deal_count, amount_recurring)
+    SELECT
+        deals_deal.tenant_id,
+        deals_deal.assigned_to_id,
+        deals_deal.closed_date::date,
+        deals_deal.status_id,
+        deals_deal.new_business,
+        count(deals_deal.id),
+        sum(deals_deal.amount_recurring)
+    FROM
+        deals_deal
+    WHERE
+        deals_deal.tenant_id = %s AND
+        deals_deal.is_deleted = false AND
+        deals_deal.assigned_to_id IS NOT NULL AND
+        deals_deal.closed_date IS NOT NULL
+        {day_filter}
+    GROUP BY
+        deals_deal.tenant_id,
+        deals_deal.assigned_to_id,
+        deals_deal.closed_date::date,
+        deals_deal.status_id,
+        deals_deal.new_business;
+'''
+
+DEAL_FOLLOW_UP_STATS_QUERY = '''
+    INSERT INTO stats_dealfollowupstats
+        (tenant_id, assigned_to_id, day, status_id, deal_count)
+    SELECT
+        deals_deal.tenant_id,
+        deals_deal.assigned_to_id,
+        deals_deal.next_step_date,
+        deals_deal.status_id,
+        count(deals_deal.id)
+    FROM
+        deals_deal
+    WHERE
+        deals_deal.tenant_id = %s AND
+        deals_deal.is_deleted = false AND
+        deals_deal.assigned_to_id IS NOT NULL AND
+        deals_deal.next_step_date IS NOT NULL
+        {day_filter}
+    GROUP BY
+        deals_deal.tenant_id,
+        deals_deal.assigned_to_id,
+        deals_deal.next_step_date,
+        deals_deal.status_id;
+'''
+
+
+def get_generation(tenant_id):
+    """
+    Return the current generation of the stats of a tenant, cached stats responses include it in their key.
+    """
+    return cache.get(GENERATION_KEY % tenant_id, 0)
+
+
+def bump_generation(tenant_id):
+    """
+    Invalidate all cached stats responses of a tenant.
+    """
+    if settings.STATS_CACHE_ENABLED:
+        incr(GENERATION_KEY % tenant_id)
+
+
+def _lock(cursor, table, tenant_id, days=None):
+    """
+    Serialize updates of the same rows of a rollup, concurrent delete and inserts would duplicate rows otherwise.
+
+    Updates of days only wait for updates of the same days, rebuilds of a tenant wait for (and block) all updates of
+    the tenant. The locks are released at the end of the transaction.
+    """
+    if days is None:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s);', [LOCK_NAMESPACE, tenant_id])
+    else:
+        cursor.execute('SELECT pg_advisory_xact_lock_shared(%s, %s);', [LOCK_NAMESPACE, tenant_id])
+
+        # Always lock days in the same order to prevent deadlocks.
+        for day in days:
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s));', [DAY_LOCK_KEY % (table, tenant_id, day)])
+
+
+def _recompute(cursor, table, query, tenant_id, day_column, days=None):
+    """
+    Replace the rollup rows of a tenant, for the given days or all days.
+    """
+    if days is not None:
+        days = sorted(set(day for day in days if day))
+        if not days:
+            return
+
+    _lock(cursor, table, tenant_id, days)
+
+    if days is None:
+        cursor.execute('DELETE FROM %s WHERE tenant_id = %%s;' % table, [tenant_id])
+        cursor.execute(query.format(day_filter=''), [tenant_id])
+    else:
+        cursor.execute('DELETE FROM %s WHERE tenant_id = %%s AND day = ANY(%%s);' % table, [tenant_id, days])
+        cursor.execute(query.format(day_filter='AND %s = ANY(%%s)' % day_column), [tenant_id, days])
+
+
+def update_case_stats(tenant_id, days=None):
+    """
+    Recompute the case rollups of a tenant for the given creation days of cases, or for all days.
+    """
+    with transaction.atomic():
+        cursor = connection.cursor()
+        _recompute(cursor, 'stats_casestats', CASE_STATS_QUERY, tenant_id, 'cases_case.created::date', days)
+        _recompute(cursor, 'stats_casetagstats', CASE_TAG_STATS_QUERY, tenant_id, 'cases_case.created::date', days)
+
+    bump_generation(tenant_id)
+
+
+def update_deal_stats(tenant_id, closed_days=None, follow_up_days=None, rebuild=False):
+    """
+    Recompute the deal rollups of a tenant for the given closed and next step days, or for all days on a rebuild.
+    """
+    with transaction.atomic():
+        cursor = connection.cursor()
+        if closed_days or rebuild:
+            _recompute(cursor, 'stats_dealclosedstats', DEAL_CLOSED_STATS_QUERY, tenant_id,
+                       'deals_deal.closed_date::date', None if rebuild else closed_days)
+        if follow_up_days or rebuild:
+            _recompute(cursor, 'stats_dealfollowupstats', DEAL_FOLLOW_UP_STATS_QUERY, tenant_id,
+                       'deals_deal.next_step_date', None if rebuild else follow_up_days)
+
+    bump_generation(tenant_id)
+
+
+def get_case_day(case_id):
+    """
+    Return the tenant and the rollup day of a case, as computed by the database.
+    """
+    cursor = connection.cursor()
+    cursor.execute('SELECT tenant_id, created::date FROM cases_case WHERE id = %s;', [case_id])
+    return cursor.fetchone()
+
+
+def get_deal_days(deal_id):
+    """
+    Return the closed day and next step date of a deal, as computed by the database.
+    """
+    cursor = connection.cursor()
+    cursor.execute('SELECT closed_date::date, next_step_date FROM deals_deal WHERE id = %s;', [deal_id])
+    return cursor.fetchone() or (None, None)
+
+
+def rebuild_stats(tenant_id):
+    """
+    Rebuild all rollups of a tenant.
+    """
+    update_case_stats(tenant_id)
+    update_deal_stats(tenant_id, rebuild=True)
+
+    logger.info('Rebuilt stats for tenant %s', tenant_id)
+
+
+class StatsQueue(RequestQueue):
+    """
+    Thread local queue of the rollup days which have to be recomputed, per tenant.
+
+    Within requests and tasks the days touched by changes are collected and recomputed by a task at the end, so saving
+    objects doesn't wait for it and every day is recomputed once. Outside of requests and tasks (e.g. in management
+    commands) the days are recomputed right away.
+    """
+    def reset(self):
+        self.items = {}
+
+    def add(self, tenant_id, case_days=None, closed_days=None, follow_up_days=None):
+        case_days = set(day for day in case_days or [] if day)
+        closed_days = set(day for day in closed_days or [] if day)
+        follow_up_days = set(day for day in follow_up_days or [] if day)
+
+        if not self.active:
+            if case_days:
+                update_case_stats(tenant_id, case_days)
+            if closed_days or follow_up_days:
+                update_deal_stats(tenant_id, closed_days, follow_up_days)
+            return
+
+        queued = self.items.setdefault(tenant_id, (set(), set(), set()))
+        queued[0].update(case_days)
+        queued[1].update(closed_days)
+        queued[2].update(follow_up_days)
+
+    def process(self, items):
+        # Prevent circular imports.
+        from .tasks import update_stats_task
+
+        for tenant_id, days in items.items():
+            # Tasks are serialized as json, so the days are sent as iso dates.
+            update_stats_task.apply_async(args=[tenant_id] + [[day.isoformat() for day in queued] for queued in days])
+
+
+stats_queue = register(StatsQueue())
+
+
+def queue_stats(tenant_id, case_days=None, closed_days=None, follow_up_days=None):
+    """
+    Recompute the rollups of a tenant for the given creation days of cases and closed and next step days of deals, at
+    the end of the current request or task.
+    """
+    stats_queue.add(tenant_id, case_days, closed_days, follow_up_days)
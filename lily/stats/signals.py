@@ -0,0 +1,80 @@
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
+from django.dispatch.dispatcher import receiver
+
+from lily.cases.models import Case
+from lily.deals.models import Deal
+from lily.search.signals import skip_signal
+from lily.tags.models import Tag
+
+from .rollups import get_case_day, get_deal_days, queue_stats
+
+
+@receiver(pre_delete, sender=Case)
+@skip_signal()
+def case_pre_delete(sender, instance, **kwargs):
+    # The day can't be retrieved anymore once the case is gone.
+    instance._stats_day = get_case_day(instance.pk)
+
+
+@receiver(post_save, sender=Case)
+@receiver(post_delete, sender=Case)
+@skip_signal()
+def case_changed(sender, instance, **kwargs):
+    if kwargs.get('signal') == post_delete:
+        case_day = getattr(instance, '_stats_day', None)
+    else:
+        case_day = get_case_day(instance.pk)
+
+    if case_day:
+        tenant_id, day = case_day
+        queue_stats(tenant_id, case_days=[day])
+
+
+@receiver(m2m_changed, sender=Case.assigned_to_teams.through)
+@skip_signal()
+def case_teams_changed(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, Case):
+        case_day = get_case_day(instance.pk)
+
+        if case_day:
+            tenant_id, day = case_day
+            queue_stats(tenant_id, case_days=[day])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@skip_signal()
+def tag_changed(sender, instance, **kwargs):
+    # Tags are counted for the case with the same id as the tagged object.
+    case_day = get_case_day(instance.object_id)
+
+    if case_day:
+        tenant_id, day = case_day
+        for stats_tenant_id in set([tenant_id, instance.tenant_id]):
+            queue_stats(stats_tenant_id, case_days=[day])
+
+
+@receiver(pre_save, sender=Deal)
+@receiver(pre_delete, sender=Deal)
+@skip_signal()
+def deal_pre_change(sender, instance, **kwargs):
+    # Remember the days the deal is counted for now, the deal moves away from them with this change.
+    instance._stats_days = get_deal_days(instance.pk) if instance.pk else (None, None)
+
+
+@receiver(post_save, sender=Deal)
+@receiver(post_delete, sender=Deal)
+@skip_signal()
+def deal_changed(sender, instance, **kwargs):
+    old_closed_day, old_follow_up_day = getattr(instance, '_stats_days', (None, None))
+
+    if kwargs.get('signal') == post_delete:
+        closed_day, follow_up_day = None, None
+    else:
+        closed_day, follow_up_day = get_deal_days(instance.pk)
+
+    queue_stats(
+        instance.tenant_id,
+        closed_days=[old_closed_day, closed_day],
+        follow_up_days=[old_follow_up_day, follow_up_day],
+    )
@@ -0,0 +1,28 @@
+from celery.task import task
+from django.core.management import call_command
+from django.utils.dateparse import parse_date
+
+from .rollups import update_case_stats, update_deal_stats
+
+
+@task(name='rebuild_stats_scheduler')
+def rebuild_stats_scheduler():
+    """
+    Rebuild the stats rollups, to repair any drift from changes the signals didn't see (e.g. bulk updates).
+    """
+    call_command('rebuild_stats')
+
+
+@task(name='update_stats')
+def update_stats_task(tenant_id, case_days, closed_days, follow_up_days):
+    """
+    Recompute the rollup days queued during a request or task, see StatsQueue.
+    """
+    if case_days:
+        update_case_stats(tenant_id, [parse_date(day) for day in case_days])
+    if closed_days or follow_up_days:
+        update_deal_stats(
+            tenant_id,
+            closed_days=[parse_date(day) for day in closed_days],
+            follow_up_days=[parse_date(day) for day in follow_up_days],
+        )
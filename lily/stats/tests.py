@@ -1,7 +1,13 @@
+import anyjson
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from mock import patch
 
+from lily.cases.factories import CaseFactory, CaseStatusFactory
+from lily.cases.models import Case
 from lily.users.factories import TeamFactory, LilyUserFactory
+from .models import CaseStats
+from .rollups import rebuild_stats, stats_queue
 from .urls import case_patterns, deal_patterns
 
 
@@ -26,3 +32,67 @@ class StatsTests(TestCase):
             # Loop over deal patterns, these need no kwargs.
             response = self.client.get(reverse(pattern.name))
             self.assertEqual(response.status_code, 200)
+
+    def _get_count_per_status(self, team):
+        response = self.client.get(reverse('stats_cases_cps', kwargs={'team_id': team.id}))
+        self.assertEqual(response.status_code, 200)
+
+        return {row['name']: int(row['count']) for row in anyjson.loads(response.content)}
+
+    def test_rollups_follow_changes(self):
+        """
+        Test that the case stats are updated when cases change and match the cases themselves.
+        """
+        user_obj = LilyUserFactory(is_active=True)
+        team = TeamFactory(tenant=user_obj.tenant)
+        status = CaseStatusFactory(tenant=user_obj.tenant, name='New')
+        self.client.login(email=user_obj.email, password='admin')
+
+        cases = CaseFactory.create_batch(3, tenant=user_obj.tenant, status=status, teams=team)
+        self.assertEqual(self._get_count_per_status(team), {'New': 3})
+
+        cases[0].is_archived = True
+        cases[0].save()
+        self.assertEqual(self._get_count_per_status(team), {'New': 2})
+
+        cases[1].delete()
+        self.assertEqual(self._get_count_per_status(team), {'New': 1})
+        self.assertEqual(self._get_count_per_status(team)['New'], Case.objects.filter(
+            assigned_to_teams=team,
+            is_archived=False,
+            is_deleted=False,
+        ).count())
+
+    def test_rebuild_stats(self):
+        """
+        Test that a rebuild results in the same rollups as the incremental updates.
+        """
+        user_obj = LilyUserFactory(is_active=True)
+        team = TeamFactory(tenant=user_obj.tenant)
+        CaseFactory.create_batch(5, tenant=user_obj.tenant, teams=team)
+
+        fields = ('team_id', 'day', 'type_id', 'status_id', 'is_archived', 'case_count', 'tagged_case_count')
+        incremental = sorted(CaseStats.objects.values_list(*fields))
+
+        rebuild_stats(user_obj.tenant_id)
+
+        self.assertEqual(sorted(CaseStats.objects.values_list(*fields)), incremental)
+        self.assertEqual(sum(row[5] for row in incremental), 5)
+
+    def test_rollups_deferred(self):
+        """
+        Test that the days touched during a request or task are recomputed once, by a task at the end.
+        """
+        user_obj = LilyUserFactory(is_active=True)
+        team = TeamFactory(tenant=user_obj.tenant)
+
+        with patch('lily.stats.tasks.update_stats_task.apply_async') as apply_async:
+            stats_queue.start()
+            try:
+                cases = CaseFactory.create_batch(2, tenant=user_obj.tenant, teams=team)
+                self.assertFalse(CaseStats.objects.exists())
+            finally:
+                stats_queue.finish()
+
+        days = [case.created.date().isoformat() for case in cases]
+        apply_async.assert_called_once_with(args=[user_obj.tenant_id, list(set(days)), [], []])
@@ -1,4 +1,8 @@
+import hashlib
+
 import anyjson
+from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
 from django.http import HttpResponse
 from django.views.generic import View
@@ -6,6 +10,42 @@ from django.views.generic import View
 from lily.deals.models import DealStatus
 from lily.utils.views import LoginRequiredMixin
 
+from .rollups import get_generation
+
+
+RESPONSE_KEY = 'stats:response:%s:%s:%s'
+
+# Rollup days are whole days, so deals closed on the day of the boundary are selected from the deals table itself.
+DEALS_CLOSED_LAST_MONTH = '''
+    (
+        SELECT
+            stats_dealclosedstats.assigned_to_id,
+            stats_dealclosedstats.status_id,
+            stats_dealclosedstats.new_business,
+            stats_dealclosedstats.deal_count,
+            stats_dealclosedstats.amount_recurring
+        FROM
+            stats_dealclosedstats
+        WHERE
+            stats_dealclosedstats.tenant_id = {tenant_id} AND
+            stats_dealclosedstats.day > (now() - interval '30 days month')::date
+        UNION ALL
+        SELECT
+            deals_deal.assigned_to_id,
+            deals_deal.status_id,
+            deals_deal.new_business,
+            1,
+            deals_deal.amount_recurring
+        FROM
+            deals_deal
+        WHERE
+            deals_deal.tenant_id = {tenant_id} AND
+            deals_deal.is_deleted = false AND
+            deals_deal.closed_date > now() - interval '30 days month' AND
+            deals_deal.closed_date::date = (now() - interval '30 days month')::date
+    ) AS closed_deals
+'''
+
 
 def dictfetchall(cursor):
     """
@@ -19,20 +59,40 @@ def dictfetchall(cursor):
 
 
 class RawDatabaseView(LoginRequiredMixin, View):
+    """
+    Base view for the stats, which are queried from the daily rollups (see lily.stats.rollups).
+
+    Responses are cached per tenant until the rollups of the tenant change.
+    """
 
     def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request, *args, **kwargs)
+
+        content = cache.get(key) if settings.STATS_CACHE_ENABLED else None
+
+        if content is None:
+            query = self.get_query(request, *args, **kwargs)
 
-        query = self.get_query(request, *args, **kwargs)
+            if query:
+                cursor = connection.cursor()
+                cursor.execute(query)
 
-        if query:
-            cursor = connection.cursor()
-            cursor.execute(query)
+                results = self.parse_results(dictfetchall(cursor))
+            else:
+                results = []
 
-            results = self.parse_results(dictfetchall(cursor))
-        else:
-            results = []
+            content = anyjson.dumps(results)
 
-        return HttpResponse(anyjson.dumps(results))
+            if settings.STATS_CACHE_ENABLED:
+                cache.set(key, content, settings.STATS_CACHE_TIMEOUT)
+
+        return HttpResponse(content)
+
+    def get_cache_key(self, request, *args, **kwargs):
+        tenant_id = request.user.tenant_id
+        digest = hashlib.md5(anyjson.dumps([self.__class__.__name__, args, sorted(kwargs.items())])).hexdigest()
+
+        return RESPONSE_KEY % (tenant_id, get_generation(tenant_id), digest)
 
     def get_query(self, request, *args, **kwargs):
         raise NotImplementedError
@@ -55,23 +115,16 @@ class CasesTotalCountLastWeek(RawDatabaseView):
     def get_query(self, request, *args, **kwargs):
         return '''
             SELECT
-                count (cases_case.id)
+                COALESCE(sum(stats_casestats.case_count), 0) as count
             FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams
+                stats_casestats
             WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
+                stats_casestats.tenant_id = {tenant_id} AND
+                stats_casestats.team_id = {team_id} AND
 
                 /*last week*/
-                cases_case.created BETWEEN  date_trunc( 'week', now() - interval '1 week' ) AND
-                date_trunc( 'week', now() - interval '1 week' )+ interval '1 week' - interval '1 second';
+                stats_casestats.day BETWEEN date_trunc( 'week', now() - interval '1 week' )::date AND
+                (date_trunc( 'week', now() - interval '1 week' ) + interval '1 week' - interval '1 second')::date;
         '''.format(
             tenant_id=request.user.tenant_id,
             team_id=int(kwargs['team_id']),
@@ -83,27 +136,22 @@ class CasesPerTypeCountLastWeek(RawDatabaseView):
     def get_query(self, request, *args, **kwargs):
         return '''
             SELECT
-                count(cases_case.id),
+                sum(stats_casestats.case_count) as count,
                 cases_casetype.name,
                 date_trunc( 'week', now() - interval '1 week' ) as from,
                 (date_trunc('week', now() - interval '1 week' ) + interval '1 week' - interval '1 second') as to,
                 EXTRACT(WEEK FROM date_trunc( 'week', now() - interval '1 week' )) as weeknr
             FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams
+                stats_casestats,
+                cases_casetype
             WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
+                stats_casestats.type_id = cases_casetype.id AND
+                stats_casestats.tenant_id = {tenant_id} AND
+                stats_casestats.team_id = {team_id} AND
 
                 /*last week*/
-                cases_case.created BETWEEN  date_trunc( 'week', now() - interval '1 week' ) AND
-                date_trunc( 'week', now() - interval '1 week' )+ interval '1 week' - interval '1 second'
+                stats_casestats.day BETWEEN date_trunc( 'week', now() - interval '1 week' )::date AND
+                (date_trunc( 'week', now() - interval '1 week' ) + interval '1 week' - interval '1 second')::date
             GROUP BY
                 cases_casetype.name;
         '''.format(
@@ -116,28 +164,18 @@ class CasesWithTagsLastWeek(RawDatabaseView):
     def get_query(self, request, *args, **kwargs):
         return '''
             SELECT
-                count(DISTINCT(cases_case.id)),
+                COALESCE(sum(stats_casestats.tagged_case_count), 0) as count,
                 date_trunc( 'week', now() - interval '1 week' ) as start,
                 (date_trunc( 'week', now() - interval '1 week' ) + interval '1 week' - interval '1 second') as end
             FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams,
-                tags_tag
+                stats_casestats
             WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.id = tags_tag.object_id AND
-                tags_tag.name != '' AND
-                tags_tag.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
+                stats_casestats.tenant_id = {tenant_id} AND
+                stats_casestats.team_id = {team_id} AND
 
                 /*last week*/
-                cases_case.created BETWEEN date_trunc( 'week', now() - interval '1 week' ) AND
-                date_trunc( 'week', now() - interval '1 week' )+ interval '1 week' - interval '1 second';
+                stats_casestats.day BETWEEN date_trunc( 'week', now() - interval '1 week' )::date AND
+                (date_trunc( 'week', now() - interval '1 week' ) + interval '1 week' - interval '1 second')::date;
         '''.format(
             tenant_id=request.user.tenant_id,
             team_id=int(kwargs['team_id']),
@@ -148,20 +186,15 @@ class CasesCountPerStatus(RawDatabaseView):
     def get_query(self, request, *args, **kwargs):
         return '''
             SELECT
-                count (cases_case.id), cases_casestatus.name
+                sum(stats_casestats.case_count) as count, cases_casestatus.name
             FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams
+                stats_casestats,
+                cases_casestatus
             WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.tenant_id = {tenant_id} AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
-                cases_case.is_deleted = false AND
-                cases_case.is_archived = false AND
+                stats_casestats.status_id = cases_casestatus.id AND
+                stats_casestats.tenant_id = {tenant_id} AND
+                stats_casestats.team_id = {team_id} AND
+                stats_casestats.is_archived = false AND
                 cases_casestatus.name != 'Closed'
             GROUP BY
                 cases_casestatus.name;
@@ -175,33 +208,25 @@ class CasesTopTags(RawDatabaseView):
     def get_query(self, request, *args, **kwargs):
         return '''
             SELECT
-                count(tags_tag.name), tags_tag.name
+                sum(stats_casetagstats.tag_count) as count, stats_casetagstats.tag_name as name
             FROM
-                cases_case,
-                cases_casestatus,
-                cases_casetype,
-                cases_case_assigned_to_teams,
-                tags_tag
+                stats_casetagstats,
+                cases_casetype
             WHERE
-                cases_case.status_id = cases_casestatus.id AND
-                cases_case.type_id = cases_casetype.id AND
-                cases_case.id = cases_case_assigned_to_teams.case_id AND
-                cases_case.id = tags_tag.object_id AND
-                tags_tag.name <> '' AND
-                tags_tag.tenant_id = {tenant_id} AND
-                cases_case.is_deleted = false AND
-                cases_case.created BETWEEN date_trunc('month', now()- interval '1 month') AND
-                date_trunc('month', now()) - interval '1 second' AND
-                cases_case_assigned_to_teams.team_id = {team_id} AND
+                stats_casetagstats.type_id = cases_casetype.id AND
+                stats_casetagstats.tenant_id = {tenant_id} AND
+                stats_casetagstats.day BETWEEN date_trunc('month', now()- interval '1 month')::date AND
+                (date_trunc('month', now()) - interval '1 second')::date AND
+                stats_casetagstats.team_id = {team_id} AND
                 cases_casetype.name != 'Config' AND
                 cases_casetype.name != 'Retour' AND
                 cases_casetype.name != 'Callback'
             GROUP BY
-                tags_tag.name
+                stats_casetagstats.tag_name
             HAVING
-                COUNT (tags_tag.name) > 2
+                sum(stats_casetagstats.tag_count) > 2
             ORDER BY
-                count(tags_tag.name) desc
+                sum(stats_casetagstats.tag_count) desc
             LIMIT 15;
           '''.format(
             tenant_id=request.user.tenant_id,
@@ -220,17 +245,19 @@ class DealsUrgentFollowUp(RawDatabaseView):
         return '''
             SELECT
                 users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfDeals
+                sum(stats_dealfollowupstats.deal_count) as NrOfDeals
             FROM
                 public.users_lilyuser,
-                public.deals_deal
+                public.stats_dealfollowupstats
             WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.next_step_date < now() - interval '7 days' AND
-                deals_deal.next_step_date > now() - interval '60 days' AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.is_deleted = false AND
-                (deals_deal.status_id = {status_id_open} or deals_deal.status_id = {status_id_proposal_sent})
+                stats_dealfollowupstats.assigned_to_id = users_lilyuser.id AND
+                stats_dealfollowupstats.day < now() - interval '7 days' AND
+                stats_dealfollowupstats.day > now() - interval '60 days' AND
+                stats_dealfollowupstats.tenant_id = {tenant_id} AND
+                (
+                    stats_dealfollowupstats.status_id = {status_id_open} or
+                    stats_dealfollowupstats.status_id = {status_id_proposal_sent}
+                )
             GROUP BY
                users_lilyuser.first_name, users_lilyuser.last_name
             ORDER BY
@@ -252,25 +279,22 @@ class DealsWon(RawDatabaseView):
         return '''
             SELECT
                 users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfDealsWon,
-                sum(deals_deal.amount_recurring) as TotalAmountDealsWon,
-                ROUND(sum(deals_deal.amount_recurring)/count(deals_deal.id),2) as AvgPerDealWon
+                sum(closed_deals.deal_count) as NrOfDealsWon,
+                sum(closed_deals.amount_recurring) as TotalAmountDealsWon,
+                ROUND(sum(closed_deals.amount_recurring)/sum(closed_deals.deal_count),2) as AvgPerDealWon
             FROM
                 public.users_lilyuser,
-                public.deals_deal
+                {closed_deals}
             WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.closed_date > now() - interval '30 days month' AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.is_deleted = false AND
-                deals_deal.new_business = true AND
-                deals_deal.status_id = {status_id}
+                closed_deals.assigned_to_id = users_lilyuser.id AND
+                closed_deals.new_business = true AND
+                closed_deals.status_id = {status_id}
             GROUP BY
                 users_lilyuser.last_name
             ORDER BY
                 users_lilyuser.last_name;
         '''.format(
-            tenant_id=request.user.tenant_id,
+            closed_deals=DEALS_CLOSED_LAST_MONTH.format(tenant_id=request.user.tenant_id),
             status_id=deal_status.pk
         )
 
@@ -285,25 +309,22 @@ class DealsLost(RawDatabaseView):
         return '''
             SELECT
                 users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfNotWonDeals,
-                sum(deals_deal.amount_recurring) as TotalAmountNotWonDeals,
-                ROUND(sum(deals_deal.amount_recurring)/count(deals_deal.id),2) as AvgPerNotWonDeal
+                sum(closed_deals.deal_count) as NrOfNotWonDeals,
+                sum(closed_deals.amount_recurring) as TotalAmountNotWonDeals,
+                ROUND(sum(closed_deals.amount_recurring)/sum(closed_deals.deal_count),2) as AvgPerNotWonDeal
             FROM
                 public.users_lilyuser,
-                public.deals_deal
+                {closed_deals}
             WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.closed_date > now() - interval '30 days month' AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.status_id = {status_id} AND
-                deals_deal.is_deleted = false AND
-                deals_deal.new_business = true
+                closed_deals.assigned_to_id = users_lilyuser.id AND
+                closed_deals.status_id = {status_id} AND
+                closed_deals.new_business = true
             GROUP BY
-                users_lilyuser.last_name,deals_deal.new_business
+                users_lilyuser.last_name,closed_deals.new_business
             ORDER BY
                 users_lilyuser.last_name;
         '''.format(
-            tenant_id=request.user.tenant_id,
+            closed_deals=DEALS_CLOSED_LAST_MONTH.format(tenant_id=request.user.tenant_id),
             status_id=deal_status.pk
         )
 
@@ -318,25 +339,22 @@ class DealsAmountRecurring(RawDatabaseView):
         return '''
             SELECT
                 users_lilyuser.last_name,
-                count(deals_deal.id) as NrOfWonDeals,
-                sum(deals_deal.amount_recurring) as TotalAmountWonDeals,
-                ROUND(sum(deals_deal.amount_recurring)/count(deals_deal.id),2) as AvgPerWonDeal,
-                deals_deal.new_business
+                sum(closed_deals.deal_count) as NrOfWonDeals,
+                sum(closed_deals.amount_recurring) as TotalAmountWonDeals,
+                ROUND(sum(closed_deals.amount_recurring)/sum(closed_deals.deal_count),2) as AvgPerWonDeal,
+                closed_deals.new_business
             FROM
                 public.users_lilyuser,
-                public.deals_deal
+                {closed_deals}
             WHERE
-                deals_deal.assigned_to_id = users_lilyuser.id AND
-                deals_deal.closed_date > now() - interval '30 days month' AND
-                deals_deal.is_deleted = false AND
-                deals_deal.tenant_id = {tenant_id} AND
-                deals_deal.new_business = false AND
-                deals_deal.status_id = {status_id}
+                closed_deals.assigned_to_id = users_lilyuser.id AND
+                closed_deals.new_business = false AND
+                closed_deals.status_id = {status_id}
             GROUP BY
-                users_lilyuser.last_name,deals_deal.new_business
+                users_lilyuser.last_name,closed_deals.new_business
             ORDER BY
-                users_lilyuser.last_name,deals_deal.new_business;
+                users_lilyuser.last_name,closed_deals.new_business;
         '''.format(
-            tenant_id=request.user.tenant_id,
+            closed_deals=DEALS_CLOSED_LAST_MONTH.format(tenant_id=request.user.tenant_id),
             status_id=deal_status.pk
         )
@@ -3,12 +3,17 @@ from urllib import urlencode
 from datetime import datetime, timedelta, date
 import json
 
+import redis
 from oauth2client import GOOGLE_TOKEN_URI
 from oauth2client.client import OAuth2Credentials
 
 from decimal import Decimal
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, Group
+from django.db import connection
 from django.db.models import Manager, Model
+from django.test.utils import CaptureQueriesContext
+from mock import patch
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient, APITestCase
@@ -19,6 +24,30 @@ from lily.tenant.middleware import set_current_user
 from lily.users.models import LilyUser
 
 
+class RedisTestMixin(object):
+    """
+    Mixin for tests of code that uses Redis directly (see lily.utils.functions.get_redis).
+
+    The tests run against a dedicated database of the Redis server, so they don't touch the data of a development
+    environment. The database is emptied before and after every test.
+    """
+    def setUp(self):
+        super(RedisTestMixin, self).setUp()
+
+        self.redis = redis.StrictRedis(
+            host=settings.REDIS.hostname,
+            port=settings.REDIS.port or 6379,
+            password=settings.REDIS.password,
+            db=settings.REDIS_TEST_DB
+        )
+        self.redis.flushdb()
+        self.addCleanup(self.redis.flushdb)
+
+        patcher = patch('lily.utils.functions._redis', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
 class UserBasedTest(object):
     """
     Baseclass that provides functionality for tests that require a logged in user.
@@ -190,6 +219,8 @@ class GenericAPITestCase(CompareObjectsMixin, UserBasedTest, APITestCase):
     model_cls = None
     serializer_cls = None
     ordering = ('-id', )  # Default ordering field
+    # Whether the number of queries for the list is independent of the number of objects (see PrefetchRelatedMixin).
+    constant_list_queries = False
 
     def __call__(self, result=None):
         """
@@ -266,6 +297,32 @@ class GenericAPITestCase(CompareObjectsMixin, UserBasedTest, APITestCase):
         for i, db_obj in enumerate(reversed(other_tenant_obj_list)):
             self._compare_objects(db_obj, request.data.get('results')[i])
 
+    def _get_list_query_count(self):
+        with CaptureQueriesContext(connection) as context:
+            request = self.user.get(self.get_url(self.list_url))
+
+        self.assertStatus(request, status.HTTP_200_OK)
+
+        return len(context.captured_queries)
+
+    def test_get_list_query_count(self):
+        """
+        Test that the number of queries for the list doesn't grow with the number of objects.
+        """
+        if not self.constant_list_queries:
+            self.skipTest('The list of %s doesn\'t prefetch its relations.' % self.model_cls.__name__)
+
+        set_current_user(self.user_obj)
+        self._create_object(with_relations=True, size=2)
+        query_count = self._get_list_query_count()
+
+        self._create_object(with_relations=True, size=5)
+        self.assertEqual(
+            self._get_list_query_count(),
+            query_count,
+            '%s list used %s queries for 2 objects, but more for 7 objects.' % (self.model_cls.__name__, query_count)
+        )
+
     def test_get_object_unauthenticated(self):
         """
         Test that an unauthenticated user doesn't have access to the object.
@@ -0,0 +1,75 @@
+"""
+Exports of list views to file storage, for exports too large to stream within a request.
+
+The export is produced by the view itself (see ExportListViewMixin), with a request rebuilt from the original query.
+The progress and the storage path of the file are stored in the cache, so they can be polled. The url of the file is
+signed when it's polled, because signed urls expire long before the status.
+"""
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import HttpRequest, QueryDict
+from django.utils.module_loading import import_string
+
+from lily.tenant.middleware import set_current_user
+
+from .jobs import DONE, RUNNING, get_job_status, set_job_status
+
+
+STATUS_KEY = 'export:%s'
+UPLOAD_TO = 'exports/%(tenant_id)s/%(export_id)s/%(file_name)s'
+
+
+def get_export_status(export_id):
+    return get_job_status(STATUS_KEY % export_id)
+
+
+def set_export_status(export_id, **status):
+    set_job_status(STATUS_KEY % export_id, **status)
+
+
+def export_to_storage(view_path, user_id, query_string, export_id):
+    """
+    Write the export of a list view to file storage.
+
+    Args:
+        view_path (str): dotted path of the view class
+        user_id (int): id of the user that requested the export
+        query_string (str): the query of the export request
+        export_id (str): id to report the progress with
+
+    Returns:
+        str: the storage path of the exported file
+    """
+    user = get_user_model().objects.get(pk=user_id)
+    # Querysets of the view are filtered on the tenant of the current user.
+    set_current_user(user)
+
+    request = HttpRequest()
+    request.user = user
+    request.GET = QueryDict(query_string)
+
+    view = import_string(view_path)()
+    view.request = request
+    view.args = ()
+    view.kwargs = {}
+
+    set_export_status(export_id, tenant_id=user.tenant_id, status=RUNNING)
+
+    # Write to a temporary file first, so the export doesn't have to fit in memory.
+    with tempfile.TemporaryFile() as export_file:
+        for line in view.get_csv():
+            export_file.write(line)
+
+        export_file.seek(0)
+        path = default_storage.save(UPLOAD_TO % {
+            'tenant_id': user.tenant_id,
+            'export_id': export_id,
+            'file_name': view.file_name,
+        }, File(export_file))
+
+    set_export_status(export_id, tenant_id=user.tenant_id, status=DONE, path=path)
+
+    return path
@@ -6,6 +6,7 @@ from time import time
 
 import anyjson
 import phonenumbers
+import redis
 import requests
 from django import forms
 from django.conf import settings
@@ -92,6 +93,32 @@ def parse_phone_number(raw_number):
     return number
 
 
+def normalize_phone_number(number, country_code=None):
+    """
+    Return the phone number in E.164 format, so differently formatted numbers can be compared.
+
+    Args:
+        number (str): the phone number as entered or received
+        country_code (str): country to parse numbers without international prefix for
+
+    Returns:
+        str: the normalized number or an empty string if the number has no digits
+    """
+    if not number:
+        return ''
+
+    try:
+        parsed_number = phonenumbers.parse(number, country_code or None)
+    except phonenumbers.NumberParseException:
+        parsed_number = None
+
+    if parsed_number is None or not phonenumbers.is_possible_number(parsed_number):
+        # Internal, partial or foreign numbers without country code, use the same parsing as before.
+        return parse_phone_number(number)
+
+    return phonenumbers.format_number(parsed_number, phonenumbers.PhoneNumberFormat.E164)
+
+
 def format_phone_number(number, country_code=None, international=False):
     if international:
         # Parse phone number including country code.
@@ -327,3 +354,18 @@ def has_required_tier(required_tier, tenant=None):
     else:
         # Billing isn't enable so always return true.
         return True
+
+
+_redis = None
+
+
+def get_redis():
+    """
+    Return the Redis client of this process, which is shared by everything that uses Redis directly.
+    """
+    global _redis
+
+    if _redis is None:
+        _redis = redis.StrictRedis.from_url(settings.REDIS_URL)
+
+    return _redis
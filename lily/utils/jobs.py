@@ -0,0 +1,29 @@
+"""
+Status of background jobs (e.g. imports and exports).
+
+The status is stored in the cache, so clients can poll the progress of a job while it runs in a task.
+"""
+from django.core.cache import cache
+
+
+STATUS_TIMEOUT = 60 * 60 * 24
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def get_job_status(key):
+    """
+    Return the status of a job, or None if it doesn't exist (anymore).
+    """
+    return cache.get(key)
+
+
+def set_job_status(key, **status):
+    """
+    Replace the status of a job.
+
+    Args:
+        key (str): cache key of the job, e.g. 'export:<export id>'
+        status (dict): the status, the tenant of the job is included to check who can see it
+    """
+    cache.set(key, status, STATUS_TIMEOUT)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from lily.utils.functions import normalize_phone_number
+
+
+def link_normalized_numbers(apps, schema_editor):
+    Tenant = apps.get_model('tenant', 'Tenant')
+    NormalizedPhoneNumber = apps.get_model('utils', 'NormalizedPhoneNumber')
+    PhoneNumber = apps.get_model('utils', 'PhoneNumber')
+
+    for tenant in Tenant.objects.all():
+        numbers = defaultdict(list)
+        for number in PhoneNumber.objects.filter(tenant=tenant).values_list('number', flat=True).distinct():
+            normalized_number = normalize_phone_number(number, tenant.country)
+            if normalized_number:
+                numbers[normalized_number].append(number)
+
+        existing = set(NormalizedPhoneNumber.objects.filter(tenant=tenant).values_list('number', flat=True))
+        NormalizedPhoneNumber.objects.bulk_create([
+            NormalizedPhoneNumber(tenant=tenant, number=number) for number in numbers if number not in existing
+        ])
+        normalized_ids = dict(NormalizedPhoneNumber.objects.filter(tenant=tenant).values_list('number', 'id'))
+
+        for normalized_number, raw_numbers in numbers.items():
+            PhoneNumber.objects.filter(tenant=tenant, number__in=raw_numbers).update(
+                normalized_id=normalized_ids[normalized_number]
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0005_tenant_billing'),
+        ('utils', '0018_auto_20170615_1438'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NormalizedPhoneNumber',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('number', models.CharField(max_length=40)),
+                ('tenant', models.ForeignKey(to='tenant.Tenant', blank=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='normalizedphonenumber',
+            unique_together=set([('tenant', 'number')]),
+        ),
+        migrations.AddField(
+            model_name='phonenumber',
+            name='normalized',
+            field=models.ForeignKey(related_name='phone_numbers', on_delete=django.db.models.deletion.SET_NULL,
+                                    blank=True, to='utils.NormalizedPhoneNumber', null=True),
+        ),
+        migrations.RunPython(link_normalized_numbers, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from lily.tenant.models import TenantMixin
 from lily.utils.countries import COUNTRIES
+from lily.utils.functions import normalize_phone_number
 
 
 PHONE_TYPE_CHOICES = (
@@ -14,6 +15,60 @@ PHONE_TYPE_CHOICES = (
 )
 
 
+class NormalizedPhoneNumber(TenantMixin):
+    """
+    A phone number in E.164 format, linking phone numbers and call participants regardless of their formatting.
+    """
+    number = models.CharField(max_length=40)
+
+    @classmethod
+    def get_for_number(cls, tenant, number):
+        """
+        Return the normalized version of a phone number of the tenant, creating it if needed.
+
+        Returns:
+            NormalizedPhoneNumber or None if the number has no digits
+        """
+        normalized_number = normalize_phone_number(number, tenant.country)
+
+        if not normalized_number:
+            return None
+
+        return cls.objects.get_or_create(tenant=tenant, number=normalized_number)[0]
+
+    @classmethod
+    def get_for_numbers(cls, tenant, numbers):
+        """
+        Bulk version of get_for_number, for phone numbers which are created with bulk_create.
+
+        Returns:
+            dict: NormalizedPhoneNumber per given number, for the numbers that have digits
+        """
+        normalized_numbers = {}
+        for number in numbers:
+            normalized_number = normalize_phone_number(number, tenant.country)
+            if normalized_number:
+                normalized_numbers[number] = normalized_number
+
+        existing = {
+            obj.number: obj for obj in cls.objects.filter(tenant=tenant, number__in=set(normalized_numbers.values()))
+        }
+        missing = set(normalized_numbers.values()) - set(existing)
+
+        if missing:
+            cls.objects.bulk_create([cls(tenant=tenant, number=number) for number in missing])
+            existing.update({obj.number: obj for obj in cls.objects.filter(tenant=tenant, number__in=missing)})
+
+        return {number: existing[normalized_number] for number, normalized_number in normalized_numbers.items()}
+
+    def __unicode__(self):
+        return self.number
+
+    class Meta:
+        app_label = 'utils'
+        unique_together = ('tenant', 'number', )
+
+
 class PhoneNumber(TenantMixin):
     """
     Phone number model, keeps a raw input version and a clean version (only has digits).
@@ -41,6 +96,14 @@ class PhoneNumber(TenantMixin):
         default=ACTIVE_STATUS,
         verbose_name=_('status')
     )
+    # Maintained on save, used to look up calls and entities by number.
+    normalized = models.ForeignKey(
+        NormalizedPhoneNumber,
+        related_name='phone_numbers',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
 
     def __unicode__(self):
         return self.number
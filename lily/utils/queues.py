@@ -0,0 +1,125 @@
+"""
+Thread local state which lives as long as the current request or Celery task.
+
+Queues collect work during a request or task and process it at the end, when the changes the work depends on are
+committed. Requests and tasks can be nested (e.g. tasks which run eagerly), the state is only flushed when the
+outermost one finishes. Outside of requests and tasks (e.g. in management commands and the shell) nothing would flush
+a queue, so work is processed right away.
+
+All registered instances are started and finished by the request and task signals connected in lily.utils.signals.
+"""
+import logging
+import threading
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+_registry = []
+
+
+class RequestLocal(threading.local):
+    """
+    Thread local state which is set up when a request or task starts and flushed when it finishes.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.reset()
+
+    @property
+    def active(self):
+        """
+        Whether a request or task is running in this thread.
+        """
+        return self.depth > 0
+
+    def reset(self):
+        """
+        Set up the state for the next request or task.
+        """
+        pass
+
+    def start(self):
+        self.depth += 1
+
+    def finish(self):
+        self.depth = max(self.depth - 1, 0)
+
+        if not self.depth:
+            self.flush()
+
+    def flush(self):
+        self.reset()
+
+
+class RequestQueue(RequestLocal):
+    """
+    Thread local queue of work which is processed at the end of the request or task.
+
+    Subclasses implement process, and reset and add if they collect the items in something other than a list.
+    """
+    # Process the queue early when it grows larger than this (e.g. during imports), None for no limit.
+    max_size = None
+
+    def reset(self):
+        self.items = []
+
+    def add(self, item):
+        self.items.append(item)
+        self.flush_if_needed()
+
+    def flush_if_needed(self):
+        """
+        Process the queue right away outside of requests and tasks, or when it has grown too large.
+        """
+        if not self.active or (self.max_size and len(self.items) >= self.max_size):
+            self.flush()
+
+    def drain(self):
+        """
+        Empty the queue and return the items which were queued.
+        """
+        items = self.items
+        self.reset()
+        return items
+
+    def flush(self):
+        items = self.drain()
+
+        if items:
+            self.process(items)
+
+    def process(self, items):
+        raise NotImplementedError()
+
+
+def register(request_local):
+    """
+    Let the request and task signals start and finish the RequestLocal.
+
+    Returns:
+        the RequestLocal, so it can be registered where it's created
+    """
+    _registry.append(request_local)
+    return request_local
+
+
+def start_request_locals(**kwargs):
+    """
+    Start all registered RequestLocals, connected to the start of requests and tasks.
+    """
+    for request_local in _registry:
+        request_local.start()
+
+
+def finish_request_locals(**kwargs):
+    """
+    Finish all registered RequestLocals, connected to the end of requests and tasks.
+
+    A failure of one doesn't keep the others from being flushed.
+    """
+    for request_local in _registry:
+        try:
+            request_local.finish()
+        except Exception, e:
+            logger.error(traceback.format_exc(e))
@@ -0,0 +1,28 @@
+from celery.signals import task_postrun, task_prerun
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import pre_save
+from django.dispatch.dispatcher import receiver
+
+from .functions import normalize_phone_number
+from .models.models import NormalizedPhoneNumber, PhoneNumber
+from .queues import finish_request_locals, start_request_locals
+
+
+@receiver(pre_save, sender=PhoneNumber)
+def phone_number_pre_save(sender, instance, **kwargs):
+    # Not skippable, lookups by number depend on it.
+    if instance.normalized_id:
+        normalized_number = normalize_phone_number(instance.number, instance.tenant.country)
+
+        if normalized_number and normalized_number == instance.normalized.number:
+            # The number didn't change.
+            return
+
+    instance.normalized = NormalizedPhoneNumber.get_for_number(instance.tenant, instance.number)
+
+
+# Queues and other request local state (see lily.utils.queues) live as long as the request or Celery task.
+request_started.connect(start_request_locals, dispatch_uid='request_locals_request_started')
+request_finished.connect(finish_request_locals, dispatch_uid='request_locals_request_finished')
+task_prerun.connect(start_request_locals, dispatch_uid='request_locals_task_prerun', weak=False)
+task_postrun.connect(finish_request_locals, dispatch_uid='request_locals_task_postrun', weak=False)
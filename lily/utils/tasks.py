@@ -3,6 +3,13 @@ import logging
 from celery.task import task
 from django.core.management import call_command
 
+from lily.tenant.middleware import set_current_user
+
+from .exports import export_to_storage, get_export_status, set_export_status
+from .jobs import FAILED
+from .models.models import Webhook
+from .webhooks import deliver_events
+
 
 logger = logging.getLogger(__name__)
 
@@ -25,3 +32,26 @@ def clear_sessions_scheduler():
     Call the Django provided management command to clear expired sessions.
     """
     call_command('clearsessions', interactive=False)
+
+
+@task(name='export_list', logger=logger)
+def export_list(view_path, user_id, query_string, export_id):
+    """
+    Write the export of a list view to file storage, see ExportListViewMixin.
+    """
+    try:
+        export_to_storage(view_path, user_id, query_string, export_id)
+    except Exception:
+        logger.exception('Export %s of %s failed', export_id, view_path)
+        set_export_status(export_id, **dict(get_export_status(export_id) or {}, status=FAILED))
+        raise
+    finally:
+        set_current_user(None)
+
+
+@task(name='deliver_webhook_events', logger=logger)
+def deliver_webhook_events(webhook_id):
+    """
+    Post the queued events of a webhook, see lily.utils.webhooks.
+    """
+    deliver_events(Webhook.objects.filter(pk=webhook_id).first(), webhook_id)
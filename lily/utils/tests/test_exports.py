@@ -0,0 +1,100 @@
+import json
+
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.views.generic import View
+from mock import patch
+
+from lily.tenant.middleware import set_current_user
+from lily.users.factories import LilyUserFactory
+from lily.utils import exports, jobs
+from lily.utils.tasks import export_list
+from lily.utils.views.mixins import ExportListViewMixin
+
+
+class ExportView(ExportListViewMixin, View):
+    file_name = 'export.csv'
+
+    def get_csv(self):
+        yield 'id,name\r\n'
+        yield '1,Test\r\n'
+
+
+class FailingExportView(ExportView):
+    def get_csv(self):
+        raise ValueError()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ExportTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.user = LilyUserFactory.create()
+        self.view_path = '%s.%s' % (__name__, ExportView.__name__)
+
+        patcher = patch('lily.utils.exports.default_storage')
+        self.storage = patcher.start()
+        self.storage.save.side_effect = lambda path, content: path
+        self.addCleanup(patcher.stop)
+
+    def get(self, user=None, **params):
+        request = RequestFactory().get('/', params)
+        request.user = user or self.user
+
+        return ExportView.as_view()(request)
+
+    def get_status(self, export_id, user=None):
+        with patch('lily.utils.views.mixins.default_storage') as storage:
+            storage.url.side_effect = lambda path: 'https://storage.example.com/%s?signature=1' % path
+            return json.loads(self.get(user, export_id=export_id).content)
+
+    def test_export(self):
+        """
+        Test that an export is written to the storage and its status moves from pending to done.
+        """
+        with patch.object(export_list, 'apply_async') as apply_async:
+            response = self.get(export_async=1, export_columns='name')
+
+        export_id = json.loads(response.content)['export_id']
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.get_status(export_id)['status'], jobs.PENDING)
+
+        view_path, user_id, query_string, task_export_id = apply_async.call_args[1]['args']
+        self.assertEqual((view_path, user_id, query_string, task_export_id),
+                         (self.view_path, self.user.pk, 'export_columns=name', export_id))
+
+        export_list(view_path, user_id, query_string, export_id)
+
+        path = 'exports/%s/%s/export.csv' % (self.user.tenant_id, export_id)
+        self.assertEqual(self.storage.save.call_args[0][0], path)
+        self.assertEqual(self.get_status(export_id), {
+            'tenant_id': self.user.tenant_id,
+            'status': jobs.DONE,
+            'url': 'https://storage.example.com/%s?signature=1' % path,
+        })
+
+    def test_failed_export(self):
+        """
+        Test that the status of an export that raises an error is failed.
+        """
+        exports.set_export_status('1', tenant_id=self.user.tenant_id, status=jobs.PENDING)
+
+        with self.assertRaises(ValueError):
+            export_list('%s.%s' % (__name__, FailingExportView.__name__), self.user.pk, '', '1')
+
+        self.assertEqual(self.get_status('1'), {'tenant_id': self.user.tenant_id, 'status': jobs.FAILED})
+        self.assertFalse(self.storage.save.called)
+
+    def test_status_of_other_tenant(self):
+        """
+        Test that the status of an export can only be requested by its own tenant.
+        """
+        exports.set_export_status('1', tenant_id=self.user.tenant_id, status=jobs.DONE, path='exports/export.csv')
+
+        with self.assertRaises(Http404):
+            self.get_status('1', user=LilyUserFactory.create())
+
+        with self.assertRaises(Http404):
+            self.get_status('2')
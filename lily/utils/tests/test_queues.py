@@ -0,0 +1,76 @@
+from django.test import SimpleTestCase
+from mock import patch
+
+from lily.utils import queues
+
+
+class ListQueue(queues.RequestQueue):
+    max_size = 3
+
+    def __init__(self):
+        super(ListQueue, self).__init__()
+        self.processed = []
+
+    def process(self, items):
+        self.processed.append(items)
+
+
+class FailingQueue(queues.RequestQueue):
+    def process(self, items):
+        raise ValueError()
+
+
+class RequestQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.queue = ListQueue()
+
+    def test_outside_request(self):
+        """
+        Test that items are processed right away outside of requests and tasks.
+        """
+        self.queue.add(1)
+        self.queue.add(2)
+
+        self.assertEqual(self.queue.processed, [[1], [2]])
+
+    def test_nested(self):
+        """
+        Test that items are only processed at the end of the outermost request or task.
+        """
+        self.queue.start()
+        self.queue.start()
+        self.queue.add(1)
+        self.queue.finish()
+        self.assertEqual(self.queue.processed, [])
+
+        self.queue.finish()
+        self.assertEqual(self.queue.processed, [[1]])
+        self.assertFalse(self.queue.active)
+
+    def test_max_size(self):
+        """
+        Test that a full queue is processed before the request or task finishes.
+        """
+        self.queue.start()
+        for item in range(4):
+            self.queue.add(item)
+        self.assertEqual(self.queue.processed, [[0, 1, 2]])
+
+        self.queue.finish()
+        self.assertEqual(self.queue.processed, [[0, 1, 2], [3]])
+
+    def test_finish_request_locals(self):
+        """
+        Test that all registered queues are flushed, even if one of them fails.
+        """
+        failing_queue = FailingQueue()
+
+        with patch.object(queues, '_registry', [failing_queue, self.queue]):
+            queues.start_request_locals()
+            failing_queue.add(1)
+            self.queue.add(2)
+
+            queues.finish_request_locals()
+
+        self.assertEqual(self.queue.processed, [[2]])
+        self.assertFalse(failing_queue.items)
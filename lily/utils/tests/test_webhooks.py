@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from mock import Mock, patch
+from requests import ConnectionError
+
+from lily.tests.utils import RedisTestMixin
+from lily.utils import webhooks
+
+
+class WebhookDeliveryTests(RedisTestMixin, SimpleTestCase):
+    webhook_id = 1
+
+    def setUp(self):
+        super(WebhookDeliveryTests, self).setUp()
+        self.webhook = Mock(url='https://example.com/hook')
+        self.client = self.redis
+
+        patcher = patch('lily.utils.tasks.deliver_webhook_events.apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue(self, *payloads):
+        for payload in payloads:
+            webhooks.queue_webhook_event(self.webhook_id, payload)
+        webhooks.flush_webhook_queue()
+
+    def deliver(self, *results):
+        with patch.object(webhooks, 'post_event', side_effect=results) as post_event:
+            webhooks.deliver_events(self.webhook, self.webhook_id)
+
+        return [call[0][1] for call in post_event.call_args_list]
+
+    def post(self, status_code=None, error=None):
+        session = Mock()
+        session.post.return_value = Mock(status_code=status_code)
+        session.post.side_effect = error
+
+        with patch.object(webhooks, 'get_session', return_value=session):
+            return webhooks.post_event('https://example.com/hook', '{}')
+
+    def test_post_event(self):
+        """
+        Test that only temporary errors of webhooks are retried.
+        """
+        self.assertEqual(self.post(200), webhooks.DELIVERED)
+        self.assertEqual(self.post(404), webhooks.FAILED)
+        self.assertEqual(self.post(429), webhooks.RETRY)
+        self.assertEqual(self.post(503), webhooks.RETRY)
+        self.assertEqual(self.post(error=ConnectionError()), webhooks.RETRY)
+
+    def test_queue(self):
+        """
+        Test that events are handed off at the end of a request or task, or right away outside of them.
+        """
+        events_key = webhooks.EVENTS_KEY % self.webhook_id
+
+        webhooks.webhook_queue.start()
+        try:
+            webhooks.queue_webhook_event(self.webhook_id, '1')
+            self.assertEqual(self.client.llen(events_key), 0)
+        finally:
+            webhooks.webhook_queue.finish()
+        self.assertEqual(self.client.llen(events_key), 1)
+
+        # E.g. a management command.
+        webhooks.queue_webhook_event(self.webhook_id, '2')
+        self.assertEqual(self.client.lrange(events_key, 0, -1), ['1', '2'])
+
+    @override_settings(WEBHOOK_BATCH_SIZE=2)
+    def test_batching(self):
+        """
+        Test that a burst of events is delivered by one task in batches, in order.
+        """
+        self.queue('1', '2', '3')
+        self.assertEqual(self.apply_async.call_count, 1)
+
+        self.assertEqual(self.deliver(webhooks.DELIVERED, webhooks.DELIVERED), ['1', '2'])
+        # The rest of the events needs another delivery.
+        self.assertEqual(self.apply_async.call_count, 2)
+
+        self.assertEqual(self.deliver(webhooks.DELIVERED), ['3'])
+        self.assertEqual(self.apply_async.call_count, 2)
+        self.assertEqual(webhooks.get_webhook_metrics(self.webhook_id)[webhooks.DELIVERED], 3)
+
+    def test_failure(self):
+        """
+        Test that events aren't lost when a delivery fails or crashes.
+        """
+        self.queue('1', '2', '3')
+
+        with self.assertRaises(ConnectionError):
+            self.deliver(webhooks.DELIVERED, ConnectionError())
+
+        # The delivered event is removed, the others are resumed by the next delivery.
+        self.assertEqual(self.deliver(webhooks.DELIVERED, webhooks.DELIVERED), ['2', '3'])
+
+        self.queue('4')
+        self.assertEqual(self.deliver(webhooks.FAILED), ['4'])
+        self.assertEqual(self.deliver(), [])
+        self.assertEqual(webhooks.get_webhook_metrics(self.webhook_id)[webhooks.FAILED], 1)
+
+    def test_retry(self):
+        """
+        Test that a temporary error is retried with backoff, also by deliveries that were scheduled already.
+        """
+        self.queue('1', '2')
+        self.apply_async.reset_mock()
+
+        self.assertEqual(self.deliver(webhooks.DELIVERED, webhooks.RETRY), ['1', '2'])
+        self.assertEqual(self.apply_async.call_args[1]['countdown'], settings.WEBHOOK_RETRY_DELAY)
+
+        # A delivery scheduled before the failure waits for the backoff as well.
+        self.assertEqual(self.deliver(), [])
+        self.assertGreater(self.apply_async.call_args[1]['countdown'], 0)
+
+        # Once the backoff is over the failed event is delivered again, before any later events.
+        self.client.delete(webhooks.NOT_BEFORE_KEY % self.webhook_id)
+        self.queue('3')
+        self.assertEqual(self.deliver(webhooks.RETRY), ['2'])
+        self.assertEqual(self.apply_async.call_args[1]['countdown'], settings.WEBHOOK_RETRY_DELAY * 2)
+
+        self.client.delete(webhooks.NOT_BEFORE_KEY % self.webhook_id)
+        self.assertEqual(self.deliver(webhooks.DELIVERED), ['2'])
+        self.assertEqual(self.deliver(webhooks.DELIVERED), ['3'])
+        self.assertEqual(webhooks.get_webhook_metrics(self.webhook_id)['retried'], 2)
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=2)
+    def test_dropped(self):
+        """
+        Test that an event is dropped after the max number of attempts.
+        """
+        self.queue('1', '2')
+
+        self.assertEqual(self.deliver(webhooks.RETRY), ['1'])
+
+        self.client.delete(webhooks.NOT_BEFORE_KEY % self.webhook_id)
+        self.assertEqual(self.deliver(webhooks.RETRY), ['1'])
+        self.assertEqual(webhooks.get_webhook_metrics(self.webhook_id)['dropped'], 1)
+
+        self.assertEqual(self.deliver(webhooks.DELIVERED), ['2'])
@@ -1,4 +1,5 @@
 import operator
+import uuid
 from collections import OrderedDict
 
 import anyjson
@@ -6,16 +7,19 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
 from django.db.models import Q, FieldDoesNotExist
 from django.forms.models import modelformset_factory
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils.http import base36_to_int
 import unicodecsv
 
 from lily.tags.models import Tag
 
+from ..exports import get_export_status, set_export_status
 from ..functions import is_ajax
+from ..jobs import PENDING
 
 
 class LoginRequiredMixin(object):
@@ -85,6 +89,14 @@ class FilterQuerysetMixin(object):
         return queryset
 
 
+class Echo(object):
+    """
+    File-like object that returns what is written to it, so csv writers can be used to produce streamed content.
+    """
+    def write(self, value):
+        return value
+
+
 class ExportListViewMixin(FilterQuerysetMixin):
     """
     Mixin that makes it possible to export current list view
@@ -94,6 +106,10 @@ class ExportListViewMixin(FilterQuerysetMixin):
 
     If `export_columns` in request.POST, only these will be exported.
     If `export_filter` in request.POST, object_list will be searched.
+    If `export_async` in request.GET, the export is written to file storage by a task, its progress (and the url of the
+    file when it's done) can be requested with `export_id` in request.GET.
+
+    The export is streamed, the rows are written as soon as they're ready.
 
     Attributes:
         exportable_columns (dict): List with info on the columns to be exported. Should look like:
@@ -129,13 +145,21 @@ class ExportListViewMixin(FilterQuerysetMixin):
     def value_for_column(self, item, column):
         return ''
 
-    def get(self, request, *args, **kwargs):
+    def get_column_extractor(self, column):
+        """
+        Return a function that returns the value of the column for an item.
+
+        This is called once per column of an export, so views can do the work independent of the items up front.
         """
+        return lambda item: self.value_for_column(item, column)
+
+    def get_export_columns(self):
+        """
+        Return the headers and the columns to export.
         """
-        # Setup headers, columns and search
         headers = []
         columns = []
-        export_columns = request.GET.getlist('export_columns', None)
+        export_columns = self.request.GET.getlist('export_columns', None)
         if export_columns:
             # Always insert id
             export_columns.insert(0, 'id')
@@ -151,26 +175,65 @@ class ExportListViewMixin(FilterQuerysetMixin):
                 headers.extend(value.get('headers', []))
                 columns.extend(value.get('columns_for_item', []))
 
-        # Setup response type.
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="%s"' % self.file_name
+        return [unicode(header) for header in headers], columns
 
-        # Setup writer.
-        writer = unicodecsv.writer(response)
+    def get_rows(self):
+        """
+        Yield the headers followed by a row for every item.
+        """
+        headers, columns = self.get_export_columns()
+        extractors = [self.get_column_extractor(column) for column in columns]
 
-        # Add headers to response.
-        headers = [unicode(header) for header in headers]
-        writer.writerow(headers)
+        yield headers
 
         # For each item, make a row to export.
         for item in self.get_items():
-            row = []
-            for column in columns:
-                # Get the value from the item.
-                value = self.value_for_column(item, column)
-                row.append(value)
-            # Add complete row to response.
-            writer.writerow(row)
+            yield [extractor(item) for extractor in extractors]
+
+    def get_csv(self):
+        """
+        Yield the export as csv, line by line.
+        """
+        writer = unicodecsv.writer(Echo())
+
+        for row in self.get_rows():
+            yield writer.writerow(row)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Stream the export to the client, or start or check an export to file storage.
+        """
+        if 'export_id' in request.GET:
+            export_status = get_export_status(request.GET['export_id'])
+
+            if not export_status or export_status.get('tenant_id') != request.user.tenant_id:
+                raise Http404()
+
+            path = export_status.pop('path', None)
+            if path:
+                # Sign the url on every request, signed urls expire long before the export.
+                export_status['url'] = default_storage.url(path)
+
+            return HttpResponse(anyjson.serialize(export_status), content_type='application/json')
+
+        if 'export_async' in request.GET:
+            # Prevent circular imports.
+            from ..tasks import export_list
+
+            export_id = uuid.uuid4().hex
+            set_export_status(export_id, tenant_id=request.user.tenant_id, status=PENDING)
+
+            query = request.GET.copy()
+            del query['export_async']
+            view_path = '%s.%s' % (self.__class__.__module__, self.__class__.__name__)
+            export_list.apply_async(args=(view_path, request.user.pk, query.urlencode(), export_id))
+
+            return HttpResponse(anyjson.serialize({'export_id': export_id}), content_type='application/json',
+                                status=202)
+
+        response = StreamingHttpResponse(self.get_csv(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % self.file_name
+
         return response
 
 
@@ -0,0 +1,274 @@
+"""
+Delivery of webhook events.
+
+Events are queued during a request (or task) and pushed to a list per webhook in Redis when it finishes, outside of
+requests and tasks they're pushed right away. The deliver_webhook_events task posts them to the webhook on its own
+queue, so slow endpoints don't delay API responses.
+
+A burst of events for the same webhook is delivered by a single task, over a reused connection. The number of
+deliveries to a webhook at a time is limited, failed deliveries are retried with exponential backoff and delivery
+metrics are counted per webhook.
+
+A delivery moves a batch of events to a processing list of its slot and only removes an event from it once the webhook
+has accepted or refused it, so a failed delivery or a crashed worker doesn't lose events. They're resumed by the next
+delivery that takes the slot.
+"""
+import logging
+import math
+import time
+import traceback
+
+import requests
+from django.conf import settings
+
+from .functions import get_redis
+from .queues import RequestQueue, register
+
+
+logger = logging.getLogger(__name__)
+
+EVENTS_KEY = 'webhooks:events:%s'
+PROCESSING_KEY = 'webhooks:processing:%s:%s'
+SCHEDULED_KEY = 'webhooks:scheduled:%s'
+NOT_BEFORE_KEY = 'webhooks:not_before:%s'
+SLOT_KEY = 'webhooks:slot:%s:%s'
+ATTEMPTS_KEY = 'webhooks:attempts:%s'
+METRICS_KEY = 'webhooks:metrics:%s'
+
+# Move a batch of events to a processing list in one go, so no events get lost in between.
+MOVE_BATCH_SCRIPT = """
+local events = redis.call('lrange', KEYS[1], 0, ARGV[1] - 1)
+if #events > 0 then
+    redis.call('ltrim', KEYS[1], ARGV[1], -1)
+    redis.call('rpush', KEYS[2], unpack(events))
+end
+return events
+"""
+
+DELIVERED, RETRY, FAILED = 'delivered', 'retry', 'failed'
+
+_session = None
+
+
+def get_session():
+    """
+    Return the HTTP session of this process, which keeps the connections to webhooks open between deliveries.
+    """
+    global _session
+
+    if _session is None:
+        _session = requests.Session()
+        _session.headers.update({'Content-Type': 'application/json'})
+
+    return _session
+
+
+class WebhookQueue(RequestQueue):
+    """
+    Thread local queue of webhook events which still have to be handed off for delivery.
+
+    Events are handed off at the end of the request or task, when the changes they describe are committed.
+    """
+    def process(self, events):
+        try:
+            pipeline = get_redis().pipeline()
+            for webhook_id, payload in events:
+                pipeline.rpush(EVENTS_KEY % webhook_id, payload)
+            pipeline.execute()
+
+            for webhook_id in set(webhook_id for webhook_id, payload in events):
+                # Wait a bit, so the rest of a burst of events is delivered by the same task.
+                schedule_delivery(webhook_id, countdown=settings.WEBHOOK_BATCH_DELAY)
+        except Exception, e:
+            logger.error(traceback.format_exc(e))
+
+
+webhook_queue = register(WebhookQueue())
+
+
+def queue_webhook_event(webhook_id, payload):
+    """
+    Queue an event to be delivered to a webhook.
+
+    Args:
+        webhook_id (int): id of the Webhook
+        payload (str): the JSON body to post
+    """
+    webhook_queue.add((webhook_id, payload))
+
+
+def flush_webhook_queue(**kwargs):
+    """
+    Hand off all queued events for delivery, without waiting for the request or task to finish.
+    """
+    webhook_queue.flush()
+
+
+def schedule_delivery(webhook_id, countdown=0):
+    """
+    Schedule the delivery of the queued events of a webhook, unless a delivery is scheduled already.
+    """
+    if get_redis().set(SCHEDULED_KEY % webhook_id, 1, nx=True, ex=countdown + 60):
+        # Import here to prevent circular imports.
+        from .tasks import deliver_webhook_events
+
+        deliver_webhook_events.apply_async(args=(webhook_id, ), countdown=countdown)
+
+
+def acquire_slot(webhook_id):
+    """
+    Take one of the delivery slots of the webhook.
+
+    Returns:
+        the slot or None if the max number of deliveries to the webhook are in progress
+    """
+    client = get_redis()
+    # Prefer slots with events left by an interrupted delivery, so those are delivered first.
+    slots = sorted(
+        range(settings.WEBHOOK_MAX_CONCURRENCY),
+        key=lambda slot: -client.llen(PROCESSING_KEY % (webhook_id, slot))
+    )
+
+    for slot in slots:
+        # Expire the slot, so a crashed delivery doesn't block the webhook forever.
+        if client.set(SLOT_KEY % (webhook_id, slot), 1, nx=True, ex=settings.WEBHOOK_TIMEOUT * 60):
+            return slot
+
+    return None
+
+
+def release_slot(webhook_id, slot):
+    get_redis().delete(SLOT_KEY % (webhook_id, slot))
+
+
+def post_event(url, payload):
+    """
+    Post an event to a webhook.
+
+    Returns:
+        DELIVERED, RETRY for errors that might be temporary or FAILED if the webhook refuses the event
+    """
+    try:
+        response = get_session().post(url, data=payload, timeout=settings.WEBHOOK_TIMEOUT)
+    except requests.RequestException as e:
+        logger.info('Delivery to webhook %s failed: %s', url, e)
+        return RETRY
+
+    if response.status_code < 400:
+        return DELIVERED
+    elif response.status_code >= 500 or response.status_code == 429:
+        logger.info('Delivery to webhook %s failed with status %s', url, response.status_code)
+        return RETRY
+
+    logger.warning('Webhook %s refused an event with status %s', url, response.status_code)
+    return FAILED
+
+
+def count(webhook_id, metric, amount=1):
+    get_redis().hincrby(METRICS_KEY % webhook_id, metric, amount)
+
+
+def get_webhook_metrics(webhook_id):
+    """
+    Return the delivery metrics of a webhook: the number of delivered, failed, retried and dropped events and the
+    total time spent on deliveries in milliseconds.
+    """
+    metrics = get_redis().hgetall(METRICS_KEY % webhook_id)
+    return {metric: int(metrics.get(metric, 0)) for metric in (DELIVERED, FAILED, 'retried', 'dropped', 'duration_ms')}
+
+
+def get_batch(webhook_id, slot):
+    """
+    Return the events the delivery in the slot has to post, the ones left by an interrupted delivery or a new batch.
+    """
+    client = get_redis()
+    processing_key = PROCESSING_KEY % (webhook_id, slot)
+
+    events = client.lrange(processing_key, 0, -1)
+    if not events:
+        events = client.register_script(MOVE_BATCH_SCRIPT)(
+            keys=[EVENTS_KEY % webhook_id, processing_key],
+            args=[settings.WEBHOOK_BATCH_SIZE],
+            client=client
+        )
+
+    return events
+
+
+def retry_delivery(webhook_id, attempts):
+    """
+    Deliver the events of a webhook again after the backoff, deliveries scheduled in the meantime wait for it as well.
+    """
+    client = get_redis()
+    delay = min(settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1), settings.WEBHOOK_MAX_RETRY_DELAY)
+
+    client.set(NOT_BEFORE_KEY % webhook_id, time.time() + delay, ex=delay + 60)
+    client.delete(SCHEDULED_KEY % webhook_id)
+    schedule_delivery(webhook_id, countdown=delay)
+
+
+def deliver_events(webhook, webhook_id):
+    """
+    Deliver a batch of the queued events of a webhook.
+
+    Args:
+        webhook (Webhook): the webhook or None if it has been deleted
+        webhook_id (int): id of the webhook
+    """
+    client = get_redis()
+    events_key = EVENTS_KEY % webhook_id
+
+    if not webhook:
+        client.delete(
+            events_key,
+            SCHEDULED_KEY % webhook_id,
+            NOT_BEFORE_KEY % webhook_id,
+            ATTEMPTS_KEY % webhook_id,
+            *[PROCESSING_KEY % (webhook_id, slot) for slot in range(settings.WEBHOOK_MAX_CONCURRENCY)]
+        )
+        return
+
+    # Events queued from now on need another delivery.
+    client.delete(SCHEDULED_KEY % webhook_id)
+
+    not_before = float(client.get(NOT_BEFORE_KEY % webhook_id) or 0)
+    if not_before > time.time():
+        # A retry is pending, a delivery scheduled before it doesn't skip the backoff.
+        schedule_delivery(webhook_id, countdown=int(math.ceil(not_before - time.time())))
+        return
+
+    slot = acquire_slot(webhook_id)
+    if slot is None:
+        schedule_delivery(webhook_id, countdown=settings.WEBHOOK_BATCH_DELAY)
+        return
+
+    try:
+        processing_key = PROCESSING_KEY % (webhook_id, slot)
+
+        for payload in get_batch(webhook_id, slot):
+            start = time.time()
+            result = post_event(webhook.url, payload)
+            count(webhook_id, 'duration_ms', int((time.time() - start) * 1000))
+
+            if result == RETRY:
+                attempts = client.incr(ATTEMPTS_KEY % webhook_id)
+
+                if attempts < settings.WEBHOOK_MAX_ATTEMPTS:
+                    # Keep the rest of the batch in the processing list, the retry continues with it in order.
+                    count(webhook_id, 'retried')
+                    retry_delivery(webhook_id, attempts)
+                    return
+
+                logger.warning('Dropped event for webhook %s after %s attempts', webhook_id, attempts)
+                count(webhook_id, 'dropped')
+            else:
+                count(webhook_id, result)
+
+            client.lpop(processing_key)
+            client.delete(ATTEMPTS_KEY % webhook_id)
+
+        if client.llen(events_key):
+            # More events than fit in a batch.
+            schedule_delivery(webhook_id)
+    finally:
+        release_slot(webhook_id, slot)
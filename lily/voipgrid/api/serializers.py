@@ -7,14 +7,17 @@ from django.contrib.staticfiles.templatetags.staticfiles import static
 from django.db import IntegrityError
 from rest_framework import serializers
 
-from lily.accounts.models import Account
 from lily.calls.models import CallRecord, CallParticipant, CallTransfer
-from lily.contacts.models import Contact
-from lily.users.models import LilyUser
+from lily.calls.resolver import resolve_internal_number, resolve_number
 
 
 logger = logging.getLogger(__name__)
 
+NOTIFICATION_ICONS = {
+    'contact': 'app/images/notification_icons/contact.png',
+    'account': 'app/images/notification_icons/account.png',
+}
+
 
 def create_or_get(model_cls, lookup, data):
     """
@@ -62,16 +65,18 @@ class CallNotificationSerializer(serializers.Serializer):
 
         return save_func(validated_data)
 
+    def get_tenant_id(self):
+        return self.context['request'].user.tenant_id
+
     def save_participant(self, data, metadata=False):
+        tenant_id = self.get_tenant_id()
         name = data.get('name', '') or ''
         number = data.get('number', '') or ''
         internal_number = data.get('account_number', '') or ''
 
         # First try to autocomplete the name using a user.
         if internal_number and not name:
-            user = LilyUser.objects.filter(internal_number=internal_number).first()
-            if user:
-                name = user.full_name
+            name = resolve_internal_number(tenant_id, internal_number).get('name', '')
 
         meta = {
             'destination': 'create',
@@ -82,35 +87,19 @@ class CallNotificationSerializer(serializers.Serializer):
             },
         }
 
-        # Second try to autocomplete the name using a contact.
-        if number and not name:
-            contact = Contact.objects.filter(phone_numbers__number=number).first()
-
-            if contact:
-                name = contact.full_name
-                meta = {
-                    'destination': 'contact',
-                    'icon': static('app/images/notification_icons/contact.png'),
-                    'params': {
-                        'name': name,
-                        'number': number,
-                        'id': contact.id,
-                    },
-                }
-
-        # Third try to autocomplete the name using an account.
+        # Second try to autocomplete the name using a contact or an account.
         if number and not name:
-            account = Account.objects.filter(phone_numbers__number=number).first()
+            entity = resolve_number(tenant_id, number)
 
-            if account:
-                name = account.name
+            if entity:
+                name = entity['name']
                 meta = {
-                    'destination': 'account',
-                    'icon': static('app/images/notification_icons/account.png'),
+                    'destination': entity['type'],
+                    'icon': static(NOTIFICATION_ICONS[entity['type']]),
                     'params': {
                         'name': name,
                         'number': number,
-                        'id': account.id,
+                        'id': entity['id'],
                     },
                 }
 
@@ -138,10 +127,13 @@ class CallNotificationSerializer(serializers.Serializer):
         })
         cr = create_or_get(CallRecord, lookup={'call_id': data['call_id']}, data=data)
 
-        user_list = LilyUser.objects.filter(internal_number=destination['account_number'])
-        for user in user_list:
+        users = {}
+        if destination.get('account_number'):
+            users = resolve_internal_number(self.get_tenant_id(), destination['account_number'])
+
+        for user_id in users.get('user_ids', []):
             # Sends the data as a notification event to the users.
-            Group('user-%s' % user.id).send({
+            Group('user-%s' % user_id).send({
                 'text': json.dumps({
                     'event': 'notification',
                     'data': caller_meta